@@ -173,6 +173,19 @@ def _build_parser():
             'Will be created if not present.'
         ),
     )
+    g_bids.add_argument(
+        '--bids-database-cache',
+        metavar='PATH',
+        type=Path,
+        help=(
+            'Path to a folder in which to cache PyBIDS database indices of the input dataset, '
+            'one per subject, so that they can be shared across invocations '
+            '(e.g., one job per participant). '
+            'Subjects are only re-indexed when their files change. '
+            'Defaults to a "bids_db_cache" folder in the working directory. '
+            'Ignored if --bids-database-dir is provided.'
+        ),
+    )
 
     g_perfm = parser.add_argument_group('Options for resource management')
     g_perfm.add_argument(
@@ -213,6 +226,50 @@ def _build_parser():
             'IMPORTANT: At the moment, this option has no effect.'
         ),
     )
+    g_perfm.add_argument(
+        '--resource-profile',
+        '--resource_profile',
+        dest='resource_profile',
+        metavar='FILE',
+        type=IsFile,
+        default=None,
+        help=(
+            "A profile of the resources used by XCP-D's nodes in previous runs "
+            '(the "logs/resource_profile.json" file written with --resource-monitor). '
+            'Nodes found in the profile are given the memory and number of threads '
+            'they were measured to use, instead of estimates, '
+            'so that they can be packed more tightly within --nprocs and --mem-mb. '
+            'This is best used when processing data with the same number of volumes, '
+            'resolution, and atlases as the profiled runs.'
+        ),
+    )
+    g_perfm.add_argument(
+        '--smoothing-cache-dir',
+        dest='smoothing_cache_dir',
+        metavar='PATH',
+        type=Path,
+        default=None,
+        help=(
+            'Directory in which to cache precomputed CIFTI smoothing operators. '
+            'If provided, CIFTI data are smoothed with a sparse grayordinate smoothing operator '
+            'that is built once per set of surfaces and kernel widths and shared across runs '
+            'and subjects, instead of calling wb_command -cifti-smoothing for each file. '
+            'Has no effect on NIfTI data.'
+        ),
+    )
+    g_perfm.add_argument(
+        '--surface-cache-dir',
+        dest='surface_cache_dir',
+        metavar='PATH',
+        type=Path,
+        default=None,
+        help=(
+            'Directory in which to cache the projections of the surface meshes '
+            'used to plot CIFTI data, so that they are computed once per mesh and view '
+            'and shared across runs and subjects. '
+            'Defaults to a "surface_projections" folder in the working directory.'
+        ),
+    )
     g_perfm.add_argument(
         '--use-plugin',
         '--use_plugin',
@@ -345,6 +402,31 @@ def _build_parser():
             "'y' enables concatenation. 'n' disables concatenation."
         ),
     )
+    g_param.add_argument(
+        '--incremental-concatenation',
+        '--incremental_concatenation',
+        dest='incremental_concatenation',
+        action='store_true',
+        default=False,
+        help=(
+            'When combining runs, compute running sums for the concatenated correlation '
+            'matrices as each run finishes, instead of concatenating and re-reading every '
+            "run's derivatives. "
+            'Concatenated BOLD files (and the concatenated QC report, which depends on them) '
+            'are only written if --concatenate-bold is also provided.'
+        ),
+    )
+    g_param.add_argument(
+        '--concatenate-bold',
+        '--concatenate_bold',
+        dest='concatenate_bold',
+        action='store_true',
+        default=False,
+        help=(
+            'Write concatenated BOLD files when combining runs with --incremental-concatenation. '
+            'Concatenated BOLD files are always written without --incremental-concatenation.'
+        ),
+    )
 
     g_motion_filter = parser.add_argument_group(
         title='Motion filtering parameters',
@@ -656,6 +738,20 @@ This will create the DCAN executive summary, including a brainsprite visualizati
 anatomical tissue segmentation, and an HDF5 file containing motion levels at different thresholds.
 """,
     )
+    g_linc.add_argument(
+        '--scene-renderer',
+        dest='scene_renderer',
+        action='store',
+        choices=['auto', 'workbench', 'python'],
+        default='auto',
+        help=(
+            "How to render the anatomical PNGs of the executive summary's scenes. "
+            '"workbench" uses wb_command -show-scene, '
+            '"python" draws the slices and surface contours without Connectome Workbench, '
+            'which is faster when offscreen rendering is slow. '
+            'The default is "auto", which uses wb_command if it is available.'
+        ),
+    )
 
     g_other = parser.add_argument_group('Other options')
     g_other.add_argument(
@@ -723,7 +819,12 @@ anatomical tissue segmentation, and an HDF5 file containing motion levels at dif
         dest='resource_monitor',
         action='store_true',
         default=False,
-        help="Enable Nipype's resource monitoring to keep track of memory and CPU usage.",
+        help=(
+            "Enable Nipype's resource monitoring to keep track of memory and CPU usage. "
+            'The resources used by each type of node are aggregated into '
+            '"logs/resource_profile.json" in the output directory, '
+            'which can be used with --resource-profile in later runs.'
+        ),
     )
     g_other.add_argument(
         '--config-file',
@@ -801,6 +902,30 @@ anatomical tissue segmentation, and an HDF5 file containing motion levels at dif
             'aggregation, not reportlet generation for specific nodes.'
         ),
     )
+    g_other.add_argument(
+        '--incremental-reports',
+        dest='incremental_reports',
+        action='store_true',
+        default=False,
+        help=(
+            'Skip the HTML reports and executive summaries that were written after the last '
+            "change to the subject's reportlets."
+        ),
+    )
+    g_other.add_argument(
+        '--reportlet-rendering',
+        dest='reportlet_rendering',
+        action='store',
+        choices=['workflow', 'deferred', 'none'],
+        default='workflow',
+        help=(
+            'When to render the censoring and design matrix figures. '
+            '"workflow" renders them while the data are postprocessed. '
+            '"deferred" only writes the data of the figures, '
+            'which are then rendered in parallel when the reports are generated. '
+            '"none" skips the figures, for users who only need the derivatives.'
+        ),
+    )
 
     g_experimental = parser.add_argument_group('Experimental options')
 
@@ -987,6 +1112,8 @@ def parse_args(args=None, namespace=None):
     config.execution.log_dir.mkdir(exist_ok=True, parents=True)
     output_dir.mkdir(exist_ok=True, parents=True)
     work_dir.mkdir(exist_ok=True, parents=True)
+    if config.execution.surface_cache_dir is None:
+        config.execution.surface_cache_dir = work_dir / 'surface_projections'
 
     # Force initialization of the BIDSLayout
     config.execution.init()
@@ -16,7 +16,7 @@ def main():
     from pathlib import Path
 
     from xcp_d.cli.parser import parse_args
-    from xcp_d.cli.workflow import build_workflow
+    from xcp_d.cli.workflow import build_boilerplate, build_workflow, load_workflow
     from xcp_d.utils.bids import (
         write_atlas_dataset_description,
         write_derivative_description,
@@ -48,6 +48,8 @@ def main():
     # CRITICAL Call build_workflow(config_file, retval) in a subprocess.
     # Because Python on Linux does not ever free virtual memory (VM), running the
     # workflow construction jailed within a process preempts excessive VM buildup.
+    # The workflow is written to the working directory once, instead of being pickled
+    # back through ``retval``.
     if 'pdb' not in config.execution.debug:
         with Manager() as mgr:
             retval = mgr.dict()
@@ -63,7 +65,7 @@ def main():
         retval = build_workflow(str(config_file), {})
 
     exitcode = retval.get('return_code', 0)
-    xcpd_wf = retval.get('workflow', None)
+    workflow_file = retval.get('workflow_file', None)
 
     # CRITICAL Load the config from the file. This is necessary because the ``build_workflow``
     # function executed constrained in a process may change the config (and thus the global
@@ -73,20 +75,18 @@ def main():
     if config.execution.reports_only:
         sys.exit(int(exitcode > 0))
 
-    if xcpd_wf and config.execution.write_graph:
-        xcpd_wf.write_graph(graph2use='colored', format='svg', simple_form=True)
-
-    exitcode = exitcode or (xcpd_wf is None) * EX_SOFTWARE
+    exitcode = exitcode or (workflow_file is None) * EX_SOFTWARE
     if exitcode != 0:
         sys.exit(exitcode)
 
-    # Generate boilerplate
-    with Manager() as mgr:
-        from xcp_d.cli.workflow import build_boilerplate
+    # Generate boilerplate from the serialized workflow, while the workflow is loaded here
+    p = Process(target=build_boilerplate, args=(str(config_file), workflow_file))
+    p.start()
+    xcpd_wf = load_workflow(workflow_file)
+    if config.execution.write_graph:
+        xcpd_wf.write_graph(graph2use='colored', format='svg', simple_form=True)
 
-        p = Process(target=build_boilerplate, args=(str(config_file), xcpd_wf))
-        p.start()
-        p.join()
+    p.join()
 
     if config.execution.boilerplate_only:
         sys.exit(int(exitcode > 0))
@@ -108,9 +108,20 @@ def main():
         '\n'.join(['XCP-D config:'] + [f'\t\t{s}' for s in config.dumps().splitlines()]),
     )
     config.loggers.workflow.log(25, 'XCP-D started!')
+    plugin_settings = config.nipype.get_plugin()
+    if config.nipype.resource_monitor:
+        from xcp_d.utils.resources import init_resource_log, log_node_resources
+
+        resource_log = config.execution.work_dir / config.execution.run_uuid / 'resources.jsonl'
+        init_resource_log(resource_log)
+        plugin_settings['plugin_args'] = {
+            **plugin_settings['plugin_args'],
+            'status_callback': log_node_resources,
+        }
+
     errno = 1  # Default is error exit unless otherwise set
     try:
-        xcpd_wf.run(**config.nipype.get_plugin())
+        xcpd_wf.run(**plugin_settings)
     except Exception as e:
         if not config.execution.notrack:
             from xcp_d.utils.sentry import process_crashfile
@@ -169,6 +180,16 @@ def main():
         if config.execution.atlases:
             write_atlas_dataset_description(config.execution.output_dir / 'atlases')
 
+        if config.nipype.resource_monitor and resource_log.is_file():
+            from xcp_d.utils.resources import update_resource_profile
+
+            profile_file = config.execution.output_dir / 'logs' / 'resource_profile.json'
+            n_records = update_resource_profile(resource_log, profile_file)
+            if n_records is not None:
+                config.loggers.cli.info(
+                    'Added the resources used by %d nodes to %s.', n_records, profile_file
+                )
+
         # Generate reports phase
         failed_reports = generate_reports(
             processing_list=config.execution.processing_list,
@@ -176,6 +197,8 @@ def main():
             dataset_dir=config.execution.output_dir,
             abcc_qc=config.workflow.abcc_qc,
             run_uuid=config.execution.run_uuid,
+            n_procs=config.nipype.nprocs,
+            incremental=config.execution.incremental_reports,
         )
 
         if failed_reports:
@@ -7,6 +7,13 @@ dictionary (``retval``) to allow isolation using a
 ``multiprocessing.Process`` that allows XCP-D to enforce
 a hard-limited memory-scope.
 
+The workflow itself is not returned through ``retval``.
+It is serialized once to the working directory, and ``retval["workflow_file"]``
+points to that file, which can be read with :func:`load_workflow`.
+
+Built workflows are also cached in the working directory (see :func:`get_workflow_cache_file`),
+so that re-running XCP-D with the same settings on the same inputs does not rebuild them.
+
 """
 
 
@@ -15,8 +22,9 @@ def build_workflow(config_file, retval):
     from xcp_d import config, data
     from xcp_d.reports.core import generate_reports
     from xcp_d.utils.bids import check_pipeline_version, collect_participants
+    from xcp_d.utils.resources import apply_resource_profile
     from xcp_d.utils.utils import check_deps
-    from xcp_d.workflows.base import init_xcpd_wf
+    from xcp_d.workflows.base import init_xcpd_wf, set_run_logs
 
     config.load(config_file)
     build_log = config.loggers.workflow
@@ -24,7 +32,7 @@ def build_workflow(config_file, retval):
     version = config.environment.version
 
     retval['return_code'] = 1
-    retval['workflow'] = None
+    retval['workflow_file'] = None
 
     banner = [f'Running XCP-D version {version}']
     notice_path = data.load.readable('NOTICE')
@@ -68,6 +76,8 @@ def build_workflow(config_file, retval):
             dataset_dir=config.execution.output_dir,
             abcc_qc=config.workflow.abcc_qc,
             run_uuid=config.execution.run_uuid,
+            n_procs=config.nipype.nprocs,
+            incremental=config.execution.incremental_reports,
         )
         if failed_reports:
             config.loggers.cli.error(
@@ -91,10 +101,35 @@ def build_workflow(config_file, retval):
 
     build_log.log(25, f'\n{" " * 11}* '.join(init_msg))
 
-    retval['workflow'] = init_xcpd_wf()
+    xcpd_wf = None
+    cache_file = get_workflow_cache_file()
+    if cache_file.is_file():
+        try:
+            xcpd_wf = load_workflow(cache_file)
+        except Exception as exc:  # noqa: BLE001
+            build_log.warning('Could not load cached workflow from %s: %s', cache_file, exc)
+        else:
+            build_log.log(25, 'Reusing the workflow built by a previous run (%s).', cache_file)
+            set_run_logs(xcpd_wf)
+
+    if xcpd_wf is None:
+        xcpd_wf = init_xcpd_wf()
+        for stale_file in cache_file.parent.glob(f'{cache_file.name.split("_")[0]}_*.pkl'):
+            stale_file.unlink(missing_ok=True)
+
+        save_workflow(xcpd_wf, cache_file)
+
+    # The profile changes from run to run, so it is applied to the cached workflow
+    if config.nipype.resource_profile:
+        n_nodes = apply_resource_profile(xcpd_wf, config.nipype.resource_profile)
+        build_log.info(
+            'Set the resources of %d nodes from the profile in %s.',
+            n_nodes,
+            config.nipype.resource_profile,
+        )
 
     # Check workflow for missing commands
-    missing = check_deps(retval['workflow'])
+    missing = check_deps(xcpd_wf)
     if missing:
         build_log.critical(
             'Cannot run XCP-D. Missing dependencies:%s',
@@ -106,19 +141,143 @@ def build_workflow(config_file, retval):
     config.to_filename(config_file)
     build_log.info(
         'XCP-D workflow graph with %d nodes built successfully.',
-        len(retval['workflow']._get_all_nodes()),
+        len(xcpd_wf._get_all_nodes()),
     )
+    workflow_file = config.execution.work_dir / config.execution.run_uuid / 'workflow.pkl'
+    save_workflow(xcpd_wf, workflow_file)
+    retval['workflow_file'] = str(workflow_file)
     retval['return_code'] = 0
     return retval
 
 
-def build_boilerplate(config_file, workflow):
-    """Write boilerplate in an isolated process."""
+def get_workflow_cache_file():
+    """Get the file in which a workflow built with the current settings is cached.
+
+    The file name combines two hashes.
+    The first covers the configuration (see :func:`~xcp_d.config.hash_config`),
+    except for settings that change between runs without affecting the workflow,
+    such as the run identifier.
+    The second covers XCP-D's version and source files,
+    the paths, sizes, and modification times of the files of the participants
+    being processed in the input dataset and in any ``--datasets``,
+    and the contents of the confounds configuration, which is only hashed by path
+    in the first hash but is read while the workflow is built.
+
+    Returns
+    -------
+    cache_file : :obj:`pathlib.Path`
+        The (possibly nonexistent) cached workflow file.
+    """
+    import json
+    import os
+    from hashlib import blake2b
+    from pathlib import Path
+
+    import toml
+
+    from xcp_d import config
+    from xcp_d.config import get_bids_ignore_patterns, hash_config
+    from xcp_d.utils.bids_db import _fingerprint_dataset
+    from xcp_d.utils.utils import is_number
+
+    conf = toml.loads(config.dumps())
+    ignore = {
+        'execution': ('run_uuid', 'layout', 'bids_database_dir', 'log_level'),
+        'nipype': ('resource_profile',),
+        'seeds': (),
+    }
+    if not any(is_number(length) for length in config.workflow.correlation_lengths):
+        # The random seed is only used in the workflow for randomly censored correlations.
+        ignore['seeds'] = ('master',)
+
+    fields = {
+        section: sorted(set(conf.get(section, {})) - set(ignore.get(section, ())))
+        for section in ('execution', 'workflow', 'nipype', 'seeds')
+    }
+    config_hash = hash_config(conf, fields_required=fields, digest_size=8)
+
+    subjects = sorted({subject_id for subject_id, _, _ in config.execution.processing_list})
+    datasets = [config.execution.fmri_dir, *config.execution.datasets.values()]
+    manifest = {
+        'version': config.environment.version,
+        'source': [
+            (str(path.relative_to(Path(__file__).parents[1])), path.stat().st_mtime_ns)
+            for path in sorted(Path(__file__).parents[1].rglob('*.py'))
+        ],
+        'confounds_config': (
+            blake2b(config.execution.confounds_config.read_bytes(), digest_size=8).hexdigest()
+            if isinstance(config.execution.confounds_config, Path)
+            else None
+        ),
+        'inputs': {
+            str(dataset_dir): _fingerprint_dataset(
+                Path(dataset_dir).absolute(),
+                subjects,
+                ignore=get_bids_ignore_patterns(),
+            )
+            for dataset_dir in datasets
+            if os.path.isdir(dataset_dir)
+        },
+    }
+    inputs_hash = blake2b(json.dumps(manifest).encode(), digest_size=8).hexdigest()
+    cache_dir = config.execution.work_dir / 'workflow_cache'
+    return cache_dir / f'{config_hash.replace("+", "-")}_{inputs_hash}.pkl'
+
+
+def save_workflow(workflow, workflow_file):
+    """Serialize a workflow to a file.
+
+    The file is written atomically, so readers never see a partially-written workflow.
+
+    Parameters
+    ----------
+    workflow : :obj:`~nipype.pipeline.engine.Workflow`
+        The workflow to serialize.
+    workflow_file : :obj:`str` or :obj:`pathlib.Path`
+        The file to write.
+    """
+    import os
+    import pickle
+    from pathlib import Path
+
+    workflow_file = Path(workflow_file)
+    workflow_file.parent.mkdir(exist_ok=True, parents=True)
+    tmp_file = workflow_file.with_name(f'.{workflow_file.name}.{os.getpid()}')
+    with tmp_file.open('wb') as fobj:
+        pickle.dump(workflow, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp_file, workflow_file)
+
+
+def load_workflow(workflow_file):
+    """Load a workflow written by :func:`save_workflow`.
+
+    Parameters
+    ----------
+    workflow_file : :obj:`str` or :obj:`pathlib.Path`
+        The serialized workflow.
+
+    Returns
+    -------
+    workflow : :obj:`~nipype.pipeline.engine.Workflow`
+    """
+    import pickle
+
+    with open(workflow_file, 'rb') as fobj:
+        return pickle.load(fobj)  # noqa: S301
+
+
+def build_boilerplate(config_file, workflow_file):
+    """Write boilerplate in an isolated process.
+
+    The workflow is read from ``workflow_file`` (see :func:`save_workflow`),
+    rather than being passed to the process.
+    """
     from xcp_d import config
 
     config.load(config_file)
     logs_path = config.execution.output_dir / 'logs'
-    boilerplate = workflow.visit_desc()
+    boilerplate = load_workflow(workflow_file).visit_desc()
     citation_files = {ext: logs_path / f'CITATION.{ext}' for ext in ('bib', 'tex', 'md', 'html')}
 
     if boilerplate:
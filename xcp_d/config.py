@@ -93,9 +93,6 @@ import typing as ty
 from multiprocessing import set_start_method
 
 import yaml
-from bids.layout import Query
-from bids.utils import listify
-from templateflow.conf import TF_LAYOUT
 
 # Disable NiPype etelemetry always
 _disable_et = bool(os.getenv('NO_ET') is not None or os.getenv('NIPYPE_NO_ET') is not None)
@@ -113,12 +110,14 @@ finally:
     # ignoring the most annoying warnings
     import random
     import sys
+    from importlib.metadata import version as _pkg_version
     from pathlib import Path
     from time import strftime
     from uuid import uuid4
 
-    from nipype import __version__ as _nipype_ver
-    from templateflow import __version__ as _tf_ver
+    # Read versions from package metadata, as importing nipype or templateflow is slow
+    _nipype_ver = _pkg_version('nipype')
+    _tf_ver = _pkg_version('templateflow')
 
     from xcp_d import __version__
     from xcp_d.data import load as load_data
@@ -322,6 +321,8 @@ class environment(_Config):
 class nipype(_Config):
     """Nipype settings."""
 
+    _paths = ('resource_profile',)
+
     crashfile_format = 'txt'
     """The file format for crashfiles, either text or pickle."""
     get_linked_libs = False
@@ -341,6 +342,8 @@ class nipype(_Config):
     """Settings for NiPype's execution plugin."""
     resource_monitor = False
     """Enable resource monitor."""
+    resource_profile = None
+    """A profile of the resources used by nodes in previous runs, to set nodes' resources."""
     stop_on_first_crash = True
     """Whether the workflow should stop or continue after the first error."""
 
@@ -401,6 +404,8 @@ class execution(_Config):
     """Path(s) to search for other datasets (either derivatives or atlases)."""
     aggr_ses_reports = None
     """Maximum number of sessions aggregated in one subject's visual report."""
+    bids_database_cache = None
+    """Directory with a shared, incrementally refreshed cache of BIDS database indices."""
     bids_database_dir = None
     """Path to the directory containing SQLite database indices for the input BIDS dataset."""
     bids_description_hash = None
@@ -415,6 +420,8 @@ class execution(_Config):
     """Debug mode(s)."""
     fs_license_file = _fs_license
     """An existing file containing a FreeSurfer license."""
+    incremental_reports = None
+    """Only regenerate the reports of subjects whose reportlets changed since the last reports."""
     layout = None
     """A :py:class:`~bids.layout.BIDSLayout` object, see :py:func:`init`."""
     log_dir = None
@@ -445,6 +452,10 @@ class execution(_Config):
     """List of participant identifiers that are to be preprocessed."""
     session_id = None
     """Select a particular session from all available in the dataset."""
+    smoothing_cache_dir = None
+    """Directory in which to cache precomputed CIFTI smoothing operators."""
+    surface_cache_dir = None
+    """Directory in which to cache the projections of the surface meshes used in plots."""
     task_id = None
     """Select a particular task from all available in the dataset."""
     processing_list = []
@@ -463,8 +474,11 @@ class execution(_Config):
     _paths = (
         'fmri_dir',
         'datasets',
+        'bids_database_cache',
         'bids_database_dir',
         'fs_license_file',
+        'smoothing_cache_dir',
+        'surface_cache_dir',
         'layout',
         'log_dir',
         'output_dir',
@@ -480,43 +494,44 @@ class execution(_Config):
         if cls.fs_license_file and Path(cls.fs_license_file).is_file():
             os.environ['FS_LICENSE'] = str(cls.fs_license_file)
 
-        if cls._layout is None:
-            import re
+        from bids.layout import Query
+        from bids.utils import listify
 
+        if cls._layout is None:
             from bids.layout import BIDSLayout
             from bids.layout.index import BIDSLayoutIndexer
 
             _db_path = cls.bids_database_dir or (cls.work_dir / cls.run_uuid / 'bids_db')
             _db_path.mkdir(exist_ok=True, parents=True)
 
-            # Recommended after PyBIDS 12.1
-            ignore_patterns = [
-                'code',
-                'stimuli',
-                'models',
-                re.compile(r'\/\.\w+|^\.\w+'),  # hidden files
-                re.compile(
-                    r'sub-[a-zA-Z0-9]+(/ses-[a-zA-Z0-9]+)?/'
-                    r'(beh|dwi|eeg|ieeg|meg|perf|pet|physio)'
-                ),
-            ]
-            if cls.participant_label and cls.bids_database_dir is None:
-                # Ignore any subjects who aren't the requested ones.
-                ignore_patterns.append(
-                    re.compile(r'sub-(?!(' + '|'.join(cls.participant_label) + r')(\b|_))')
+            ignore_patterns = get_bids_ignore_patterns()
+            xcp_d_config = str(load_data('xcp_d_bids_config2.json'))
+            _config = ['bids', 'derivatives', xcp_d_config]
+            _reset_database = cls.bids_database_dir is None
+            if cls.bids_database_dir is None:
+                # Reuse (and refresh) an index shared with other invocations.
+                from xcp_d.utils.bids_db import get_cached_database
+
+                get_cached_database(
+                    cls.fmri_dir,
+                    cache_dir=cls.bids_database_cache or (cls.work_dir / 'bids_db_cache'),
+                    database_dir=_db_path,
+                    config=_config,
+                    ignore=ignore_patterns,
+                    participant_label=cls.participant_label,
                 )
+                _reset_database = False
 
             _indexer = BIDSLayoutIndexer(
                 validate=False,
                 ignore=ignore_patterns,
             )
-            xcp_d_config = str(load_data('xcp_d_bids_config2.json'))
             cls._layout = BIDSLayout(
                 str(cls.fmri_dir),
                 database_path=_db_path,
-                reset_database=cls.bids_database_dir is None,
+                reset_database=_reset_database,
                 indexer=_indexer,
-                config=['bids', 'derivatives', xcp_d_config],
+                config=_config,
             )
             cls.bids_database_dir = _db_path
 
@@ -561,9 +576,11 @@ class execution(_Config):
                 for k, v in filters.items():
                     cls.bids_filters[acq][k] = _process_value(v)
 
+        from templateflow.conf import TF_HOME
+
         dataset_links = {
             'preprocessed': cls.fmri_dir,
-            'templateflow': Path(TF_LAYOUT.root),
+            'templateflow': Path(TF_HOME),
         }
         if cls.atlases:
             dataset_links['atlas'] = cls.output_dir / 'atlases'
@@ -582,6 +599,7 @@ del _exec_env
 del _nipype_ver
 del _templateflow_home
 del _tf_ver
+del _pkg_version
 del _free_mem_at_start
 del _oc_limit
 del _oc_policy
@@ -606,6 +624,10 @@ class workflow(_Config):
     """Output interpolated data, not censored data."""
     combine_runs = None
     """Combine runs of the same task."""
+    incremental_concatenation = None
+    """Combine runs from per-run running sums, instead of re-reading every run's derivatives."""
+    concatenate_bold = None
+    """Write concatenated BOLD files even when combining runs incrementally."""
     motion_filter_type = None
     """Type of filter to apply to the motion regressors."""
     band_stop_min = None
@@ -640,6 +662,10 @@ class workflow(_Config):
     """Warp fsnative-space surfaces to the MNI space."""
     abcc_qc = None
     """Run DCAN QC."""
+    scene_renderer = None
+    """Render the executive summary's scene PNGs with "workbench", "python", or "auto"."""
+    reportlet_rendering = None
+    """Render the censoring and design matrix figures in the "workflow", "deferred", or "none"."""
     linc_qc = None
     """Run LINC QC."""
 
@@ -811,6 +837,23 @@ def dismiss_hash(entities: list | None = None):
     return entities
 
 
+def get_bids_ignore_patterns():
+    """Get the patterns of files and folders that are not indexed in the input datasets."""
+    import re
+
+    # Recommended after PyBIDS 12.1
+    return [
+        'code',
+        'stimuli',
+        'models',
+        re.compile(r'\/\.\w+|^\.\w+'),  # hidden files
+        re.compile(
+            r'sub-[a-zA-Z0-9]+(/ses-[a-zA-Z0-9]+)?/'
+            r'(beh|dwi|eeg|ieeg|meg|perf|pet|physio)'
+        ),
+    ]
+
+
 DEFAULT_DISMISS_ENTITIES = dismiss_hash()
 
 DEFAULT_CONFIG_HASH_FIELDS = {
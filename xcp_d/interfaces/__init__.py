@@ -1,29 +1,24 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
-"""Initialize interfaces."""
+"""Initialize interfaces.
 
-from xcp_d.interfaces import (
-    ants,
-    bids,
-    censoring,
-    connectivity,
-    execsummary,
-    nilearn,
-    plotting,
-    report,
-    restingstate,
-    workbench,
-)
+Submodules are imported on first access.
+"""
+
+from xcp_d.utils.lazy import attach
 
-__all__ = [
-    'ants',
-    'bids',
-    'connectivity',
-    'execsummary',
-    'nilearn',
-    'plotting',
-    'censoring',
-    'report',
-    'restingstate',
-    'workbench',
-]
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    [
+        'ants',
+        'bids',
+        'censoring',
+        'connectivity',
+        'execsummary',
+        'nilearn',
+        'plotting',
+        'report',
+        'restingstate',
+        'workbench',
+    ],
+)
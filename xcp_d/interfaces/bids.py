@@ -16,6 +16,7 @@ from nipype.interfaces.base import (
     File,
     SimpleInterface,
     TraitedSpec,
+    isdefined,
     traits,
 )
 from nipype.interfaces.io import add_traits
@@ -43,6 +44,8 @@ class DerivativesDataSink(BaseDerivativesDataSink):
     """Store derivative files.
 
     A child class of the niworkflows DerivativesDataSink, using xcp_d's configuration files.
+    The written files are recorded in the manifests of their subjects,
+    which the reports use to find them without indexing the output dataset.
     """
 
     out_path_base = ''
@@ -51,6 +54,21 @@ class DerivativesDataSink(BaseDerivativesDataSink):
     _config_entities_dict = merged_entities
     _file_patterns = xcp_d_spec['default_path_patterns']
 
+    def _run_interface(self, runtime):
+        from bids.utils import listify
+
+        from xcp_d.utils.reportlets import update_manifest
+
+        runtime = super()._run_interface(runtime)
+
+        base_directory = runtime.cwd
+        if isdefined(self.inputs.base_directory):
+            base_directory = self.inputs.base_directory
+
+        update_manifest(os.path.abspath(base_directory), listify(self._results['out_file']))
+
+        return runtime
+
 
 class _CollectRegistrationFilesInputSpec(BaseInterfaceInputSpec):
     software = traits.Enum(
@@ -16,9 +16,9 @@ from nipype.interfaces.base import (
     traits,
 )
 
-from xcp_d.utils.confounds import _infer_dummy_scans, _modify_motion_filter, load_motion
+from xcp_d.utils.confounds import _infer_dummy_scans, _modify_motion_filter
 from xcp_d.utils.filemanip import fname_presuffix
-from xcp_d.utils.modified_data import _drop_dummy_scans, compute_fd
+from xcp_d.utils.modified_data import _drop_dummy_scans, process_motion
 from xcp_d.utils.utils import get_col
 
 LOGGER = logging.getLogger('nipype.interface')
@@ -447,6 +447,17 @@ class _ProcessMotionInputSpec(BaseInterfaceInputSpec):
         mandatory=True,
         desc='Upper frequency for the band-stop motion filter, in breaths-per-minute (bpm).',
     )
+    cache_dir = traits.Either(
+        None,
+        traits.Str,
+        default=None,
+        usedefault=True,
+        nohash=True,
+        desc=(
+            'Directory with processed motion parameters cached during workflow construction. '
+            'Cached results are reused, and new results are added to the cache.'
+        ),
+    )
 
 
 class _ProcessMotionOutputSpec(TraitedSpec):
@@ -484,20 +495,16 @@ class ProcessMotion(SimpleInterface):
             TR=self.inputs.TR,
         )
 
-        motion_df = load_motion(
+        # Filter the motion parameters and add in framewise displacement
+        motion_df = process_motion(
             self.inputs.motion_file,
             TR=self.inputs.TR,
             motion_filter_type=self.inputs.motion_filter_type,
             motion_filter_order=self.inputs.motion_filter_order,
-            band_stop_min=band_stop_min_adjusted,
-            band_stop_max=band_stop_max_adjusted,
-        )
-
-        # Add in framewise displacement
-        motion_df['framewise_displacement'] = compute_fd(
-            confound=motion_df,
+            band_stop_min=self.inputs.band_stop_min,
+            band_stop_max=self.inputs.band_stop_max,
             head_radius=self.inputs.head_radius,
-            filtered=False,
+            cache_dir=self.inputs.cache_dir,
         )
         fd_timeseries = motion_df['framewise_displacement'].to_numpy()
         motion_metadata['framewise_displacement'] = {
@@ -506,11 +513,6 @@ class ProcessMotion(SimpleInterface):
             'Units': 'mm',
         }
         if self.inputs.motion_filter_type:
-            motion_df['framewise_displacement_filtered'] = compute_fd(
-                confound=motion_df,
-                head_radius=self.inputs.head_radius,
-                filtered=True,
-            )
             fd_timeseries = motion_df['framewise_displacement_filtered'].to_numpy()
 
         # Compile motion metadata from confounds metadata, adding in filtering info
@@ -698,17 +700,13 @@ class GenerateConfounds(SimpleInterface):
     def _run_interface(self, runtime):
         import re
 
-        import nibabel as nb
         import pandas as pd
 
         from xcp_d.utils.bids import _get_bidsuris
         from xcp_d.utils.confounds import filter_motion, volterra
+        from xcp_d.utils.probe import get_n_volumes
 
-        in_img = nb.load(self.inputs.in_file)
-        if in_img.ndim == 2:  # CIFTI
-            n_volumes = in_img.shape[0]
-        else:  # NIfTI
-            n_volumes = in_img.shape[3]
+        n_volumes = get_n_volumes(self.inputs.in_file)
 
         new_confound_df = pd.DataFrame(index=np.arange(n_volumes))
 
@@ -786,11 +784,7 @@ class GenerateConfounds(SimpleInterface):
                         )
 
             else:  # Voxelwise confounds
-                confound_img = nb.load(confound_file)
-                if confound_img.ndim == 2:  # CIFTI
-                    n_volumes_check = confound_img.shape[0]
-                else:  # NIfTI
-                    n_volumes_check = confound_img.shape[3]
+                n_volumes_check = get_n_volumes(confound_file)
 
                 if n_volumes_check != n_volumes:
                     raise ValueError(
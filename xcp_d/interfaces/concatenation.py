@@ -4,7 +4,8 @@ import itertools
 import os
 import re
 
-import pandas as pd
+import nibabel as nb
+import numpy as np
 from nipype import logging
 from nipype.interfaces.base import (
     BaseInterfaceInputSpec,
@@ -16,7 +17,16 @@ from nipype.interfaces.base import (
     traits,
 )
 
-from xcp_d.utils.concatenation import concatenate_niimgs, concatenate_tsvs
+from xcp_d.utils.concatenation import (
+    combine_correlation_accumulators,
+    compute_correlation_accumulators,
+    concatenate_niimgs,
+    concatenate_tsvs,
+    finalize_correlations,
+    load_correlation_accumulators,
+    save_correlation_accumulators,
+)
+from xcp_d.utils.probe import get_n_volumes
 
 LOGGER = logging.getLogger('nipype.interface')
 
@@ -130,6 +140,14 @@ class _FilterOutFailedRunsInputSpec(BaseInterfaceInputSpec):
             'Only defined for CIFTI processing.'
         ),
     )
+    correlation_accumulators = traits.Either(
+        traits.List(traits.Either(traits.List(File(exists=True)), Undefined)),
+        Undefined,
+        desc=(
+            'List of lists of correlation accumulator files. '
+            'Only defined for incremental concatenation.'
+        ),
+    )
 
 
 class _FilterOutFailedRunsOutputSpec(TraitedSpec):
@@ -198,6 +216,16 @@ class _FilterOutFailedRunsOutputSpec(TraitedSpec):
             'Only defined for CIFTI processing.'
         ),
     )
+    correlation_accumulators = traits.List(
+        traits.Either(
+            traits.List(File(exists=True)),
+            Undefined,
+        ),
+        desc=(
+            'List of lists of correlation accumulator files. '
+            'Only defined for incremental concatenation.'
+        ),
+    )
 
 
 class FilterOutFailedRuns(SimpleInterface):
@@ -219,6 +247,7 @@ class FilterOutFailedRuns(SimpleInterface):
             'boldref': self.inputs.boldref,
             'timeseries': self.inputs.timeseries,
             'timeseries_ciftis': self.inputs.timeseries_ciftis,
+            'correlation_accumulators': self.inputs.correlation_accumulators,
         }
 
         n_runs = len(denoised_bold)
@@ -254,8 +283,11 @@ class FilterOutFailedRuns(SimpleInterface):
 class _ConcatenateInputsInputSpec(BaseInterfaceInputSpec):
     preprocessed_bold = traits.List(
         File(exists=True),
-        mandatory=True,
-        desc='Preprocessed BOLD files, after dummy volume removal.',
+        desc=(
+            'Preprocessed BOLD files, after dummy volume removal. '
+            'BOLD inputs are optional, as they are not concatenated in incremental mode '
+            'unless explicitly requested.'
+        ),
     )
     motion_file = traits.List(
         File(exists=True),
@@ -271,17 +303,14 @@ class _ConcatenateInputsInputSpec(BaseInterfaceInputSpec):
     )
     denoised_bold = traits.List(
         File(exists=True),
-        mandatory=True,
         desc='Denoised BOLD data.',
     )
     denoised_interpolated_bold = traits.List(
         File(exists=True),
-        mandatory=True,
         desc='Denoised BOLD data.',
     )
     censored_denoised_bold = traits.List(
         File(exists=True),
-        mandatory=True,
         desc='Denoised BOLD data.',
     )
     smoothed_denoised_bold = traits.List(
@@ -308,6 +337,12 @@ class _ConcatenateInputsInputSpec(BaseInterfaceInputSpec):
             'Only defined for CIFTI processing.'
         ),
     )
+    n_procs = traits.Int(
+        1,
+        usedefault=True,
+        nohash=True,
+        desc='Number of processes used to concatenate different inputs in parallel.',
+    )
 
 
 class _ConcatenateInputsOutputSpec(TraitedSpec):
@@ -359,8 +394,20 @@ class _ConcatenateInputsOutputSpec(TraitedSpec):
     )
 
 
+def _concatenate_files(in_files, out_file):
+    """Concatenate a list of TSV or NIfTI/CIFTI files, based on the output extension."""
+    if out_file.endswith('.tsv'):
+        return concatenate_tsvs(in_files, out_file=out_file)
+
+    return concatenate_niimgs(in_files, out_file=out_file)
+
+
 class ConcatenateInputs(SimpleInterface):
-    """Concatenate inputs."""
+    """Concatenate inputs.
+
+    Each type of input (e.g., denoised BOLD, or one atlas's time series) is concatenated
+    independently, so different inputs may be concatenated in parallel with ``n_procs``.
+    """
 
     input_spec = _ConcatenateInputsInputSpec
     output_spec = _ConcatenateInputsOutputSpec
@@ -380,11 +427,13 @@ class ConcatenateInputs(SimpleInterface):
 
         run_index, n_volumes = [], 0
         for run_motion in self.inputs.motion_file[:-1]:
-            n_volumes = n_volumes + pd.read_table(run_motion).shape[0]
+            n_volumes = n_volumes + get_n_volumes(run_motion)
             run_index.append(n_volumes)
 
         self._results['run_index'] = run_index
 
+        # Collect every concatenation job first, so they can be run in parallel.
+        jobs = []
         for name, run_files in merge_inputs.items():
             LOGGER.info(f'Concatenating {name}')
             if len(run_files) == 0 or any(not isdefined(f) for f in run_files):
@@ -400,29 +449,129 @@ class ConcatenateInputs(SimpleInterface):
             if isinstance(run_files[0], list):
                 # Files are organized in a list of lists, like parcellated time series, in order
                 # [['run-1_atlas-a', 'run-2_atlas-a'], ['run-1_atlas-b', 'run-2_atlas-b']]
-                out_files = []
+                self._results[name] = []
                 for i_atlas, parc_files in enumerate(run_files):
                     extension = '.'.join(os.path.basename(parc_files[0]).split('.')[1:])
                     out_file = os.path.join(runtime.cwd, f'{name}_{i_atlas}.{extension}')
-                    if out_file.endswith('.tsv'):
-                        concatenate_tsvs(parc_files, out_file=out_file)
-                    else:
-                        concatenate_niimgs(parc_files, out_file=out_file)
-
-                    assert os.path.isfile(out_file), f'Output file {out_file} not created.'
-                    out_files.append(out_file)
-
-                self._results[name] = out_files
+                    jobs.append((parc_files, out_file))
+                    self._results[name].append(out_file)
             else:
                 # Files are a single list of paths.
                 extension = '.'.join(os.path.basename(run_files[0]).split('.')[1:])
                 out_file = os.path.join(runtime.cwd, f'{name}.{extension}')
-                if out_file.endswith('.tsv'):
-                    concatenate_tsvs(run_files, out_file=out_file)
-                else:
-                    concatenate_niimgs(run_files, out_file=out_file)
-
-                assert os.path.isfile(out_file), f'Output file {out_file} not created.'
+                jobs.append((run_files, out_file))
                 self._results[name] = out_file
 
+        n_procs = min(self.inputs.n_procs, len(jobs))
+        if n_procs > 1:
+            from multiprocessing import Pool
+
+            with Pool(processes=n_procs) as pool:
+                out_files = pool.starmap(_concatenate_files, jobs)
+        else:
+            out_files = [_concatenate_files(*job) for job in jobs]
+
+        for out_file in out_files:
+            assert os.path.isfile(out_file), f'Output file {out_file} not created.'
+
+        return runtime
+
+
+class _AccumulateCorrelationsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(
+        exists=True,
+        mandatory=True,
+        desc='Parcellated time series from a single run, as a TSV or ptseries CIFTI file.',
+    )
+    temporal_mask = traits.Either(
+        File(exists=True),
+        Undefined,
+        desc='TSV file with high-motion outliers indexed.',
+    )
+
+
+class _AccumulateCorrelationsOutputSpec(TraitedSpec):
+    out_file = File(
+        exists=True,
+        desc='NumPy archive with the correlation accumulators for the run.',
+    )
+
+
+class AccumulateCorrelations(SimpleInterface):
+    """Compute the running sums needed to correlate parcellated time series across runs.
+
+    This is run as soon as each run's time series are available,
+    so that concatenated correlations can be computed with :class:`FinalizeCorrelations`
+    without concatenating or re-reading the runs' time series.
+    """
+
+    input_spec = _AccumulateCorrelationsInputSpec
+    output_spec = _AccumulateCorrelationsOutputSpec
+
+    def _run_interface(self, runtime):
+        temporal_mask = self.inputs.temporal_mask if isdefined(self.inputs.temporal_mask) else None
+        accumulators = compute_correlation_accumulators(
+            self.inputs.in_file,
+            temporal_mask=temporal_mask,
+        )
+        self._results['out_file'] = save_correlation_accumulators(
+            accumulators,
+            os.path.join(runtime.cwd, 'correlation_accumulators.npz'),
+        )
+        return runtime
+
+
+class _FinalizeCorrelationsInputSpec(BaseInterfaceInputSpec):
+    accumulators = traits.List(
+        File(exists=True),
+        mandatory=True,
+        desc='Correlation accumulators for each run, in concatenation order.',
+    )
+    parcellated_cifti = File(
+        exists=True,
+        desc=(
+            'Parcellated CIFTI file from which to take the parcel axis. '
+            'If provided, the correlations are written to a pconn CIFTI file instead of a TSV.'
+        ),
+    )
+
+
+class _FinalizeCorrelationsOutputSpec(TraitedSpec):
+    correlations = File(
+        exists=True,
+        desc='Correlation matrix of the concatenated time series.',
+    )
+
+
+class FinalizeCorrelations(SimpleInterface):
+    """Compute correlations across runs from per-run correlation accumulators."""
+
+    input_spec = _FinalizeCorrelationsInputSpec
+    output_spec = _FinalizeCorrelationsOutputSpec
+
+    def _run_interface(self, runtime):
+        accumulators = combine_correlation_accumulators(
+            [load_correlation_accumulators(f) for f in self.inputs.accumulators]
+        )
+        correlations_df = finalize_correlations(accumulators)
+
+        if isdefined(self.inputs.parcellated_cifti):
+            parcels_axis = nb.load(self.inputs.parcellated_cifti).header.get_axis(1)
+            correlations_df = correlations_df.loc[parcels_axis.name, parcels_axis.name]
+            out_img = nb.Cifti2Image(
+                correlations_df.to_numpy(dtype=np.float32),
+                header=(parcels_axis, parcels_axis),
+            )
+            out_img.nifti_header.set_intent('ConnParcels')
+            self._results['correlations'] = os.path.join(runtime.cwd, 'correlations.pconn.nii')
+            out_img.to_filename(self._results['correlations'])
+        else:
+            self._results['correlations'] = os.path.join(runtime.cwd, 'correlations.tsv')
+            correlations_df.to_csv(
+                self._results['correlations'],
+                sep='\t',
+                na_rep='n/a',
+                index_label='Node',
+            )
+
         return runtime
@@ -4,11 +4,9 @@
 
 import gc
 
-import matplotlib.pyplot as plt
 import nibabel as nb
 import numpy as np
 import pandas as pd
-from nilearn.maskers import NiftiLabelsMasker
 from nipype import logging
 from nipype.interfaces.base import (
     BaseInterfaceInputSpec,
@@ -21,10 +19,14 @@ from nipype.interfaces.base import (
 )
 
 from xcp_d.utils.filemanip import fname_presuffix
+from xcp_d.utils.lazy import lazy_import
+from xcp_d.utils.plotting import save_figure
 from xcp_d.utils.utils import get_col
 from xcp_d.utils.write_save import write_ndata
 
 LOGGER = logging.getLogger('nipype.interface')
+plt = lazy_import('matplotlib.pyplot')
+maskers = lazy_import('nilearn.maskers')
 
 
 class _NiftiParcellateInputSpec(BaseInterfaceInputSpec):
@@ -88,7 +90,7 @@ class NiftiParcellate(SimpleInterface):
             atlas_img.header,
         )
 
-        sum_masker_masked = NiftiLabelsMasker(
+        sum_masker_masked = maskers.NiftiLabelsMasker(
             labels_img=atlas_img,
             lut=masker_lut,
             background_label=0,
@@ -98,7 +100,7 @@ class NiftiParcellate(SimpleInterface):
             strategy='sum',
             resampling_target=None,  # they should be in the same space/resolution already
         )
-        sum_masker_unmasked = NiftiLabelsMasker(
+        sum_masker_unmasked = maskers.NiftiLabelsMasker(
             labels_img=atlas_img,
             lut=masker_lut,
             background_label=0,
@@ -146,7 +148,7 @@ class NiftiParcellate(SimpleInterface):
                 'calculated from the remaining voxels.'
             )
 
-        masker = NiftiLabelsMasker(
+        masker = maskers.NiftiLabelsMasker(
             labels_img=atlas_img,
             lut=masker_lut,
             background_label=0,
@@ -344,6 +346,21 @@ class _ConnectPlotInputSpec(BaseInterfaceInputSpec):
             "Aligned with the list of atlases in 'atlases'."
         ),
     )
+    correlations_cifti = InputMultiObject(
+        File(exists=True),
+        desc=(
+            'List of pconn CIFTI files with the same correlation matrices as correlations_tsv. '
+            'If provided, the matrices are read from these binary files instead of the TSVs.'
+        ),
+    )
+    max_display_size = traits.Int(
+        300,
+        usedefault=True,
+        desc=(
+            'Matrices with more parcels are shown as the means of blocks of neighboring parcels, '
+            'after sorting by network, with at most this many rows and columns.'
+        ),
+    )
 
 
 class _ConnectPlotOutputSpec(TraitedSpec):
@@ -355,12 +372,17 @@ class _ConnectPlotOutputSpec(TraitedSpec):
 
 
 class ConnectPlot(SimpleInterface):
-    """Extract timeseries and compute connectivity matrices."""
+    """Extract timeseries and compute connectivity matrices.
+
+    Each matrix is drawn as a single raster image.
+    Large matrices are reduced to block means for display,
+    so the size of the figure does not grow with the number of parcels.
+    """
 
     input_spec = _ConnectPlotInputSpec
     output_spec = _ConnectPlotOutputSpec
 
-    def plot_matrix(self, corr_mat, network_labels, ax):
+    def plot_matrix(self, corr_mat, network_labels, ax, max_size=None):
         """Plot matrix in subplot Axes."""
         assert corr_mat.shape[0] == len(network_labels)
         assert corr_mat.shape[1] == len(network_labels)
@@ -405,8 +427,12 @@ class ConnectPlot(SimpleInterface):
 
         np.fill_diagonal(corr_mat, 0)
 
+        if max_size and corr_mat.shape[0] > max_size:
+            corr_mat, to_display = _get_block_means(corr_mat, max_size)
+            break_idx, label_idx = to_display(break_idx), to_display(label_idx)
+
         # Plot the correlation matrix
-        im = ax.imshow(corr_mat, vmin=-1, vmax=1, cmap='seismic')
+        im = ax.imshow(corr_mat, vmin=-1, vmax=1, cmap='seismic', interpolation='none')
 
         # Add lines separating networks
         for idx in break_idx[1:-1]:
@@ -480,7 +506,12 @@ class ConnectPlot(SimpleInterface):
             if 0 in dseg_df.index:
                 dseg_df = dseg_df.drop(index=[0])
 
-            corrs_df = pd.read_table(atlas_file, index_col='Node')
+            if isdefined(self.inputs.correlations_cifti):
+                corr_mat = np.asarray(
+                    nb.load(self.inputs.correlations_cifti[atlas_idx]).dataobj, dtype=np.float32
+                )
+            else:
+                corr_mat = pd.read_table(atlas_file, index_col='Node').to_numpy()
 
             if atlas.startswith('4S'):
                 atlas_mapper = {
@@ -496,9 +527,10 @@ class ConnectPlot(SimpleInterface):
                 network_labels = ['None'] * dseg_df.shape[0]
 
             im, ax = self.plot_matrix(
-                corr_mat=corrs_df.to_numpy(),
+                corr_mat=corr_mat,
                 network_labels=network_labels,
                 ax=ax,
+                max_size=self.inputs.max_display_size,
             )
             ax.set_title(
                 atlas,
@@ -519,12 +551,43 @@ class ConnectPlot(SimpleInterface):
             use_ext=False,
         )
 
-        fig.savefig(self._results['connectplot'], bbox_inches='tight', pad_inches=None)
-        plt.close(fig)
+        save_figure(fig, self._results['connectplot'], bbox_inches='tight', pad_inches=None)
 
         return runtime
 
 
+def _get_block_means(matrix, max_size):
+    """Average a square matrix over blocks of neighboring rows and columns.
+
+    Parameters
+    ----------
+    matrix : (N, N) numpy.ndarray
+        The matrix. NaNs are ignored.
+    max_size : int
+        Maximum number of rows and columns of the reduced matrix.
+
+    Returns
+    -------
+    block_means : (M, M) numpy.ndarray
+        The mean of each block. Blocks without finite values are NaN.
+    to_display : callable
+        Maps positions along the axes of ``matrix`` to positions along the axes of
+        ``block_means``, with pixel centers at integer positions in both cases.
+    """
+    block_size = int(np.ceil(matrix.shape[0] / max_size))
+    starts = np.arange(0, matrix.shape[0], block_size)
+    finite = np.isfinite(matrix)
+    sums = np.add.reduceat(np.add.reduceat(np.where(finite, matrix, 0), starts, 0), starts, 1)
+    counts = np.add.reduceat(np.add.reduceat(finite.astype(np.int32), starts, 0), starts, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        block_means = sums / counts
+
+    def to_display(positions):
+        return (np.asarray(positions) + 0.5) / block_size - 0.5
+
+    return block_means, to_display
+
+
 class _CiftiToTSVInputSpec(BaseInterfaceInputSpec):
     in_file = File(
         exists=True,
@@ -1,6 +1,5 @@
 """Classes for building an executive summary file."""
 
-import multiprocessing
 import os
 import re
 from pathlib import Path
@@ -19,13 +18,25 @@ from nipype.interfaces.base import (
     OutputMultiObject,
     SimpleInterface,
     TraitedSpec,
+    isdefined,
     traits,
 )
-from PIL import Image
+from PIL import Image, ImageColor
 
 from xcp_d.data import load as load_data
-from xcp_d.utils.execsummary import get_mesh, plot_gii
+from xcp_d.utils.execsummary import (
+    assemble_mosaic,
+    get_scene_slices,
+    load_surface,
+    section_mesh,
+)
 from xcp_d.utils.filemanip import fname_presuffix
+from xcp_d.utils.reportlets import (
+    OutputManifest,
+    fetch_reportlets,
+    get_reportlet_key,
+    store_reportlets,
+)
 
 
 class ExecutiveSummary:
@@ -41,9 +52,16 @@ class ExecutiveSummary:
         Subject ID.
     session_id : None or :obj:`str`, optional
         Session ID.
+    layout : None, :obj:`~bids.layout.BIDSLayout`, or \
+            :obj:`~xcp_d.utils.reportlets.OutputManifest`, optional
+        Index of the XCP-D derivatives, with the "figures" configuration.
+        Passing the same index to the summaries of several subjects avoids indexing
+        the whole dataset for each of them.
+        If None, the subject's manifest is used if it exists.
+        Otherwise, the derivatives are indexed when the summary is created.
     """
 
-    def __init__(self, xcpd_path, output_dir, subject_id, session_id=None):
+    def __init__(self, xcpd_path, output_dir, subject_id, session_id=None, layout=None):
         self.xcpd_path = xcpd_path
         self.output_dir = output_dir
         self.subject_id = subject_id
@@ -52,7 +70,12 @@ class ExecutiveSummary:
         else:
             self.session_id = None
 
-        self.layout = BIDSLayout(xcpd_path, config='figures', validate=False)
+        if layout is None and OutputManifest.exists(xcpd_path, subject_id):
+            layout = OutputManifest(xcpd_path, subject_id)
+        elif layout is None:
+            layout = BIDSLayout(xcpd_path, config='figures', validate=False)
+
+        self.layout = layout
 
     def write_html(self, document, filename):
         """Write an html document to a filename.
@@ -296,20 +319,22 @@ class ExecutiveSummary:
 
         self.task_files_ = task_files
 
+    def get_out_file(self, parameters_hash=None):
+        """Get the default path of the executive summary."""
+        prefix = f'sub-{self.subject_id}'
+        if self.session_id:
+            prefix = f'{prefix}_ses-{self.session_id}'
+
+        if parameters_hash:
+            prefix = f'{prefix}_hash-{parameters_hash}'
+
+        return os.path.join(self.output_dir, f'{prefix}_executive_summary.html')
+
     def generate_report(self, out_file=None, parameters_hash=None):
         """Generate the report."""
         logs_path = Path(self.xcpd_path) / 'logs'
         if out_file is None:
-            prefix = f'sub-{self.subject_id}'
-            if self.session_id:
-                prefix = f'{prefix}_ses-{self.session_id}'
-
-            if parameters_hash:
-                prefix = f'{prefix}_hash-{parameters_hash}'
-
-            out_file = f'{prefix}_executive_summary.html'
-
-            out_file = os.path.join(self.output_dir, out_file)
+            out_file = self.get_out_file(parameters_hash=parameters_hash)
 
         boilerplate = []
         boiler_idx = 0
@@ -435,7 +460,6 @@ class FormatForBrainSwipes(SimpleInterface):
 
 
 class _PlotSlicesForBrainSpriteInputSpec(BaseInterfaceInputSpec):
-    n_procs = traits.Int(1, usedefault=True, desc='number of cpus to use for making figures')
     lh_wm = File(exists=True, mandatory=True, desc='left hemisphere wm surface in gifti format')
     rh_wm = File(exists=True, mandatory=True, desc='right hemisphere wm surface in gifti format')
     lh_pial = File(
@@ -445,99 +469,402 @@ class _PlotSlicesForBrainSpriteInputSpec(BaseInterfaceInputSpec):
         exists=True, mandatory=True, desc='right hemisphere pial surface in gifti format'
     )
     nifti = File(exists=True, mandatory=True, desc='3dVolume aligned to the wm and pial surfaces')
+    tile_dim = traits.Int(
+        218,
+        usedefault=True,
+        desc='size of the square tiles of the mosaic, in pixels',
+    )
+    reportlet_store = traits.Either(
+        None,
+        traits.Str,
+        default=None,
+        usedefault=True,
+        nohash=True,
+        desc=(
+            'Directory of a content-hash store of reportlets. '
+            'Images rendered before from the same data and parameters are linked from the '
+            'store instead of being rendered again.'
+        ),
+    )
 
 
 class _PlotSlicesForBrainSpriteOutputSpec(BaseInterfaceInputSpec):
     out_files = OutputMultiObject(File(exist=True), desc='png files')
+    mosaic_file = File(exists=True, desc='BrainSprite mosaic of the png files')
 
 
 class PlotSlicesForBrainSprite(SimpleInterface):
-    """A class that produces images for BrainSprite mosaics."""
+    """A class that produces images for BrainSprite mosaics.
+
+    All sagittal slices are drawn at once:
+    the intensity limits are computed once for the whole volume,
+    the surfaces are sectioned by every slice plane in a single sweep,
+    and the contours are rasterized directly into the slice images.
+    The mosaic is then assembled from the images in memory.
+    """
 
     input_spec = _PlotSlicesForBrainSpriteInputSpec
     output_spec = _PlotSlicesForBrainSpriteOutputSpec
 
     def _run_interface(self, runtime):
-        img = nb.load(self.inputs.nifti)
-        lh_wm = get_mesh(self.inputs.lh_wm)
-        lh_pial = get_mesh(self.inputs.lh_pial)
-        rh_wm = get_mesh(self.inputs.rh_wm)
-        rh_pial = get_mesh(self.inputs.rh_pial)
-
-        n_x = img.shape[0]
-        filenames = []
-        slice_args = [
-            (img, i_slice, rh_pial, lh_pial, rh_wm, lh_wm, runtime.cwd) for i_slice in range(n_x)
+        img = nb.as_closest_canonical(nb.load(self.inputs.nifti))
+        self._results['out_files'] = [
+            os.path.join(runtime.cwd, f'test_{i_slice:03d}.png') for i_slice in range(img.shape[0])
         ]
+        self._results['mosaic_file'] = os.path.join(runtime.cwd, 'mosaic.png')
+        out_files = self._results['out_files'] + [self._results['mosaic_file']]
+
+        store_dir = self.inputs.reportlet_store
+        if store_dir:
+            key = get_reportlet_key(
+                self.__class__.__name__,
+                [
+                    self.inputs.nifti,
+                    self.inputs.lh_pial,
+                    self.inputs.rh_pial,
+                    self.inputs.lh_wm,
+                    self.inputs.rh_wm,
+                ],
+                {'tile_dim': self.inputs.tile_dim},
+            )
+            if fetch_reportlets(store_dir, key, out_files):
+                return runtime
+
+        tiles, voxel_to_pixel = _render_sagittal_slices(img, self.inputs.tile_dim)
+
+        # Draw the white matter contours on top of the pial ones
+        world_to_voxel = np.linalg.inv(img.affine)
+        for surfaces, color in (
+            ((self.inputs.lh_pial, self.inputs.rh_pial), 'darkred'),
+            ((self.inputs.lh_wm, self.inputs.rh_wm), 'black'),
+        ):
+            for surface in surfaces:
+                vertices, faces = load_surface(surface)
+                vertices = nb.affines.apply_affine(world_to_voxel, vertices)
+                segments, indptr = section_mesh(vertices, faces, np.arange(img.shape[0]))
+                _draw_segments(tiles, voxel_to_pixel(segments), indptr, ImageColor.getrgb(color))
+
+        images = [Image.fromarray(tile) for tile in tiles]
+        for image, filename in zip(images, self._results['out_files'], strict=True):
+            image.save(filename)
+
+        assemble_mosaic(images, self.inputs.tile_dim).save(
+            self._results['mosaic_file'], 'PNG', quality=95
+        )
 
-        with multiprocessing.Pool(processes=self.inputs.n_procs) as pool:
-            filenames = pool.starmap(_plot_single_slice, slice_args)
-        self._results['out_files'] = filenames
+        if store_dir:
+            store_reportlets(store_dir, key, out_files)
 
         return runtime
 
 
-def _plot_single_slice(img, i_slice, rh_pial, lh_pial, rh_wm, lh_wm, root_dir):
-    """Filter translation and rotation motion parameters.
+class _RenderScenesInputSpec(BaseInterfaceInputSpec):
+    scene_file = File(exists=True, mandatory=True, desc='Connectome Workbench scene file')
+    scene_names = traits.List(
+        traits.Either(traits.Int, traits.Str),
+        mandatory=True,
+        desc='names or numbers (starting at one) of the scenes to render',
+    )
+    image_width = traits.Int(mandatory=True, desc='width of the images, in pixels')
+    image_height = traits.Int(mandatory=True, desc='height of the images, in pixels')
+    renderer = traits.Enum(
+        'auto',
+        'workbench',
+        'python',
+        usedefault=True,
+        desc=(
+            'Render the scenes with wb_command or with Python. '
+            '"auto" uses wb_command if it is available.'
+        ),
+    )
+    anat_file = File(exists=True, desc='volume shown in the scenes, for the Python renderer')
+    lh_pial_surf = File(exists=True, desc='left hemisphere pial surface in gifti format')
+    rh_pial_surf = File(exists=True, desc='right hemisphere pial surface in gifti format')
+    lh_wm_surf = File(exists=True, desc='left hemisphere wm surface in gifti format')
+    rh_wm_surf = File(exists=True, desc='right hemisphere wm surface in gifti format')
+    num_threads = traits.Int(1, usedefault=True, nohash=True, desc='number of threads')
+    reportlet_store = traits.Either(
+        None,
+        traits.Str,
+        default=None,
+        usedefault=True,
+        nohash=True,
+        desc=(
+            'Directory of a content-hash store of reportlets. '
+            'Images rendered before from the same data and parameters are linked from the '
+            'store instead of being rendered again.'
+        ),
+    )
+
+
+class _RenderScenesOutputSpec(TraitedSpec):
+    out_files = OutputMultiObject(File(exists=True), desc='one image per scene')
+
+
+class RenderScenes(SimpleInterface):
+    """Render the volume slices of several scenes of a scene file in a single node.
+
+    ``wb_command -show-scene`` renders one scene per call,
+    so the workbench renderer runs the scenes one after the other,
+    without a node (and a process pool job) per scene.
+    The Python renderer reads the view plane and slice coordinate of each scene from the
+    scene file, then loads the volume and surfaces once and draws the pial (maroon)
+    and white matter (black) contours on every slice, like the scene template does.
+    """
+
+    input_spec = _RenderScenesInputSpec
+    output_spec = _RenderScenesOutputSpec
+
+    def _run_interface(self, runtime):
+        import shutil
+
+        from xcp_d.interfaces.workbench import ShowScene
+
+        out_files = [
+            os.path.join(runtime.cwd, ShowScene(scene_name_or_number=name)._gen_outfilename())
+            for name in self.inputs.scene_names
+        ]
+
+        self._results['out_files'] = out_files
+        renderer = self.inputs.renderer
+        if renderer == 'auto':
+            renderer = 'workbench' if shutil.which('wb_command') else 'python'
+
+        anat_files = [
+            self.inputs.anat_file,
+            self.inputs.lh_pial_surf,
+            self.inputs.rh_pial_surf,
+            self.inputs.lh_wm_surf,
+            self.inputs.rh_wm_surf,
+        ]
+        # The rest of the scenes are set by the template, which only changes with XCP-D
+        store_dir = self.inputs.reportlet_store
+        if store_dir and all(isdefined(anat_file) for anat_file in anat_files):
+            key = get_reportlet_key(
+                self.__class__.__name__,
+                anat_files,
+                {
+                    'slices': get_scene_slices(self.inputs.scene_file, self.inputs.scene_names),
+                    'size': [self.inputs.image_width, self.inputs.image_height],
+                    'renderer': renderer,
+                },
+            )
+            if fetch_reportlets(store_dir, key, out_files):
+                return runtime
+        else:
+            store_dir = None
+
+        if renderer == 'workbench':
+            for scene_name in self.inputs.scene_names:
+                ShowScene(
+                    scene_file=self.inputs.scene_file,
+                    scene_name_or_number=scene_name,
+                    image_width=self.inputs.image_width,
+                    image_height=self.inputs.image_height,
+                    num_threads=self.inputs.num_threads,
+                ).run(cwd=runtime.cwd)
+        else:
+            img = nb.as_closest_canonical(nb.load(self.inputs.anat_file))
+            slices = get_scene_slices(self.inputs.scene_file, self.inputs.scene_names)
+            size = (self.inputs.image_width, self.inputs.image_height)
+            surfaces = (
+                ((self.inputs.lh_pial_surf, self.inputs.rh_pial_surf), 'maroon'),
+                ((self.inputs.lh_wm_surf, self.inputs.rh_wm_surf), 'black'),
+            )
+            for image, out_file in zip(
+                _render_scene_slices(img, slices, size, surfaces), out_files, strict=True
+            ):
+                Image.fromarray(image).save(out_file)
+
+        if store_dir:
+            store_reportlets(store_dir, key, out_files)
+
+        return runtime
+
+
+def _render_scene_slices(img, slices, size, surfaces):
+    """Draw slices of an image with the contours of surfaces, on black backgrounds.
 
     Parameters
     ----------
     img : nb.Nifti1Image
-        NiBabel Spatial Image
-    i_slice : int
-        Which slice number to create a png of
-    rh_pial : trimesh.Trimesh
-        Right hemisphere pial surface loaded as a Trimesh
-    lh_pial : trimesh.Trimesh
-        Left hemisphere pial surface loaded as a Trimesh
-    rh_wm : trimesh.Trimesh
-        Right hemisphere wm surface loaded as a Trimesh
-    lh_wm : trimesh.Trimesh
-        Left hemisphere wm surface loaded as a Trimesh
-    root_dir : str
-        String representing the directory where files will be written
+        NiBabel Spatial Image, in RAS+ orientation.
+    slices : list of tuple
+        The view plane ("AXIAL", "CORONAL", or "PARASAGITTAL") and the world coordinate of
+        each slice, as returned by :func:`~xcp_d.utils.execsummary.get_scene_slices`.
+    size : tuple of int
+        Width and height of the images, in pixels.
+        The slices are scaled to fit, preserving the physical aspect ratio of the voxels.
+    surfaces : list of tuple
+        GIFTI surface files and the color of their contours.
 
     Returns
     -------
-    filename : str
-        Absolute path of the png created
+    images : (N, H, W, 3) numpy.ndarray of uint8
+        One image per slice, with left to the left, anterior to the right (sagittal slices),
+        and superior (or anterior, for axial slices) to the top.
     """
+    scaled = _scale_intensities(img)
+    zooms = np.array(img.header.get_zooms()[:3])
+    world_to_voxel = np.linalg.inv(img.affine)
+    planes = {'PARASAGITTAL': 0, 'CORONAL': 1, 'AXIAL': 2}
+    images = np.zeros((len(slices), size[1], size[0], 3), dtype=np.uint8)
+
+    # Voxel coordinates of the slices along their normal axes
+    axes = np.array([planes[plane] for plane, _ in slices], dtype=int)
+    positions = np.empty(len(slices))
+    for i_slice, (axis, (_, coordinate)) in enumerate(zip(axes, slices, strict=True)):
+        world = np.zeros(3)
+        world[axis] = coordinate
+        positions[i_slice] = nb.affines.apply_affine(world_to_voxel, world)[axis]
+
+    # Load each surface once and section it by all the slices along each axis in one sweep
+    contours = [[] for _ in slices]
+    for surface_files, color in surfaces:
+        for surface_file in surface_files:
+            vertices, faces = load_surface(surface_file)
+            vertices = nb.affines.apply_affine(world_to_voxel, vertices)
+            for axis in np.unique(axes):
+                i_slices = np.flatnonzero(axes == axis)
+                segments, indptr = section_mesh(vertices, faces, positions[i_slices], axis=axis)
+                for i_plane, i_slice in enumerate(i_slices):
+                    contours[i_slice].append(
+                        (segments[indptr[i_plane] : indptr[i_plane + 1]], ImageColor.getrgb(color))
+                    )
+
+    for i_slice, axis in enumerate(axes):
+        index = int(np.clip(np.round(positions[i_slice]), 0, scaled.shape[axis] - 1))
+        first, second = [i for i in range(3) if i != axis]
+        n_first, n_second = scaled.shape[first], scaled.shape[second]
+
+        width_mm, height_mm = n_first * zooms[first], n_second * zooms[second]
+        scale = min(size[0] / width_mm, size[1] / height_mm)
+        width = max(int(round(width_mm * scale)), 1)
+        height = max(int(round(height_mm * scale)), 1)
+        left, top = (size[0] - width) // 2, (size[1] - height) // 2
+        slice_data = np.take(scaled, index, axis=axis)
+        tile = Image.fromarray(np.ascontiguousarray(slice_data.T[::-1]))
+        tile = np.asarray(tile.resize((width, height), Image.Resampling.BILINEAR))
+        images[i_slice, top : top + height, left : left + width] = tile[..., None]
+
+        for segments, color in contours[i_slice]:
+            pixels = np.stack(
+                (
+                    left + (segments[..., first] + 0.5) * width / n_first,
+                    top + (n_second - 0.5 - segments[..., second]) * height / n_second,
+                ),
+                axis=-1,
+            )
+            _draw_segments(
+                images[i_slice : i_slice + 1],
+                pixels,
+                np.array([0, segments.shape[0]]),
+                color,
+                thickness=2,
+            )
+
+    return images
+
+
+def _render_sagittal_slices(img, tile_dim):
+    """Scale every sagittal slice of an image to a grayscale RGB tile.
+
+    Parameters
+    ----------
+    img : nb.Nifti1Image
+        NiBabel Spatial Image, in RAS+ orientation.
+    tile_dim : int
+        The larger side of the slices is scaled to this many pixels,
+        preserving the physical aspect ratio of the voxels.
+
+    Returns
+    -------
+    tiles : (X, H, W, 3) numpy.ndarray of uint8
+        One image per slice, with anterior to the right and superior to the top.
+    voxel_to_pixel : callable
+        Maps (..., 3) voxel coordinates to (..., 2) pixel coordinates of the tiles.
+    """
+    scaled = _scale_intensities(img)
+
+    _, n_y, n_z = scaled.shape
+    width_mm, height_mm = np.array([n_y, n_z]) * img.header.get_zooms()[1:3]
+    scale = tile_dim / max(width_mm, height_mm)
+    size = (max(int(round(width_mm * scale)), 1), max(int(round(height_mm * scale)), 1))
+
+    tiles = np.empty((scaled.shape[0], size[1], size[0], 3), dtype=np.uint8)
+    for i_slice, slice_data in enumerate(scaled):
+        # Anterior to the right, superior to the top
+        tile = Image.fromarray(np.ascontiguousarray(slice_data.T[::-1]))
+        tiles[i_slice] = np.asarray(tile.resize(size, Image.Resampling.BILINEAR))[..., None]
+
+    def voxel_to_pixel(coords):
+        return np.stack(
+            (
+                (coords[..., 1] + 0.5) * size[0] / n_y,
+                (n_z - 0.5 - coords[..., 2]) * size[1] / n_z,
+            ),
+            axis=-1,
+        )
+
+    return tiles, voxel_to_pixel
+
+
+def _scale_intensities(img):
+    """Map the 2nd to 98th percentiles of an image's intensities to grayscale levels.
+
+    Parameters
+    ----------
+    img : nb.Nifti1Image
+        NiBabel Spatial Image.
+
+    Returns
+    -------
+    scaled : numpy.ndarray of uint8
+        The first three dimensions of the image's data.
+    """
+    data = np.asanyarray(img.dataobj, dtype=np.float32).reshape(img.shape[:3])
+    vmin, vmax = np.percentile(data, [2, 98])
+    scaled = np.clip((data - vmin) / max(vmax - vmin, np.finfo(np.float32).eps), 0, 1)
+    return (scaled * 255).astype(np.uint8)
 
-    import os
-
-    import matplotlib.pyplot as plt
-    import nibabel as nb
-    from nilearn import plotting
-
-    fig, ax = plt.subplots(figsize=(9, 7.5))
-
-    # Get the appropriate coordinate
-    # TODO: Shift so middle is center of image
-    coord = nb.affines.apply_affine(img.affine, [i_slice, 0, 0])[0]
-
-    # Display a sagittal slice (adjust 'display_mode' and 'cut_coords' as needed)
-    data = img.get_fdata()
-    vmin = np.percentile(data, 2)
-    vmax = np.percentile(data, 98)
-    slicer = plotting.plot_anat(
-        img,
-        display_mode='x',
-        cut_coords=[coord],
-        axes=ax,
-        figure=fig,
-        annotate=False,
-        vmin=vmin,
-        vmax=vmax,
-        colorbar=False,
-        black_bg=True,
-    )
 
-    # Load the surface mesh (GIFTI format)
-    plot_gii(lh_pial, coord, 'darkred', slicer, 'x')
-    plot_gii(rh_pial, coord, 'darkred', slicer, 'x')
-    plot_gii(lh_wm, coord, 'black', slicer, 'x')
-    plot_gii(rh_wm, coord, 'black', slicer, 'x')
+def _draw_segments(tiles, segments, indptr, color, thickness=1):
+    """Rasterize line segments into their slice images.
+
+    Parameters
+    ----------
+    tiles : (X, H, W, 3) numpy.ndarray
+        The slice images. Modified in place.
+    segments : (S, 2, 2) numpy.ndarray
+        End points of the segments, in pixel coordinates.
+    indptr : (X + 1,) numpy.ndarray
+        The segments of slice ``i`` are ``segments[indptr[i]:indptr[i + 1]]``.
+    color : tuple of int
+        RGB color of the lines.
+    thickness : int, optional
+        Width of the lines, in pixels. Default is 1.
+    """
+    # Sample each segment at least once per pixel along its length
+    lengths = np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1)
+    n_samples = np.ceil(lengths).astype(int) + 1
+    i_segment = np.repeat(np.arange(segments.shape[0]), n_samples)
+    starts = np.cumsum(n_samples) - n_samples
+    steps = (np.arange(n_samples.sum()) - np.repeat(starts, n_samples)) / np.repeat(
+        np.maximum(n_samples - 1, 1), n_samples
+    )
+    points = segments[i_segment, 0] + steps[:, None] * (
+        segments[i_segment, 1] - segments[i_segment, 0]
+    )
 
-    filename = os.path.join(root_dir, f'test_{i_slice:03d}.png')
-    fig.savefig(filename, bbox_inches='tight', facecolor='black')
-    return filename
+    i_slice = np.repeat(np.arange(indptr.size - 1), np.diff(indptr))[i_segment]
+    cols, rows = np.floor(points).astype(int).T
+    for row_shift in range(thickness):
+        for col_shift in range(thickness):
+            shifted_rows, shifted_cols = rows + row_shift, cols + col_shift
+            inside = (
+                (shifted_rows >= 0)
+                & (shifted_rows < tiles.shape[1])
+                & (shifted_cols >= 0)
+                & (shifted_cols < tiles.shape[2])
+            )
+            tiles[i_slice[inside], shifted_rows[inside], shifted_cols[inside]] = color
@@ -3,20 +3,23 @@
 import os
 
 import pandas as pd
-from nilearn import masking
 from nipype.interfaces.base import (
     BaseInterfaceInputSpec,
     File,
     InputMultiPath,
     SimpleInterface,
     TraitedSpec,
+    isdefined,
     traits,
 )
 from nipype.interfaces.nilearn import NilearnBaseInterface
 
+from xcp_d.utils.lazy import lazy_import
 from xcp_d.utils.utils import denoise_with_nilearn, get_col
 from xcp_d.utils.write_save import read_ndata, write_ndata
 
+masking = lazy_import('nilearn.masking')
+
 
 class _IndexImageInputSpec(BaseInterfaceInputSpec):
     in_file = File(
@@ -115,6 +118,20 @@ class _SmoothInputSpec(BaseInterfaceInputSpec):
             'Smoothing strength, as a full-width at half maximum, in millimeters.'
         ),
     )
+    mask = File(
+        exists=True,
+        mandatory=False,
+        desc=(
+            'A brain mask. '
+            'If provided, the image is smoothed within the mask with a separable Gaussian kernel, '
+            'one block of volumes at a time, instead of with Nilearn.'
+        ),
+    )
+    n_procs = traits.Int(
+        1,
+        usedefault=True,
+        desc='Number of processes to use when smoothing within a mask.',
+    )
     out_file = File(
         'smooth_img.nii.gz',
         usedefault=True,
@@ -131,7 +148,12 @@ class _SmoothOutputSpec(TraitedSpec):
 
 
 class Smooth(NilearnBaseInterface, SimpleInterface):
-    """Smooth image."""
+    """Smooth image.
+
+    If a mask is provided, smoothing is restricted to the mask and done with
+    :func:`~xcp_d.utils.smoothing.smooth_masked_img`.
+    Otherwise, :func:`nilearn.image.smooth_img` is applied to the full image.
+    """
 
     input_spec = _SmoothInputSpec
     output_spec = _SmoothOutputSpec
@@ -139,9 +161,20 @@ class Smooth(NilearnBaseInterface, SimpleInterface):
     def _run_interface(self, runtime):
         from nilearn.image import smooth_img
 
-        img_smoothed = smooth_img(self.inputs.in_file, fwhm=self.inputs.fwhm)
+        from xcp_d.utils.smoothing import smooth_masked_img
+
         self._results['out_file'] = os.path.join(runtime.cwd, self.inputs.out_file)
-        img_smoothed.to_filename(self._results['out_file'])
+        if isdefined(self.inputs.mask):
+            smooth_masked_img(
+                in_file=self.inputs.in_file,
+                mask_file=self.inputs.mask,
+                fwhm=self.inputs.fwhm,
+                out_file=self._results['out_file'],
+                n_procs=self.inputs.n_procs,
+            )
+        else:
+            img_smoothed = smooth_img(self.inputs.in_file, fwhm=self.inputs.fwhm)
+            img_smoothed.to_filename(self._results['out_file'])
 
         return runtime
 
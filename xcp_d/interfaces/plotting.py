@@ -4,15 +4,9 @@
 
 import os
 
-import matplotlib.pyplot as plt
 import nibabel as nb
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from matplotlib.cm import ScalarMappable
-from matplotlib.colors import Normalize
-from matplotlib.gridspec import GridSpec, GridSpecFromSubplotSpec
-from nilearn.plotting import plot_anat, plot_stat_map, plot_surf_stat_map
 from nipype import logging
 from nipype.interfaces.base import (
     BaseInterfaceInputSpec,
@@ -27,15 +21,37 @@ from nipype.interfaces.base import (
     traits,
 )
 from nipype.interfaces.fsl.base import FSLCommand, FSLCommandInputSpec
-from templateflow.api import get as get_template
 
 from xcp_d.utils.filemanip import fname_presuffix
-from xcp_d.utils.plotting import FMRIPlot, plot_fmri_es, surf_data_from_cifti
+from xcp_d.utils.lazy import lazy_import
+from xcp_d.utils.plotting import (
+    FMRIPlot,
+    get_fslr_surfaces,
+    get_template_file,
+    plot_fmri_es,
+    plot_surface_map,
+    save_figure,
+    surf_data_from_cifti,
+)
 from xcp_d.utils.qcmetrics import compute_dvars
 from xcp_d.utils.utils import get_col
 from xcp_d.utils.write_save import read_ndata
 
 LOGGER = logging.getLogger('nipype.interface')
+plt = lazy_import('matplotlib.pyplot')
+sns = lazy_import('seaborn')
+mcm = lazy_import('matplotlib.cm')
+mcolors = lazy_import('matplotlib.colors')
+mgs = lazy_import('matplotlib.gridspec')
+nlplotting = lazy_import('nilearn.plotting')
+
+# Hemisphere and view of the four panels of the surface plots, in reading order
+_SURFACE_PANELS = [
+    ('left', 'lateral'),
+    ('right', 'lateral'),
+    ('left', 'medial'),
+    ('right', 'medial'),
+]
 
 
 class _CensoringPlotInputSpec(BaseInterfaceInputSpec):
@@ -149,13 +165,14 @@ class CensoringPlot(SimpleInterface):
             vline_yspan = 0.2 / len(exact_columns)
             vline_ymin = vline_ymax - vline_yspan
 
-            for j_idx, idx in enumerate(tmask_idx):
-                label = f'Randomly Censored Volumes {exact_col}' if j_idx == 0 else ''
-                ax.axvline(
-                    idx * self.inputs.TR,
+            # One collection for all the lines is much faster to draw than one line each
+            if tmask_idx.size:
+                ax.vlines(
+                    tmask_idx * self.inputs.TR,
                     ymin=vline_ymin,
                     ymax=vline_ymax,
-                    label=label,
+                    transform=ax.get_xaxis_transform(),
+                    label=f'Randomly Censored Volumes {exact_col}',
                     color=palette[4 + i_col],
                     alpha=0.8,
                 )
@@ -166,11 +183,13 @@ class CensoringPlot(SimpleInterface):
         tmask_arr = get_col(censoring_df, 'framewise_displacement').values
         assert preproc_fd_timeseries.size == tmask_arr.size
         tmask_idx = np.where(tmask_arr)[0]
-        for i_idx, idx in enumerate(tmask_idx):
-            label = 'Motion-Censored Volumes' if i_idx == 0 else ''
-            ax.axvline(
-                idx * self.inputs.TR,
-                label=label,
+        if tmask_idx.size:
+            ax.vlines(
+                tmask_idx * self.inputs.TR,
+                ymin=0,
+                ymax=1,
+                transform=ax.get_xaxis_transform(),
+                label='Motion-Censored Volumes',
                 color=palette[3],
                 alpha=0.5,
             )
@@ -187,8 +206,92 @@ class CensoringPlot(SimpleInterface):
             use_ext=False,
         )
 
-        fig.savefig(self._results['out_file'])
-        plt.close(fig)
+        save_figure(fig, self._results['out_file'])
+        return runtime
+
+
+class _DeferReportletInputSpec(BaseInterfaceInputSpec):
+    reportlet = traits.Enum(
+        'censoring',
+        'design',
+        mandatory=True,
+        desc='The figure to render: the censoring plot or the design matrix.',
+    )
+    source_file = traits.Str(mandatory=True, desc='File used to name the figure.')
+    motion_file = File(exists=True, desc='Motion parameters, with framewise displacement.')
+    temporal_mask = File(exists=True, desc='Temporal mask after dummy scan removal.')
+    design_matrix = File(exists=True, desc='Design matrix of the confound regression.')
+    dummy_scans = traits.Int(desc='Dummy time to drop')
+    parameters = traits.Dict(usedefault=True, desc='Other inputs of the plotting interface.')
+    datasink = traits.Dict(
+        mandatory=True,
+        desc='Inputs of the DerivativesDataSink that writes the figure.',
+    )
+    base_directory = Directory(mandatory=True, desc='The output dataset.')
+    hash = traits.Str(desc='Hash of the parameters, in the multiverse output layout.')
+
+
+class _DeferReportletOutputSpec(TraitedSpec):
+    out_dir = Directory(exists=True, desc='Folder with the data of the figure.')
+
+
+class DeferReportlet(SimpleInterface):
+    """Write the data of a figure, which is then rendered when the reports are generated.
+
+    The data are written to the subject's ``log/reportlets`` folder in the output dataset,
+    where :func:`~xcp_d.utils.reportlets.render_deferred_reportlet` finds them.
+    Only the framewise displacement columns of the motion file are kept.
+    """
+
+    input_spec = _DeferReportletInputSpec
+    output_spec = _DeferReportletOutputSpec
+
+    def _run_interface(self, runtime):
+        import json
+        import shutil
+
+        from xcp_d.utils.bids import get_entity
+        from xcp_d.utils.reportlets import DEFERRED_SPEC_FILE, get_deferred_dir
+
+        source_file = self.inputs.source_file
+        datasink = dict(self.inputs.datasink)
+        reportlet_name = f'{os.path.basename(source_file).split(".")[0]}_{self.inputs.reportlet}'
+        if isdefined(self.inputs.hash):
+            datasink['hash'] = self.inputs.hash
+            reportlet_name += f'_hash-{self.inputs.hash}'
+
+        subject = get_entity(source_file, 'sub')
+        out_dir = get_deferred_dir(self.inputs.base_directory, subject) / reportlet_name
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        files = {}
+        if isdefined(self.inputs.motion_file):
+            motion_df = pd.read_table(self.inputs.motion_file)
+            motion_df = motion_df.filter(regex='^framewise_displacement')
+            files['motion_file'] = 'motion.tsv'
+            motion_df.to_csv(out_dir / files['motion_file'], sep='\t', index=False)
+
+        for name in ('temporal_mask', 'design_matrix'):
+            in_file = getattr(self.inputs, name)
+            if isdefined(in_file):
+                files[name] = f'{name}.tsv'
+                shutil.copyfile(in_file, out_dir / files[name])
+
+        parameters = dict(self.inputs.parameters)
+        if isdefined(self.inputs.dummy_scans):
+            parameters['dummy_scans'] = self.inputs.dummy_scans
+
+        spec = {
+            'reportlet': self.inputs.reportlet,
+            'source_file': source_file,
+            'files': files,
+            'parameters': parameters,
+            'datasink': datasink,
+        }
+        # The spec is written last, so partially written data are never rendered
+        (out_dir / DEFERRED_SPEC_FILE).write_text(json.dumps(spec, indent=1))
+
+        self._results['out_dir'] = str(out_dir)
         return runtime
 
 
@@ -317,11 +420,7 @@ class QCPlots(SimpleInterface):
             mask_file=self.inputs.mask_file,
         ).plot(labelsize=8)
 
-        preproc_fig.savefig(
-            self._results['raw_qcplot'],
-            bbox_inches='tight',
-        )
-        plt.close(preproc_fig)
+        save_figure(preproc_fig, self._results['raw_qcplot'], bbox_inches='tight')
 
         postproc_confounds = pd.DataFrame(
             {
@@ -337,11 +436,7 @@ class QCPlots(SimpleInterface):
             mask_file=self.inputs.mask_file,
         ).plot(labelsize=8)
 
-        postproc_fig.savefig(
-            self._results['clean_qcplot'],
-            bbox_inches='tight',
-        )
-        plt.close(postproc_fig)
+        save_figure(postproc_fig, self._results['clean_qcplot'], bbox_inches='tight')
 
         return runtime
 
@@ -449,7 +544,6 @@ class QCPlotsES(SimpleInterface):
             preprocessed_figure=preprocessed_figure,
             denoised_figure=denoised_figure,
             standardize=self.inputs.standardize,
-            temporary_file_dir=runtime.cwd,
             mask=mask_file,
             seg_data=segmentation_file,
             run_index=run_index,
@@ -480,7 +574,7 @@ class AnatomicalPlot(SimpleInterface):
         arr = img.get_fdata()
 
         fig = plt.figure(constrained_layout=False, figsize=(25, 10))
-        plot_anat(
+        nlplotting.plot_anat(
             img,
             draw_cross=False,
             figure=fig,
@@ -489,8 +583,7 @@ class AnatomicalPlot(SimpleInterface):
             cut_coords=[0, 0, 0],
             annotate=False,
         )
-        fig.savefig(self._results['out_file'], bbox_inches='tight', pad_inches=None)
-        plt.close(fig)
+        save_figure(fig, self._results['out_file'], bbox_inches='tight', pad_inches=None)
 
         return runtime
 
@@ -705,6 +798,14 @@ class _PlotCiftiParcellationInputSpec(BaseInterfaceInputSpec):
         mandatory=False,
         desc='Right hemisphere underlay.',
     )
+    surface_cache_dir = traits.Either(
+        None,
+        traits.Str,
+        default=None,
+        usedefault=True,
+        nohash=True,
+        desc='Directory in which the projections of the surface meshes are kept.',
+    )
 
 
 class _PlotCiftiParcellationOutputSpec(TraitedSpec):
@@ -724,26 +825,7 @@ class PlotCiftiParcellation(SimpleInterface):
 
         if not (isdefined(self.inputs.lh_underlay) and isdefined(self.inputs.rh_underlay)):
             self._results['desc'] = f'{self.inputs.base_desc}ParcellatedStandard'
-            rh = str(
-                get_template(
-                    template='fsLR',
-                    hemi='R',
-                    density='32k',
-                    suffix='midthickness',
-                    extension='.surf.gii',
-                    raise_empty=True,
-                )
-            )
-            lh = str(
-                get_template(
-                    template='fsLR',
-                    hemi='L',
-                    density='32k',
-                    suffix='midthickness',
-                    extension='.surf.gii',
-                    raise_empty=True,
-                )
-            )
+            lh, rh = get_fslr_surfaces()
         else:
             self._results['desc'] = f'{self.inputs.base_desc}ParcellatedSubject'
             rh = self.inputs.rh_underlay
@@ -765,7 +847,7 @@ class PlotCiftiParcellation(SimpleInterface):
         if n_files == 1:
             fig.set_size_inches(6.5, 6)
             # Add an additional column for the colorbar
-            gs = GridSpec(1, 2, figure=fig, width_ratios=[1, 0.05])
+            gs = mgs.GridSpec(1, 2, figure=fig, width_ratios=[1, 0.05])
             gs_list = [gs[0, 0]]
             subplots = [fig.add_subplot(gs) for gs in gs_list]
             cbar_gs_list = [gs[0, 1]]
@@ -773,7 +855,7 @@ class PlotCiftiParcellation(SimpleInterface):
             nrows = np.ceil(n_files / 2).astype(int)
             fig.set_size_inches(12.5, 6 * nrows)
             # Add an additional column for the colorbar
-            gs = GridSpec(nrows, 3, figure=fig, width_ratios=[1, 1, 0.05])
+            gs = mgs.GridSpec(nrows, 3, figure=fig, width_ratios=[1, 1, 0.05])
             gs_list = [gs[i, j] for i in range(nrows) for j in range(2)]
             subplots = [fig.add_subplot(gs) for gs in gs_list]
             cbar_gs_list = [gs[i, 2] for i in range(nrows)]
@@ -800,12 +882,8 @@ class PlotCiftiParcellation(SimpleInterface):
             subplot_gridspec = gs_list[i_file]
 
             # Create 4 Axes (2 rows, 2 columns) from the subplot
-            gs_inner = GridSpecFromSubplotSpec(2, 2, subplot_spec=subplot_gridspec)
-            inner_subplots = [
-                fig.add_subplot(gs_inner[i, j], projection='3d')
-                for i in range(2)
-                for j in range(2)
-            ]
+            gs_inner = mgs.GridSpecFromSubplotSpec(2, 2, subplot_spec=subplot_gridspec)
+            inner_subplots = [fig.add_subplot(gs_inner[i, j]) for i in range(2) for j in range(2)]
 
             img = nb.load(cortical_files[i_file])
             img_data = img.get_fdata()
@@ -821,68 +899,22 @@ class PlotCiftiParcellation(SimpleInterface):
                 'CIFTI_STRUCTURE_CORTEX_RIGHT',
             )
 
-            plot_surf_stat_map(
-                lh,
-                lh_surf_data,
-                threshold=threshold,
-                vmin=vmin,
-                vmax=vmax,
-                hemi='left',
-                view='lateral',
-                engine='matplotlib',
-                cmap='cool',
-                colorbar=False,
-                axes=inner_subplots[0],
-                figure=fig,
-            )
-            plot_surf_stat_map(
-                rh,
-                rh_surf_data,
-                threshold=threshold,
-                vmin=vmin,
-                vmax=vmax,
-                hemi='right',
-                view='lateral',
-                engine='matplotlib',
-                cmap='cool',
-                colorbar=False,
-                axes=inner_subplots[1],
-                figure=fig,
-            )
-            plot_surf_stat_map(
-                lh,
-                lh_surf_data,
-                threshold=threshold,
-                vmin=vmin,
-                vmax=vmax,
-                hemi='left',
-                view='medial',
-                engine='matplotlib',
-                cmap='cool',
-                colorbar=False,
-                axes=inner_subplots[2],
-                figure=fig,
-            )
-            plot_surf_stat_map(
-                rh,
-                rh_surf_data,
-                threshold=threshold,
-                vmin=vmin,
-                vmax=vmax,
-                hemi='right',
-                view='medial',
-                engine='matplotlib',
-                cmap='cool',
-                colorbar=False,
-                axes=inner_subplots[3],
-                figure=fig,
-            )
-
-            for ax in inner_subplots:
-                ax.set_rasterized(True)
+            surfaces = {'left': (lh, lh_surf_data), 'right': (rh, rh_surf_data)}
+            for ax, (hemi, view) in zip(inner_subplots, _SURFACE_PANELS, strict=True):
+                plot_surface_map(
+                    *surfaces[hemi],
+                    hemi,
+                    view,
+                    ax,
+                    cmap='cool',
+                    vmin=vmin,
+                    vmax=vmax,
+                    threshold=threshold,
+                    cache_dir=self.inputs.surface_cache_dir,
+                )
 
         # Create a ScalarMappable with the "cool" colormap and the specified vmin and vmax
-        sm = ScalarMappable(cmap='cool', norm=Normalize(vmin=vmin, vmax=vmax))
+        sm = mcm.ScalarMappable(cmap='cool', norm=mcolors.Normalize(vmin=vmin, vmax=vmax))
 
         for colorbar_gridspec in cbar_gs_list:
             colorbar_ax = fig.add_subplot(colorbar_gridspec)
@@ -895,13 +927,13 @@ class PlotCiftiParcellation(SimpleInterface):
             newpath=runtime.cwd,
             use_ext=False,
         )
-        fig.savefig(
+        save_figure(
+            fig,
             self._results['out_file'],
             bbox_inches='tight',
             pad_inches=None,
             format='svg',
         )
-        plt.close(fig)
 
         return runtime
 
@@ -928,6 +960,14 @@ class _PlotDenseCiftiInputSpec(BaseInterfaceInputSpec):
         mandatory=False,
         desc='Right hemisphere underlay.',
     )
+    surface_cache_dir = traits.Either(
+        None,
+        traits.Str,
+        default=None,
+        usedefault=True,
+        nohash=True,
+        desc='Directory in which the projections of the surface meshes are kept.',
+    )
 
 
 class _PlotDenseCiftiOutputSpec(TraitedSpec):
@@ -944,26 +984,7 @@ class PlotDenseCifti(SimpleInterface):
     def _run_interface(self, runtime):
         if not (isdefined(self.inputs.lh_underlay) and isdefined(self.inputs.rh_underlay)):
             self._results['desc'] = f'{self.inputs.base_desc}SurfaceStandard'
-            rh = str(
-                get_template(
-                    template='fsLR',
-                    hemi='R',
-                    density='32k',
-                    suffix='midthickness',
-                    extension='.surf.gii',
-                    raise_empty=True,
-                )
-            )
-            lh = str(
-                get_template(
-                    template='fsLR',
-                    hemi='L',
-                    density='32k',
-                    suffix='midthickness',
-                    extension='.surf.gii',
-                    raise_empty=True,
-                )
-            )
+            lh, rh = get_fslr_surfaces()
         else:
             self._results['desc'] = f'{self.inputs.base_desc}SurfaceSubject'
             rh = self.inputs.rh_underlay
@@ -977,7 +998,7 @@ class PlotDenseCifti(SimpleInterface):
         fig = plt.figure(constrained_layout=False)
         fig.set_size_inches(6.5, 6)
         # Add an additional column for the colorbar
-        gs = GridSpec(1, 2, figure=fig, width_ratios=[1, 0.05])
+        gs = mgs.GridSpec(1, 2, figure=fig, width_ratios=[1, 0.05])
         subplot_gridspec = gs[0, 0]
         subplot = fig.add_subplot(subplot_gridspec)
         colorbar_gridspec = gs[0, 1]
@@ -985,10 +1006,8 @@ class PlotDenseCifti(SimpleInterface):
         subplot.set_axis_off()
 
         # Create 4 Axes (2 rows, 2 columns) from the subplot
-        gs_inner = GridSpecFromSubplotSpec(2, 2, subplot_spec=subplot_gridspec)
-        inner_subplots = [
-            fig.add_subplot(gs_inner[i, j], projection='3d') for i in range(2) for j in range(2)
-        ]
+        gs_inner = mgs.GridSpecFromSubplotSpec(2, 2, subplot_spec=subplot_gridspec)
+        inner_subplots = [fig.add_subplot(gs_inner[i, j]) for i in range(2) for j in range(2)]
 
         lh_surf_data = surf_data_from_cifti(
             cifti_data,
@@ -1004,67 +1023,24 @@ class PlotDenseCifti(SimpleInterface):
         vmax = np.nanmax([np.nanmax(lh_surf_data), np.nanmax(rh_surf_data)])
         vmin = np.nanmin([np.nanmin(lh_surf_data), np.nanmin(rh_surf_data)])
 
-        plot_surf_stat_map(
-            lh,
-            lh_surf_data,
-            vmin=vmin,
-            vmax=vmax,
-            hemi='left',
-            view='lateral',
-            engine='matplotlib',
-            cmap='cool',
-            colorbar=False,
-            axes=inner_subplots[0],
-            figure=fig,
-        )
-        plot_surf_stat_map(
-            rh,
-            rh_surf_data,
-            vmin=vmin,
-            vmax=vmax,
-            hemi='right',
-            view='lateral',
-            engine='matplotlib',
-            cmap='cool',
-            colorbar=False,
-            axes=inner_subplots[1],
-            figure=fig,
-        )
-        plot_surf_stat_map(
-            lh,
-            lh_surf_data,
-            vmin=vmin,
-            vmax=vmax,
-            hemi='left',
-            view='medial',
-            engine='matplotlib',
-            cmap='cool',
-            colorbar=False,
-            axes=inner_subplots[2],
-            figure=fig,
-        )
-        plot_surf_stat_map(
-            rh,
-            rh_surf_data,
-            vmin=vmin,
-            vmax=vmax,
-            hemi='right',
-            view='medial',
-            engine='matplotlib',
-            cmap='cool',
-            colorbar=False,
-            axes=inner_subplots[3],
-            figure=fig,
-        )
+        surfaces = {'left': (lh, lh_surf_data), 'right': (rh, rh_surf_data)}
+        for ax, (hemi, view) in zip(inner_subplots, _SURFACE_PANELS, strict=True):
+            plot_surface_map(
+                *surfaces[hemi],
+                hemi,
+                view,
+                ax,
+                cmap='cool',
+                vmin=vmin,
+                vmax=vmax,
+                cache_dir=self.inputs.surface_cache_dir,
+            )
 
         inner_subplots[0].set_title('Left Hemisphere', fontsize=10)
         inner_subplots[1].set_title('Right Hemisphere', fontsize=10)
 
-        for ax in inner_subplots:
-            ax.set_rasterized(True)
-
         # Create a ScalarMappable with the "cool" colormap and the specified vmin and vmax
-        sm = ScalarMappable(cmap='cool', norm=Normalize(vmin=vmin, vmax=vmax))
+        sm = mcm.ScalarMappable(cmap='cool', norm=mcolors.Normalize(vmin=vmin, vmax=vmax))
 
         colorbar_ax = fig.add_subplot(colorbar_gridspec)
         # Add a colorbar to colorbar_ax using the ScalarMappable
@@ -1077,13 +1053,13 @@ class PlotDenseCifti(SimpleInterface):
             use_ext=False,
         )
         fig.tight_layout()
-        fig.savefig(
+        save_figure(
+            fig,
             self._results['out_file'],
             bbox_inches='tight',
             pad_inches=None,
             format='svg',
         )
-        plt.close(fig)
 
         return runtime
 
@@ -1129,17 +1105,7 @@ class PlotNifti(SimpleInterface):
         cohort = get_entity(self.inputs.name_source, 'cohort')
         entities_to_use['cohort'] = cohort
 
-        template_file = get_template(
-            template=space,
-            **entities_to_use,
-            suffix='T1w',
-            desc=None,
-            raise_empty=True,
-        )
-        if isinstance(template_file, list):
-            template_file = template_file[0]
-
-        template = str(template_file)
+        template = get_template_file(space, **entities_to_use, suffix='T1w', desc=None)
 
         self._results['out_file'] = fname_presuffix(
             self.inputs.in_file,
@@ -1148,7 +1114,7 @@ class PlotNifti(SimpleInterface):
             use_ext=False,
         )
 
-        plot_stat_map(
+        nlplotting.plot_stat_map(
             self.inputs.in_file,
             bg_img=template,
             display_mode='mosaic',
@@ -1342,3 +1342,59 @@ class CiftiSmooth(WBCommand):
     input_spec = _CiftiSmoothInputSpec
     output_spec = _CiftiSmoothOutputSpec
     _cmd = 'wb_command -cifti-smoothing'
+
+
+class _CachedCiftiSmoothInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc='The input CIFTI file')
+    sigma_surf = traits.Float(
+        mandatory=True,
+        desc='the sigma for the gaussian surface smoothing kernel, in mm',
+    )
+    sigma_vol = traits.Float(
+        mandatory=True,
+        desc='the sigma for the gaussian volume smoothing kernel, in mm',
+    )
+    left_surf = File(exists=True, mandatory=True, desc='The left spherical surface')
+    right_surf = File(exists=True, mandatory=True, desc='The right spherical surface')
+    cache_dir = traits.Directory(
+        mandatory=True,
+        desc='Directory in which smoothing operators are cached and shared across runs.',
+    )
+
+
+class _CachedCiftiSmoothOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc='output CIFTI file')
+
+
+class CachedCiftiSmooth(SimpleInterface):
+    """This is not technically a Connectome Workbench interface, but it replaces CiftiSmooth.
+
+    The grayordinate smoothing operator is built once per set of surfaces, kernels, and
+    brain models as a sparse matrix and cached in ``cache_dir``,
+    so later runs (and subjects) only need a sparse-times-dense product instead of
+    recomputing the geodesic kernels with ``wb_command -cifti-smoothing``.
+    Smoothing is applied along the columns (i.e., ``direction='COLUMN'``),
+    and subcortical structures are smoothed independently.
+
+    The output keeps the input file's intent code, so FixCiftiIntent is not required.
+    """
+
+    input_spec = _CachedCiftiSmoothInputSpec
+    output_spec = _CachedCiftiSmoothOutputSpec
+
+    def _run_interface(self, runtime):
+        from xcp_d.utils.smoothing import smooth_cifti_with_operator
+
+        _, base, extension = split_filename(self.inputs.in_file)
+        self._results['out_file'] = os.path.join(runtime.cwd, f'smoothed_{base}{extension}')
+        smooth_cifti_with_operator(
+            in_file=self.inputs.in_file,
+            out_file=self._results['out_file'],
+            left_surf=self.inputs.left_surf,
+            right_surf=self.inputs.right_surf,
+            sigma_surf=self.inputs.sigma_surf,
+            sigma_vol=self.inputs.sigma_vol,
+            cache_dir=self.inputs.cache_dir,
+        )
+
+        return runtime
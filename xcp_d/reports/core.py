@@ -5,13 +5,37 @@
 This is adapted from fMRIPost-AROMA.
 """
 
+import os
+from functools import cache
 from pathlib import Path
+from tempfile import TemporaryDirectory
 
-from bids.layout import Query
+from bids.layout import BIDSLayout, Query
 from nireports.assembler.report import Report
 
 from xcp_d import config, data
 from xcp_d.interfaces.execsummary import ExecutiveSummary
+from xcp_d.utils.reportlets import (
+    OutputManifest,
+    find_deferred_reportlets,
+    render_deferred_reportlet,
+)
+
+
+class SubjectReport(Report):
+    """A report that only indexes the reportlets of its subject.
+
+    :class:`~nireports.assembler.report.Report` indexes the whole reportlets directory,
+    which makes the reports of large datasets slower to build with every new subject.
+    """
+
+    def index(self, config):
+        """Index the reportlets in the subject's folder, then build the report."""
+        subject = config['bids_filters'].get('subject')
+        if subject:
+            config = {**config, 'root': Path(config['root']) / f'sub-{subject}'}
+
+        super().index(config)
 
 
 def run_reports(
@@ -26,7 +50,7 @@ def run_reports(
     **entities,
 ):
     """Run the reports."""
-    robj = Report(
+    robj = SubjectReport(
         out_dir,
         run_uuid,
         bootstrap_file=bootstrap_file,
@@ -63,12 +87,18 @@ def generate_reports(
     run_uuid,
     bootstrap_file=None,
     work_dir=None,
+    n_procs=1,
+    incremental=False,
 ):
     """Generate reports for a list of subjects.
 
     Parameters
     ----------
     output_level : {'root', 'subject', 'session'}
+    n_procs : :obj:`int`, optional
+        Maximum number of subjects whose reports are generated in parallel.
+    incremental : :obj:`bool`, optional
+        Skip the reports that were written after the last change to the subject's reportlets.
     """
     # The number of sessions is intentionally not based on session_list but
     # on the total number of sessions, because I want the final derivatives
@@ -85,7 +115,8 @@ def generate_reports(
         parameters_hash = config.execution.parameters_hash
         hash_str = f'_hash-{parameters_hash}'
 
-    errors = []
+    # Collect the reports of each subject, which are then generated together
+    jobs = []
     for subject_label, _, sessions in processing_list:
         subject_label = subject_label[4:] if subject_label.startswith('sub-') else subject_label
         # Drop ses- prefixes
@@ -102,6 +133,7 @@ def generate_reports(
                 'Writing out reports to subject level.'
             )
 
+        reports, summaries = [], []
         if output_level != 'session' and n_ses <= config.execution.aggr_ses_reports:
             html_report = f'sub-{subject_label}{hash_str}.html'
 
@@ -110,34 +142,29 @@ def generate_reports(
             elif output_level == 'subject':
                 report_dir = Path(dataset_dir) / f'sub-{subject_label}'
 
-            report_error = run_reports(
-                out_dir=report_dir,
-                subject_label=subject_label,
-                run_uuid=run_uuid,
-                bootstrap_file=bootstrap_file,
-                out_filename=html_report,
-                dataset_dir=dataset_dir,
-                errorname=f'report-{run_uuid}-{subject_label}.err',
-                subject=subject_label,
+            reports.append(
+                {
+                    'out_dir': report_dir,
+                    'subject_label': subject_label,
+                    'run_uuid': run_uuid,
+                    'bootstrap_file': bootstrap_file,
+                    'out_filename': html_report,
+                    'dataset_dir': dataset_dir,
+                    'errorname': f'report-{run_uuid}-{subject_label}.err',
+                    'subject': subject_label,
+                }
             )
-            # If the report generation failed, append the subject label for which it failed
-            if report_error is not None:
-                errors.append(report_error)
 
             if abcc_qc:
                 # Executive summaries should always be split by session, when sessions exist.
-                if not sessions:
-                    sessions = [None]
-
-                for session_label in sessions:
-                    exsumm = ExecutiveSummary(
-                        xcpd_path=dataset_dir,
-                        output_dir=report_dir,
-                        subject_id=subject_label,
-                        session_id=session_label,
-                    )
-                    exsumm.collect_inputs()
-                    exsumm.generate_report(parameters_hash=parameters_hash)
+                summaries += [
+                    {
+                        'output_dir': report_dir,
+                        'subject_id': subject_label,
+                        'session_id': session_label,
+                    }
+                    for session_label in (sessions or [None])
+                ]
         else:
             if not sessions:
                 sessions = [None]
@@ -157,33 +184,80 @@ def generate_reports(
                         Path(dataset_dir) / f'sub-{subject_label}' / f'ses-{session_label}'
                     )
 
-                report_error = run_reports(
-                    out_dir=report_dir,
-                    subject_label=subject_label,
-                    run_uuid=run_uuid,
-                    bootstrap_file=bootstrap_file,
-                    out_filename=html_report,
-                    dataset_dir=dataset_dir,
-                    errorname=f'report-{run_uuid}-{subject_label}-{session_label}.err',
-                    metadata={
-                        'session_str': f", session '{session_label}'" if session_label else '',
-                    },
-                    subject=subject_label,
-                    session=session_label,
+                reports.append(
+                    {
+                        'out_dir': report_dir,
+                        'subject_label': subject_label,
+                        'run_uuid': run_uuid,
+                        'bootstrap_file': bootstrap_file,
+                        'out_filename': html_report,
+                        'dataset_dir': dataset_dir,
+                        'errorname': f'report-{run_uuid}-{subject_label}-{session_label}.err',
+                        'metadata': {
+                            'session_str': (
+                                f", session '{session_label}'" if session_label else ''
+                            ),
+                        },
+                        'subject': subject_label,
+                        'session': session_label,
+                    }
                 )
-                # If the report generation failed, append the subject label for which it failed
-                if report_error is not None:
-                    errors.append(report_error)
 
                 if abcc_qc:
-                    exsumm = ExecutiveSummary(
-                        xcpd_path=dataset_dir,
-                        output_dir=report_dir,
-                        subject_id=subject_label,
-                        session_id=session_label,
+                    summaries.append(
+                        {
+                            'output_dir': report_dir,
+                            'subject_id': subject_label,
+                            'session_id': session_label,
+                        }
                     )
-                    exsumm.collect_inputs()
-                    exsumm.generate_report(parameters_hash=parameters_hash)
+
+        jobs.append((subject_label, reports, summaries))
+
+    # Render the figures whose data the workflows wrote with --reportlet-rendering deferred,
+    # before the reportlets are collected.
+    deferred_reportlets = [
+        (dataset_dir, reportlet_dir)
+        for subject_label, _, _ in jobs
+        for reportlet_dir in find_deferred_reportlets(dataset_dir, subject_label)
+    ]
+    if deferred_reportlets:
+        config.loggers.cli.info(f'Rendering {len(deferred_reportlets)} deferred reportlets.')
+        _starmap(render_deferred_reportlet, deferred_reportlets, n_procs)
+
+    with TemporaryDirectory(dir=work_dir) as tmpdir:
+        database_path = None
+        if any(
+            summaries and not OutputManifest.exists(dataset_dir, subject_label)
+            for subject_label, _, summaries in jobs
+        ):
+            # Index the figures once for all of the executive summaries without a manifest.
+            # The index is shared with the worker processes through its database.
+            database_path = str(Path(tmpdir) / 'figures_index')
+            BIDSLayout(
+                dataset_dir,
+                config='figures',
+                validate=False,
+                database_path=database_path,
+                reset_database=True,
+            )
+
+        args = [
+            (
+                dataset_dir,
+                subject_label,
+                reports,
+                summaries,
+                database_path,
+                parameters_hash,
+                incremental,
+            )
+            for subject_label, reports, summaries in jobs
+        ]
+        results = _starmap(_generate_subject_reports, args, n_procs)
+        _load_figures_index.cache_clear()
+
+    errors = [error for subject_errors in results for error in subject_errors]
 
     if errors:
         # Suboptimal to just report the subject IDs (with potential duplicates)
@@ -200,3 +274,90 @@ def generate_reports(
     config.loggers.cli.info('Reports generated successfully')
 
     return errors
+
+
+def _starmap(function, args, n_procs):
+    """Call a function on each tuple of arguments, with up to ``n_procs`` processes."""
+    n_procs = min(n_procs, len(args))
+    if n_procs > 1:
+        from multiprocessing import Pool
+
+        with Pool(processes=n_procs) as pool:
+            return pool.starmap(function, args)
+
+    return [function(*arg) for arg in args]
+
+
+def _generate_subject_reports(
+    dataset_dir,
+    subject_label,
+    reports,
+    summaries,
+    database_path,
+    parameters_hash,
+    incremental,
+):
+    """Generate the HTML reports and executive summaries of one subject.
+
+    This runs in the worker processes of :func:`generate_reports`,
+    so it only relies on its arguments.
+
+    Returns
+    -------
+    errors : :obj:`list` of :obj:`str`
+        The subject label, for each report that could not be generated.
+    """
+    figures_dir = Path(dataset_dir) / f'sub-{subject_label}' / 'figures'
+
+    errors = []
+    layout = None
+    if summaries and OutputManifest.exists(dataset_dir, subject_label):
+        layout = OutputManifest(dataset_dir, subject_label)
+    elif summaries:
+        layout = _load_figures_index(dataset_dir, database_path)
+
+    for report_kwargs in reports:
+        out_file = Path(report_kwargs['out_dir']) / report_kwargs['out_filename']
+        if incremental and _is_up_to_date(out_file, figures_dir):
+            continue
+
+        report_error = run_reports(**report_kwargs)
+        # If the report generation failed, append the subject label for which it failed
+        if report_error is not None:
+            errors.append(report_error)
+
+    for summary_kwargs in summaries:
+        exsumm = ExecutiveSummary(
+            xcpd_path=dataset_dir,
+            layout=layout,
+            **summary_kwargs,
+        )
+        if incremental and _is_up_to_date(exsumm.get_out_file(parameters_hash), figures_dir):
+            continue
+
+        exsumm.collect_inputs()
+        exsumm.generate_report(parameters_hash=parameters_hash)
+
+    return errors
+
+
+@cache
+def _load_figures_index(dataset_dir, database_path):
+    """Load the shared index of the figures, once per process."""
+    return BIDSLayout(dataset_dir, config='figures', validate=False, database_path=database_path)
+
+
+def _is_up_to_date(out_file, figures_dir):
+    """Check if a report was written after the last change to the reportlets it shows.
+
+    Adding or removing a reportlet changes the modification time of the folder itself.
+    """
+    if not os.path.isfile(out_file) or not os.path.isdir(figures_dir):
+        return False
+
+    with os.scandir(figures_dir) as entries:
+        last_change = max(
+            [os.stat(figures_dir).st_mtime] + [entry.stat().st_mtime for entry in entries]
+        )
+
+    return os.stat(out_file).st_mtime >= last_change
@@ -12,7 +12,7 @@ from nipype import logging
 
 from xcp_d.cli import combineqc, run
 from xcp_d.cli.parser import parse_args
-from xcp_d.cli.workflow import build_boilerplate, build_workflow
+from xcp_d.cli.workflow import build_boilerplate, build_workflow, load_workflow
 from xcp_d.reports.core import generate_reports
 from xcp_d.tests.utils import (
     check_affines,
@@ -459,7 +459,7 @@ def _run_and_generate(test_name, parameters, input_type, test_main=False):
         config.to_filename(config_file)
 
         retval = build_workflow(config_file, retval={})
-        xcpd_wf = retval['workflow']
+        xcpd_wf = load_workflow(retval['workflow_file'])
         xcpd_wf.run(**config.nipype.get_plugin())
         write_derivative_description(
             config.execution.fmri_dir,
@@ -470,7 +470,7 @@ def _run_and_generate(test_name, parameters, input_type, test_main=False):
         if config.execution.atlases:
             write_atlas_dataset_description(config.execution.output_dir / 'atlases')
 
-        build_boilerplate(str(config_file), xcpd_wf)
+        build_boilerplate(str(config_file), retval['workflow_file'])
         generate_reports(
             processing_list=config.execution.processing_list,
             output_level=config.execution.report_output_level,
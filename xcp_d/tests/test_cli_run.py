@@ -814,3 +814,40 @@ def test_parse_args_03(tmp_path_factory):
     assert config.execution.output_dir == out_dir
     assert config.execution.processing_list == [['01', 'V02', ['V02', 'V03', 'V04']]]
     _reset_config()
+
+
+def test_parser_import_time():
+    """Check that building the parser does not import heavy dependencies.
+
+    ``python -X importtime`` reports the cumulative import time (in microseconds)
+    of each module on stderr.
+    """
+    import subprocess
+    import sys
+
+    code = (
+        'import sys; from xcp_d.cli import parser; parser._build_parser(); '
+        "print(','.join(sorted({m.split('.')[0] for m in sys.modules})))"
+    )
+    with modified_environ(NO_ET='1'):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    imported = set(result.stdout.strip().split(','))
+    heavy = {'bids', 'matplotlib', 'nilearn', 'nipype', 'niworkflows', 'scipy', 'templateflow'}
+    assert not heavy & imported, f'Heavy modules imported by the parser: {heavy & imported}'
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative_us, module = line.split('|')
+        cumulative[module.strip()] = int(cumulative_us)
+
+    # A generous threshold, as the tests may run in parallel on a busy machine.
+    assert cumulative['xcp_d.cli.parser'] < 2e6
@@ -0,0 +1,103 @@
+"""Tests for functions in the cli.workflow module."""
+
+import os
+
+from nipype.interfaces import utility as niu
+from nipype.pipeline import engine as pe
+from niworkflows.utils.testing import generate_bids_skeleton
+
+from xcp_d import config
+from xcp_d.cli import parser
+from xcp_d.cli import workflow as cli_workflow
+from xcp_d.data import load as load_data
+from xcp_d.tests.test_config import _reset_config
+from xcp_d.workflows.base import _get_subject_wf_name, set_run_logs
+
+
+def test_get_workflow_cache_file(tmp_path_factory):
+    """Test that the workflow cache key only changes when the settings or inputs change."""
+    skeleton = load_data('tests/skeletons/nibabies_longitudinal_one_anat_session.yml')
+    tmpdir = tmp_path_factory.mktemp('test_get_workflow_cache_file')
+    bids_dir = tmpdir / 'bids'
+    generate_bids_skeleton(str(bids_dir), str(skeleton))
+    out_dir = tmpdir / 'out'
+    out_dir.mkdir(exist_ok=True, parents=True)
+
+    base_args = [
+        str(bids_dir),
+        str(out_dir),
+        'participant',
+        '--mode',
+        'hbcd',
+        '--motion-filter-type',
+        'lp',
+        '--band-stop-min',
+        '10',
+        '--input-type',
+        'nibabies',
+        '-w',
+        str(tmpdir / 'work'),
+    ]
+    parser.parse_args(args=base_args, namespace=None)
+    cache_file = cli_workflow.get_workflow_cache_file()
+    assert cache_file.parent == tmpdir / 'work' / 'workflow_cache'
+
+    # A new run with the same settings and inputs reuses the workflow.
+    config.execution.run_uuid = 'another_run'
+    assert cli_workflow.get_workflow_cache_file() == cache_file
+
+    # Modifying one of the inputs invalidates it.
+    anat_file = sorted((bids_dir / 'sub-01').glob('ses-*/anat/*'))[0]
+    os.utime(anat_file, ns=(0, 0))
+    new_cache_file = cli_workflow.get_workflow_cache_file()
+    assert new_cache_file != cache_file
+    # Only the inputs part of the name changes.
+    assert new_cache_file.name.split('_')[0] == cache_file.name.split('_')[0]
+
+    # So does editing a custom confounds configuration in place.
+    confounds_config = tmpdir / 'confounds.yml'
+    confounds_config.write_text(load_data.readable('nuisance/24P.yml').read_text())
+    config.execution.confounds_config = confounds_config
+    cache_file = cli_workflow.get_workflow_cache_file()
+    confounds_config.write_text(load_data.readable('nuisance/36P.yml').read_text())
+    new_cache_file = cli_workflow.get_workflow_cache_file()
+    assert new_cache_file != cache_file
+    assert new_cache_file.name.split('_')[0] == cache_file.name.split('_')[0]
+
+    # So does changing the settings.
+    config.workflow.fd_thresh = 0.1
+    config_hash = cli_workflow.get_workflow_cache_file().name.split('_')[0]
+    assert config_hash != cache_file.name.split('_')[0]
+    _reset_config()
+
+
+def test_set_run_logs(tmp_path_factory):
+    """Test that a serialized workflow can be pointed at a new run's log directories."""
+    tmpdir = tmp_path_factory.mktemp('test_set_run_logs')
+    config.execution.output_dir = tmpdir / 'out'
+    config.execution.processing_list = [['01', 'V01', ['V01', 'V02']]]
+    config.execution.run_uuid = 'first_run'
+
+    subject_wf = pe.Workflow(name=_get_subject_wf_name('01', 'V01', ['V01', 'V02']))
+    for name in ('node_a', 'node_b'):
+        subject_wf.add_nodes([pe.Node(niu.IdentityInterface(fields=['a']), name=name)])
+
+    for node in subject_wf._get_all_nodes():
+        node.config = subject_wf.config
+
+    xcpd_wf = pe.Workflow(name='xcpd_wf')
+    xcpd_wf.add_nodes([subject_wf])
+    set_run_logs(xcpd_wf)
+
+    workflow_file = tmpdir / 'work' / 'workflow.pkl'
+    cli_workflow.save_workflow(xcpd_wf, workflow_file)
+
+    config.execution.run_uuid = 'second_run'
+    loaded_wf = cli_workflow.load_workflow(workflow_file)
+    set_run_logs(loaded_wf)
+    log_dir = tmpdir / 'out' / 'sub-01' / 'log' / 'second_run'
+    for node in loaded_wf._get_all_nodes():
+        assert node.config['execution']['crashdump_dir'] == str(log_dir)
+
+    assert (log_dir / 'xcp_d.toml').is_file()
+    _reset_config()
@@ -284,6 +284,64 @@ def test_process_motion(ds001419_data, tmp_path_factory):
     assert os.path.isfile(results.outputs.temporal_mask)
 
 
+def test_process_motion_cached(ds001419_data, tmp_path_factory):
+    """Test that cached motion processing matches uncached processing."""
+    from xcp_d.utils.modified_data import flag_bad_run, flag_bad_runs
+
+    tmpdir = tmp_path_factory.mktemp('test_process_motion_cached')
+    cache_dir = tmpdir / 'cache'
+
+    kwargs = {
+        'motion_file': ds001419_data['confounds_file'],
+        'motion_json': ds001419_data['confounds_json'],
+        'TR': 2.0,
+        'fd_thresh': 0.2,
+        'head_radius': 50,
+        'motion_filter_type': 'notch',
+        'motion_filter_order': 4,
+        'band_stop_min': 12,
+        'band_stop_max': 20,
+    }
+    os.makedirs(tmpdir / 'uncached')
+    uncached = censoring.ProcessMotion(**kwargs).run(cwd=str(tmpdir / 'uncached'))
+    for i_run in range(2):
+        os.makedirs(tmpdir / f'cached{i_run}')
+        cached = censoring.ProcessMotion(cache_dir=str(cache_dir), **kwargs).run(
+            cwd=str(tmpdir / f'cached{i_run}')
+        )
+        assert len(list(cache_dir.glob('*.tsv'))) == 1
+        pd.testing.assert_frame_equal(
+            pd.read_table(cached.outputs.motion_file),
+            pd.read_table(uncached.outputs.motion_file),
+        )
+        pd.testing.assert_frame_equal(
+            pd.read_table(cached.outputs.temporal_mask),
+            pd.read_table(uncached.outputs.temporal_mask),
+        )
+
+    # The parallel pre-scan should match the serial one
+    run_kwargs = []
+    for fd_thresh in (0.1, 0.2, 0.5):
+        run_kwargs.append(
+            {
+                'motion_file': ds001419_data['confounds_file'],
+                'dummy_scans': 2,
+                'TR': 2.0,
+                'motion_filter_type': None,
+                'motion_filter_order': None,
+                'band_stop_min': None,
+                'band_stop_max': None,
+                'head_radius': 50,
+                'fd_thresh': fd_thresh,
+                'cache_dir': str(cache_dir),
+            }
+        )
+
+    serial = [flag_bad_run(**run) for run in run_kwargs]
+    assert flag_bad_runs(run_kwargs, n_procs=2) == serial
+    assert serial[0] <= serial[1] <= serial[2]
+
+
 def test_removedummyvolumes_nifti(ds001419_data, tmp_path_factory):
     """Test RemoveDummyVolumes() for NIFTI input data."""
     # Define inputs
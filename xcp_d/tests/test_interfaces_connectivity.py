@@ -6,7 +6,7 @@ import nibabel as nb
 import numpy as np
 import pandas as pd
 
-from xcp_d.interfaces.connectivity import NiftiParcellate
+from xcp_d.interfaces.connectivity import ConnectPlot, NiftiParcellate, _get_block_means
 
 
 def test_nifti_parcellate(tmp_path_factory):
@@ -85,3 +85,74 @@ def test_nifti_parcellate(tmp_path_factory):
         np.array([[np.nan, np.nan, 3, 4, np.nan]]),
         equal_nan=True,
     )
+
+
+def test_get_block_means():
+    """Test the reduction of matrices to block means for display."""
+    matrix = np.arange(25, dtype=float).reshape(5, 5)
+    matrix[0, 1] = np.nan
+    block_means, to_display = _get_block_means(matrix, 3)
+    # Blocks of two rows and columns, with a smaller block at the end
+    expected = np.array(
+        [
+            [np.mean([0, 5, 6]), np.mean([2, 3, 7, 8]), np.mean([4, 9])],
+            [np.mean([10, 11, 15, 16]), np.mean([12, 13, 17, 18]), np.mean([14, 19])],
+            [np.mean([20, 21]), np.mean([22, 23]), 24],
+        ]
+    )
+    np.testing.assert_allclose(block_means, expected)
+    # Boundaries between pixels stay between pixels
+    np.testing.assert_allclose(to_display([-0.5, 1.5, 3.5]), [-0.5, 0.5, 1.5])
+
+
+def test_connectplot(tmp_path_factory):
+    """Test that ConnectPlot reads pconn files and reduces large matrices."""
+    tmpdir = tmp_path_factory.mktemp('test_connectplot')
+    rng = np.random.default_rng(0)
+    atlases = ['Gordon', 'Glasser']
+    correlations_tsv, correlations_cifti, atlas_tsvs = [], [], []
+    for atlas, n_parcels in zip(atlases, (50, 500), strict=True):
+        labels = [f'parcel{i}' for i in range(n_parcels)]
+        corr = np.corrcoef(rng.standard_normal((n_parcels, 100)))
+        tsv = str(tmpdir / f'{atlas}_correlations.tsv')
+        pd.DataFrame(corr, index=labels, columns=labels).to_csv(tsv, sep='\t', index_label='Node')
+        correlations_tsv.append(tsv)
+
+        parcels = nb.cifti2.ParcelsAxis.from_brain_models(
+            [
+                (label, nb.cifti2.BrainModelAxis.from_surface([i], n_parcels, 'CortexLeft'))
+                for i, label in enumerate(labels)
+            ]
+        )
+        pconn = str(tmpdir / f'{atlas}_correlations.pconn.nii')
+        nb.Cifti2Image(corr, (parcels, parcels)).to_filename(pconn)
+        correlations_cifti.append(pconn)
+
+        dseg = str(tmpdir / f'{atlas}_dseg.tsv')
+        column = 'community_yeo' if atlas == 'Glasser' else 'network_label'
+        pd.DataFrame(
+            {
+                'index': np.arange(1, n_parcels + 1),
+                'label': labels,
+                column: [f'network{i % 7}' for i in range(n_parcels)],
+            }
+        ).to_csv(dseg, sep='\t', index=False)
+        atlas_tsvs.append(dseg)
+
+    interface = ConnectPlot(
+        atlases=atlases,
+        atlas_tsvs=atlas_tsvs,
+        correlations_tsv=correlations_tsv,
+        max_display_size=100,
+    )
+    out_file = interface.run(cwd=tmpdir).outputs.connectplot
+    assert os.path.isfile(out_file)
+    # Both matrices are embedded as small raster images
+    assert os.path.getsize(out_file) < 200_000
+
+    # The pconn files are read instead of the TSVs, which are not needed
+    for tsv in correlations_tsv:
+        pd.DataFrame(np.zeros((1, 1))).to_csv(tsv, sep='\t', index_label='Node')
+
+    interface.inputs.correlations_cifti = correlations_cifti
+    assert os.path.isfile(interface.run(cwd=tmpdir).outputs.connectplot)
@@ -3,6 +3,7 @@
 import os
 
 import nibabel as nb
+import numpy as np
 
 from xcp_d.interfaces import execsummary
 
@@ -23,7 +24,6 @@ def test_plotslicesforbrainsprite(datasets, tmp_path_factory):
     n_slices = img.shape[0]
 
     interface = execsummary.PlotSlicesForBrainSprite(
-        n_procs=1,
         lh_wm=lh_wm,
         lh_pial=lh_pial,
         rh_wm=rh_wm,
@@ -32,3 +32,140 @@ def test_plotslicesforbrainsprite(datasets, tmp_path_factory):
     )
     results = interface.run(cwd=tmpdir)
     assert len(results.outputs.out_files) == n_slices
+    assert os.path.isfile(results.outputs.mosaic_file)
+
+
+def test_plotslicesforbrainsprite_synthetic(tmp_path_factory):
+    """Test the contours drawn by PlotSlicesForBrainSprite on a synthetic sphere."""
+    import trimesh
+    from PIL import Image
+
+    tmpdir = tmp_path_factory.mktemp('test_plotslicesforbrainsprite_synthetic')
+
+    # A 2 mm anisotropic volume, so that the tiles are not square
+    shape = (30, 40, 30)
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    affine[:3, 3] = -np.array(shape) + 1
+    anat = str(tmpdir / 'anat.nii.gz')
+    nb.Nifti1Image(np.ones(shape, dtype=np.float32), affine).to_filename(anat)
+
+    surfaces = {}
+    for name, radius in (('pial', 20), ('wm', 10)):
+        sphere = trimesh.creation.icosphere(subdivisions=4, radius=radius)
+        surfaces[name] = str(tmpdir / f'{name}.surf.gii')
+        nb.GiftiImage(
+            darrays=[
+                nb.gifti.GiftiDataArray(
+                    sphere.vertices.astype(np.float32), intent='NIFTI_INTENT_POINTSET'
+                ),
+                nb.gifti.GiftiDataArray(
+                    sphere.faces.astype(np.int32), intent='NIFTI_INTENT_TRIANGLE'
+                ),
+            ]
+        ).to_filename(surfaces[name])
+
+    interface = execsummary.PlotSlicesForBrainSprite(
+        lh_wm=surfaces['wm'],
+        rh_wm=surfaces['wm'],
+        lh_pial=surfaces['pial'],
+        rh_pial=surfaces['pial'],
+        nifti=anat,
+    )
+    results = interface.run(cwd=tmpdir)
+    assert len(results.outputs.out_files) == shape[0]
+
+    tiles = [np.asarray(Image.open(f)) for f in results.outputs.out_files]
+    # The longest side fills the tile, preserving the aspect ratio
+    assert tiles[0].shape == (164, 218, 3)
+    # The central slice has both contours, the outer ones only show the (uniform) volume
+    center = tiles[shape[0] // 2]
+    assert np.any(np.all(center == (139, 0, 0), axis=-1))
+    assert np.any(np.all(center == (0, 0, 0), axis=-1))
+    assert np.unique(tiles[0].reshape(-1, 3), axis=0).shape[0] == 1
+
+    mosaic = Image.open(results.outputs.mosaic_file)
+    assert mosaic.size == (218 * 6, 218 * 6)
+
+
+def test_renderscenes_python(tmp_path_factory):
+    """Test rendering the scenes of the PNG scene template without Connectome Workbench."""
+    import trimesh
+    from PIL import Image
+
+    from xcp_d.data import load as load_data
+    from xcp_d.tests.utils import chdir
+    from xcp_d.utils.execsummary import modify_pngs_scene_template
+
+    tmpdir = tmp_path_factory.mktemp('test_renderscenes_python')
+
+    shape = (30, 40, 30)
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    affine[:3, 3] = -np.array(shape) + 1
+    anat = str(tmpdir / 'anat.nii.gz')
+    data = np.zeros(shape, dtype=np.float32)
+    data[1:-1, 1:-1, 1:-1] = 1
+    nb.Nifti1Image(data, affine).to_filename(anat)
+
+    surfaces = {}
+    for name, radius in (('pial', 20), ('wm', 10)):
+        sphere = trimesh.creation.icosphere(subdivisions=4, radius=radius)
+        surfaces[name] = str(tmpdir / f'{name}.surf.gii')
+        nb.GiftiImage(
+            darrays=[
+                nb.gifti.GiftiDataArray(
+                    sphere.vertices.astype(np.float32), intent='NIFTI_INTENT_POINTSET'
+                ),
+                nb.gifti.GiftiDataArray(
+                    sphere.faces.astype(np.int32), intent='NIFTI_INTENT_TRIANGLE'
+                ),
+            ]
+        ).to_filename(surfaces[name])
+
+    with chdir(tmpdir):
+        scene_file = modify_pngs_scene_template(
+            anat_file=anat,
+            rh_pial_surf=surfaces['pial'],
+            lh_pial_surf=surfaces['pial'],
+            rh_wm_surf=surfaces['wm'],
+            lh_wm_surf=surfaces['wm'],
+            scene_template=str(load_data('executive_summary_scenes/pngs_template.scene.gz')),
+        )
+
+    # Axial at z=-40 (outside of the spheres), coronal at y=0, and sagittal at x=0
+    interface = execsummary.RenderScenes(
+        scene_file=scene_file,
+        scene_names=[1, 'T1_C_0', 8],
+        image_width=90,
+        image_height=80,
+        renderer='python',
+        anat_file=anat,
+        lh_pial_surf=surfaces['pial'],
+        rh_pial_surf=surfaces['pial'],
+        lh_wm_surf=surfaces['wm'],
+        rh_wm_surf=surfaces['wm'],
+    )
+    results = interface.run(cwd=tmpdir)
+    assert [os.path.basename(f) for f in results.outputs.out_files] == [
+        'frame_000001.png',
+        'frame_T1_C_0.png',
+        'frame_000008.png',
+    ]
+
+    images = [np.asarray(Image.open(f)) for f in results.outputs.out_files]
+    assert all(image.shape == (80, 90, 3) for image in images)
+    maroon = (128, 0, 0)
+    assert not np.any(np.all(images[0] == maroon, axis=-1))
+    for image in images[1:]:
+        assert np.any(np.all(image == maroon, axis=-1))
+        # The volume is drawn in the middle of a black background
+        assert np.all(image[0, 0] == 0)
+        assert np.all(image[40, 45] == 255)
+
+    # With a reportlet store, a second node with the same inputs links the stored images
+    interface.inputs.reportlet_store = str(tmpdir / 'store')
+    (tmpdir / 'first').mkdir()
+    (tmpdir / 'second').mkdir()
+    first = interface.run(cwd=tmpdir / 'first').outputs.out_files
+    second = interface.run(cwd=tmpdir / 'second').outputs.out_files
+    for first_file, second_file in zip(first, second, strict=True):
+        assert os.path.samefile(first_file, second_file)
@@ -0,0 +1,70 @@
+"""Tests for the xcp_d.reports.core module."""
+
+import json
+import os
+
+from bids.layout import BIDSLayout
+
+from xcp_d import config
+from xcp_d.reports.core import generate_reports
+from xcp_d.tests.test_config import _reset_config
+from xcp_d.utils.reportlets import update_manifest
+
+
+def test_generate_reports(tmp_path_factory):
+    """Test the parallel and incremental generation of the reports."""
+    dataset_dir = tmp_path_factory.mktemp('test_generate_reports')
+    (dataset_dir / 'dataset_description.json').write_text(
+        json.dumps({'Name': 'XCP-D', 'BIDSVersion': '1.9.0', 'DatasetType': 'derivative'})
+    )
+    subjects = ['01', '02']
+    for subject in subjects:
+        figures_dir = dataset_dir / f'sub-{subject}' / 'figures'
+        figures_dir.mkdir(parents=True)
+        (figures_dir / f'sub-{subject}_desc-summary_bold.html').write_text(f'<p>{subject}</p>')
+        (figures_dir / f'sub-{subject}_task-rest_desc-censoring_motion.svg').write_text(
+            '<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+        )
+        func_dir = dataset_dir / f'sub-{subject}' / 'func'
+        func_dir.mkdir()
+        (func_dir / f'sub-{subject}_task-rest_desc-denoised_bold.nii.gz').touch()
+
+    # The outputs of sub-02 are found from its manifest, the others from an index of the dataset
+    update_manifest(dataset_dir, [str(f) for f in (dataset_dir / 'sub-02').glob('*/*')])
+
+    config.execution.layout = BIDSLayout(dataset_dir, validate=False)
+    config.execution.aggr_ses_reports = 4
+    config.execution.output_layout = 'bids'
+    kwargs = {
+        'processing_list': [[subject, None, []] for subject in subjects],
+        'output_level': 'root',
+        'dataset_dir': dataset_dir,
+        'abcc_qc': True,
+        'run_uuid': 'test',
+    }
+
+    assert generate_reports(n_procs=2, **kwargs) == []
+    out_files = {
+        subject: [
+            dataset_dir / f'sub-{subject}.html',
+            dataset_dir / f'sub-{subject}_executive_summary.html',
+        ]
+        for subject in subjects
+    }
+    for subject, subject_files in out_files.items():
+        for out_file in subject_files:
+            assert out_file.is_file()
+            assert f'sub-{subject}' in out_file.read_text()
+
+    # Only the subjects with new reportlets get new reports
+    for out_file in out_files['01'] + out_files['02']:
+        os.utime(out_file, (1e9, 1e9))
+    for reportlet in (dataset_dir / 'sub-01' / 'figures').iterdir():
+        os.utime(reportlet, (1e9 - 1, 1e9 - 1))
+    os.utime(dataset_dir / 'sub-01' / 'figures', (1e9 - 1, 1e9 - 1))
+    (dataset_dir / 'sub-02' / 'figures' / 'sub-02_desc-about_bold.html').write_text('<p></p>')
+
+    assert generate_reports(incremental=True, **kwargs) == []
+    assert all(out_file.stat().st_mtime == 1e9 for out_file in out_files['01'])
+    assert all(out_file.stat().st_mtime > 1e9 for out_file in out_files['02'])
+    _reset_config()
@@ -151,3 +151,137 @@ def test_smoothing_cifti(ds001419_data, tmp_path_factory):
     out_file_smoothness = np.sum(out_file_smoothness)
 
     assert in_file_smoothness < out_file_smoothness
+
+
+def test_smoothing_nifti_masked(tmp_path_factory):
+    """Test masked NIFTI smoothing against Nilearn on a zero-filled image."""
+    import nibabel as nb
+    from nilearn.image import smooth_img
+
+    tmpdir = tmp_path_factory.mktemp('test_smoothing_nifti_masked')
+
+    rng = np.random.default_rng(0)
+    affine = np.diag([2.0, 2.0, 2.5, 1.0])
+    mask = np.zeros((20, 22, 18), dtype=np.uint8)
+    mask[4:15, 3:18, 5:13] = 1
+    data = rng.standard_normal(mask.shape + (7,)).astype(np.float32)
+    data[~mask.astype(bool)] = 0
+
+    in_file = str(tmpdir / 'in.nii.gz')
+    mask_file = str(tmpdir / 'mask.nii.gz')
+    nb.Nifti1Image(data, affine).to_filename(in_file)
+    nb.Nifti1Image(mask, affine).to_filename(mask_file)
+
+    expected = smooth_img(in_file, fwhm=6).get_fdata()
+    expected[~mask.astype(bool)] = 0
+
+    for n_procs in (1, 2):
+        smooth_data = pe.Node(
+            Smooth(fwhm=6, mask=mask_file, n_procs=n_procs),
+            name=f'nifti_smoothing_{n_procs}',
+            base_dir=str(tmpdir),
+        )
+        smooth_data.inputs.in_file = in_file
+        results = smooth_data.run()
+        out_img = nb.load(results.outputs.out_file)
+        assert out_img.shape == data.shape
+        np.testing.assert_allclose(out_img.get_fdata(), expected, atol=1e-5)
+
+    # The FFT path should give the same result as direct convolution.
+    from xcp_d.utils.smoothing import smooth_masked_img
+
+    fft_file = smooth_masked_img(
+        in_file,
+        mask_file,
+        fwhm=[6, 6, 8],
+        out_file=str(tmpdir / 'fft.nii.gz'),
+        block_size=3,
+        method='fft',
+    )
+    direct_file = smooth_masked_img(
+        in_file,
+        mask_file,
+        fwhm=[6, 6, 8],
+        out_file=str(tmpdir / 'direct.nii.gz'),
+        method='direct',
+    )
+    np.testing.assert_allclose(
+        nb.load(fft_file).get_fdata(),
+        nb.load(direct_file).get_fdata(),
+        atol=1e-5,
+    )
+
+
+def test_smoothing_cifti_cached(tmp_path_factory):
+    """Test CIFTI smoothing with a cached sparse operator on a synthetic file."""
+    import nibabel as nb
+    import trimesh
+
+    from xcp_d.interfaces.workbench import CachedCiftiSmooth
+
+    tmpdir = tmp_path_factory.mktemp('test_smoothing_cifti_cached')
+    cache_dir = tmpdir / 'cache'
+
+    sphere = trimesh.creation.icosphere(subdivisions=3, radius=100)
+    surf_files = {}
+    for hemi in ('L', 'R'):
+        surf_img = nb.gifti.GiftiImage(
+            darrays=[
+                nb.gifti.GiftiDataArray(
+                    sphere.vertices.astype(np.float32),
+                    intent='NIFTI_INTENT_POINTSET',
+                ),
+                nb.gifti.GiftiDataArray(
+                    sphere.faces.astype(np.int32),
+                    intent='NIFTI_INTENT_TRIANGLE',
+                ),
+            ]
+        )
+        surf_files[hemi] = str(tmpdir / f'hemi-{hemi}_sphere.surf.gii')
+        nb.save(surf_img, surf_files[hemi])
+
+    n_vertices = sphere.vertices.shape[0]
+    vertices = np.arange(0, n_vertices, 2)
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    brain_models = (
+        nb.cifti2.BrainModelAxis.from_surface(vertices, n_vertices, 'CortexLeft')
+        + nb.cifti2.BrainModelAxis.from_surface(vertices, n_vertices, 'CortexRight')
+        + nb.cifti2.BrainModelAxis.from_mask(np.ones((4, 4, 3)), 'ThalamusLeft', affine)
+    )
+
+    rng = np.random.default_rng(0)
+    n_volumes = 5
+    data = rng.standard_normal((n_volumes, len(brain_models))).astype(np.float32)
+    data[0] = 1  # a constant map should be unchanged by smoothing
+    series = nb.cifti2.SeriesAxis(start=0, step=2, size=n_volumes)
+    in_file = str(tmpdir / 'sub-01_task-rest_bold.dtseries.nii')
+    in_img = nb.Cifti2Image(data, header=(series, brain_models))
+    in_img.nifti_header.set_intent('ConnDenseSeries')
+    in_img.to_filename(in_file)
+
+    out_files = []
+    for i_run in range(2):
+        smooth_data = pe.Node(
+            CachedCiftiSmooth(
+                in_file=in_file,
+                sigma_surf=fwhm2sigma(20),
+                sigma_vol=fwhm2sigma(4),
+                left_surf=surf_files['L'],
+                right_surf=surf_files['R'],
+                cache_dir=str(cache_dir),
+            ),
+            name=f'cached_cifti_smoothing_{i_run}',
+            base_dir=str(tmpdir),
+        )
+        results = smooth_data.run()
+        out_files.append(results.outputs.out_file)
+        # The operator is only built once
+        assert len(list(cache_dir.glob('*.npz'))) == 1
+
+    out_img = nb.load(out_files[0])
+    out_data = out_img.get_fdata()
+    assert out_img.shape == data.shape
+    assert out_img.nifti_header.get_intent()[0] == 'ConnDenseSeries'
+    np.testing.assert_allclose(out_data[0], 1, rtol=1e-5)
+    assert np.all(out_data[1:].std(axis=1) < data[1:].std(axis=1))
+    np.testing.assert_allclose(out_data, nb.load(out_files[1]).get_fdata())
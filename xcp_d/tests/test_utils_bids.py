@@ -561,3 +561,194 @@ def test_collect_morphometry_data_longitudinal_one_to_one(tmp_path_factory, capl
     )
     assert morph_file_types == ['cortical_thickness', 'sulcal_curv', 'sulcal_depth']
     assert morphometry_files is not None
+
+
+def test_collect_confounds_for_runs(tmp_path_factory):
+    """Test that confounds for several runs are collected from one shared layout."""
+    tmpdir = tmp_path_factory.mktemp('test_collect_confounds_for_runs')
+
+    def _make_dataset(root, dataset_type, filenames):
+        func_dir = root / 'sub-01' / 'func'
+        func_dir.mkdir(parents=True)
+        (root / 'dataset_description.json').write_text(
+            json.dumps(
+                {
+                    'Name': root.name,
+                    'BIDSVersion': '1.9.0',
+                    'DatasetType': dataset_type,
+                    'GeneratedBy': [{'Name': root.name}],
+                }
+            )
+        )
+        for filename in filenames:
+            (func_dir / filename).touch()
+
+    preproc_dir = tmpdir / 'preproc'
+    _make_dataset(
+        preproc_dir,
+        'derivative',
+        [
+            f'sub-01_task-{task}_run-{run}_{suffix}'
+            for task in ('rest', 'nback')
+            for run in (1, 2)
+            for suffix in (
+                'space-MNI152NLin6Asym_res-2_desc-preproc_bold.nii.gz',
+                'desc-confounds_timeseries.tsv',
+            )
+        ],
+    )
+    rapidtide_dir = tmpdir / 'rapidtide'
+    _make_dataset(
+        rapidtide_dir,
+        'derivative',
+        [
+            f'sub-01_task-{task}_run-{run}_space-{space}_res-2_desc-LFO_timeseries.nii.gz'
+            for task in ('rest', 'nback')
+            for run in (1, 2)
+            for space in ('MNI152NLin6Asym', 'MNI152NLin2009cAsym')
+        ],
+    )
+
+    xcp_d_config = str(load_data('xcp_d_bids_config2.json'))
+    preproc_layout = BIDSLayout(
+        preproc_dir,
+        validate=False,
+        config=['bids', 'derivatives', xcp_d_config],
+    )
+    bold_files = [
+        f.path for f in preproc_layout.get(desc='preproc', suffix='bold', extension='.nii.gz')
+    ]
+    assert len(bold_files) == 4
+    confound_spec = {
+        'confounds': {
+            'preproc_confounds': {
+                'dataset': 'preprocessed',
+                'query': {
+                    'space': None,
+                    'res': None,
+                    'desc': 'confounds',
+                    'extension': '.tsv',
+                    'suffix': 'timeseries',
+                },
+            },
+            'rapidtide_slfo': {
+                'dataset': 'rapidtide',
+                'query': {'desc': 'LFO', 'extension': '.nii.gz', 'suffix': 'timeseries'},
+            },
+        },
+    }
+
+    xbids._DERIVATIVES_LAYOUTS.clear()
+    database_dir = tmpdir / 'bids_db'
+    confounds = xbids.collect_confounds_for_runs(
+        bold_files=bold_files,
+        preproc_dataset=preproc_layout,
+        derivatives_datasets={'rapidtide': rapidtide_dir},
+        confound_spec=confound_spec,
+        database_dir=database_dir,
+    )
+    assert len(xbids._DERIVATIVES_LAYOUTS) == 1
+    rapidtide_layout = next(iter(xbids._DERIVATIVES_LAYOUTS.values()))
+    assert list(database_dir.glob('derivatives/rapidtide_*/layout_index.sqlite'))
+
+    layouts = {'preprocessed': preproc_layout, 'rapidtide': rapidtide_layout}
+    for bold_file in bold_files:
+        entities = preproc_layout.get_file(bold_file).get_entities()
+        for confound_name, confound_def in confound_spec['confounds'].items():
+            # The batched lookup must match a query for the single run.
+            expected = layouts[confound_def['dataset']].get(
+                **{**entities, **confound_def['query']}
+            )
+            assert confounds[bold_file][confound_name]['file'] == expected[0].path
+            assert f'task-{entities["task"]}_run-{entities["run"]}_' in expected[0].path
+
+        assert 'space-MNI152NLin6Asym' in confounds[bold_file]['rapidtide_slfo']['file']
+
+    # Single-run collection reuses the registered layout.
+    single = xbids.collect_confounds(
+        bold_file=bold_files[0],
+        preproc_dataset=preproc_layout,
+        derivatives_datasets={'rapidtide': rapidtide_dir},
+        confound_spec=confound_spec,
+        database_dir=database_dir,
+    )
+    assert single == confounds[bold_files[0]]
+    assert len(xbids._DERIVATIVES_LAYOUTS) == 1
+    xbids._DERIVATIVES_LAYOUTS.clear()
+
+
+def test_collect_run_data_for_runs(tmp_path_factory):
+    """Test that bulk run data collection matches collecting each run separately."""
+    tmpdir = tmp_path_factory.mktemp('test_collect_run_data_for_runs')
+    preproc_dir = tmpdir / 'preproc'
+    preproc_dir.mkdir()
+    (preproc_dir / 'dataset_description.json').write_text(
+        json.dumps(
+            {
+                'Name': 'preproc',
+                'BIDSVersion': '1.9.0',
+                'DatasetType': 'derivative',
+                'GeneratedBy': [{'Name': 'fMRIPrep'}],
+            }
+        )
+    )
+    for subject in ('01', '02'):
+        func_dir = preproc_dir / f'sub-{subject}' / 'func'
+        func_dir.mkdir(parents=True)
+        for task in ('rest', 'nback'):
+            for run in (1, 2):
+                prefix = f'sub-{subject}_task-{task}_run-{run}'
+                suffixes = [
+                    'desc-confounds_timeseries.tsv',
+                    'space-fsLR_den-91k_bold.dtseries.nii',
+                ]
+                for space in ('MNI152NLin6Asym', 'MNI152NLin2009cAsym'):
+                    suffixes += [
+                        f'space-{space}_res-2_desc-preproc_bold.nii.gz',
+                        f'space-{space}_res-2_boldref.nii.gz',
+                        f'space-{space}_res-2_desc-brain_mask.nii.gz',
+                    ]
+
+                for suffix in suffixes:
+                    (func_dir / f'{prefix}_{suffix}').touch()
+
+                for suffix in (
+                    'desc-confounds_timeseries',
+                    'space-fsLR_den-91k_bold',
+                    'space-MNI152NLin6Asym_res-2_desc-preproc_bold',
+                ):
+                    (func_dir / f'{prefix}_{suffix}.json').write_text(
+                        json.dumps({'RepetitionTime': 2.0, 'Run': run})
+                    )
+
+    xcp_d_config = str(load_data('xcp_d_bids_config2.json'))
+    layout = BIDSLayout(
+        preproc_dir,
+        validate=False,
+        config=['bids', 'derivatives', xcp_d_config],
+    )
+    queries = {
+        'nifti': {'space': 'MNI152NLin6Asym', 'desc': 'preproc', 'extension': '.nii.gz'},
+        'cifti': {'space': 'fsLR', 'extension': '.dtseries.nii'},
+    }
+    for file_format, query in queries.items():
+        bold_files = layout.get(subject='01', suffix='bold', return_type='file', **query)
+        assert len(bold_files) == 4
+        run_datas = xbids.collect_run_data_for_runs(
+            layout,
+            bold_files,
+            file_format=file_format,
+            target_space='MNI152NLin6Asym',
+        )
+        assert list(run_datas.keys()) == bold_files
+        for bold_file in bold_files:
+            expected = xbids.collect_run_data(
+                layout,
+                bold_file,
+                file_format=file_format,
+                target_space='MNI152NLin6Asym',
+            )
+            assert run_datas[bold_file] == expected
+            assert list(run_datas[bold_file].keys()) == list(expected.keys())
+            assert 'space-MNI152NLin6Asym' in run_datas[bold_file]['boldref']
+            assert run_datas[bold_file]['bold_metadata']['RepetitionTime'] == 2.0
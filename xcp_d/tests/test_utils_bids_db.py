@@ -0,0 +1,197 @@
+"""Tests for the xcp_d.utils.bids_db module."""
+
+import json
+import os
+
+from bids.layout import BIDSLayout
+
+from xcp_d.data import load as load_data
+from xcp_d.utils import bids_db
+
+
+def _make_dataset(root, subjects):
+    """Write a small fMRIPrep-like dataset."""
+    root.mkdir(exist_ok=True)
+    (root / 'dataset_description.json').write_text(
+        json.dumps(
+            {
+                'Name': 'preproc',
+                'BIDSVersion': '1.9.0',
+                'DatasetType': 'derivative',
+                'GeneratedBy': [{'Name': 'fMRIPrep'}],
+            }
+        )
+    )
+    # An inherited sidecar at the top level
+    (root / 'task-rest_bold.json').write_text(json.dumps({'RepetitionTime': 2.0}))
+    for subject in subjects:
+        func_dir = root / f'sub-{subject}' / 'func'
+        func_dir.mkdir(parents=True, exist_ok=True)
+        (root / f'sub-{subject}.html').touch()
+        # Subjects' folders below the top level, as in fMRIPrep's FreeSurfer outputs
+        stats_dir = root / 'sourcedata' / 'freesurfer' / f'sub-{subject}' / 'stats'
+        stats_dir.mkdir(parents=True, exist_ok=True)
+        (stats_dir / 'aseg.stats').touch()
+        for run in (1, 2):
+            prefix = f'sub-{subject}_task-rest_run-{run}'
+            (func_dir / f'{prefix}_desc-confounds_timeseries.tsv').touch()
+            (func_dir / f'{prefix}_desc-confounds_timeseries.json').write_text(
+                json.dumps({'Run': run})
+            )
+            (func_dir / f'{prefix}_space-MNI152NLin6Asym_desc-preproc_bold.nii.gz').touch()
+
+
+def _summarize(layout):
+    """Collect the files, entities, and metadata in a layout."""
+    return {
+        f.path: (f.get_entities(), layout.get_metadata(f.path))
+        for f in layout.get(return_type='object')
+    }
+
+
+def test_get_cached_database(tmp_path_factory, monkeypatch):
+    """Test that cached databases match freshly-indexed ones, and are refreshed incrementally."""
+    tmpdir = tmp_path_factory.mktemp('test_get_cached_database')
+    dataset_dir = tmpdir / 'preproc'
+    cache_dir = tmpdir / 'cache'
+    _make_dataset(dataset_dir, ['01', '02', '03'])
+
+    config = ['bids', 'derivatives', str(load_data('xcp_d_bids_config2.json'))]
+    ignore = ['code', 'models']
+
+    def _check(participant_label, name):
+        database_dir = bids_db.get_cached_database(
+            dataset_dir,
+            cache_dir=cache_dir,
+            database_dir=tmpdir / name / 'cached',
+            config=config,
+            ignore=ignore,
+            participant_label=participant_label,
+        )
+        cached = BIDSLayout(dataset_dir, database_path=database_dir, reset_database=False)
+        expected_dir = tmpdir / name / 'expected'
+        bids_db._index_subjects(dataset_dir, expected_dir, config, ignore, participant_label)
+        expected = BIDSLayout(dataset_dir, database_path=expected_dir, reset_database=False)
+        assert _summarize(cached) == _summarize(expected)
+        return cached
+
+    def _mtimes():
+        return {path.name: path.stat().st_mtime_ns for path in cache_dir.glob('*/sub-*.sqlite')}
+
+    layout = _check(['01'], 'first')
+    assert sorted(layout.get_subjects()) == ['01']
+    assert len(layout.get(suffix='timeseries', extension='.tsv')) == 2
+    assert _mtimes().keys() == {'sub-01.sqlite'}
+    freesurfer_files = [f for f in layout.get(return_type='file') if 'freesurfer' in f]
+    assert freesurfer_files == [
+        str(dataset_dir / 'sourcedata' / 'freesurfer' / 'sub-01' / 'stats' / 'aseg.stats')
+    ]
+
+    # Other subjects are indexed on demand, and the first one is reused.
+    before = _mtimes()
+    layout = _check(['01', '03'], 'second')
+    assert sorted(layout.get_subjects()) == ['01', '03']
+    after = _mtimes()
+    assert after['sub-01.sqlite'] == before['sub-01.sqlite']
+    assert after.keys() == {'sub-01.sqlite', 'sub-03.sqlite'}
+
+    # Changing a subject's files only re-indexes that subject.
+    new_file = (
+        dataset_dir / 'sub-03' / 'func' / 'sub-03_task-rest_run-3_desc-confounds_timeseries.tsv'
+    )
+    new_file.touch()
+    before = after
+    layout = _check(None, 'third')
+    assert sorted(layout.get_subjects()) == ['01', '02', '03']
+    assert new_file.as_posix() in layout.get(subject='03', return_type='file')
+    after = _mtimes()
+    assert after['sub-01.sqlite'] == before['sub-01.sqlite']
+    assert after['sub-03.sqlite'] != before['sub-03.sqlite']
+
+    # Changing another subject's nested files does not re-index the first one.
+    freesurfer_dir = dataset_dir / 'sourcedata' / 'freesurfer'
+    before = after
+    os.utime(freesurfer_dir / 'sub-02' / 'stats' / 'aseg.stats')
+    (freesurfer_dir / 'sub-04').mkdir()
+    _check(['01'], 'nested')
+    after = _mtimes()
+    assert after['sub-01.sqlite'] == before['sub-01.sqlite']
+
+    # Changing the subject's own nested files does.
+    os.utime(
+        dataset_dir / 'sourcedata' / 'freesurfer' / 'sub-01' / 'stats' / 'aseg.stats', ns=(1, 1)
+    )
+    _check(['01'], 'nested_own')
+    assert _mtimes()['sub-01.sqlite'] != after['sub-01.sqlite']
+    after = _mtimes()
+
+    # Changing top-level files re-indexes every subject.
+    (dataset_dir / 'task-rest_bold.json').write_text(json.dumps({'RepetitionTime': 3.0}))
+    os.utime(dataset_dir / 'task-rest_bold.json', ns=(1, 1))
+    before = after
+    layout = _check(['01', '02'], 'fourth')
+    after = _mtimes()
+    assert after['sub-01.sqlite'] != before['sub-01.sqlite']
+    bold_file = layout.get(subject='02', suffix='bold', return_type='file')[0]
+    assert layout.get_metadata(bold_file)['RepetitionTime'] == 3.0
+
+    # A lock left behind by a killed job falls back to indexing without the cache.
+    monkeypatch.setattr(bids_db, 'DATABASE_LOCK_TIMEOUT', 0.1)
+    new_file = dataset_dir / 'sub-02' / 'func' / 'sub-02_task-rest_run-3_bold.nii.gz'
+    new_file.touch()
+    lock_file = next(cache_dir.glob('*/sub-02.sqlite')).with_suffix('.lock')
+    lock_file.touch()
+    layout = _check(['01', '02'], 'stale_lock')
+    assert new_file.as_posix() in layout.get(subject='02', return_type='file')
+    assert _mtimes() == after
+
+
+def test_scoped_layout_indexer(tmp_path_factory):
+    """Test that scoped indexing matches indexing with a subject-exclusion pattern."""
+    import re
+
+    from bids.layout.index import BIDSLayoutIndexer
+
+    tmpdir = tmp_path_factory.mktemp('test_scoped_layout_indexer')
+    dataset_dir = tmpdir / 'preproc'
+    _make_dataset(dataset_dir, ['01', '02', '010', '1'])
+    config = ['bids', 'derivatives', str(load_data('xcp_d_bids_config2.json'))]
+
+    # Subjects are scoped at any depth, including sourcedata, which is not ignored here
+    scoped = BIDSLayout(
+        dataset_dir,
+        config=config,
+        indexer=bids_db.ScopedLayoutIndexer(labels=['01', '1'], validate=False, ignore=['code']),
+    )
+    expected = BIDSLayout(
+        dataset_dir,
+        config=config,
+        indexer=BIDSLayoutIndexer(
+            validate=False,
+            ignore=['code', re.compile(r'sub-(?!(01|1)(\b|_))')],
+        ),
+    )
+    assert sorted(scoped.get_subjects()) == ['01', '1']
+    assert _summarize(scoped) == _summarize(expected)
+    assert sorted(f for f in scoped.get(return_type='file') if 'freesurfer' in f) == [
+        str(dataset_dir / 'sourcedata' / 'freesurfer' / f'sub-{subject}' / 'stats' / 'aseg.stats')
+        for subject in ('01', '1')
+    ]
+    assert str(dataset_dir / 'sub-01.html') in scoped.get(return_type='file')
+    assert str(dataset_dir / 'sub-010.html') not in scoped.get(return_type='file')
+
+    # Atlas datasets are scoped by atlas
+    atlas_dir = tmpdir / 'atlases'
+    for atlas in ('A', 'B'):
+        (atlas_dir / f'atlas-{atlas}').mkdir(parents=True)
+        (atlas_dir / f'atlas-{atlas}' / f'atlas-{atlas}_dseg.tsv').touch()
+
+    (atlas_dir / 'dataset_description.json').write_text(
+        json.dumps({'Name': 'atlases', 'BIDSVersion': '1.9.0', 'DatasetType': 'atlas'})
+    )
+    layout = BIDSLayout(
+        atlas_dir,
+        config=[str(load_data('atlas_bids_config.json'))],
+        indexer=bids_db.ScopedLayoutIndexer(labels=['B'], entity_prefix='atlas', validate=False),
+    )
+    assert layout.get(return_type='id', target='atlas') == ['B']
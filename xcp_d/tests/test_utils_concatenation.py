@@ -5,6 +5,7 @@ import os
 import nibabel as nb
 import numpy as np
 import pandas as pd
+import pytest
 
 from xcp_d.utils import concatenation
 
@@ -79,3 +80,103 @@ def test_concatenate_niimgs(ds001419_data, tmp_path_factory):
     concat_cifti_img = nb.load(concat_cifti_file)
     assert concat_cifti_img.shape[0] == cifti_img.shape[0] * n_repeats
     assert concat_cifti_img.shape[1] == cifti_img.shape[1]
+
+
+def test_concatenate_niimgs_synthetic(tmp_path_factory):
+    """Test streaming concatenation of synthetic NIfTI and CIFTI files."""
+    from nilearn.image import concat_imgs
+
+    tmpdir = tmp_path_factory.mktemp('test_concatenate_niimgs_synthetic')
+    rng = np.random.default_rng(0)
+
+    # NIfTIs with scaled integer data and different numbers of volumes
+    nifti_files = []
+    for i_run, n_volumes in enumerate([3, 5, 1]):
+        data = rng.integers(-100, 100, size=(4, 5, 6, n_volumes)).astype(np.int16)
+        img = nb.Nifti1Image(data, np.diag([2, 2, 2, 1]))
+        img.header.set_slope_inter(0.5, 1)
+        nifti_files.append(os.path.join(tmpdir, f'run-{i_run}_bold.nii.gz'))
+        img.to_filename(nifti_files[-1])
+
+    concat_nifti_file = os.path.join(tmpdir, 'concat_bold.nii.gz')
+    concatenation.concatenate_niimgs(nifti_files, out_file=concat_nifti_file)
+    concat_img = nb.load(concat_nifti_file)
+    expected_img = concat_imgs(nifti_files)
+    assert concat_img.shape == (4, 5, 6, 9)
+    np.testing.assert_allclose(concat_img.get_fdata(), expected_img.get_fdata())
+    np.testing.assert_array_equal(concat_img.affine, expected_img.affine)
+
+    # CIFTI dtseries
+    brain_models = nb.cifti2.BrainModelAxis.from_surface(np.arange(10), 10, 'CortexLeft')
+    cifti_files, cifti_data = [], []
+    for i_run, n_volumes in enumerate([3, 4]):
+        data = rng.standard_normal((n_volumes, 10)).astype(np.float32)
+        series = nb.cifti2.SeriesAxis(start=0, step=2, size=n_volumes)
+        img = nb.Cifti2Image(data, header=(series, brain_models))
+        img.nifti_header.set_intent('ConnDenseSeries')
+        cifti_files.append(os.path.join(tmpdir, f'run-{i_run}_bold.dtseries.nii'))
+        img.to_filename(cifti_files[-1])
+        cifti_data.append(data)
+
+    concat_cifti_file = os.path.join(tmpdir, 'concat_bold.dtseries.nii')
+    concatenation.concatenate_niimgs(cifti_files, out_file=concat_cifti_file)
+    concat_img = nb.load(concat_cifti_file)
+    np.testing.assert_array_equal(concat_img.get_fdata(), np.vstack(cifti_data))
+    assert concat_img.header.get_axis(0).size == 7
+    assert concat_img.header.get_axis(0).step == 2
+    assert concat_img.header.get_axis(1) == brain_models
+    assert concat_img.nifti_header.get_intent()[0] == 'ConnDenseSeries'
+
+
+def test_correlation_accumulators(tmp_path_factory):
+    """Test that accumulated correlations match correlations of concatenated time series."""
+    from xcp_d.interfaces.concatenation import AccumulateCorrelations, FinalizeCorrelations
+
+    tmpdir = tmp_path_factory.mktemp('test_correlation_accumulators')
+
+    rng = np.random.default_rng(0)
+    node_names = ['a', 'b', 'c', 'd', 'e']
+    censored_dfs, accumulator_files = [], []
+    for i_run in range(3):
+        timeseries_df = pd.DataFrame(
+            rng.standard_normal((40, len(node_names))) + 10,
+            columns=node_names,
+        )
+        if i_run == 1:
+            # A parcel without coverage in one run
+            timeseries_df['c'] = np.nan
+
+        timeseries_file = str(tmpdir / f'timeseries_{i_run}.tsv')
+        timeseries_df.to_csv(timeseries_file, sep='\t', index=False, na_rep='n/a')
+
+        outliers = (rng.random(40) < 0.25).astype(int)
+        temporal_mask = str(tmpdir / f'outliers_{i_run}.tsv')
+        pd.DataFrame({'framewise_displacement': outliers}).to_csv(
+            temporal_mask,
+            sep='\t',
+            index=False,
+        )
+        censored_dfs.append(timeseries_df.loc[outliers == 0])
+
+        run_dir = tmpdir / f'run_{i_run}'
+        run_dir.mkdir()
+        results = AccumulateCorrelations(
+            in_file=timeseries_file,
+            temporal_mask=temporal_mask,
+        ).run(cwd=str(run_dir))
+        accumulator_files.append(results.outputs.out_file)
+
+    expected = pd.concat(censored_dfs).corr()
+
+    final_dir = tmpdir / 'final'
+    final_dir.mkdir()
+    results = FinalizeCorrelations(accumulators=accumulator_files).run(cwd=str(final_dir))
+    correlations_df = pd.read_table(results.outputs.correlations, index_col='Node')
+    assert correlations_df.index.tolist() == node_names
+    np.testing.assert_allclose(correlations_df.to_numpy(), expected.to_numpy(), atol=1e-10)
+
+    # Runs must share the same parcels
+    accumulators = [concatenation.load_correlation_accumulators(f) for f in accumulator_files]
+    accumulators[1]['node_names'] = np.array(node_names[::-1])
+    with pytest.raises(ValueError, match='Parcel names do not match'):
+        concatenation.combine_correlation_accumulators(accumulators)
@@ -3,6 +3,8 @@
 import os
 
 import matplotlib.pyplot as plt
+import numpy as np
+import pytest
 
 from xcp_d.data import load as load_data
 from xcp_d.tests.utils import chdir
@@ -29,6 +31,39 @@ def test_make_mosaic(tmp_path_factory):
     assert os.path.isfile(mosaic_file)
 
 
+def test_section_mesh():
+    """Test section_mesh against sectioning one plane at a time."""
+    import trimesh
+
+    sphere = trimesh.creation.icosphere(subdivisions=3, radius=50)
+    offsets = np.array([30.5, -20.25, 0.1, 60.0, 12.0])
+    segments, indptr = execsummary.section_mesh(sphere.vertices, sphere.faces, offsets, axis=1)
+    assert indptr.shape == (offsets.size + 1,)
+    assert indptr[-1] == segments.shape[0]
+
+    for i_plane, offset in enumerate(offsets):
+        plane_segments = segments[indptr[i_plane] : indptr[i_plane + 1]]
+        np.testing.assert_allclose(plane_segments[..., 1], offset)
+
+        section = sphere.section(plane_origin=[0, offset, 0], plane_normal=[0, 1, 0])
+        if section is None:
+            assert plane_segments.shape[0] == 0
+            continue
+
+        # Same total contour length as trimesh
+        length = np.linalg.norm(plane_segments[:, 1] - plane_segments[:, 0], axis=1).sum()
+        assert np.isclose(length, section.length)
+
+    # Oblique planes give the same sections as a rotated mesh
+    rotation = trimesh.transformations.rotation_matrix(0.3, [1, 0, 1])[:3, :3]
+    normal = rotation @ [0, 1, 0]
+    oblique, oblique_indptr = execsummary.section_mesh(
+        sphere.vertices @ rotation.T, sphere.faces, offsets, axis=normal
+    )
+    np.testing.assert_array_equal(oblique_indptr, indptr)
+    assert np.allclose(oblique @ normal, np.repeat(offsets, np.diff(indptr))[:, None])
+
+
 def test_modify_pngs_scene_template(tmp_path_factory):
     """Test modify_pngs_scene_template."""
     tmpdir = tmp_path_factory.mktemp('test_modify_pngs_scene_template')
@@ -48,6 +83,20 @@ def test_modify_pngs_scene_template(tmp_path_factory):
     assert os.path.isfile(scene_file)
 
 
+def test_get_scene_slices():
+    """Test get_scene_slices."""
+    pngs_scene_template = str(load_data('executive_summary_scenes/pngs_template.scene.gz'))
+    scene_index, _ = execsummary.get_png_image_names()
+    slices = execsummary.get_scene_slices(pngs_scene_template, scene_index)
+    assert slices[0] == ('AXIAL', -40.0)
+    assert slices[4] == ('CORONAL', 0.0)
+    assert slices[8] == ('PARASAGITTAL', 40.0)
+
+    assert execsummary.get_scene_slices(pngs_scene_template, ['T1_C_-50']) == [('CORONAL', -50.0)]
+    with pytest.raises(ValueError, match='not found'):
+        execsummary.get_scene_slices(pngs_scene_template, ['T2_A_0'])
+
+
 def test_get_png_image_names():
     """Test get_png_image_names."""
     scene_index, image_descriptions = execsummary.get_png_image_names()
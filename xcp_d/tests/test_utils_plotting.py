@@ -37,7 +37,6 @@ def test_plot_fmri_es(ds001419_data, tmp_path_factory):
         denoised_figure=denoised_figure,
         TR=t_r,
         standardize=False,
-        temporary_file_dir=tmpdir,
         temporal_mask=temporal_mask,
     )
     assert os.path.isfile(out_file1)
@@ -54,8 +53,144 @@ def test_plot_fmri_es(ds001419_data, tmp_path_factory):
         denoised_figure=denoised_figure,
         TR=t_r,
         standardize=True,
-        temporary_file_dir=tmpdir,
         temporal_mask=temporal_mask,
     )
     assert os.path.isfile(out_file1)
     assert os.path.isfile(out_file2)
+
+
+def test_save_figure(tmp_path_factory):
+    """Test that save_figure rasterizes heavy artists and keeps the rest as vectors."""
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    tmpdir = tmp_path_factory.mktemp('test_save_figure')
+    rng = np.random.default_rng(0)
+
+    fig, (ax0, ax1) = plt.subplots(1, 2, figsize=(4, 2))
+    many_lines = LineCollection(rng.random((plotting.RASTERIZE_MIN_ELEMENTS + 1, 2, 2)))
+    few_lines = LineCollection(rng.random((10, 2, 2)))
+    ax0.add_collection(many_lines)
+    ax0.add_collection(few_lines)
+    ax0.set_title('Vector title')
+    # Smaller than the axes: embedded as is. Larger than the axes: resampled.
+    small = ax1.imshow(rng.random((10, 10)), interpolation='none', aspect='auto')
+    large = ax1.imshow(rng.random((1000, 10)), interpolation='none', aspect='auto')
+
+    out_file = str(tmpdir / 'figure.svg')
+    assert plotting.save_figure(fig, out_file) == out_file
+    assert not plt.fignum_exists(fig.number)
+    assert many_lines.get_rasterized()
+    assert not few_lines.get_rasterized()
+    assert small.get_interpolation() == 'none'
+    assert large.get_interpolation() == 'nearest'
+
+    svg = open(out_file).read()
+    # The rasterized lines are embedded as an image, the title stays text
+    assert svg.count('<image') == 3
+    assert 'Vector title' in svg
+
+
+def test_plot_surface_map(tmp_path_factory, monkeypatch):
+    """Test that surface maps are drawn from projections cached in memory and on disk."""
+    import matplotlib.pyplot as plt
+    import nibabel as nb
+    import trimesh
+    from matplotlib.collections import PathCollection
+
+    tmpdir = tmp_path_factory.mktemp('test_plot_surface_map')
+    cache_dir = str(tmpdir / 'cache')
+
+    sphere = trimesh.creation.icosphere(subdivisions=3, radius=50)
+    surf_file = str(tmpdir / 'sphere.surf.gii')
+    nb.GiftiImage(
+        darrays=[
+            nb.gifti.GiftiDataArray(
+                sphere.vertices.astype(np.float32), intent='NIFTI_INTENT_POINTSET'
+            ),
+            nb.gifti.GiftiDataArray(sphere.faces.astype(np.int32), intent='NIFTI_INTENT_TRIANGLE'),
+        ]
+    ).to_filename(surf_file)
+
+    vertices, faces = plotting.get_surface_projection(surf_file, 0, 180, cache_dir)
+    assert vertices.shape == (sphere.vertices.shape[0], 2)
+    assert sorted(map(tuple, np.sort(faces, axis=1))) == sorted(
+        map(tuple, np.sort(sphere.faces, axis=1))
+    )
+    # The mesh fits in the 2D view of the axes
+    assert vertices.min() > -0.095
+    assert vertices.max() < 0.09
+    assert len(list((tmpdir / 'cache').glob('*.npz'))) == 1
+
+    # A new process reads the projection from the disk
+    plotting._get_surface_projection.cache_clear()
+    monkeypatch.setattr(plotting, '_project_surface', None)
+    cached_vertices, cached_faces = plotting.get_surface_projection(surf_file, 0, 180, cache_dir)
+    np.testing.assert_array_equal(cached_vertices, vertices)
+    np.testing.assert_array_equal(cached_faces, faces)
+
+    surf_data = sphere.vertices[:, 2] / 50
+    fig, ax = plt.subplots()
+    kwargs = {'vmin': -1, 'vmax': 1, 'cache_dir': cache_dir}
+    plotting.plot_surface_map(surf_file, surf_data, 'left', 'lateral', ax, **kwargs)
+    plotting.plot_surface_map(surf_file, surf_data, 'left', 'lateral', ax, threshold=0.5, **kwargs)
+    assert len(ax.collections) == 2
+    assert all(isinstance(collection, PathCollection) for collection in ax.collections)
+    all_faces, thresholded = ax.collections
+    # Both maps share the same triangles, but the thresholded one shows the background
+    assert all_faces.get_paths() is thresholded.get_paths()
+    assert len(thresholded.get_paths()) == faces.shape[0]
+    face_data = np.abs(surf_data[faces].mean(axis=1))
+    background = thresholded.get_facecolor()[face_data < 0.5]
+    assert np.unique(background, axis=0).shape[0] == 1
+    assert not np.allclose(all_faces.get_facecolor()[face_data < 0.5], background[0])
+    plt.close(fig)
+
+
+def test_load_carpet_data(tmp_path_factory):
+    """Test that the carpet data read from the files match the decimated full data."""
+    import nibabel as nb
+    from nibabel.cifti2 import cifti2_axes
+
+    tmpdir = tmp_path_factory.mktemp('test_load_carpet_data')
+    rng = np.random.default_rng(0)
+    size = (50, 40)
+
+    # NIfTI: only the voxels with positive labels are sampled
+    data = rng.standard_normal((8, 9, 10, 130)).astype(np.float32)
+    data[1, 2, 3, 5] = np.nan
+    bold_file = str(tmpdir / 'bold.nii.gz')
+    nb.Nifti1Image(data, np.eye(4)).to_filename(bold_file)
+    atlaslabels = rng.choice([0, 3, 40, 150, 255], size=data.shape[:3])
+    atlaslabels[1, 2, 3] = 3
+
+    img = nb.load(bold_file, keep_file_open=True)
+    carpet, seg_data, volumes = plotting.load_carpet_data(
+        img, atlaslabels=atlaslabels, size=size, chunk_size=7
+    )
+    expected = np.nan_to_num(data[atlaslabels > 0])
+    p_dec = 1 + expected.shape[0] // size[0]
+    expected = expected[::p_dec, volumes]
+    assert volumes == slice(None, None, 4)
+    assert carpet.shape == expected.shape == (expected.shape[0], 33)
+    np.testing.assert_array_equal(carpet, expected)
+    lut = {3: 1, 40: 3, 150: 4, 255: 2}
+    assert seg_data.tolist() == [lut[label] for label in atlaslabels[atlaslabels > 0][::p_dec]]
+
+    # CIFTI: the tissue types are read from the brain models
+    brain_models = cifti2_axes.BrainModelAxis.from_surface(
+        np.arange(60), 60, 'CortexLeft'
+    ) + cifti2_axes.BrainModelAxis.from_mask(np.ones((2, 2, 5)), name='thalamus_left')
+    data = rng.standard_normal((30, 80))
+    cifti_file = str(tmpdir / 'bold.dtseries.nii')
+    cifti = nb.Cifti2Image(
+        data,
+        nb.cifti2.Cifti2Header.from_axes((cifti2_axes.SeriesAxis(0, 2, 30), brain_models)),
+    )
+    cifti.nifti_header.set_intent('ConnDenseSeries')
+    cifti.to_filename(cifti_file)
+
+    carpet, seg_data, volumes = plotting.load_carpet_data(nb.load(cifti_file), size=size)
+    np.testing.assert_array_equal(carpet, data[:, ::2].T)
+    assert volumes == slice(None, None, 1)
+    assert seg_data.tolist() == [1] * 30 + [3] * 10
@@ -0,0 +1,86 @@
+"""Tests for the xcp_d.utils.probe module."""
+
+import json
+import os
+
+import nibabel as nb
+import numpy as np
+import pandas as pd
+
+from xcp_d.utils import probe
+
+
+def test_probe_nifti(tmp_path_factory):
+    """Test xcp_d.utils.probe.probe_file with a NIfTI image and sidecar."""
+    tmpdir = tmp_path_factory.mktemp('test_probe_nifti')
+
+    img = nb.Nifti1Image(np.zeros((4, 5, 6, 7), dtype=np.int16), np.eye(4))
+    img.header.set_zooms((2, 2, 2, 1.5))
+    in_file = os.path.join(tmpdir, 'sub-01_task-rest_bold.nii.gz')
+    img.to_filename(in_file)
+
+    info = probe.probe_file(in_file)
+    assert info['shape'] == (4, 5, 6, 7)
+    assert info['dtype'] == np.int16
+    assert info['n_volumes'] == 7
+    assert info['tr'] == 1.5
+    assert info['nbytes'] == 4 * 5 * 6 * 7 * 2
+    assert info['metadata'] == {}
+    assert probe.get_tr(in_file) == 1.5
+
+    # Modifying the returned dictionary must not affect the cache
+    info['metadata']['RepetitionTime'] = 10
+    assert probe.probe_file(in_file)['metadata'] == {}
+
+    # The sidecar takes precedence in get_tr, but not in the header-based "tr" value.
+    # Rewriting the image changes its mtime, so the cache is refreshed.
+    with open(os.path.join(tmpdir, 'sub-01_task-rest_bold.json'), 'w') as fobj:
+        json.dump({'RepetitionTime': 2}, fobj)
+
+    img.to_filename(in_file)
+    os.utime(in_file, ns=(0, 0))
+    assert probe.get_tr(in_file) == 2
+    assert probe.probe_file(in_file)['tr'] == 1.5
+
+
+def test_probe_cifti(tmp_path_factory):
+    """Test xcp_d.utils.probe.probe_file with a CIFTI image."""
+    tmpdir = tmp_path_factory.mktemp('test_probe_cifti')
+
+    brain_models = nb.cifti2.BrainModelAxis.from_surface(np.arange(10), 10, 'CortexLeft')
+    series = nb.cifti2.SeriesAxis(start=0, step=0.8, size=3)
+    img = nb.Cifti2Image(np.zeros((3, 10), dtype=np.float32), header=(series, brain_models))
+    img.nifti_header.set_intent('ConnDenseSeries')
+    in_file = os.path.join(tmpdir, 'sub-01_task-rest_bold.dtseries.nii')
+    img.to_filename(in_file)
+
+    info = probe.probe_file(in_file)
+    assert info['shape'] == (3, 10)
+    assert info['n_volumes'] == 3
+    assert np.isclose(info['tr'], 0.8)
+    assert info['intent'] == 'ConnDenseSeries'
+    assert probe.get_n_volumes(in_file) == 3
+
+    # Files without a series axis have no repetition time
+    scalars = nb.cifti2.ScalarAxis(['alff', 'reho'])
+    img = nb.Cifti2Image(np.zeros((2, 10), dtype=np.float32), header=(scalars, brain_models))
+    img.nifti_header.set_intent('ConnDenseScalar')
+    in_file = os.path.join(tmpdir, 'sub-01_task-rest_stat-alff_boldmap.dscalar.nii')
+    img.to_filename(in_file)
+
+    info = probe.probe_file(in_file)
+    assert info['n_volumes'] == 2
+    assert info['tr'] is None
+    assert probe.get_tr(in_file) is None
+
+
+def test_probe_table(tmp_path_factory):
+    """Test that TSV row counts match pandas."""
+    tmpdir = tmp_path_factory.mktemp('test_probe_table')
+
+    in_file = os.path.join(tmpdir, 'sub-01_task-rest_desc-confounds_timeseries.tsv')
+    with open(in_file, 'w') as fobj:
+        fobj.write('a\tb\n1\t2\n\t\n3\t4\n\n')
+
+    assert probe.probe_file(in_file)['shape'] == pd.read_table(in_file).shape
+    assert probe.get_n_volumes(in_file) == pd.read_table(in_file).shape[0]
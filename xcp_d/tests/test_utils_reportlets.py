@@ -0,0 +1,200 @@
+"""Tests for the xcp_d.utils.reportlets module."""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from bids.layout import Query
+
+from xcp_d.interfaces.plotting import DeferReportlet
+from xcp_d.utils import reportlets
+
+
+def test_reportlet_store(tmp_path_factory):
+    """Test storing and reusing reportlets across working directories."""
+    tmpdir = tmp_path_factory.mktemp('test_reportlet_store')
+    store_dir = tmpdir / 'store'
+    for session in ('1', '2'):
+        (tmpdir / f'ses-{session}').mkdir()
+
+    in_file = tmpdir / 'ses-1' / 'anat.nii.gz'
+    in_file.write_bytes(b'anatomical data')
+    shutil.copyfile(in_file, tmpdir / 'ses-2' / 'anat.nii.gz')
+
+    # Only the contents of the inputs matter
+    key = reportlets.get_reportlet_key('Plot', [str(in_file)], {'size': 10})
+    assert key == reportlets.get_reportlet_key(
+        'Plot', [str(tmpdir / 'ses-2' / 'anat.nii.gz')], {'size': 10}
+    )
+    assert key != reportlets.get_reportlet_key('Plot', [str(in_file)], {'size': 20})
+
+    out_files = [str(tmpdir / 'ses-1' / 'a.png'), str(tmpdir / 'ses-1' / 'b.png')]
+    assert not reportlets.fetch_reportlets(store_dir, key, out_files)
+    for out_file in out_files:
+        with open(out_file, 'w') as fo:
+            fo.write(os.path.basename(out_file))
+
+    reportlets.store_reportlets(store_dir, key, out_files)
+    # Storing the same reportlets again keeps the first ones
+    reportlets.store_reportlets(store_dir, key, out_files[:1])
+    assert sorted(os.listdir(store_dir / key)) == ['a.png', 'b.png']
+
+    new_files = [str(tmpdir / 'ses-2' / 'a.png'), str(tmpdir / 'ses-2' / 'b.png')]
+    assert reportlets.fetch_reportlets(store_dir, key, new_files)
+    for out_file, new_file in zip(out_files, new_files, strict=True):
+        assert os.path.samefile(out_file, new_file)
+
+
+def test_output_manifest(tmp_path_factory):
+    """Test querying derivatives from the manifest written along with them."""
+    output_dir = tmp_path_factory.mktemp('test_output_manifest')
+    out_files = [
+        'sub-01/figures/sub-01_desc-mosaic_T1w.png',
+        'sub-01/figures/sub-01_task-rest_run-01_desc-mean_bold.svg',
+        'sub-01/figures/sub-01_task-rest_desc-preprocESQC_bold.svg',
+        'sub-01/func/sub-01_task-rest_run-01_desc-denoised_bold.nii.gz',
+        'sub-02/figures/sub-02_desc-mosaic_T1w.png',
+        'atlases/atlas-Gordon/atlas-Gordon_dseg.nii.gz',
+    ]
+    for out_file in out_files:
+        (output_dir / out_file).parent.mkdir(parents=True, exist_ok=True)
+        (output_dir / out_file).touch()
+
+    # Outputs of an earlier run, written before there were manifests
+    old_file = 'sub-01/anat/sub-01_desc-preproc_T1w.nii.gz'
+    (output_dir / old_file).parent.mkdir()
+    (output_dir / old_file).touch()
+
+    assert not reportlets.OutputManifest.exists(output_dir, '01')
+    reportlets.update_manifest(output_dir, [str(output_dir / f) for f in out_files[:2]])
+    reportlets.update_manifest(output_dir, [str(output_dir / f) for f in out_files[2:]])
+    assert reportlets.OutputManifest.exists(output_dir, '01')
+    assert reportlets.OutputManifest.exists(output_dir, '02')
+    manifest = json.loads(reportlets.get_manifest_file(output_dir, '01').read_text())
+    assert manifest['files'] == sorted(out_files[:4] + [old_file])
+    (output_dir / old_file).unlink()
+
+    # Files removed after they were written are ignored
+    (output_dir / out_files[0]).unlink()
+    manifest = reportlets.OutputManifest(output_dir, '01')
+    assert len(manifest.files) == 3
+
+    def _get(**query):
+        return sorted(os.path.basename(f.path) for f in manifest.get(subject='01', **query))
+
+    assert _get(datatype='func', suffix='bold', extension=['.dtseries.nii', '.nii.gz']) == [
+        'sub-01_task-rest_run-01_desc-denoised_bold.nii.gz'
+    ]
+    assert _get(task='rest', run=1.0, desc='mean', extension=['.svg', '.png']) == [
+        'sub-01_task-rest_run-01_desc-mean_bold.svg'
+    ]
+    assert _get(task='rest', run=Query.NONE, suffix='bold', extension='.svg') == [
+        'sub-01_task-rest_desc-preprocESQC_bold.svg'
+    ]
+    assert _get(desc='mosaic') == []
+    assert manifest.get(subject='02') == []
+
+
+def test_deferred_reportlets(tmp_path_factory):
+    """Test writing the data of figures in the workflow and rendering them later."""
+    tmpdir = tmp_path_factory.mktemp('test_deferred_reportlets')
+    output_dir = tmpdir / 'xcp_d'
+    source_file = str(tmpdir / 'sub-01_task-rest_space-MNI152NLin6Asym_desc-preproc_bold.nii.gz')
+
+    rng = np.random.default_rng(0)
+    motion_file = str(tmpdir / 'motion.tsv')
+    pd.DataFrame(
+        {
+            'trans_x': rng.random(50),
+            'framewise_displacement': rng.random(50),
+            'framewise_displacement_filtered': rng.random(50),
+        }
+    ).to_csv(motion_file, sep='\t', index=False)
+    temporal_mask = str(tmpdir / 'outliers.tsv')
+    pd.DataFrame({'framewise_displacement': (rng.random(45) > 0.8).astype(int)}).to_csv(
+        temporal_mask, sep='\t', index=False
+    )
+    design_matrix = str(tmpdir / 'design.tsv')
+    pd.DataFrame({'intercept': np.ones(45), 'global_signal': rng.random(45)}).to_csv(
+        design_matrix, sep='\t', index=False
+    )
+
+    DeferReportlet(
+        reportlet='censoring',
+        source_file=source_file,
+        motion_file=motion_file,
+        temporal_mask=temporal_mask,
+        dummy_scans=5,
+        parameters={
+            'TR': 2.0,
+            'motion_filter_type': 'lp',
+            'fd_thresh': 0.5,
+            'head_radius': 50.0,
+        },
+        datasink={
+            'dismiss_entities': ['hash'],
+            'desc': 'censoring',
+            'suffix': 'motion',
+            'extension': '.svg',
+        },
+        base_directory=str(output_dir),
+    ).run(cwd=tmpdir)
+    results = DeferReportlet(
+        reportlet='design',
+        source_file=source_file,
+        design_matrix=design_matrix,
+        temporal_mask=temporal_mask,
+        datasink={
+            'dismiss_entities': ['space', 'desc', 'hash'],
+            'suffix': 'design',
+            'extension': '.svg',
+        },
+        base_directory=str(output_dir),
+    ).run(cwd=tmpdir)
+
+    # Only the framewise displacement is kept from the motion file
+    reportlet_dirs = reportlets.find_deferred_reportlets(output_dir, '01')
+    assert len(reportlet_dirs) == 2
+    assert results.outputs.out_dir in reportlet_dirs
+    motion_df = pd.read_table(os.path.join(reportlet_dirs[0], 'motion.tsv'))
+    assert motion_df.columns.tolist() == [
+        'framewise_displacement',
+        'framewise_displacement_filtered',
+    ]
+
+    out_files = [
+        reportlets.render_deferred_reportlet(output_dir, reportlet_dir)
+        for reportlet_dir in reportlet_dirs
+    ]
+    figures_dir = output_dir / 'sub-01' / 'figures'
+    assert sorted(os.path.basename(f) for f in out_files) == [
+        'sub-01_task-rest_design.svg',
+        'sub-01_task-rest_space-MNI152NLin6Asym_desc-censoring_motion.svg',
+    ]
+    assert all(os.path.dirname(f) == str(figures_dir) for f in out_files)
+    assert reportlets.find_deferred_reportlets(output_dir, '01') == []
+    assert len(reportlets.OutputManifest(output_dir, '01').get(extension='.svg')) == 2
+
+
+def test_update_manifest_stale_lock(tmp_path_factory, monkeypatch):
+    """Test that a lock left behind by a killed job does not fail the datasinks."""
+    output_dir = tmp_path_factory.mktemp('test_update_manifest_stale_lock')
+    out_file = output_dir / 'sub-01' / 'figures' / 'sub-01_desc-mosaic_T1w.png'
+    out_file.parent.mkdir(parents=True)
+    out_file.touch()
+    reportlets.update_manifest(output_dir, [str(out_file)])
+    assert reportlets.OutputManifest.exists(output_dir, '01')
+
+    manifest_file = reportlets.get_manifest_file(output_dir, '01')
+    (manifest_file.parent / f'{manifest_file.name}.lock').touch()
+    monkeypatch.setattr(reportlets, 'MANIFEST_LOCK_TIMEOUT', 0.1)
+    monkeypatch.setattr(reportlets, '_LOCKED_MANIFESTS', set())
+    new_file = out_file.with_name('sub-01_desc-mean_bold.svg')
+    new_file.touch()
+    reportlets.update_manifest(output_dir, [str(new_file)])
+
+    # The manifest may be missing outputs, so the reports index the subject's outputs instead
+    assert not reportlets.OutputManifest.exists(output_dir, '01')
+    assert reportlets._LOCKED_MANIFESTS == {str(manifest_file)}
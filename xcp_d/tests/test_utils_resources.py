@@ -0,0 +1,268 @@
+"""Tests for the xcp_d.utils.resources module."""
+
+import json
+import os
+import subprocess
+import sys
+
+import nibabel as nb
+import numpy as np
+import pandas as pd
+import pytest
+
+from xcp_d import config
+from xcp_d.tests.test_config import _reset_config
+from xcp_d.utils import resources
+
+# Runs one interface in a fresh process and reports the growth of its peak resident memory,
+# excluding the memory used by the imports.
+_MEASURE_PEAK = """
+import json, os, resource, sys
+
+from xcp_d.interfaces import censoring, connectivity, nilearn, restingstate
+
+step = sys.argv[1]
+os.chdir(sys.argv[2])
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if step == 'denoise':
+    nilearn.DenoiseNifti(
+        preprocessed_bold='bold.nii.gz',
+        mask='mask.nii.gz',
+        confounds_tsv='confounds.tsv',
+        temporal_mask='temporal_mask.tsv',
+        TR=2,
+        bandpass_filter=True,
+        low_pass=0.08,
+        high_pass=0.01,
+        filter_order=2,
+    ).run()
+elif step == 'censor':
+    censoring.Censor(
+        in_file='bold.nii.gz',
+        temporal_mask='temporal_mask.tsv',
+        column='framewise_displacement',
+    ).run()
+elif step == 'alff':
+    restingstate.ComputeALFF(
+        in_file='bold.nii.gz',
+        mask='mask.nii.gz',
+        TR=2,
+        low_pass=0.08,
+        high_pass=0.01,
+    ).run()
+elif step == 'parcellate':
+    connectivity.NiftiParcellate(
+        filtered_file='bold.nii.gz',
+        mask='mask.nii.gz',
+        atlas='atlas.nii.gz',
+        atlas_labels='atlas.tsv',
+        min_coverage=0.5,
+    ).run()
+
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'peak_gb': (peak - base) / 1024**2}))
+"""
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(sys.platform != 'linux', reason='ru_maxrss is in kilobytes on Linux only')
+def test_estimates_cover_measured_peaks(tmp_path_factory):
+    """Check the calibrated estimates against the peak memory of the interfaces."""
+    tmpdir = tmp_path_factory.mktemp('test_estimates_cover_measured_peaks')
+    rng = np.random.default_rng(0)
+    shape, n_volumes = (40, 48, 40), 150
+    affine = np.diag([2, 2, 2, 1])
+
+    data = rng.standard_normal(shape + (n_volumes,), dtype=np.float32) + 100
+    nb.Nifti1Image(data, affine).to_filename(tmpdir / 'bold.nii.gz')
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[5:-5, 5:-5, 5:-5] = 1
+    nb.Nifti1Image(mask, affine).to_filename(tmpdir / 'mask.nii.gz')
+    atlas = (np.arange(mask.size).reshape(shape) % 100 + 1) * mask
+    nb.Nifti1Image(atlas.astype(np.int16), affine).to_filename(tmpdir / 'atlas.nii.gz')
+    pd.DataFrame({'index': np.arange(1, 101), 'label': [f'p{i}' for i in range(1, 101)]}).to_csv(
+        tmpdir / 'atlas.tsv', sep='\t', index=False
+    )
+    pd.DataFrame(rng.standard_normal((n_volumes, 24))).add_prefix('c').to_csv(
+        tmpdir / 'confounds.tsv', sep='\t', index=False
+    )
+    pd.DataFrame({'framewise_displacement': (rng.random(n_volumes) > 0.9).astype(int)}).to_csv(
+        tmpdir / 'temporal_mask.tsv', sep='\t', index=False
+    )
+
+    estimates = resources.estimate_resources(str(tmpdir / 'bold.nii.gz'))
+    for step in ('denoise', 'censor', 'alff', 'parcellate'):
+        result = subprocess.run(
+            [sys.executable, '-c', _MEASURE_PEAK, step, str(tmpdir)],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, 'NO_ET': '1'},
+        )
+        peak_gb = json.loads(result.stdout.strip().splitlines()[-1])['peak_gb']
+        estimate_gb = estimates['resources'][step]['mem_gb']
+        # Large enough to avoid running out of memory, small enough to pack nodes efficiently.
+        assert peak_gb <= estimate_gb <= peak_gb * 4 + 0.5, step
+
+
+def test_estimate_resources(tmp_path_factory):
+    """Test the scaling of the estimates with the data and the settings."""
+    tmpdir = tmp_path_factory.mktemp('test_estimate_resources')
+    bold_file = str(tmpdir / 'bold.nii.gz')
+    nb.Nifti1Image(np.zeros((10, 10, 10, 50), dtype=np.int16), np.eye(4)).to_filename(bold_file)
+
+    estimates = resources.estimate_resources(bold_file)
+    # The original dictionary values are the on-disk (int16) sizes
+    assert estimates['bold'] == 10 * 10 * 10 * 50 * 2 / 1024**3
+    assert estimates['volume'] == estimates['bold'] / 50
+    # The models use the size as float32
+    model = resources.RESOURCE_MODEL['denoise']
+    assert estimates['resources']['denoise']['mem_gb'] == pytest.approx(
+        model['base_gb'] + model['factor'] * 2 * estimates['bold']
+    )
+    # Small data are not worth splitting across threads
+    assert estimates['resources']['denoise']['n_procs'] == 1
+
+    # Concatenated runs add up
+    concatenated = resources.estimate_resources([bold_file, bold_file])
+    assert concatenated['bold'] == 2 * estimates['bold']
+    assert concatenated['volume'] == estimates['volume']
+    assert (
+        concatenated['resources']['concatenate']['mem_gb']
+        > estimates['resources']['concatenate']['mem_gb']
+    )
+
+    # More exact scans and atlases need more memory for their correlation matrices
+    more = resources.estimate_resources(bold_file, n_atlases=4, n_exact_scans=3)
+    for step in ('correlate', 'connectivity_plot'):
+        assert more['resources'][step]['mem_gb'] > estimates['resources'][step]['mem_gb']
+
+    # CIFTI time series are stored as (time, grayordinates)
+    cifti_file = str(tmpdir / 'bold.dtseries.nii')
+    brain_models = nb.cifti2.BrainModelAxis.from_surface(np.arange(1000), 1000, 'CortexLeft')
+    series = nb.cifti2.SeriesAxis(start=0, step=2, size=50)
+    nb.Cifti2Image(
+        np.zeros((50, 1000), dtype=np.int16), header=(series, brain_models)
+    ).to_filename(cifti_file)
+    cifti = resources.estimate_resources(cifti_file)
+    assert cifti['bold'] == estimates['bold']
+    assert cifti['volume'] == estimates['volume']
+    for step, estimate in estimates['resources'].items():
+        assert cifti['resources'][step]['mem_gb'] == pytest.approx(estimate['mem_gb'])
+
+
+def test_get_mem_gb_and_n_procs():
+    """Test the lookups of the estimates, with and without a resource model."""
+    mem_gb = {
+        'bold': 1.0,
+        'volume': 0.01,
+        'resources': {
+            'denoise': {'mem_gb': 5.0, 'parallel_gb': 2.0, 'n_procs': 3},
+            'map': {'mem_gb': 0.2, 'parallel_gb': 0, 'n_procs': 1},
+        },
+    }
+    config.nipype.omp_nthreads = 8
+    assert resources.get_n_procs(mem_gb, 'denoise') == 3
+    assert resources.get_mem_gb(mem_gb, 'denoise') == 7.0
+
+    config.nipype.omp_nthreads = 1
+    assert resources.get_n_procs(mem_gb, 'denoise') == 1
+    assert resources.get_mem_gb(mem_gb, 'denoise') == 5.0
+
+    # Dictionaries without estimates fall back to the data size and all threads
+    config.nipype.omp_nthreads = 4
+    assert resources.get_mem_gb({'bold': 2}, 'denoise') == 2
+    assert resources.get_n_procs({'bold': 2}, 'denoise') == 4
+    assert resources.get_mem_gb({'bold': 2, 'volume': 0.1}, 'map') == 0.1
+    assert resources.get_n_procs({'bold': 2}, 'censor') == 1
+    _reset_config()
+
+
+def test_resource_profile(tmp_path_factory, monkeypatch):
+    """Test recording, aggregating, and applying the resources used by nodes."""
+    import logging
+
+    from nipype.interfaces import utility as niu
+    from nipype.pipeline import engine as pe
+
+    tmpdir = tmp_path_factory.mktemp('test_resource_profile')
+
+    def _init_wf():
+        wf = pe.Workflow(name='xcpd_wf', base_dir=str(tmpdir / 'work'))
+        for i_run in range(2):
+            run_wf = pe.Workflow(name=f'postprocess_{i_run}_wf')
+            single = pe.Node(niu.Merge(2), name='single', n_procs=4)
+            single.inputs.in1 = i_run
+            single.inputs.in2 = i_run + 1
+            mapped = pe.MapNode(niu.Merge(1), name='mapped', iterfield=['in1'], mem_gb=3)
+            run_wf.connect([(single, mapped, [('out', 'in1')])])
+            wf.add_nodes([run_wf])
+
+        return wf
+
+    log_file = tmpdir / 'resources.jsonl'
+    resources.init_resource_log(log_file)
+    try:
+        # MapNodes are only split into subnodes by the distributed plugins
+        _init_wf().run(
+            plugin='MultiProc',
+            plugin_args={
+                'n_procs': 4,
+                'memory_gb': 8,
+                'status_callback': resources.log_node_resources,
+            },
+        )
+    finally:
+        for handler in logging.getLogger('callback').handlers[:]:
+            handler.close()
+            logging.getLogger('callback').removeHandler(handler)
+
+    records = [json.loads(line) for line in log_file.read_text().splitlines()]
+    # Runs and MapNode subnodes share keys
+    assert sorted(record['key'] for record in records) == (
+        ['postprocess_wf.mapped'] * 4 + ['postprocess_wf.single'] * 2
+    )
+
+    # Without the resource monitor, there is nothing to aggregate
+    profile_file = tmpdir / 'logs' / 'resource_profile.json'
+    assert resources.update_resource_profile(log_file, profile_file) == 0
+
+    for i_record, record in enumerate(records):
+        record['runtime_memory_gb'] = 0.5 + i_record / 10
+        record['runtime_threads'] = 150.0
+        record['duration'] = 1.0
+
+    log_file.write_text('\n'.join(json.dumps(record) for record in records))
+    assert resources.update_resource_profile(log_file, profile_file) == 6
+    # Profiles accumulate across jobs
+    assert resources.update_resource_profile(log_file, profile_file) == 6
+    profile = json.loads(profile_file.read_text())['nodes']
+    assert profile['postprocess_wf.mapped']['n_runs'] == 8
+
+    # A lock left behind by a killed job does not fail the run
+    monkeypatch.setattr(resources, 'PROFILE_LOCK_TIMEOUT', 0.1)
+    lock_file = tmpdir / 'logs' / 'resource_profile.json.lock'
+    lock_file.touch()
+    assert resources.update_resource_profile(log_file, profile_file) is None
+    assert json.loads(profile_file.read_text())['nodes'] == profile
+    lock_file.unlink()
+    assert profile['postprocess_wf.single']['duration_mean'] == 1.0
+
+    wf = _init_wf()
+    assert resources.apply_resource_profile(wf, profile_file) == 4
+    for node in wf._get_all_nodes():
+        stats = profile[f'postprocess_wf.{node.name}']
+        assert node.mem_gb == stats['memory_gb_max'] * resources.PROFILE_MEMORY_MARGIN
+        # Threads are reduced to the measured CPU usage, but never increased
+        assert node.n_procs == (2 if node.name == 'single' else 1)
+
+    # Interfaces that start their own workers are limited to the node's threads
+    from xcp_d.interfaces.concatenation import ConcatenateInputs
+
+    wf = pe.Workflow(name='xcpd_wf')
+    run_wf = pe.Workflow(name='postprocess_0_wf')
+    run_wf.add_nodes([pe.Node(ConcatenateInputs(n_procs=4), name='single', n_procs=4)])
+    wf.add_nodes([run_wf])
+    assert resources.apply_resource_profile(wf, profile_file) == 1
+    node = run_wf.get_node('single')
+    assert node.n_procs == node.inputs.n_procs == 2
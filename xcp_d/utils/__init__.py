@@ -1,39 +1,32 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
-"""A range of utility functions for xcp_d interfaces and workflows."""
+"""A range of utility functions for xcp_d interfaces and workflows.
 
-from xcp_d.utils import (
-    atlas,
-    bids,
-    boilerplate,
-    concatenation,
-    confounds,
-    doc,
-    execsummary,
-    filemanip,
-    modified_data,
-    plotting,
-    qcmetrics,
-    restingstate,
-    sentry,
-    utils,
-    write_save,
-)
+Submodules are imported on first access, so that importing one utility module
+does not import the heavy dependencies of all of the others.
+"""
+
+from xcp_d.utils.lazy import attach
 
-__all__ = [
-    'atlas',
-    'bids',
-    'boilerplate',
-    'concatenation',
-    'confounds',
-    'doc',
-    'execsummary',
-    'filemanip',
-    'modified_data',
-    'plotting',
-    'qcmetrics',
-    'restingstate',
-    'sentry',
-    'utils',
-    'write_save',
-]
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    [
+        'atlas',
+        'bids',
+        'boilerplate',
+        'concatenation',
+        'confounds',
+        'doc',
+        'execsummary',
+        'filemanip',
+        'modified_data',
+        'plotting',
+        'probe',
+        'qcmetrics',
+        'restingstate',
+        'sentry',
+        'smoothing',
+        'utils',
+        'write_save',
+    ],
+)
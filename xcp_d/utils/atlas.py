@@ -1,6 +1,6 @@
 """Functions for working with atlases."""
 
-from nipype import logging
+import logging
 
 LOGGER = logging.getLogger('nipype.utils')
 
@@ -98,6 +98,7 @@ def collect_atlases(datasets, atlases, file_format, bids_filters=None):
     from bids.layout import BIDSLayout
 
     from xcp_d.data import load as load_data
+    from xcp_d.utils.bids_db import ScopedLayoutIndexer
 
     atlas_cfg = load_data('atlas_bids_config.json')
     bids_filters = bids_filters or {}
@@ -119,7 +120,13 @@ def collect_atlases(datasets, atlases, file_format, bids_filters=None):
     atlas_cache = {}
     for dataset_name, dataset_path in datasets.items():
         if not isinstance(dataset_path, BIDSLayout):
-            layout = BIDSLayout(dataset_path, config=[atlas_cfg], validate=False)
+            # Only index the requested atlases' folders
+            layout = BIDSLayout(
+                dataset_path,
+                config=[atlas_cfg],
+                validate=False,
+                indexer=ScopedLayoutIndexer(labels=atlases, entity_prefix='atlas', validate=False),
+            )
         else:
             layout = dataset_path
 
@@ -11,7 +11,6 @@ import warnings
 from pathlib import Path
 
 import filelock
-import nibabel as nb
 import yaml
 from bids.layout import BIDSLayout
 from bids.utils import listify
@@ -664,11 +663,69 @@ def collect_run_data(layout, bold_file, file_format, target_space):
     run_data : :obj:`dict`
         A dictionary of file types (e.g., "confounds") and associated filenames.
     """
-    bids_file = layout.get_file(bold_file)
+    return _collect_run_data(
+        bold_file,
+        file_format=file_format,
+        target_space=target_space,
+        get_nearest=layout.get_nearest,
+        get_metadata=layout.get_metadata,
+    )
+
+
+def collect_run_data_for_runs(layout, bold_files, file_format, target_space):
+    """Collect data associated with several BOLD files at once.
+
+    The files, entities, and metadata of every subject in ``bold_files`` are retrieved
+    from the layout in a single query, and each run is then matched to its associated files
+    in memory, following the same rules as :func:`collect_run_data`.
+
+    Parameters
+    ----------
+    %(layout)s
+    bold_files : :obj:`list` of :obj:`str`
+        Paths to the BOLD files.
+    file_format
+        Whether to collect files associated with a CIFTI image (True) or a NIFTI (False).
+    target_space
+        Used to find NIfTIs in the appropriate space if ``cifti`` is ``True``.
+
+    Returns
+    -------
+    run_datas : :obj:`dict`
+        Dictionary with one entry per BOLD file, each of which is the output of
+        :func:`collect_run_data` for that file.
+    """
+    if layout.derivatives:
+        # Metadata may come from more than one index, so use PyBIDS' own resolution.
+        return {
+            bold_file: collect_run_data(layout, bold_file, file_format, target_space)
+            for bold_file in bold_files
+        }
+
+    subjects = sorted({get_entity(bold_file, 'sub') for bold_file in bold_files})
+    file_index = _LayoutFileIndex(layout, subjects)
+    return {
+        bold_file: _collect_run_data(
+            bold_file,
+            file_format=file_format,
+            target_space=target_space,
+            get_nearest=file_index.get_nearest,
+            get_metadata=file_index.get_metadata,
+        )
+        for bold_file in bold_files
+    }
+
+
+def _collect_run_data(bold_file, file_format, target_space, get_nearest, get_metadata):
+    """Collect data associated with a given BOLD file, using the provided search functions.
+
+    ``get_nearest`` and ``get_metadata`` must behave like
+    :meth:`~bids.layout.BIDSLayout.get_nearest` and :meth:`~bids.layout.BIDSLayout.get_metadata`.
+    """
     run_data, metadata = {}, {}
 
-    run_data['motion_file'] = layout.get_nearest(
-        bids_file.path,
+    run_data['motion_file'] = get_nearest(
+        bold_file,
         strict=True,
         ignore_strict_entities=['space', 'res', 'den', 'desc', 'suffix', 'extension'],
         desc='confounds',
@@ -676,25 +733,25 @@ def collect_run_data(layout, bold_file, file_format, target_space):
         extension='.tsv',
     )
     if not run_data['motion_file']:
-        raise FileNotFoundError(f'No confounds file detected for {bids_file.path}')
+        raise FileNotFoundError(f'No confounds file detected for {bold_file}')
 
-    run_data['motion_json'] = layout.get_nearest(run_data['motion_file'], extension='.json')
+    run_data['motion_json'] = get_nearest(run_data['motion_file'], extension='.json')
 
-    metadata['bold_metadata'] = layout.get_metadata(bold_file)
+    metadata['bold_metadata'] = get_metadata(bold_file)
     # Ensure that we know the TR
     if 'RepetitionTime' not in metadata['bold_metadata'].keys():
         metadata['bold_metadata']['RepetitionTime'] = _get_tr(bold_file)
 
     if file_format == 'nifti':
-        run_data['boldref'] = layout.get_nearest(
-            bids_file.path,
+        run_data['boldref'] = get_nearest(
+            bold_file,
             strict=True,
             ignore_strict_entities=['desc', 'suffix'],
             suffix='boldref',
             extension=['.nii', '.nii.gz'],
         )
-        run_data['boldmask'] = layout.get_nearest(
-            bids_file.path,
+        run_data['boldmask'] = get_nearest(
+            bold_file,
             strict=True,
             ignore_strict_entities=['desc', 'suffix'],
             desc='brain',
@@ -707,8 +764,8 @@ def collect_run_data(layout, bold_file, file_format, target_space):
         if '+' in target_space:
             target_space, cohort = target_space.split('+')
 
-        run_data['boldref'] = layout.get_nearest(
-            bids_file.path,
+        run_data['boldref'] = get_nearest(
+            bold_file,
             strict=True,
             ignore_strict_entities=[
                 'cohort',
@@ -725,8 +782,8 @@ def collect_run_data(layout, bold_file, file_format, target_space):
             extension=['.nii', '.nii.gz'],
             invalid_filters='allow',
         )
-        run_data['boldmask'] = layout.get_nearest(
-            bids_file.path,
+        run_data['boldmask'] = get_nearest(
+            bold_file,
             strict=True,
             ignore_strict_entities=[
                 'cohort',
@@ -744,8 +801,8 @@ def collect_run_data(layout, bold_file, file_format, target_space):
             extension=['.nii', '.nii.gz'],
             invalid_filters='allow',
         )
-        run_data['nifti_file'] = layout.get_nearest(
-            bids_file.path,
+        run_data['nifti_file'] = get_nearest(
+            bold_file,
             strict=True,
             ignore_strict_entities=[
                 'cohort',
@@ -774,27 +831,138 @@ def collect_run_data(layout, bold_file, file_format, target_space):
 
     for k, v in run_data.items():
         if v is None:
-            raise FileNotFoundError(f'No {k} file found for {bids_file.path}')
+            raise FileNotFoundError(f'No {k} file found for {bold_file}')
 
-        metadata[f'{k}_metadata'] = layout.get_metadata(v)
+        metadata[f'{k}_metadata'] = get_metadata(v)
 
     run_data.update(metadata)
 
     return run_data
 
 
-def collect_confounds(
-    bold_file: str,
-    preproc_dataset: BIDSLayout,
-    derivatives_datasets: dict[str, Path | BIDSLayout] | None,
-    confound_spec: dict | None,
-):
-    """Gather confounds files from derivatives datasets and compose a cache."""
+class _LayoutFileIndex:
+    """In-memory index of the files, entities, and metadata of some subjects in a layout.
+
+    The index is built with a single database query, and provides :meth:`get_nearest` and
+    :meth:`get_metadata` methods that return the same results as the
+    corresponding :class:`~bids.layout.BIDSLayout` methods, for plain-valued filters.
+    """
+
+    def __init__(self, layout, subjects):
+        from collections import defaultdict
+
+        from bids.layout.models import Tag
+
+        self.layout = layout
+        self.path_entities = layout.get_entities(metadata=False).values()
+        self.entities = defaultdict(dict)
+        self.metadata = defaultdict(dict)
+
+        subject_files = layout.session.query(Tag.file_path).filter(
+            Tag.entity_name == 'subject',
+            Tag._value.in_(subjects),
+        )
+        for tag in layout.session.query(Tag).filter(Tag.file_path.in_(subject_files)):
+            self.entities[tag.file_path][tag.entity_name] = tag.value
+            if tag.is_metadata:
+                self.metadata[tag.file_path][tag.entity_name] = tag.value
+
+        # PyBIDS returns query results sorted by path
+        self.entities = dict(sorted(self.entities.items()))
+
+    def get_nearest(self, path, strict=True, ignore_strict_entities='extension', **filters):
+        """Find the nearest matching file, as in :meth:`~bids.layout.BIDSLayout.get_nearest`."""
+        path = str(Path(path).absolute())
+        filters.pop('invalid_filters', None)
+        if not filters.get('suffix'):
+            filters['suffix'] = self.entities[path]['suffix']
+
+        # Entities are read from the path itself, rather than from the index
+        entities = {}
+        for entity in self.path_entities:
+            match = entity.regex.search(path)
+            if match:
+                entities[entity.name] = entity._astype(match.group(1))
+
+        if strict and ignore_strict_entities is not None:
+            for entity in listify(ignore_strict_entities):
+                entities.pop(entity, None)
+
+        folders = {}
+        for candidate, candidate_entities in self.entities.items():
+            if _matches_query(candidate_entities, filters):
+                folders.setdefault(os.path.dirname(candidate), []).append(candidate)
+
+        # Only the nearest folder with candidate files is searched
+        while path not in folders:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+        matches = []
+        for candidate in folders[path]:
+            candidate_entities = self.entities[candidate]
+            shared = set(entities.keys()) & set(candidate_entities.keys())
+            n_matches = sum(entities[k] == candidate_entities[k] for k in shared)
+            if strict and n_matches != len(shared):
+                continue
+
+            matches.append((candidate, n_matches))
+
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[0][0] if matches else None
+
+    def get_metadata(self, path):
+        """Get a file's metadata, as in :meth:`~bids.layout.BIDSLayout.get_metadata`."""
+        from bids.layout.utils import BIDSMetadata
+
+        if str(path) not in self.entities:
+            return self.layout.get_metadata(path)
+
+        metadata = BIDSMetadata(str(path))
+        metadata.update(self.metadata[str(path)])
+        return metadata
+
+
+# Layouts of derivatives datasets, keyed by dataset path and database directory.
+# Indexing large derivatives datasets is slow, so each one is only indexed once per process.
+_DERIVATIVES_LAYOUTS = {}
+
+
+def get_derivatives_layout(dataset_path, database_dir=None, participant_label=None):
+    """Get a layout for a derivatives dataset, indexing the dataset at most once per process.
+
+    Parameters
+    ----------
+    dataset_path : :obj:`str` or :obj:`~pathlib.Path`
+        Path to the dataset.
+    database_dir : :obj:`str` or :obj:`~pathlib.Path` or None, optional
+        Directory in which to persist the dataset's index.
+        If an index for the dataset already exists there, it is reused instead of
+        re-indexing the dataset, so the index can be shared across processes and runs.
+        If None, the index is kept in memory.
+    participant_label : :obj:`list` of :obj:`str` or None, optional
+        Subjects to index. Other subjects' folders are skipped without being inspected.
+        If None, all subjects are indexed.
+
+    Returns
+    -------
+    layout : :obj:`~bids.layout.BIDSLayout`
+        The dataset's layout. The same object is returned for repeated calls.
+    """
+    import hashlib
     import re
 
-    from bids.layout.index import BIDSLayoutIndexer
+    from xcp_d.utils.bids_db import ScopedLayoutIndexer
+
+    dataset_path = os.path.abspath(str(dataset_path))
+    if participant_label is not None:
+        participant_label = tuple(sorted(set(participant_label)))
 
-    bold_file = preproc_dataset.get_file(bold_file)
+    key = (dataset_path, str(database_dir) if database_dir else None, participant_label)
+    if key in _DERIVATIVES_LAYOUTS:
+        return _DERIVATIVES_LAYOUTS[key]
 
     # Recommended after PyBIDS 12.1
     ignore_patterns = [
@@ -806,13 +974,98 @@ def collect_confounds(
             r'sub-[a-zA-Z0-9]+(/ses-[a-zA-Z0-9]+)?/(anat|beh|dwi|eeg|ieeg|meg|perf|pet|physio)'
         ),
     ]
-    _indexer = BIDSLayoutIndexer(
+    _indexer = ScopedLayoutIndexer(
+        labels=participant_label,
         validate=False,
         ignore=ignore_patterns,
         index_metadata=False,  # we don't need metadata to find confound files
     )
     xcp_d_config = str(load_data('xcp_d_bids_config2.json'))
+    layout_kwargs = {
+        'config': ['bids', 'derivatives', xcp_d_config],
+        'indexer': _indexer,
+    }
+
+    if database_dir:
+        # One database per dataset path (and set of subjects),
+        # so datasets with the same name don't collide.
+        path_key = dataset_path
+        if participant_label is not None:
+            path_key += ':' + ','.join(participant_label)
+
+        path_hash = hashlib.sha1(path_key.encode()).hexdigest()[:10]  # noqa: S324
+        database_path = (
+            Path(database_dir) / 'derivatives' / f'{os.path.basename(dataset_path)}_{path_hash}'
+        )
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+        # Concurrent processes must not index the same dataset into the same database.
+        with filelock.SoftFileLock(f'{database_path}.lock', timeout=600):
+            layout = BIDSLayout(
+                dataset_path,
+                database_path=database_path,
+                reset_database=not (database_path / 'layout_index.sqlite').is_file(),
+                **layout_kwargs,
+            )
+    else:
+        layout = BIDSLayout(dataset_path, **layout_kwargs)
+
+    _DERIVATIVES_LAYOUTS[key] = layout
+    return layout
+
+
+def collect_confounds(
+    bold_file: str,
+    preproc_dataset: BIDSLayout,
+    derivatives_datasets: dict[str, Path | BIDSLayout] | None,
+    confound_spec: dict | None,
+    database_dir: Path | str | None = None,
+):
+    """Gather confounds files from derivatives datasets and compose a cache.
+
+    See :func:`collect_confounds_for_runs` for details.
+    """
+    return collect_confounds_for_runs(
+        bold_files=[bold_file],
+        preproc_dataset=preproc_dataset,
+        derivatives_datasets=derivatives_datasets,
+        confound_spec=confound_spec,
+        database_dir=database_dir,
+    )[bold_file]
+
+
+def collect_confounds_for_runs(
+    bold_files: list[str],
+    preproc_dataset: BIDSLayout,
+    derivatives_datasets: dict[str, Path | BIDSLayout] | None,
+    confound_spec: dict | None,
+    database_dir: Path | str | None = None,
+):
+    """Gather confounds files from derivatives datasets for several BOLD runs at once.
+
+    Derivatives datasets are indexed once per process (see :func:`get_derivatives_layout`),
+    only for the runs' subjects,
+    and each confound's candidate files are queried once per subject,
+    then matched to the individual runs in memory.
 
+    Parameters
+    ----------
+    bold_files : :obj:`list` of :obj:`str`
+        Preprocessed BOLD files from the preprocessed dataset.
+    preproc_dataset : :obj:`~bids.layout.BIDSLayout`
+        Layout of the preprocessed dataset.
+    derivatives_datasets : :obj:`dict` or None
+        Dictionary of dataset names and paths or layouts, from ``--datasets``.
+    confound_spec : :obj:`dict`
+        The confounds configuration.
+    database_dir : :obj:`str` or :obj:`~pathlib.Path` or None, optional
+        Directory in which to persist the derivatives datasets' indices.
+
+    Returns
+    -------
+    confounds : :obj:`dict`
+        Dictionary with one entry per BOLD file, each of which maps confound names to
+        dictionaries with the confound file (``file``) and its metadata (``metadata``).
+    """
     # Step 0: Determine derivatives we care about for confounds.
     req_datasets = []
     for confound_def in confound_spec['confounds'].values():
@@ -820,6 +1073,11 @@ def collect_confounds(
 
     req_datasets = sorted(set(req_datasets))
 
+    bold_files_entities = {
+        bold_file: preproc_dataset.get_file(bold_file).get_entities() for bold_file in bold_files
+    }
+    subjects = sorted({entities['subject'] for entities in bold_files_entities.values()})
+
     # Step 1: Build a dictionary of dataset: layout pairs.
     layout_dict = {}
     layout_dict['preprocessed'] = preproc_dataset
@@ -831,10 +1089,10 @@ def collect_confounds(
                 continue
 
             if isinstance(v, Path | str):
-                layout = BIDSLayout(
+                layout = get_derivatives_layout(
                     v,
-                    config=['bids', 'derivatives', xcp_d_config],
-                    indexer=_indexer,
+                    database_dir=database_dir,
+                    participant_label=subjects,
                 )
                 desc = layout.get_dataset_description()
                 # Check for derivative or derivatives. The latter is a typo, but one that I've
@@ -848,7 +1106,7 @@ def collect_confounds(
                 layout_dict[k] = v
 
     # Step 2: Loop over the confounds spec and search for each file in the corresponding dataset.
-    confounds = {}
+    confounds = {bold_file: {} for bold_file in bold_files}
     for confound_name, confound_def in confound_spec['confounds'].items():
         if confound_def['dataset'] not in layout_dict.keys():
             raise ValueError(
@@ -857,23 +1115,75 @@ def collect_confounds(
             )
 
         layout = layout_dict[confound_def['dataset']]
-        bold_file_entities = bold_file.get_entities()
-        query = {**bold_file_entities, **confound_def['query']}
-        confound_file = layout.get(**query)
-        if not confound_file:
-            raise FileNotFoundError(
-                f'Could not find confound file for {confound_name} with query {query}'
-            )
+        # Collect the candidate files for every run in a single query.
+        candidates = None
+        if _is_simple_query(confound_def['query']):
+            candidates = [
+                (candidate, candidate.get_entities())
+                for candidate in layout.get(subject=subjects, **confound_def['query'])
+            ]
+
+        for bold_file, bold_file_entities in bold_files_entities.items():
+            query = {**bold_file_entities, **confound_def['query']}
+            if candidates is not None:
+                confound_file = [
+                    candidate
+                    for candidate, entities in candidates
+                    if _matches_query(entities, query)
+                ]
+            else:
+                confound_file = layout.get(**query)
+
+            if not confound_file:
+                raise FileNotFoundError(
+                    f'Could not find confound file for {confound_name} with query {query}'
+                )
 
-        confound_file = confound_file[0]
-        confound_metadata = confound_file.get_metadata()
-        confounds[confound_name] = {}
-        confounds[confound_name]['file'] = confound_file.path
-        confounds[confound_name]['metadata'] = confound_metadata
+            confound_file = confound_file[0]
+            confound_metadata = confound_file.get_metadata()
+            confounds[bold_file][confound_name] = {}
+            confounds[bold_file][confound_name]['file'] = confound_file.path
+            confounds[bold_file][confound_name]['metadata'] = confound_metadata
 
     return confounds
 
 
+def _is_simple_query(query):
+    """Determine if a query can be evaluated in memory by :func:`_matches_query`."""
+    for value in query.values():
+        for item in value if isinstance(value, list | tuple) else [value]:
+            if item is not None and not isinstance(item, str | int):
+                return False
+
+    return True
+
+
+def _matches_query(entities, query):
+    """Check if a file's entities match a PyBIDS-style query with plain values.
+
+    Lists match any of their values, and None matches files without the entity.
+    """
+    for entity, value in query.items():
+        values = list(value) if isinstance(value, list | tuple) else [value]
+        if None in values:
+            if entity not in entities:
+                continue
+            values = [v for v in values if v is not None]
+
+        if entity not in entities:
+            return False
+
+        file_value = entities[entity]
+        if entity == 'extension':
+            file_value = file_value.lstrip('.')
+            values = [str(v).lstrip('.') for v in values]
+
+        if not any(file_value == v or str(file_value) == str(v) for v in values):
+            return False
+
+    return True
+
+
 def write_derivative_description(
     fmri_dir,
     output_dir,
@@ -1077,8 +1387,10 @@ def _get_tr(img):
     ...    'sub-01_task-mixedgamblestask_run-02_space-fsLR_den-91k_bold.dtseries.nii'))
     2.0
     """
-    if isinstance(img, str):
-        img = nb.load(img)
+    if isinstance(img, str | Path):
+        from xcp_d.utils.probe import probe_file
+
+        return probe_file(img)['tr']
 
     try:
         return img.header.matrix.get_index_map(0).series_step  # Get TR
@@ -0,0 +1,458 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""A shared, incrementally refreshed cache of PyBIDS database indices.
+
+Indexing a large derivatives dataset is one of the slowest parts of workflow construction,
+and XCP-D is typically run once per participant.
+The functions in this module keep one small index per subject of a dataset
+(and per indexing configuration) in a cache directory that may be shared across invocations.
+Subjects are only re-indexed when the modification times of their files change,
+and each invocation merges the indices of the subjects it needs into its own database.
+
+Cached indices are replaced atomically and never modified in place,
+so many jobs can read them concurrently.
+
+This module also provides :class:`ScopedLayoutIndexer`, which only indexes the subjects
+(or atlases) that are needed, without inspecting the rest of the dataset.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from contextlib import ExitStack
+from pathlib import Path
+
+from bids.layout.index import BIDSLayoutIndexer
+from nipype import logging
+
+LOGGER = logging.getLogger('nipype.utils')
+
+DATABASE_FILE = 'layout_index.sqlite'
+#: Seconds to wait for the lock of a subject's cached index.
+DATABASE_LOCK_TIMEOUT = 600
+
+
+class ScopedLayoutIndexer(BIDSLayoutIndexer):
+    """A PyBIDS indexer that only indexes the entries of some subjects (or atlases).
+
+    Folders and files named after an entity (e.g., ``sub-<label>``) are only indexed
+    if their label is one of the requested ones, at any depth of the dataset
+    (e.g., ``sourcedata/freesurfer/sub-<label>``).
+    Unlike an ``ignore`` pattern, the other entries are skipped based on their names alone,
+    so they are never inspected, which matters for datasets with thousands of subjects.
+
+    Parameters
+    ----------
+    labels : :obj:`list` of :obj:`str` or None, optional
+        Labels of the entries to index. If None, all entries are indexed.
+    entity_prefix : :obj:`str`, optional
+        The prefix of the entity used to name the entries. Default is "sub".
+    **kwargs
+        Passed to :class:`~bids.layout.index.BIDSLayoutIndexer`.
+    """
+
+    def __init__(self, labels=None, entity_prefix='sub', **kwargs):
+        super().__init__(**kwargs)
+        self.labels = None if labels is None else {str(label) for label in labels}
+        self.entity_prefix = entity_prefix
+
+    def _in_scope(self, name):
+        """Determine if an entry should be indexed, based on its name."""
+        if self.labels is None:
+            return True
+
+        label = _get_label(name, self.entity_prefix)
+        return label is None or label in self.labels
+
+    def _index_dir(self, path, config, force=None):
+        if self.labels is None:
+            return super()._index_dir(path, config, force=force)
+
+        # Each folder is handled as in BIDSLayoutIndexer._index_dir,
+        # but out-of-scope entries are dropped before they are inspected.
+        from bids.layout.index import _validate_path
+        from bids.layout.models import Config
+
+        root_path = Path(self._layout._root.path)
+        abs_path = root_path / Path(path.path).relative_to(root_path)
+
+        # Derivative directories must always be added separately
+        if root_path.joinpath('derivatives') in abs_path.parents:
+            return [], []
+
+        config = list(config)
+        if (abs_path / self.config_filename).exists():
+            config.append(Config.load(abs_path / self.config_filename, session=self.session))
+
+        config_entities = {}
+        for config_item in config:
+            config_entities.update(config_item.entities)
+
+        with os.scandir(abs_path) as entries:
+            names = sorted(entry.name for entry in entries if self._in_scope(entry.name))
+
+        all_bfs, all_tag_dicts, dirnames = [], [], []
+        for name in names:
+            entry = path / name
+            if entry.is_dir() and Path(name).suffix != '.zarr':
+                dirnames.append(entry)
+            elif name != self.config_filename and (force or self._validate_file(entry)):
+                bf, tag_dicts = self._index_file(entry, config_entities)
+                all_bfs.append(bf)
+                all_tag_dicts += tag_dicts
+
+        for entry in dirnames:
+            dir_force = _validate_path(
+                entry,
+                incl_patt=self._include_patterns,
+                excl_patt=self._exclude_patterns,
+                root=self._layout._root,
+            )
+            if dir_force is not False:
+                dir_bfs, dir_tag_dicts = self._index_dir(entry, config, force=dir_force)
+                all_bfs += dir_bfs
+                all_tag_dicts += dir_tag_dicts
+
+        return all_bfs, all_tag_dicts
+
+
+def _get_label(name, entity_prefix='sub'):
+    """Get the label of a file or folder named after an entity (e.g., ``sub-<label>``)."""
+    prefix = f'{entity_prefix}-'
+    if not name.startswith(prefix):
+        return None
+
+    return re.split(r'[._]', name[len(prefix) :], maxsplit=1)[0]
+
+
+def _get_path_subject(relpath):
+    """Get the subject that a path, relative to the dataset, belongs to, if any."""
+    for part in Path(relpath).parts:
+        subject = _get_label(part)
+        if subject is not None:
+            return subject
+
+    return None
+
+
+def get_cached_database(
+    dataset_dir,
+    cache_dir,
+    database_dir,
+    config,
+    ignore,
+    participant_label=None,
+):
+    """Build a PyBIDS database for some subjects of a dataset from a shared cache.
+
+    Parameters
+    ----------
+    dataset_dir : :obj:`str` or :obj:`~pathlib.Path`
+        Path to the BIDS dataset.
+    cache_dir : :obj:`str` or :obj:`~pathlib.Path`
+        Directory in which the subjects' indices are cached.
+    database_dir : :obj:`str` or :obj:`~pathlib.Path`
+        Directory in which to write the database.
+    config : :obj:`list` of :obj:`str`
+        PyBIDS configurations (names or paths to JSON files) used to index the dataset.
+    ignore : :obj:`list` of :obj:`str` or :obj:`re.Pattern`
+        Patterns of files and folders to ignore when indexing the dataset.
+    participant_label : :obj:`list` of :obj:`str` or None, optional
+        Subjects to include in the database. If None, all subjects in the dataset are included.
+
+    Returns
+    -------
+    database_dir : :obj:`~pathlib.Path`
+        Directory containing the database, to be passed to :class:`~bids.layout.BIDSLayout`
+        as ``database_path``, with ``reset_database=False``.
+    """
+    import filelock
+
+    dataset_dir = Path(dataset_dir).absolute()
+    database_dir = Path(database_dir)
+    database_dir.mkdir(parents=True, exist_ok=True)
+    database_file = database_dir / DATABASE_FILE
+    if database_file.exists():
+        database_file.unlink()
+
+    subjects = participant_label
+    if subjects is None:
+        subjects = [path.name[4:] for path in dataset_dir.glob('sub-*') if path.is_dir()]
+
+    subjects = sorted(set(subjects))
+    if not subjects:
+        # Nothing worth caching
+        _index_subjects(dataset_dir, database_dir, config, ignore, subjects)
+        return database_dir
+
+    cache_key = _get_cache_key(dataset_dir, config, ignore)
+    key_dir = Path(cache_dir) / f'{dataset_dir.name}_{cache_key}'
+    key_dir.mkdir(parents=True, exist_ok=True)
+    root_fingerprint, subject_fingerprints = _fingerprint_dataset(dataset_dir, subjects, ignore)
+
+    try:
+        with ExitStack() as stack:
+            # Locks are always acquired in the same (sorted) order, to avoid deadlocks.
+            for subject in subjects:
+                stack.enter_context(
+                    filelock.SoftFileLock(
+                        str(key_dir / f'sub-{subject}.lock'), timeout=DATABASE_LOCK_TIMEOUT
+                    )
+                )
+
+            fingerprints, stale = {}, []
+            for subject in subjects:
+                fingerprints[subject] = {
+                    'root': root_fingerprint,
+                    'subject': subject_fingerprints[subject],
+                }
+                manifest_file = key_dir / f'sub-{subject}.json'
+                if (
+                    not (key_dir / f'sub-{subject}.sqlite').is_file()
+                    or not manifest_file.is_file()
+                    or json.loads(manifest_file.read_text()) != fingerprints[subject]
+                ):
+                    stale.append(subject)
+
+            if stale:
+                LOGGER.info(f'Indexing {len(stale)} subject(s) of {dataset_dir}')
+                fresh_dir = Path(tempfile.mkdtemp(prefix='.fresh-', dir=key_dir))
+                try:
+                    _index_subjects(dataset_dir, fresh_dir, config, ignore, stale)
+                    for subject in stale:
+                        tmp_file = fresh_dir / f'sub-{subject}.sqlite'
+                        _extract_subject(fresh_dir / DATABASE_FILE, tmp_file, dataset_dir, subject)
+                        os.replace(tmp_file, key_dir / f'sub-{subject}.sqlite')
+                        _write_json(key_dir / f'sub-{subject}.json', fingerprints[subject])
+                finally:
+                    shutil.rmtree(fresh_dir, ignore_errors=True)
+
+            shutil.copyfile(key_dir / f'sub-{subjects[0]}.sqlite', database_file)
+            _merge_databases(
+                database_file,
+                [key_dir / f'sub-{subject}.sqlite' for subject in subjects[1:]],
+            )
+    except filelock.Timeout as err:
+        # Most likely left behind by a job that was killed while indexing.
+        LOGGER.warning(
+            f'Could not acquire the lock {err.lock_file}. '
+            f'Indexing {dataset_dir} without the cache in {cache_dir}.'
+        )
+        _index_subjects(dataset_dir, database_dir, config, ignore, subjects)
+
+    return database_dir
+
+
+def _get_cache_key(dataset_dir, config, ignore):
+    """Build a cache key from the dataset path and the indexing configuration."""
+    import bids
+
+    config_contents = []
+    for config_item in config:
+        if os.path.isfile(config_item):
+            config_contents.append(Path(config_item).read_text())
+        else:
+            config_contents.append(config_item)
+
+    ignore_patterns = [
+        pattern.pattern if isinstance(pattern, re.Pattern) else str(pattern) for pattern in ignore
+    ]
+    key = json.dumps([str(dataset_dir), config_contents, ignore_patterns, bids.__version__])
+    return hashlib.sha256(key.encode()).hexdigest()[:10]
+
+
+def _fingerprint_dataset(dataset_dir, subjects, ignore=None):
+    """Summarize the modification times of the files that determine the subjects' indices.
+
+    Files outside of subjects' folders (e.g., inherited sidecars) can affect every subject's
+    index, so they make up a separate fingerprint.
+    Subjects' folders are found at any depth (e.g., ``sourcedata/freesurfer/sub-<label>``),
+    and the folders of other subjects are never walked.
+
+    Parameters
+    ----------
+    dataset_dir : :obj:`~pathlib.Path`
+        Path to the BIDS dataset.
+    subjects : :obj:`list` of :obj:`str`
+        The subjects to summarize.
+    ignore : :obj:`list` of :obj:`str` or :obj:`re.Pattern`, optional
+        Patterns of files and folders that are not indexed, as passed to the indexer.
+
+    Returns
+    -------
+    root_fingerprint : :obj:`str`
+    subject_fingerprints : :obj:`dict`
+        The fingerprint of each subject.
+    """
+    patterns = _compile_patterns(ignore)
+    root_files, subject_entries = [], {subject: [] for subject in subjects}
+    for root, dirnames, filenames in os.walk(dataset_dir):
+        if Path(root) == dataset_dir:
+            # Derivatives are indexed separately
+            dirnames[:] = [name for name in dirnames if name != 'derivatives']
+
+        kept_dirnames = []
+        for name in dirnames + filenames:
+            path = Path(root) / name
+            if _is_ignored(dataset_dir, path, patterns):
+                continue
+
+            subject = _get_label(name)
+            if subject is not None:
+                if subject in subject_entries:
+                    subject_entries[subject].append(path)
+            elif name in dirnames:
+                kept_dirnames.append(name)
+            else:
+                root_files.append(path)
+
+        dirnames[:] = kept_dirnames
+
+    root_fingerprint = _fingerprint(dataset_dir, root_files, patterns)
+    subject_fingerprints = {
+        subject: _fingerprint(dataset_dir, paths, patterns)
+        for subject, paths in subject_entries.items()
+    }
+    return root_fingerprint, subject_fingerprints
+
+
+def _compile_patterns(ignore):
+    """Compile ignore patterns as :class:`~bids.layout.index.BIDSLayoutIndexer` does."""
+    from bids.layout.index import _regexfy
+
+    return [_regexfy(pattern) for pattern in (ignore or [])]
+
+
+def _is_ignored(dataset_dir, path, patterns):
+    """Check if a path matches an ignore pattern, relative to the dataset's root."""
+    relpath = '/' + Path(os.path.relpath(path, dataset_dir)).as_posix()
+    return any(pattern.search(relpath) for pattern in patterns)
+
+
+def _fingerprint(dataset_dir, paths, patterns):
+    """Hash the relative paths, modification times, and sizes of the files under paths.
+
+    Only files are summarized, since the modification times of folders change
+    whenever an entry is added to them, even if it is not indexed.
+    """
+    entries = []
+    for path in paths:
+        if path.is_dir():
+            for root, dirnames, files in os.walk(path):
+                dirnames[:] = [
+                    name
+                    for name in dirnames
+                    if not _is_ignored(dataset_dir, Path(root) / name, patterns)
+                ]
+                for name in files:
+                    file_path = Path(root) / name
+                    if _is_ignored(dataset_dir, file_path, patterns):
+                        continue
+
+                    stat = os.stat(file_path)
+                    entries.append(
+                        (
+                            os.path.relpath(file_path, dataset_dir),
+                            stat.st_mtime_ns,
+                            stat.st_size,
+                        )
+                    )
+        elif path.exists():
+            stat = path.stat()
+            entries.append((os.path.relpath(path, dataset_dir), stat.st_mtime_ns, stat.st_size))
+
+    return hashlib.sha256(json.dumps(sorted(entries)).encode()).hexdigest()
+
+
+def _index_subjects(dataset_dir, database_dir, config, ignore, subjects):
+    """Index the top level of a dataset and a subset of its subjects into a new database."""
+    from bids.layout import BIDSLayout
+
+    BIDSLayout(
+        str(dataset_dir),
+        database_path=database_dir,
+        reset_database=True,
+        indexer=ScopedLayoutIndexer(labels=subjects or None, validate=False, ignore=ignore),
+        config=config,
+    )
+
+
+def _extract_subject(source_file, out_file, dataset_dir, subject):
+    """Copy the index of one subject, and of the rest of the dataset, to a new database."""
+    connection = sqlite3.connect(out_file)
+    try:
+        connection.execute('ATTACH DATABASE ? AS source', (str(source_file),))
+        # Tables must be created before their indices
+        schema = connection.execute(
+            'SELECT sql FROM source.sqlite_master WHERE sql IS NOT NULL ORDER BY type DESC'
+        ).fetchall()
+        for (statement,) in schema:
+            connection.execute(statement)
+
+        # Keep the files of this subject, and the files that do not belong to any subject,
+        # whether the subjects' folders are at the top level or deeper in the dataset.
+        connection.create_function(
+            'get_subject',
+            1,
+            lambda path: _get_path_subject(os.path.relpath(path, dataset_dir)),
+            deterministic=True,
+        )
+        connection.execute(
+            'CREATE TEMP TABLE keep AS SELECT path FROM source.files '
+            'WHERE get_subject(path) IS NULL OR get_subject(path) = ?',
+            (subject,),
+        )
+        for statement in (
+            'INSERT INTO main.layout_info SELECT * FROM source.layout_info',
+            'INSERT INTO main.configs SELECT * FROM source.configs',
+            'INSERT INTO main.entities SELECT * FROM source.entities',
+            'INSERT INTO main.config_to_entity_map SELECT * FROM source.config_to_entity_map',
+            'INSERT INTO main.files SELECT * FROM source.files WHERE path IN temp.keep',
+            'INSERT INTO main.tags SELECT * FROM source.tags WHERE file_path IN temp.keep',
+            (
+                'INSERT INTO main.associations SELECT * FROM source.associations '
+                'WHERE src IN temp.keep AND dst IN temp.keep'
+            ),
+        ):
+            connection.execute(statement)
+
+        connection.commit()
+        connection.execute('DETACH DATABASE source')
+    finally:
+        connection.close()
+
+
+def _merge_databases(database_file, other_files):
+    """Add the indices in other databases to a database.
+
+    Files shared by several databases (i.e., top-level files) are only added once.
+    """
+    connection = sqlite3.connect(database_file)
+    try:
+        for other_file in other_files:
+            connection.execute('ATTACH DATABASE ? AS other', (str(other_file),))
+            for statement in (
+                'INSERT OR IGNORE INTO main.entities SELECT * FROM other.entities',
+                'INSERT OR IGNORE INTO main.files SELECT * FROM other.files',
+                'INSERT OR IGNORE INTO main.tags SELECT * FROM other.tags',
+                'INSERT OR IGNORE INTO main.associations SELECT * FROM other.associations',
+            ):
+                connection.execute(statement)
+
+            connection.commit()
+            connection.execute('DETACH DATABASE other')
+    finally:
+        connection.close()
+
+
+def _write_json(out_file, content):
+    """Write a JSON file atomically."""
+    tmp_file = f'{out_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as fobj:
+        json.dump(content, fobj, indent=4, sort_keys=True)
+
+    os.replace(tmp_file, out_file)
@@ -2,17 +2,23 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 """Functions for concatenating scans across runs."""
 
-import os
+import operator
 from contextlib import suppress
+from functools import reduce
 
 import nibabel as nb
 import numpy as np
 import pandas as pd
-from nilearn.image import concat_imgs
+from nibabel.openers import ImageOpener
 from nipype import logging
 
+from xcp_d.utils.probe import probe_file
+
 LOGGER = logging.getLogger('nipype.interface')
 
+# Number of volumes copied at once when concatenating NIfTI images.
+CONCATENATION_BLOCK_SIZE = 100
+
 
 def concatenate_tsvs(tsv_files, out_file):
     """Concatenate framewise displacement time series across files.
@@ -44,6 +50,9 @@ def concatenate_tsvs(tsv_files, out_file):
 def concatenate_niimgs(files, out_file):
     """Concatenate niimgs.
 
+    Runs are copied into the output one at a time, so the full set of runs is never
+    held in memory at once.
+
     Parameters
     ----------
     files : :obj:`list` of :obj:`str`
@@ -56,7 +65,211 @@ def concatenate_niimgs(files, out_file):
         is_nifti = isinstance(nb.load(files[0]), nb.Nifti1Image)
 
     if is_nifti:
-        concat_preproc_img = concat_imgs(files)
-        concat_preproc_img.to_filename(out_file)
+        _concatenate_niftis(files, out_file)
+    else:
+        _concatenate_ciftis(files, out_file)
+
+    return out_file
+
+
+def _concatenate_niftis(files, out_file, block_size=CONCATENATION_BLOCK_SIZE):
+    """Stream NIfTI images into a single 4D image, a block of volumes at a time.
+
+    The output header is built from the first image, and the data are written as float32,
+    as in :func:`nilearn.image.concat_imgs`.
+    """
+    first_img = nb.load(files[0])
+    spatial_shape = first_img.shape[:3]
+    n_volumes = []
+    for file_ in files:
+        info = probe_file(file_)
+        if info['shape'][:3] != spatial_shape:
+            raise ValueError(
+                f'Image {file_} has shape {info["shape"]}, '
+                f'which does not match {files[0]} ({first_img.shape}).'
+            )
+
+        n_volumes.append(info['n_volumes'])
+
+    out_header = first_img.header.copy()
+    out_header.set_data_shape(spatial_shape + (sum(n_volumes),))
+    out_header.set_data_dtype(np.float32)
+    out_header.set_slope_inter(None, None)
+    out_header.set_data_offset(0)
+    dtype = out_header.get_data_dtype()
+
+    with ImageOpener(out_file, 'wb') as fobj:
+        out_header.write_to(fobj)
+        fobj.write(b'\x00' * (out_header.get_data_offset() - fobj.tell()))
+
+        for file_, run_volumes in zip(files, n_volumes, strict=True):
+            img = nb.load(file_)
+            if not np.allclose(img.affine, first_img.affine):
+                raise ValueError(f'Affine of {file_} does not match that of {files[0]}.')
+
+            if img.ndim == 3:
+                fobj.write(np.asanyarray(img.dataobj, dtype=dtype).tobytes('F'))
+                continue
+
+            for start in range(0, run_volumes, block_size):
+                block = img.dataobj[..., start : start + block_size]
+                # NIfTI data are stored in Fortran order, so volumes are contiguous on disk.
+                fobj.write(np.asanyarray(block, dtype=dtype).tobytes('F'))
+
+    return out_file
+
+
+def _concatenate_ciftis(files, out_file):
+    """Concatenate CIFTI files along the row (e.g., time) axis with nibabel.
+
+    The output array is preallocated from the headers and filled one run at a time.
+    The row axes are combined with nibabel's axis concatenation,
+    so series axes keep the first file's start time and step.
+    """
+    imgs = [nb.load(file_) for file_ in files]
+    first_img = imgs[0]
+    column_axis = first_img.header.get_axis(1)
+    for file_, img in zip(files, imgs, strict=True):
+        if img.header.get_axis(1) != column_axis:
+            raise ValueError(f'Columns of {file_} do not match those of {files[0]}.')
+
+    row_axis = reduce(operator.add, (img.header.get_axis(0) for img in imgs))
+    out_data = np.empty((len(row_axis), len(column_axis)), dtype=np.float32)
+    start = 0
+    for img in imgs:
+        stop = start + img.shape[0]
+        out_data[start:stop] = np.asanyarray(img.dataobj, dtype=np.float32)
+        start = stop
+
+    out_img = nb.Cifti2Image(
+        out_data,
+        header=(row_axis, column_axis),
+        nifti_header=first_img.nifti_header,
+    )
+    out_img.nifti_header.set_intent(first_img.nifti_header.get_intent()[0])
+    out_img.to_filename(out_file)
+    return out_file
+
+
+def compute_correlation_accumulators(in_file, temporal_mask=None):
+    """Compute running sums for the correlations of one run's parcellated time series.
+
+    The sums are restricted to low-motion volumes and are computed pairwise,
+    so parcels with missing values (e.g., due to low coverage) are handled like
+    :meth:`pandas.DataFrame.corr` handles them in the concatenated time series.
+
+    Parameters
+    ----------
+    in_file : :obj:`str`
+        Parcellated time series, either as a TSV file or as a ptseries CIFTI file.
+    temporal_mask : :obj:`str` or None, optional
+        Temporal mask TSV file. Volumes with a nonzero ``framewise_displacement``
+        value are excluded from the sums.
+
+    Returns
+    -------
+    accumulators : :obj:`dict`
+        Dictionary with the parcel names (``node_names``) and the following arrays,
+        each of shape (n_parcels, n_parcels):
+
+        -   ``count``: number of volumes in which both parcels are defined
+        -   ``sum``: sum of the row parcel's values over those volumes
+        -   ``sum_sq``: sum of the squared row parcel's values over those volumes
+        -   ``cross``: sum of the products of both parcels' values over those volumes
+    """
+    from xcp_d.utils.utils import get_col
+
+    if in_file.endswith('.ptseries.nii'):
+        img = nb.load(in_file)
+        node_names = list(img.header.get_axis(1).name)
+        data = np.asanyarray(img.dataobj, dtype=np.float64)
     else:
-        os.system(f'wb_command -cifti-merge {out_file} -cifti {" -cifti ".join(files)}')  # noqa: S605
+        timeseries_df = pd.read_table(in_file)
+        node_names = timeseries_df.columns.tolist()
+        data = timeseries_df.to_numpy(dtype=np.float64)
+
+    if temporal_mask:
+        censoring_df = pd.read_table(temporal_mask)
+        if censoring_df.shape[0] == data.shape[0]:
+            data = data[get_col(censoring_df, 'framewise_displacement').to_numpy() == 0]
+
+    valid = np.isfinite(data)
+    values = np.where(valid, data, 0)
+    valid = valid.astype(np.float64)
+    return {
+        'node_names': np.array(node_names, dtype=str),
+        'count': valid.T @ valid,
+        'sum': values.T @ valid,
+        'sum_sq': (values**2).T @ valid,
+        'cross': values.T @ values,
+    }
+
+
+def save_correlation_accumulators(accumulators, out_file):
+    """Write correlation accumulators to an uncompressed NumPy archive."""
+    np.savez(out_file, **accumulators)
+    return out_file
+
+
+def load_correlation_accumulators(in_file):
+    """Read correlation accumulators from a NumPy archive."""
+    with np.load(in_file, allow_pickle=False) as archive:
+        return {key: archive[key] for key in archive.files}
+
+
+def combine_correlation_accumulators(accumulators):
+    """Add up correlation accumulators from several runs.
+
+    Parameters
+    ----------
+    accumulators : :obj:`list` of :obj:`dict`
+        Accumulators from :func:`compute_correlation_accumulators`,
+        in the order the runs are concatenated.
+
+    Returns
+    -------
+    combined : :obj:`dict`
+        The summed accumulators.
+    """
+    combined = {key: value.copy() for key, value in accumulators[0].items()}
+    for run_accumulators in accumulators[1:]:
+        if not np.array_equal(run_accumulators['node_names'], combined['node_names']):
+            raise ValueError('Parcel names do not match across runs.')
+
+        for key in ('count', 'sum', 'sum_sq', 'cross'):
+            combined[key] += run_accumulators[key]
+
+    return combined
+
+
+def finalize_correlations(accumulators):
+    """Compute Pearson correlations from (combined) correlation accumulators.
+
+    Parameters
+    ----------
+    accumulators : :obj:`dict`
+        Accumulators from :func:`compute_correlation_accumulators`
+        or :func:`combine_correlation_accumulators`.
+
+    Returns
+    -------
+    correlations_df : :obj:`pandas.DataFrame`
+        Square correlation matrix, indexed by parcel name.
+        Parcel pairs with fewer than two shared volumes or no variance are set to NaN.
+    """
+    count = accumulators['count']
+    sums = accumulators['sum']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = accumulators['cross'] - (sums * sums.T) / count
+        variance = accumulators['sum_sq'] - (sums**2) / count
+        correlations = covariance / np.sqrt(variance * variance.T)
+
+    bad = (count < 2) | (variance <= 0) | (variance.T <= 0)
+    correlations[bad] = np.nan
+    correlations = np.clip(correlations, -1, 1)
+    # The diagonal is exactly one wherever the parcel has variance.
+    diagonal = np.diag_indices_from(correlations)
+    correlations[diagonal] = np.where(np.isnan(correlations[diagonal]), np.nan, 1)
+
+    node_names = accumulators['node_names'].tolist()
+    return pd.DataFrame(correlations, index=node_names, columns=node_names)
@@ -8,47 +8,88 @@ from nipype import logging
 LOGGER = logging.getLogger('nipype.utils')
 
 
-def plot_gii(mesh, coord, color, slicer, view, max_distance=10.0):
-    _ax = slicer.axes[list(slicer.axes.keys())[0]]
-
-    if view == 'x':
-        plane_origin = [coord, 0, 0]
-        plane_normal = [1, 0, 0]  # Normal for the sagittal plane
-    elif view == 'y':
-        plane_origin = [0, coord, 0]
-        plane_normal = [0, 1, 0]  # Normal for the coronal plane
+def section_mesh(vertices, faces, offsets, axis=0):
+    """Intersect a triangle mesh with a stack of parallel planes in one sweep.
+
+    Each triangle is only visited for the planes that cross it,
+    so the cost scales with the number of intersections rather than with
+    the number of planes times the size of the mesh.
+
+    Parameters
+    ----------
+    vertices : (V, 3) array_like
+        Vertex coordinates.
+    faces : (F, 3) array_like of int
+        Triangle indices.
+    offsets : (P,) array_like
+        Positions of the planes along ``axis``.
+    axis : int or (3,) array_like, optional
+        Axis normal to the planes, or the normal vector of oblique planes,
+        in which case the offsets are distances from the origin along the normal.
+        Default is 0 (sagittal planes for RAS coordinates).
+
+    Returns
+    -------
+    segments : (S, 2, 3) numpy.ndarray
+        End points of the line segments, grouped by plane.
+    indptr : (P + 1,) numpy.ndarray
+        The segments of plane ``i`` are ``segments[indptr[i]:indptr[i + 1]]``.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces, dtype=int)
+    offsets = np.asarray(offsets, dtype=float)
+    order = np.argsort(offsets, kind='stable')
+    sorted_offsets = offsets[order]
+
+    # Project the vertices on the normal once, then share them across the triangles
+    if np.ndim(axis) == 0:
+        projections = vertices[:, axis]
     else:
-        plane_origin = [0, 0, coord]
-        plane_normal = [0, 0, 1]  # Normal for the axial plane
-
-    # Use trimesh to find the intersection of the mesh and the plane
-    slice_section = mesh.section(plane_origin=plane_origin, plane_normal=plane_normal)
-    if slice_section is None:
-        return
-
-    for disc in slice_section.discrete:
-        temp = disc
-        # Check that there aren't defects in the Line
-        differences = np.abs(np.diff(temp, axis=0))
-        if np.any(differences.max(axis=0) > max_distance):
-            continue
-        if view == 'x':
-            _ax.ax.plot(temp[:, 1], temp[:, 2], color=color)
-        elif view == 'y':
-            _ax.ax.plot(temp[:, 0], temp[:, 2], color=color)
-        else:
-            _ax.ax.plot(temp[:, 0], temp[:, 1], color=color)
-
-
-def get_mesh(filename):
+        normal = np.asarray(axis, dtype=float)
+        projections = vertices @ (normal / np.linalg.norm(normal))
+
+    # A plane crosses a triangle if it lies in [lowest vertex, highest vertex)
+    heights = projections[faces]
+    first = np.searchsorted(sorted_offsets, heights.min(axis=1), side='left')
+    last = np.searchsorted(sorted_offsets, heights.max(axis=1), side='left')
+    counts = last - first
+    i_triangle = np.repeat(np.arange(faces.shape[0]), counts)
+    starts = np.cumsum(counts) - counts
+    i_plane = np.repeat(first - starts, counts) + np.arange(counts.sum())
+
+    # Exactly two of the three edges of every (triangle, plane) pair cross the plane
+    edge_starts, edge_ends = np.array([0, 1, 2]), np.array([1, 2, 0])
+    offset = sorted_offsets[i_plane][:, None]
+    tri_heights = heights[i_triangle]
+    below = tri_heights <= offset
+    crosses = below[:, edge_starts] != below[:, edge_ends]
+    start_heights, end_heights = tri_heights[:, edge_starts], tri_heights[:, edge_ends]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(crosses, (offset - start_heights) / (end_heights - start_heights), 0)
+
+    tri_vertices = vertices[faces[i_triangle]]
+    points = tri_vertices[:, edge_starts] + weights[..., None] * (
+        tri_vertices[:, edge_ends] - tri_vertices[:, edge_starts]
+    )
+    crossing_edges = np.argsort(~crosses, axis=1, kind='stable')[:, :2]
+    segments = np.take_along_axis(points, crossing_edges[..., None], axis=1)
+
+    # Group the segments by plane, in the original order of the offsets
+    i_plane = order[i_plane]
+    segments = segments[np.argsort(i_plane, kind='stable')]
+    indptr = np.zeros(offsets.size + 1, dtype=int)
+    indptr[1:] = np.cumsum(np.bincount(i_plane, minlength=offsets.size))
+    return segments, indptr
+
+
+def load_surface(filename):
+    """Load the vertices and faces of a GIFTI surface file."""
     import nibabel as nb
-    import trimesh
 
     img = nb.load(filename)
-    vertices = img.darrays[0].data  # Vertex coordinates
-    faces = img.darrays[1].data  # Triangle indices
-    mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-    return mesh
+    vertices = img.agg_data('NIFTI_INTENT_POINTSET')
+    faces = img.agg_data('NIFTI_INTENT_TRIANGLE')
+    return vertices, faces
 
 
 def make_mosaic(png_files):
@@ -60,31 +101,55 @@ def make_mosaic(png_files):
     """
     import os
 
-    import numpy as np
     from PIL import Image  # for BrainSprite
 
+    from xcp_d.utils.execsummary import assemble_mosaic
+
     mosaic_file = os.path.abspath('mosaic.png')
-    files = png_files[::-1]  # we want last first, I guess?
+    images = []
+    for file_ in png_files:
+        # Get relative path to file, from user's home folder
+        with Image.open(os.path.expanduser(file_)) as img:
+            img.load()
+            images.append(img)
+
+    assemble_mosaic(images).save(mosaic_file, 'PNG', quality=95)
+    return mosaic_file
+
+
+def assemble_mosaic(images, image_dim=218):
+    """Arrange in-memory slice images in a square BrainSprite mosaic.
+
+    Parameters
+    ----------
+    images : :obj:`list` of :obj:`PIL.Image.Image`
+        The slice images, in slice order.
+    image_dim : :obj:`int`, optional
+        Size of each tile of the mosaic, in pixels.
+        Larger images are shrunk to fit, preserving their aspect ratio.
 
-    IMAGE_DIM = 218
-    images_per_side = int(np.ceil(np.sqrt(len(files))))
-    square_dim = IMAGE_DIM * images_per_side
+    Returns
+    -------
+    mosaic : :obj:`PIL.Image.Image`
+    """
+    from PIL import Image
+
+    images = images[::-1]  # we want last first, I guess?
+    images_per_side = int(np.ceil(np.sqrt(len(images))))
+    square_dim = image_dim * images_per_side
     result = Image.new('RGB', (square_dim, square_dim), color=1)
 
-    for index, file_ in enumerate(files):
-        # Get relative path to file, from user's home folder
-        path = os.path.expanduser(file_)
-        with Image.open(path) as img:
-            # img = img.transpose(Image.FLIP_LEFT_RIGHT)
-            img.thumbnail((IMAGE_DIM, IMAGE_DIM), resample=Image.Resampling.LANCZOS)
+    for index, img in enumerate(images):
+        if max(img.size) > image_dim:
+            img = img.copy()
+            img.thumbnail((image_dim, image_dim), resample=Image.Resampling.LANCZOS)
 
-            x = index % images_per_side * IMAGE_DIM
-            y = index // images_per_side * IMAGE_DIM
-            w, h = img.size
-            result.paste(img, (x, y, x + w, y + h))
+        x = index % images_per_side * image_dim
+        y = index // images_per_side * image_dim
+        w, h = img.size
+        result.paste(img, (x, y, x + w, y + h))
 
-    result.save(mosaic_file, 'PNG', quality=95)
-    return mosaic_file
+    return result
 
 
 def modify_pngs_scene_template(
@@ -152,3 +217,52 @@ def get_png_image_names():
     scene_index = list(range(1, len(image_descriptions) + 1))
 
     return scene_index, image_descriptions
+
+
+def get_scene_slices(scene_file, scene_names):
+    """Read the volume slice shown in each scene of a Connectome Workbench scene file.
+
+    Parameters
+    ----------
+    scene_file : :obj:`str`
+        Path to the scene file. It may be gzipped.
+    scene_names : :obj:`list` of :obj:`str` or :obj:`int`
+        Names or numbers (starting at one) of the scenes.
+
+    Returns
+    -------
+    slices : :obj:`list` of :obj:`tuple`
+        The view plane ("AXIAL", "CORONAL", or "PARASAGITTAL") and the coordinate of the slice
+        along the plane's normal, in millimeters, for each scene.
+    """
+    import gzip
+    import xml.etree.ElementTree as ET
+
+    opener = gzip.open if scene_file.endswith('.gz') else open
+    with opener(scene_file, 'rb') as fo:
+        scenes = ET.parse(fo).getroot().findall('Scene')  # noqa: S314
+
+    coordinate_names = {
+        'AXIAL': 'm_sliceCoordinateAxial',
+        'CORONAL': 'm_sliceCoordinateCoronal',
+        'PARASAGITTAL': 'm_sliceCoordinateParasagittal',
+    }
+    scene_numbers = {scene.findtext('Name'): i_scene for i_scene, scene in enumerate(scenes)}
+    slices = []
+    for scene_name in scene_names:
+        if isinstance(scene_name, int):
+            scene = scenes[scene_name - 1]
+        elif scene_name in scene_numbers:
+            scene = scenes[scene_numbers[scene_name]]
+        else:
+            raise ValueError(f'Scene "{scene_name}" not found in {scene_file}')
+
+        # Only the first tab of the scene is rendered
+        objects = {}
+        for obj in scene.iter('Object'):
+            objects.setdefault(obj.get('Name'), obj.text)
+
+        plane = objects['m_sliceViewPlane']
+        slices.append((plane, float(objects[coordinate_names[plane]])))
+
+    return slices
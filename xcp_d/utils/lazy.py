@@ -0,0 +1,109 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Helpers to defer expensive imports until they are first used.
+
+Importing nipype, niworkflows, nilearn, matplotlib, or templateflow takes seconds,
+and XCP-D pays that cost in the command-line entry points and in every worker process.
+Modules that only need these packages inside some of their functions can bind them with
+:func:`lazy_import`, and packages can expose their submodules with :func:`attach`,
+so that nothing heavy is imported until it is actually accessed.
+"""
+
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """A placeholder for a module that is imported on first attribute access.
+
+    Parameters
+    ----------
+    name : :obj:`str`
+        The fully-qualified name of the module.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name):
+    """Return a module, deferring its import until one of its attributes is used.
+
+    If the module has already been imported, it is returned directly.
+
+    Parameters
+    ----------
+    name : :obj:`str`
+        The fully-qualified name of the module (e.g., ``"nibabel"``).
+
+    Returns
+    -------
+    module : :obj:`types.ModuleType`
+        The module, or a :class:`LazyModule` standing in for it.
+
+    Examples
+    --------
+    >>> nb = lazy_import('nibabel')
+    >>> nb.load  # doctest: +ELLIPSIS
+    <function load at ...>
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return LazyModule(name)
+
+
+def attach(package_name, submodules):
+    """Make a package's submodules importable on first attribute access.
+
+    This is meant to replace eager ``from package import (a, b, c)`` statements
+    in a package's ``__init__.py``.
+
+    Parameters
+    ----------
+    package_name : :obj:`str`
+        The package's ``__name__``.
+    submodules : :obj:`list` of :obj:`str`
+        The names of the submodules to expose.
+
+    Returns
+    -------
+    __getattr__ : callable
+        A module-level ``__getattr__`` (:pep:`562`) for the package.
+    __dir__ : callable
+        A module-level ``__dir__`` for the package.
+    __all__ : :obj:`list` of :obj:`str`
+        The sorted submodule names.
+    """
+    submodules = sorted(submodules)
+
+    def __getattr__(name):
+        if name in submodules:
+            return importlib.import_module(f'{package_name}.{name}')
+
+        raise AttributeError(f'module {package_name!r} has no attribute {name!r}')
+
+    def __dir__():
+        return list(submodules)
+
+    return __getattr__, __dir__, list(submodules)
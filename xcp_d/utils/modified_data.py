@@ -15,6 +15,10 @@ from xcp_d.utils.filemanip import fname_presuffix
 
 LOGGER = logging.getLogger('nipype.utils')
 
+# Bump this whenever the way motion parameters are processed changes,
+# so that stale cached results are not reused.
+MOTION_CACHE_VERSION = 1
+
 
 @fill_doc
 def compute_fd(confound, head_radius=50, filtered=False):
@@ -140,6 +144,121 @@ def downcast_to_32(in_file):
     return out_file
 
 
+@fill_doc
+def process_motion(
+    motion_file,
+    TR,
+    motion_filter_type,
+    motion_filter_order,
+    band_stop_min,
+    band_stop_max,
+    head_radius,
+    cache_dir=None,
+):
+    """Filter motion parameters and compute framewise displacement for a full run.
+
+    The results are cached in ``cache_dir``, keyed by the confounds file's content hash
+    and the motion parameters, so the workflow-construction pre-scan and
+    :class:`~xcp_d.interfaces.censoring.ProcessMotion` only compute them once.
+
+    Parameters
+    ----------
+    motion_file
+        Tabular confounds file containing motion parameters.
+    %(TR)s
+    %(motion_filter_type)s
+    %(motion_filter_order)s
+    %(band_stop_min)s
+        The unadjusted value; it is adjusted for the TR in this function.
+    %(band_stop_max)s
+        The unadjusted value; it is adjusted for the TR in this function.
+    %(head_radius)s
+    cache_dir : :obj:`str` or None, optional
+        Directory in which processed motion parameters are cached.
+        If None, nothing is cached.
+
+    Returns
+    -------
+    motion_df : :obj:`pandas.DataFrame`
+        The (possibly filtered) motion parameters,
+        with a ``framewise_displacement`` column and, if the motion parameters were filtered,
+        a ``framewise_displacement_filtered`` column.
+    """
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(
+            cache_dir,
+            _motion_cache_key(
+                motion_file,
+                TR=TR,
+                motion_filter_type=motion_filter_type,
+                motion_filter_order=motion_filter_order,
+                band_stop_min=band_stop_min,
+                band_stop_max=band_stop_max,
+                head_radius=head_radius,
+            )
+            + '.tsv',
+        )
+        if os.path.isfile(cache_file):
+            return pd.read_table(cache_file)
+
+    band_stop_min_adjusted, band_stop_max_adjusted, _ = _modify_motion_filter(
+        motion_filter_type=motion_filter_type,
+        band_stop_min=band_stop_min,
+        band_stop_max=band_stop_max,
+        TR=TR,
+    )
+    motion_df = load_motion(
+        motion_file,
+        TR=TR,
+        motion_filter_type=motion_filter_type,
+        motion_filter_order=motion_filter_order,
+        band_stop_min=band_stop_min_adjusted,
+        band_stop_max=band_stop_max_adjusted,
+    )
+    motion_df['framewise_displacement'] = compute_fd(
+        confound=motion_df,
+        head_radius=head_radius,
+        filtered=False,
+    )
+    if motion_filter_type:
+        motion_df['framewise_displacement_filtered'] = compute_fd(
+            confound=motion_df,
+            head_radius=head_radius,
+            filtered=True,
+        )
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first, so concurrent readers never see a partial file.
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        motion_df.to_csv(tmp_file, sep='\t', index=False)
+        os.replace(tmp_file, cache_file)
+
+    return motion_df
+
+
+def _motion_cache_key(motion_file, **kwargs):
+    """Hash a confounds file's content and the parameters used to process its motion."""
+    import hashlib
+    import json
+
+    digest = hashlib.sha256()
+    with open(motion_file, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(1 << 20), b''):
+            digest.update(chunk)
+
+    # Normalize numbers, so that e.g. a head radius of 50 and 50.0 share a cache entry
+    params = {
+        key: float(value) if isinstance(value, int | float | np.number) else value
+        for key, value in kwargs.items()
+    }
+    params['motion_filter_type'] = params['motion_filter_type'] or None
+    params['version'] = MOTION_CACHE_VERSION
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
 @fill_doc
 def flag_bad_run(
     motion_file,
@@ -151,9 +270,14 @@ def flag_bad_run(
     band_stop_max,
     head_radius,
     fd_thresh,
+    cache_dir=None,
 ):
     """Determine if a run has too many high-motion volumes to continue processing.
 
+    Framewise displacement is computed as in
+    :class:`~xcp_d.interfaces.censoring.ProcessMotion` (i.e., over the whole run),
+    so the amount of remaining time matches the temporal mask used in postprocessing.
+
     Parameters
     ----------
     motion_file
@@ -166,7 +290,8 @@ def flag_bad_run(
     %(band_stop_max)s
     %(head_radius)s
     %(fd_thresh)s
-    brain_mask
+    cache_dir : :obj:`str` or None, optional
+        Directory in which processed motion parameters are cached.
 
     Returns
     -------
@@ -182,35 +307,55 @@ def flag_bad_run(
         confounds_file=motion_file,
     )
 
-    # Read in fmriprep confounds tsv to calculate FD
-    fmriprep_confounds_df = pd.read_table(motion_file)
-
-    # Remove dummy volumes
-    fmriprep_confounds_df = fmriprep_confounds_df.drop(np.arange(dummy_scans))
-
-    # Calculate filtered FD
-    band_stop_min_adjusted, band_stop_max_adjusted, _ = _modify_motion_filter(
-        motion_filter_type=motion_filter_type,
-        band_stop_min=band_stop_min,
-        band_stop_max=band_stop_max,
-        TR=TR,
-    )
-    motion_df = load_motion(
-        fmriprep_confounds_df,
+    motion_df = process_motion(
+        motion_file,
         TR=TR,
         motion_filter_type=motion_filter_type,
         motion_filter_order=motion_filter_order,
-        band_stop_min=band_stop_min_adjusted,
-        band_stop_max=band_stop_max_adjusted,
-    )
-    fd_arr = compute_fd(
-        confound=motion_df,
+        band_stop_min=band_stop_min,
+        band_stop_max=band_stop_max,
         head_radius=head_radius,
-        filtered=bool(motion_filter_type),
+        cache_dir=cache_dir,
     )
+    fd_column = 'framewise_displacement'
+    if motion_filter_type:
+        fd_column = 'framewise_displacement_filtered'
+
+    # Remove dummy volumes
+    fd_arr = motion_df[fd_column].to_numpy()[dummy_scans:]
     return np.sum(fd_arr <= fd_thresh) * TR
 
 
+def flag_bad_runs(run_kwargs, n_procs=1):
+    """Run :func:`flag_bad_run` for several runs, in parallel.
+
+    Parameters
+    ----------
+    run_kwargs : :obj:`list` of :obj:`dict`
+        Keyword arguments to :func:`flag_bad_run` for each run.
+    n_procs : :obj:`int`, optional
+        Number of processes to use.
+
+    Returns
+    -------
+    post_scrubbing_durations : :obj:`list` of :obj:`float`
+        Amount of time remaining in each run after dummy scan removal, in seconds.
+    """
+    n_procs = min(n_procs, len(run_kwargs))
+    if n_procs > 1:
+        from multiprocessing import Pool
+
+        with Pool(processes=n_procs) as pool:
+            return pool.map(_flag_bad_run, run_kwargs)
+
+    return [_flag_bad_run(kwargs) for kwargs in run_kwargs]
+
+
+def _flag_bad_run(kwargs):
+    """Call :func:`flag_bad_run` with a dictionary of keyword arguments."""
+    return flag_bad_run(**kwargs)
+
+
 def calculate_exact_scans(exact_times, scan_length, t_r, bold_file):
     """Calculate the exact scans corresponding to exact times.
 
@@ -2,53 +2,222 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 """Plotting tools."""
 
+import hashlib
 import os
+from functools import cache
+from pathlib import Path
 
-import matplotlib.pyplot as plt
 import nibabel as nb
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from matplotlib import gridspec as mgs
-from matplotlib.colors import ListedColormap
-from nilearn._utils.niimg import safe_get_data
-from nilearn._utils.niimg_conversions import check_niimg_4d
-from nilearn.signal import clean
 
 from xcp_d.utils.bids import _get_tr
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.lazy import lazy_import
 from xcp_d.utils.qcmetrics import compute_dvars
-from xcp_d.utils.write_save import read_ndata, write_ndata
+from xcp_d.utils.write_save import read_ndata
 
+plt = lazy_import('matplotlib.pyplot')
+sns = lazy_import('seaborn')
+mgs = lazy_import('matplotlib.gridspec')
+mcolors = lazy_import('matplotlib.colors')
+nilearn_signal = lazy_import('nilearn.signal')
+tflow = lazy_import('templateflow.api')
 
-def _decimate_data(data, seg_data, temporal_mask, size):
-    """Decimate timeseries data.
+#: 2D collections with more elements than this are rasterized when saving figures.
+RASTERIZE_MIN_ELEMENTS = 1000
+
+#: Elevation and azimuth of the surface views, as used by nilearn's matplotlib engine.
+SURFACE_VIEWS = {
+    'left': {'lateral': (0, 180), 'medial': (0, 0)},
+    'right': {'lateral': (0, 0), 'medial': (0, 180)},
+}
+
+
+def save_figure(figure, out_file, **kwargs):
+    """Save a figure to a file and close it.
+
+    Surface meshes and other collections with many elements are rasterized,
+    so vector outputs stay small and fast to write and to display,
+    while text, lines, and axes remain vectors.
+    Images without interpolation are embedded at their own resolution,
+    unless it is finer than the one they are displayed at.
 
     Parameters
     ----------
-    data : ndarray
-        2D array of timepoints and samples
-    seg_data : ndarray
-        1D array of samples
-    temporal_mask : ndarray or None
-        1D array of timepoints. May be None.
-    size : tuple
-        2 element for P/T decimation
+    figure : :obj:`matplotlib.figure.Figure`
+        The figure to save.
+    out_file : :obj:`str`
+        The output file.
+    **kwargs
+        Passed to :meth:`matplotlib.figure.Figure.savefig`.
+
+    Returns
+    -------
+    out_file : :obj:`str`
+        The output file.
     """
-    # Decimate the data in the spatial dimension
-    p_dec = 1 + data.shape[0] // size[0]
-    if p_dec:
-        data = data[::p_dec, :]
-        seg_data = seg_data[::p_dec]
-
-    # Decimate the data in the temporal dimension
-    t_dec = 1 + data.shape[1] // size[1]
-    if t_dec:
-        data = data[:, ::t_dec]
-        if temporal_mask is not None:
-            temporal_mask = temporal_mask[::t_dec]
+    from matplotlib.collections import Collection
+    from matplotlib.image import AxesImage
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+    dpi = kwargs.get('dpi', plt.rcParams['savefig.dpi'])
+    scale = 1 if dpi == 'figure' else dpi / figure.dpi
+    for image in figure.findobj(AxesImage):
+        extent = image.axes.get_window_extent()
+        n_rows, n_cols = image.get_array().shape[:2]
+        if image.get_interpolation() == 'none' and (
+            n_cols > extent.width * scale or n_rows > extent.height * scale
+        ):
+            image.set_interpolation('nearest')
+
+    for collection in figure.findobj(Collection):
+        # 3D collections only project their paths at draw time
+        if isinstance(collection, Poly3DCollection) or (
+            len(collection.get_paths()) > RASTERIZE_MIN_ELEMENTS
+        ):
+            collection.set_rasterized(True)
+
+    figure.savefig(out_file, **kwargs)
+    plt.close(figure)
+    return out_file
+
+
+@cache
+def get_template_file(template, **entities):
+    """Get a TemplateFlow file, looking it up only once per process.
+
+    Parameters
+    ----------
+    template : :obj:`str`
+        The TemplateFlow template.
+    **entities
+        Passed to :func:`templateflow.api.get`.
+        If several files match, the first one is returned.
+
+    Returns
+    -------
+    template_file : :obj:`str`
+    """
+    template_file = tflow.get(template=template, raise_empty=True, **entities)
+    if isinstance(template_file, list):
+        template_file = template_file[0]
+
+    return str(template_file)
+
+
+def get_fslr_surfaces(suffix='midthickness'):
+    """Get the left and right fsLR 32k surfaces used as underlays in the surface plots."""
+    return tuple(
+        get_template_file('fsLR', hemi=hemi, density='32k', suffix=suffix, extension='.surf.gii')
+        for hemi in ('L', 'R')
+    )
 
-    return data, seg_data, temporal_mask
+
+@cache
+def _get_carpet_cmap(is_cifti):
+    """Get the colormap of the tissue types in the carpet plots."""
+    if is_cifti:
+        return mcolors.ListedColormap([plt.get_cmap('Paired').colors[i] for i in (1, 0, 7, 3)])
+
+    return mcolors.ListedColormap(plt.get_cmap('tab10').colors[:4][::-1])
+
+
+def load_carpet_data(img, atlaslabels=None, size=(950, 800), lut=None, chunk_size=64):
+    """Load the decimated data of a carpet plot.
+
+    The samples (voxels or grayordinates) and volumes to plot are selected first,
+    and only those are read from the file, a few volumes at a time,
+    so that the full-resolution data are never loaded in memory.
+
+    Parameters
+    ----------
+    img : :obj:`nibabel.Cifti2Image` or :obj:`nibabel.Nifti1Image`
+        4D NIfTI or dense timeseries CIFTI image.
+        Loading it with ``keep_file_open=True`` avoids reopening compressed files for every
+        chunk of volumes.
+    atlaslabels : numpy.ndarray, optional
+        A 3D array of integer labels from an atlas, in ``img`` space.
+        The samples are the voxels with positive labels.
+        Required if ``img`` is a NIfTI image.
+        Unused if ``img`` is a CIFTI.
+    size : tuple, optional
+        Approximate number of samples and volumes to keep.
+    lut : numpy.ndarray, optional
+        Look up table from the atlas labels to the tissue types.
+        Unused if ``img`` is a CIFTI.
+    chunk_size : int, optional
+        Number of volumes to read at once from NIfTI images.
+
+    Returns
+    -------
+    data : (S, T) numpy.ndarray
+        Decimated samples by decimated volumes. Non-finite values are replaced with zeros.
+    seg_data : (S,) numpy.ndarray
+        Tissue type of each sample.
+    volumes : :obj:`slice`
+        Volumes of the image that are included in ``data``.
+    """
+    if isinstance(img, nb.Cifti2Image):
+        assert img.nifti_header.get_intent()[0] == 'ConnDenseSeries', (
+            f'Not a dense timeseries: {img.nifti_header.get_intent()[0]}, {img.get_filename()}'
+        )
+        n_volumes, n_samples = img.shape
+        seg_data = np.zeros((n_samples,), dtype='uint32')
+        # Get brain model information
+        for brain_model in img.header.matrix.get_index_map(1).brain_models:
+            if 'CORTEX' in brain_model.brain_structure:
+                lidx = (1, 2)['RIGHT' in brain_model.brain_structure]
+            elif 'CEREBELLUM' in brain_model.brain_structure:
+                lidx = 4
+            else:
+                lidx = 3
+            index_final = brain_model.index_offset + brain_model.index_count
+            seg_data[brain_model.index_offset : index_final] = lidx
+        assert len(seg_data[seg_data < 1]) == 0, 'Unassigned labels'
+
+        samples, volumes = _get_carpet_slices(n_samples, n_volumes, size)
+        # The array proxy only reads the selected elements
+        data = np.asarray(img.dataobj[volumes, samples], dtype=np.float64).T
+        seg_data = seg_data[samples]
+
+    else:  # Volumetric NIfTI
+        if len(img.shape) != 4:
+            raise ValueError(f'Expected a 4D image, got shape {img.shape}: {img.get_filename()}')
+
+        n_volumes = img.shape[3]
+        atlaslabels = np.asanyarray(atlaslabels)
+        voxels = np.flatnonzero(atlaslabels > 0)
+        samples, volumes = _get_carpet_slices(voxels.size, n_volumes, size)
+        voxels = np.unravel_index(voxels[samples], atlaslabels.shape)
+
+        # Map segmentation
+        if lut is None:
+            lut = np.zeros((256,), dtype='int')
+            lut[1:11] = 1
+            lut[255] = 2
+            lut[30:99] = 3
+            lut[100:201] = 4
+        # Apply lookup table
+        seg_data = lut[atlaslabels[voxels].astype(int)]
+
+        kept_volumes = range(n_volumes)[volumes]
+        data = np.empty((seg_data.size, len(kept_volumes)))
+        for start in range(0, len(kept_volumes), chunk_size):
+            chunk = kept_volumes[start : start + chunk_size]
+            chunk_data = img.dataobj[..., chunk.start : chunk.stop : chunk.step]
+            data[:, start : start + len(chunk)] = chunk_data[voxels]
+
+    data[~np.isfinite(data)] = 0
+
+    return data, seg_data, volumes
+
+
+def _get_carpet_slices(n_samples, n_volumes, size):
+    """Get the samples and volumes that decimate a carpet plot to about ``size``."""
+    p_dec = 1 + n_samples // size[0]
+    t_dec = 1 + n_volumes // size[1]
+    return slice(None, None, p_dec), slice(None, None, t_dec)
 
 
 def plot_confounds(
@@ -489,7 +658,6 @@ def plot_fmri_es(
     preprocessed_figure,
     denoised_figure,
     standardize,
-    temporary_file_dir,
     mask=None,
     seg_data=None,
     run_index=None,
@@ -516,8 +684,6 @@ def plot_fmri_es(
         where the BOLD data are not rescaled, and the carpet plot has color limits from the
         2.5th percentile to the 97.5th percentile.
         If True, then the BOLD data will be z-scored and the color limits will be -2 and 2.
-    temporary_file_dir : :obj:`str`
-        Path in which to store temporary files.
     mask : :obj:`str`, optional
         Brain mask file. Used only when the pre- and post-processed BOLD data are NIFTIs.
     seg_data : :obj:`str`, optional
@@ -584,36 +750,9 @@ def plot_fmri_es(
     if seg_data is not None:
         atlaslabels = nb.load(seg_data).get_fdata()
 
-    rm_temp_file = False
-    temp_preprocessed_file = preprocessed_bold
-    if not standardize:
-        # The plot going to carpet plot will be mean-centered and detrended,
-        # but will not otherwise be rescaled.
-        detrended_preprocessed_arr = clean(
-            preprocessed_arr.T,
-            t_r=TR,
-            detrend=True,
-            filter=False,
-            standardize=False,
-        ).T
-
-        # Make a temporary file for niftis and ciftis
-        rm_temp_file = True
-        if preprocessed_bold.endswith('.nii.gz'):
-            temp_preprocessed_file = os.path.join(temporary_file_dir, 'filex_raw.nii.gz')
-        else:
-            temp_preprocessed_file = os.path.join(temporary_file_dir, 'filex_raw.dtseries.nii')
-
-        # Write out the scaled data
-        temp_preprocessed_file = write_ndata(
-            data_matrix=detrended_preprocessed_arr,
-            template=preprocessed_bold,
-            filename=temp_preprocessed_file,
-            mask=mask,
-            TR=TR,
-        )
-
-    files_for_carpet = [temp_preprocessed_file, denoised_interpolated_bold]
+    # The preprocessed data going to the carpet plot are mean-centered and detrended,
+    # but are not otherwise rescaled, unless standardize is True.
+    files_for_carpet = [preprocessed_bold, denoised_interpolated_bold]
     figure_names = [preprocessed_figure, denoised_figure]
     data_arrays = [preprocessed_timeseries, denoised_interpolated_timeseries]
     for i_fig, figure_name in enumerate(figure_names):
@@ -621,9 +760,6 @@ def plot_fmri_es(
         data_arr = data_arrays[i_fig]
 
         # Plot the data and confounds, plus the carpet plot
-        plt.cla()
-        plt.clf()
-
         fig = plt.figure(constrained_layout=False, figsize=(22.5, 30))
         grid = fig.add_gridspec(
             nrows=4,
@@ -659,7 +795,8 @@ def plot_fmri_es(
         plot_carpet(
             func=file_for_carpet,
             atlaslabels=atlaslabels,
-            standardize=standardize,  # Data are already detrended if standardize is False
+            standardize=standardize,
+            detrend=(i_fig == 0),
             size=(950, 800),
             labelsize=30,
             subplot=grid[2],  # Use grid for now.
@@ -682,12 +819,7 @@ def plot_fmri_es(
         plot_framewise_displacement_es(fd_regressor, ax3, TR=TR, run_index=run_index)
 
         # Save out the before processing file
-        fig.savefig(figure_name, bbox_inches='tight', pad_inches=None, dpi=300)
-        plt.close(fig)
-
-    # Remove temporary files
-    if rm_temp_file:
-        os.remove(temp_preprocessed_file)
+        save_figure(fig, figure_name, bbox_inches='tight', pad_inches=None, dpi=300)
 
     # Save out the after processing file
     return preprocessed_figure, denoised_figure
@@ -824,6 +956,7 @@ def plot_carpet(
     atlaslabels,
     TR,
     standardize,
+    detrend=False,
     temporal_mask=None,
     size=(950, 800),
     labelsize=30,
@@ -847,8 +980,12 @@ def plot_carpet(
         Unused if ``func`` is a CIFTI.
     standardize : bool, optional
         Detrend and standardize the data prior to plotting.
+    detrend : bool, optional
+        Mean-center and detrend the data prior to plotting, without rescaling them.
+        Only used if ``standardize`` is False.
     size : tuple, optional
-        Size of figure.
+        Approximate number of samples and volumes to plot.
+        The data are decimated to this size before being loaded (see :func:`load_carpet_data`).
     labelsize : int, optional
     subplot : matplotlib Subplot, optional
         Subplot to plot figure on.
@@ -866,83 +1003,45 @@ def plot_carpet(
     colorbar : bool, optional
         Default is False.
     """
-    img = nb.load(func)
-
-    if isinstance(img, nb.Cifti2Image):  # CIFTI
-        assert img.nifti_header.get_intent()[0] == 'ConnDenseSeries', (
-            f'Not a dense timeseries: {img.nifti_header.get_intent()[0]}, {func}'
-        )
-
-        # Get required information
-        data = img.get_fdata().T
-        matrix = img.header.matrix
-        struct_map = {
-            'LEFT_CORTEX': 1,
-            'RIGHT_CORTEX': 2,
-            'SUBCORTICAL': 3,
-            'CEREBELLUM': 4,
-        }
-        seg_data = np.zeros((data.shape[0],), dtype='uint32')
-        # Get brain model information
-        for brain_model in matrix.get_index_map(1).brain_models:
-            if 'CORTEX' in brain_model.brain_structure:
-                lidx = (1, 2)['RIGHT' in brain_model.brain_structure]
-            elif 'CEREBELLUM' in brain_model.brain_structure:
-                lidx = 4
-            else:
-                lidx = 3
-            index_final = brain_model.index_offset + brain_model.index_count
-            seg_data[brain_model.index_offset : index_final] = lidx
-        assert len(seg_data[seg_data < 1]) == 0, 'Unassigned labels'
-
-    else:  # Volumetric NIfTI
-        img_nii = check_niimg_4d(img, dtype='auto')  # Check the image is in nifti format
-        func_data = safe_get_data(img_nii, ensure_finite=True)
-        ntsteps = func_data.shape[-1]
-        data = func_data[atlaslabels > 0].reshape(-1, ntsteps)
-        oseg = atlaslabels[atlaslabels > 0].reshape(-1)
-
-        # Map segmentation
-        if lut is None:
-            lut = np.zeros((256,), dtype='int')
-            lut[1:11] = 1
-            lut[255] = 2
-            lut[30:99] = 3
-            lut[100:201] = 4
-        # Apply lookup table
-        seg_data = lut[oseg.astype(int)]
-
-    # Decimate data
-    data, seg_data, temporal_mask = _decimate_data(data, seg_data, temporal_mask, size)
+    img = nb.load(func, keep_file_open=True)
+    data, seg_data, volumes = load_carpet_data(img, atlaslabels=atlaslabels, size=size, lut=lut)
+    if temporal_mask is not None:
+        temporal_mask = temporal_mask[volumes]
 
     if isinstance(img, nb.Cifti2Image):
         # Preserve continuity
         order = seg_data.argsort(kind='stable')
         # Get color maps
-        cmap = ListedColormap([plt.get_cmap('Paired').colors[i] for i in (1, 0, 7, 3)])
-        assert len(cmap.colors) == len(struct_map), (
-            'Mismatch between expected # of structures and colors'
-        )
+        cmap = _get_carpet_cmap(True)
     else:
         # Order following segmentation labels
         order = np.argsort(seg_data)[::-1]
         # Set colormap
-        cmap = ListedColormap(plt.get_cmap('tab10').colors[:4][::-1])
+        cmap = _get_carpet_cmap(False)
 
     # Detrend and z-score data
     if standardize:
         # This does not account for the temporal mask.
-        data = clean(data.T, t_r=TR, detrend=True, filter=False, standardize='zscore_sample').T
+        data = nilearn_signal.clean(
+            data.T, t_r=TR, detrend=True, filter=False, standardize='zscore_sample'
+        ).T
         vlimits = (-2, 2)
-    elif temporal_mask is not None:
-        # If standardize is False and a temporal mask is provided,
-        # then we use only low-motion timepoints to define the vlimits.
-        # The executive summary uses the following range for native BOLD units.
-        vlimits = tuple(np.percentile(data[:, ~temporal_mask], q=(2.5, 97.5)))
     else:
-        # If standardize is False, then the data are assumed to have native BOLD units.
-        # The executive summary uses the following range for native BOLD units.
-        vlimits = tuple(np.percentile(data, q=(2.5, 97.5)))
+        if detrend:
+            # Mean-center and detrend the data, without rescaling them.
+            data = nilearn_signal.clean(
+                data.T, t_r=TR, detrend=True, filter=False, standardize=False
+            ).T
+
+        if temporal_mask is not None:
+            # If standardize is False and a temporal mask is provided,
+            # then we use only low-motion timepoints to define the vlimits.
+            # The executive summary uses the following range for native BOLD units.
+            vlimits = tuple(np.percentile(data[:, ~temporal_mask], q=(2.5, 97.5)))
+        else:
+            # If standardize is False, then the data are assumed to have native BOLD units.
+            # The executive summary uses the following range for native BOLD units.
+            vlimits = tuple(np.percentile(data, q=(2.5, 97.5)))
 
     # If subplot is not defined
     if subplot is None:
@@ -998,9 +1097,11 @@ def plot_carpet(
     ax0.set_xticklabels([])
 
     # Carpet plot
+    # Without interpolation, vector backends embed the decimated data as is,
+    # instead of resampling them to the resolution of the whole figure.
     pos = ax1.imshow(
         data[order],
-        interpolation='nearest',
+        interpolation='none',
         aspect='auto',
         cmap='gray',
         vmin=vlimits[0],
@@ -1051,15 +1152,199 @@ def plot_carpet(
 
     #  Write out file
     if output_file is not None:
-        figure = plt.gcf()
-        figure.savefig(output_file, bbox_inches='tight')
-        plt.close(figure)
-        figure = None
-        return output_file
+        return save_figure(plt.gcf(), output_file, bbox_inches='tight')
 
     return (ax0, ax1, ax2), grid_specification
 
 
+@cache
+def _get_surface_digest(surf_file, mtime, size):
+    """Hash the content of a surface file, once per version of the file."""
+    with open(surf_file, 'rb') as fobj:
+        return hashlib.sha1(fobj.read()).hexdigest()  # noqa: S324
+
+
+def get_surface_projection(surf_file, elev, azim, cache_dir=None):
+    """Project a surface mesh on the screen plane of a view.
+
+    The projection is the one used by matplotlib's 3D axes in nilearn's surface plots.
+    It is computed once per mesh and view, and cached in memory and, optionally,
+    in a directory shared across processes, keyed by the content of the mesh file.
+
+    Parameters
+    ----------
+    surf_file : :obj:`str`
+        GIFTI surface file.
+    elev, azim : :obj:`float`
+        Elevation and azimuth of the view, in degrees.
+    cache_dir : :obj:`str` or None, optional
+        Directory in which to keep the projections (``--surface-cache-dir``).
+        If None, projections are only kept in memory.
+
+    Returns
+    -------
+    vertices : (V, 2) numpy.ndarray
+        Projected vertex coordinates, in the 2D data coordinates of the 3D axes.
+    faces : (F, 3) numpy.ndarray
+        Triangle indices, sorted from the farthest to the closest triangle.
+    """
+    return _get_surface_projection(
+        _get_surface_key(surf_file), surf_file, float(elev), float(azim), cache_dir
+    )
+
+
+def _get_surface_key(surf_file):
+    stat = os.stat(surf_file)
+    return _get_surface_digest(os.path.abspath(surf_file), stat.st_mtime_ns, stat.st_size)
+
+
+@cache
+def _get_surface_projection(digest, surf_file, elev, azim, cache_dir=None):
+    if cache_dir is None:
+        return _project_surface(surf_file, elev, azim)
+
+    cache_file = Path(cache_dir) / f'{digest}_elev-{elev:g}_azim-{azim:g}.npz'
+    try:
+        with np.load(cache_file) as projection:
+            return projection['vertices'], projection['faces']
+    except (OSError, KeyError, ValueError):
+        pass
+
+    vertices, faces = _project_surface(surf_file, elev, azim)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f'{cache_file.stem}.{os.getpid()}.tmp.npz')
+        np.savez(tmp_file, vertices=vertices, faces=faces)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+    return vertices, faces
+
+
+@cache
+def _get_surface_paths(digest, surf_file, elev, azim, cache_dir=None):
+    """Build the (read-only) paths of the projected triangles, which collections can share."""
+    from matplotlib.path import Path
+
+    vertices, faces = _get_surface_projection(digest, surf_file, elev, azim, cache_dir)
+    codes = np.array([Path.MOVETO, Path.LINETO, Path.LINETO, Path.CLOSEPOLY], Path.code_type)
+    triangles = vertices[np.column_stack((faces, faces[:, 0]))].astype(float)
+    return [Path(triangle, codes, readonly=True) for triangle in triangles]
+
+
+def _project_surface(surf_file, elev, azim):
+    """Project a surface mesh with the settings of nilearn's matplotlib engine."""
+    from matplotlib.figure import Figure
+    from mpl_toolkits.mplot3d import proj3d
+
+    from xcp_d.utils.execsummary import load_surface
+
+    coords, faces = load_surface(surf_file)
+    ax = Figure().add_subplot(projection='3d')
+    limits = [coords.min(), coords.max()]
+    ax.set_xlim(*limits)
+    ax.set_ylim(*limits)
+    ax.view_init(elev=elev, azim=azim)
+    # Only the z limits are autoscaled to the mesh
+    ax.auto_scale_xyz(coords[:, 0], coords[:, 1], coords[:, 2], had_data=False)
+    ax.set_box_aspect(None, zoom=1.3)
+
+    x, y, z = proj3d.proj_transform(coords[:, 0], coords[:, 1], coords[:, 2], ax.get_proj())
+    # Draw the farthest triangles first, as matplotlib sorts them by their average depth
+    order = np.argsort(z[faces].mean(axis=1), kind='stable')[::-1]
+    return np.column_stack((x, y)).astype(np.float32), faces[order].astype(np.int32)
+
+
+def plot_surface_map(
+    surf_file,
+    surf_data,
+    hemi,
+    view,
+    ax,
+    *,
+    cmap='cool',
+    vmin=None,
+    vmax=None,
+    threshold=None,
+    cache_dir=None,
+):
+    """Plot a map on a surface mesh in a 2D Axes.
+
+    This reproduces :func:`nilearn.plotting.plot_surf_stat_map` with the matplotlib engine,
+    without a background map or colorbar, but draws the precomputed projection of the mesh
+    (see :func:`get_surface_projection`) as a single 2D collection,
+    instead of projecting and sorting the triangles in 3D at every draw.
+    The paths of the triangles are also kept in memory, so that the following maps on the
+    same mesh and view only need new colors.
+
+    Parameters
+    ----------
+    surf_file : :obj:`str`
+        GIFTI surface file.
+    surf_data : (V,) or (V, 1) numpy.ndarray
+        Values of the vertices.
+    hemi : {'left', 'right'}
+        Hemisphere of the surface.
+    view : {'lateral', 'medial'}
+        View of the surface.
+    ax : :obj:`matplotlib.axes.Axes`
+        2D axes to draw on.
+    cmap : :obj:`str`, optional
+        Colormap.
+    vmin, vmax : :obj:`float`, optional
+        Limits of the colormap. Default to the range of the data.
+    threshold : :obj:`float`, optional
+        Values whose magnitude is below the threshold are not shown.
+    cache_dir : :obj:`str` or None, optional
+        Directory in which the projections of the meshes are kept across processes.
+    """
+    from matplotlib.collections import PathCollection
+    from nilearn.plotting.cm import mix_colormaps
+
+    elev, azim = SURFACE_VIEWS[hemi][view]
+    digest = _get_surface_key(surf_file)
+    _, faces = _get_surface_projection(digest, surf_file, float(elev), float(azim), cache_dir)
+
+    face_data = np.mean(np.squeeze(surf_data)[faces], axis=1)
+    vmin = np.nanmin(face_data) if vmin is None else vmin
+    vmax = np.nanmax(face_data) if vmax is None else vmax
+    if vmin == vmax:
+        vmin, vmax = vmin - 1, vmax + 1
+
+    if threshold is None:
+        kept = ~np.isnan(face_data)
+    else:
+        kept = np.abs(face_data) >= threshold
+        if vmin > -threshold:
+            kept &= face_data >= vmin
+        if vmax < threshold:
+            kept &= face_data <= vmax
+
+    face_colors = plt.get_cmap(cmap)((face_data - vmin) / (vmax - vmin))
+    face_colors[~kept, 3] = 0
+    # The uniform gray, half-transparent background of the meshes without a background map
+    bg_colors = np.tile(plt.cm.gray_r(0.5 * 0.7), (face_colors.shape[0], 1))
+    bg_colors[:, 3] *= 0.5
+    face_colors = np.clip(mix_colormaps(face_colors, bg_colors), 0, 1)
+
+    ax.add_collection(
+        PathCollection(
+            _get_surface_paths(digest, surf_file, float(elev), float(azim), cache_dir),
+            facecolors=face_colors,
+            edgecolors=face_colors,
+            linewidths=0.1,
+            antialiased=False,
+        ),
+        autolim=False,
+    )
+    # The 2D view of matplotlib's 3D axes
+    ax.set_xlim(-0.095, 0.09)
+    ax.set_ylim(-0.095, 0.09)
+    ax.set_aspect('equal')
+    ax.set_axis_off()
+
+
 def surf_data_from_cifti(data, axis, surf_name):
     """From https://neurostars.org/t/separate-cifti-by-structure-in-python/17301/2.
 
@@ -0,0 +1,146 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Lightweight, cached probes of file metadata.
+
+These functions read only image headers, sidecar JSONs, or the line structure of TSV files,
+so that workflow construction and interfaces do not need to load full data arrays
+(or parse full tables) just to get a shape, data type, or repetition time.
+Results are memoized per path, modification time, and file size,
+so repeated probes of the same unchanged file are free.
+"""
+
+import json
+import os
+from functools import lru_cache
+
+import nibabel as nb
+import numpy as np
+
+from xcp_d.utils.filemanip import split_filename
+
+CIFTI_EXTENSIONS = (
+    '.dtseries.nii',
+    '.dscalar.nii',
+    '.dlabel.nii',
+    '.ptseries.nii',
+    '.pscalar.nii',
+    '.pconn.nii',
+    '.dconn.nii',
+)
+TABLE_EXTENSIONS = ('.tsv', '.tsv.gz')
+
+
+def probe_file(path):
+    """Collect basic metadata about a NIfTI, CIFTI, or TSV file without loading its data.
+
+    Parameters
+    ----------
+    path : :obj:`str` or :obj:`os.PathLike`
+        Path to the file.
+
+    Returns
+    -------
+    info : :obj:`dict`
+        A dictionary with the following keys:
+
+        -   ``shape``: shape of the data array (rows by columns for TSV files)
+        -   ``dtype``: on-disk data type (None for TSV files)
+        -   ``n_volumes``: number of volumes (time points or rows)
+        -   ``tr``: repetition time from the image header (None for TSV files)
+        -   ``intent``: NIfTI intent name (None for TSV files)
+        -   ``nbytes``: size of the uncompressed data array, in bytes (the file size for TSV files)
+        -   ``metadata``: the contents of the JSON sidecar, if one exists
+    """
+    path = os.path.abspath(os.fspath(path))
+    stat = os.stat(path)
+    info = _probe_file(path, stat.st_mtime_ns, stat.st_size)
+    # Copy, so that callers cannot modify the cached values
+    return {**info, 'metadata': dict(info['metadata'])}
+
+
+def get_n_volumes(path):
+    """Get the number of volumes in an image, or the number of rows in a TSV file."""
+    return probe_file(path)['n_volumes']
+
+
+def get_tr(path):
+    """Get the repetition time of an image, preferring its sidecar JSON over its header."""
+    info = probe_file(path)
+    return info['metadata'].get('RepetitionTime', info['tr'])
+
+
+def clear_cache():
+    """Forget all memoized probes."""
+    _probe_file.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def _probe_file(path, mtime_ns, size):
+    """Probe a file. The modification time and size are only used as part of the cache key."""
+    if path.endswith(TABLE_EXTENSIONS):
+        return _probe_table(path)
+
+    _, base, extension = split_filename(path)
+    img = nb.load(path)
+    shape = tuple(int(dim) for dim in img.shape)
+    dtype = img.get_data_dtype()
+    if extension in CIFTI_EXTENSIONS:
+        header = img.nifti_header
+        n_volumes = shape[0]
+        try:
+            series_step = img.header.matrix.get_index_map(0).series_step
+        except AttributeError:
+            series_step = None
+
+        # Only series (e.g., dtseries and ptseries) files have a repetition time
+        tr = None if series_step is None else float(series_step)
+    else:
+        header = img.header
+        n_volumes = shape[3] if len(shape) > 3 else 1
+        zooms = header.get_zooms()
+        tr = float(zooms[3]) if len(zooms) > 3 else None
+
+    sidecar = os.path.join(os.path.dirname(path), f'{base}.json')
+    metadata = {}
+    if os.path.isfile(sidecar):
+        with open(sidecar) as fobj:
+            metadata = json.load(fobj)
+
+    return {
+        'shape': shape,
+        'dtype': dtype,
+        'n_volumes': n_volumes,
+        'tr': tr,
+        'intent': header.get_intent()[0],
+        'nbytes': int(np.prod(shape)) * dtype.itemsize,
+        'metadata': metadata,
+    }
+
+
+def _probe_table(path):
+    """Count the rows and columns of a TSV file without parsing its values.
+
+    Blank lines are skipped, as in :func:`pandas.read_table`.
+    """
+    import gzip
+
+    opener = gzip.open if path.endswith('.gz') else open
+    n_rows, n_columns = 0, 0
+    with opener(path, 'rb') as fobj:
+        header = fobj.readline().rstrip(b'\r\n')
+        if header:
+            n_columns = len(header.split(b'\t'))
+
+        for line in fobj:
+            if line.rstrip(b'\r\n'):
+                n_rows += 1
+
+    return {
+        'shape': (n_rows, n_columns),
+        'dtype': None,
+        'n_volumes': n_rows,
+        'tr': None,
+        'intent': None,
+        'nbytes': os.path.getsize(path),
+        'metadata': {},
+    }
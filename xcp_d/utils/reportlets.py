@@ -0,0 +1,360 @@
+"""Tools to reuse, defer, and find reportlets without indexing the output dataset."""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+from nipype import logging
+
+LOGGER = logging.getLogger('nipype.utils')
+
+MANIFEST_FILE = 'manifest.json'
+#: Seconds to wait for the lock of a manifest.
+MANIFEST_LOCK_TIMEOUT = 60
+#: Manifests whose lock could not be acquired by this process.
+_LOCKED_MANIFESTS = set()
+DEFERRED_SPEC_FILE = 'reportlet.json'
+
+
+def get_reportlet_key(name, files, parameters):
+    """Hash everything that determines a set of reportlets.
+
+    Parameters
+    ----------
+    name : :obj:`str`
+        Name of the plotting function or interface.
+    files : :obj:`list` of :obj:`str`
+        Input files. Only their contents are hashed, so copies of the same file in
+        different sessions or working directories share a key.
+    parameters : :obj:`dict`
+        JSON-serializable plotting parameters.
+
+    Returns
+    -------
+    key : :obj:`str`
+    """
+    from xcp_d import __version__
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps([name, __version__, parameters], sort_keys=True).encode())
+    for in_file in files:
+        with open(in_file, 'rb') as fo:
+            for chunk in iter(lambda: fo.read(2**20), b''):  # noqa: B023
+                digest.update(chunk)
+
+    return digest.hexdigest()[:32]
+
+
+def fetch_reportlets(store_dir, key, out_files):
+    """Link stored reportlets to the requested paths.
+
+    Parameters
+    ----------
+    store_dir : :obj:`str`
+        Directory of the reportlet store.
+    key : :obj:`str`
+        Key from :func:`get_reportlet_key`.
+    out_files : :obj:`list` of :obj:`str`
+        Paths of the reportlets. Their file names are used to find the stored files.
+
+    Returns
+    -------
+    found : :obj:`bool`
+        Whether all of the reportlets were found in the store.
+    """
+    entry_dir = Path(store_dir) / key
+    stored_files = [entry_dir / os.path.basename(out_file) for out_file in out_files]
+    if not all(stored_file.is_file() for stored_file in stored_files):
+        return False
+
+    for stored_file, out_file in zip(stored_files, out_files, strict=True):
+        _link_or_copy(stored_file, out_file)
+
+    LOGGER.debug(f'Reused {len(out_files)} reportlets from {entry_dir}.')
+    return True
+
+
+def store_reportlets(store_dir, key, out_files):
+    """Add reportlets to the store, unless another job already stored them.
+
+    Parameters
+    ----------
+    store_dir : :obj:`str`
+        Directory of the reportlet store.
+    key : :obj:`str`
+        Key from :func:`get_reportlet_key`.
+    out_files : :obj:`list` of :obj:`str`
+        Paths of the reportlets.
+    """
+    entry_dir = Path(store_dir) / key
+    if entry_dir.is_dir():
+        return
+
+    # Fill a temporary folder first, so concurrent jobs never read a partial entry.
+    tmp_dir = entry_dir.with_name(f'.{key}.{os.getpid()}')
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    for out_file in out_files:
+        _link_or_copy(out_file, tmp_dir / os.path.basename(out_file))
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another job stored the same reportlets in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _link_or_copy(src, dst):
+    """Hard-link a file, or copy it if the file systems differ."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def get_manifest_file(output_dir, subject):
+    """Get the path to the manifest of a subject's outputs."""
+    return Path(output_dir) / f'sub-{subject}' / 'log' / MANIFEST_FILE
+
+
+def update_manifest(output_dir, out_files):
+    """Record derivatives in the manifests of their subjects.
+
+    When a subject's manifest is created, the outputs already in the subject's folder
+    (e.g., from earlier runs or releases) are recorded as well.
+    The manifest is only an index, so failing to update it never fails the caller.
+    A manifest whose lock cannot be acquired is not used by the reports
+    (see :meth:`OutputManifest.exists`).
+
+    Parameters
+    ----------
+    output_dir : :obj:`str`
+        The output dataset.
+    out_files : :obj:`list` of :obj:`str`
+        Files written to the output dataset.
+        Files outside of the subjects' folders are ignored.
+    """
+    import filelock
+
+    relpaths = {}
+    for out_file in out_files:
+        relpath = Path(os.path.relpath(out_file, output_dir))
+        if relpath.parts[0].startswith('sub-'):
+            relpaths.setdefault(relpath.parts[0][4:], []).append(relpath.as_posix())
+
+    for subject, subject_files in relpaths.items():
+        manifest_file = get_manifest_file(output_dir, subject)
+        if str(manifest_file) in _LOCKED_MANIFESTS:
+            continue
+
+        manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with filelock.SoftFileLock(f'{manifest_file}.lock', timeout=MANIFEST_LOCK_TIMEOUT):
+                files = set(subject_files)
+                if manifest_file.is_file():
+                    files.update(json.loads(manifest_file.read_text())['files'])
+                else:
+                    files.update(_list_subject_files(output_dir, subject))
+
+                tmp_file = manifest_file.with_name(f'.{MANIFEST_FILE}.{os.getpid()}')
+                tmp_file.write_text(json.dumps({'files': sorted(files)}, indent=1))
+                os.replace(tmp_file, manifest_file)
+        except filelock.Timeout:
+            # Most likely left behind by a job that was killed while holding it.
+            # Later outputs of this process skip the manifest instead of waiting again.
+            _LOCKED_MANIFESTS.add(str(manifest_file))
+            LOGGER.warning(
+                f'Could not acquire the lock of {manifest_file}. '
+                f'The reports will index the outputs of sub-{subject} instead.'
+            )
+
+
+def _list_subject_files(output_dir, subject):
+    """List the files in a subject's folder, relative to the output dataset."""
+    subject_dir = Path(output_dir) / f'sub-{subject}'
+    relpaths = []
+    for root, dirnames, filenames in os.walk(subject_dir):
+        if Path(root) == subject_dir:
+            dirnames[:] = [name for name in dirnames if name != 'log']
+
+        relpaths += [
+            Path(os.path.relpath(os.path.join(root, name), output_dir)).as_posix()
+            for name in filenames
+        ]
+
+    return relpaths
+
+
+class _ManifestFile:
+    """A file from a manifest, with the attributes used from :class:`bids.layout.BIDSFile`."""
+
+    def __init__(self, path, entities):
+        self.path = path
+        self.entities = entities
+
+
+class OutputManifest:
+    """Query a subject's derivatives from its manifest, like a :class:`~bids.BIDSLayout`.
+
+    The manifest is written by :class:`~xcp_d.interfaces.bids.DerivativesDataSink`,
+    so the outputs can be found without indexing the output dataset.
+    Only the queries used by the reports are supported:
+    entity values, lists of values, and :class:`~bids.layout.Query` values.
+
+    Parameters
+    ----------
+    output_dir : :obj:`str`
+        The output dataset.
+    subject : :obj:`str`
+        The subject label, without the "sub-" prefix.
+    """
+
+    def __init__(self, output_dir, subject):
+        from bids.layout import parse_file_entities
+
+        # Register the nireports "figures" configuration
+        from nireports.assembler import report  # noqa: F401
+
+        manifest = json.loads(get_manifest_file(output_dir, subject).read_text())
+        self.files = []
+        for relpath in manifest['files']:
+            path = os.path.join(output_dir, relpath)
+            # Files that were removed after they were recorded
+            if os.path.isfile(path):
+                self.files.append(_ManifestFile(path, parse_file_entities(path, config='figures')))
+
+    @classmethod
+    def exists(cls, output_dir, subject):
+        """Check if a subject has a manifest that can be used.
+
+        A manifest whose lock is still held (e.g., by a job that was killed while updating it)
+        may be missing outputs, so it is not used.
+        """
+        manifest_file = get_manifest_file(output_dir, subject)
+        return manifest_file.is_file() and not os.path.exists(f'{manifest_file}.lock')
+
+    def get(self, **query):
+        """Get the files that match the query."""
+        return [
+            bids_file
+            for bids_file in self.files
+            if all(_matches(bids_file.entities, k, v) for k, v in query.items())
+        ]
+
+
+def _matches(entities, entity, value):
+    """Check the value of one entity against a query, like :meth:`bids.BIDSLayout.get`."""
+    from bids.layout import Query
+
+    if value is Query.OPTIONAL:
+        return True
+    elif value is Query.NONE:
+        return entity not in entities
+    elif value is Query.ANY:
+        return entity in entities
+    elif entity not in entities:
+        return False
+
+    actual = entities[entity]
+    values = value if isinstance(value, (list, tuple)) else [value]
+    for v in values:
+        # Numeric entities (e.g., run) are padded integers, but may be queried as numbers
+        if isinstance(actual, int) and isinstance(v, (int, float)):
+            if v == actual:
+                return True
+        elif str(v) == str(actual):
+            return True
+
+    return False
+
+
+def get_deferred_dir(output_dir, subject):
+    """Get the folder with the data of a subject's deferred reportlets."""
+    return Path(output_dir) / f'sub-{subject}' / 'log' / 'reportlets'
+
+
+def find_deferred_reportlets(output_dir, subject):
+    """Find the deferred reportlets of a subject that have not been rendered yet.
+
+    Parameters
+    ----------
+    output_dir : :obj:`str`
+        The output dataset.
+    subject : :obj:`str`
+        The subject label, without the "sub-" prefix.
+
+    Returns
+    -------
+    reportlet_dirs : :obj:`list` of :obj:`str`
+        Folders written by :class:`~xcp_d.interfaces.plotting.DeferReportlet`.
+    """
+    deferred_dir = get_deferred_dir(output_dir, subject)
+    if not deferred_dir.is_dir():
+        return []
+
+    return sorted(
+        str(reportlet_dir)
+        for reportlet_dir in deferred_dir.iterdir()
+        if (reportlet_dir / DEFERRED_SPEC_FILE).is_file()
+    )
+
+
+def render_deferred_reportlet(output_dir, reportlet_dir):
+    """Render a deferred reportlet and write it to the output dataset.
+
+    The folder with the reportlet's data is removed once the figure is written.
+
+    Parameters
+    ----------
+    output_dir : :obj:`str`
+        The output dataset.
+    reportlet_dir : :obj:`str`
+        Folder written by :class:`~xcp_d.interfaces.plotting.DeferReportlet`.
+
+    Returns
+    -------
+    out_file : :obj:`str` or None
+        The figure, or None if it could not be rendered.
+    """
+    from nipype.interfaces import utility as niu
+
+    from xcp_d.interfaces.bids import DerivativesDataSink
+    from xcp_d.interfaces.plotting import CensoringPlot
+    from xcp_d.utils.plotting import plot_design_matrix
+
+    spec = json.loads((Path(reportlet_dir) / DEFERRED_SPEC_FILE).read_text())
+    inputs = {
+        **spec['parameters'],
+        **{name: os.path.join(reportlet_dir, fname) for name, fname in spec['files'].items()},
+    }
+    try:
+        if spec['reportlet'] == 'censoring':
+            results = CensoringPlot(**inputs).run(cwd=reportlet_dir)
+            figure = results.outputs.out_file
+        else:
+            plotter = niu.Function(
+                input_names=['design_matrix', 'temporal_mask'],
+                output_names=['design_matrix_figure'],
+                function=plot_design_matrix,
+            )
+            results = plotter.run(cwd=reportlet_dir, **inputs)
+            figure = results.outputs.design_matrix_figure
+
+        results = DerivativesDataSink(
+            base_directory=str(output_dir),
+            source_file=spec['source_file'],
+            in_file=figure,
+            datatype='figures',
+            **spec['datasink'],
+        ).run(cwd=reportlet_dir)
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.warning(f'Could not render the deferred reportlet in {reportlet_dir}: {exc}')
+        return None
+
+    out_file = results.outputs.out_file
+    shutil.rmtree(reportlet_dir, ignore_errors=True)
+    return out_file
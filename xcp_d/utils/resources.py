@@ -0,0 +1,443 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Estimate the peak memory and useful number of threads of processing steps.
+
+Nipype's MultiProc plugin packs nodes into the ``--mem-mb`` and ``--nprocs`` budgets
+using each node's ``mem_gb`` and ``n_procs``,
+so these should be close to what the node actually needs.
+The estimates here are linear models of the size of the BOLD data,
+``base_gb + factor * bold_gb``,
+where ``bold_gb`` is the size of the data as 32-bit floats
+(the data type every XCP-D interface works in, whatever the on-disk type).
+
+The coefficients of the Python interfaces were fit to the peak resident memory of the
+interfaces run on synthetic data of different shapes
+(see the benchmark in ``xcp_d/tests/test_utils_resources.py``, run with ``pytest -m benchmark``,
+which checks that the estimates still cover the measured peaks), and rounded up.
+Those of the external tools (AFNI, Connectome Workbench) are taken from the number of
+full-size copies of the data that they hold in memory.
+
+When XCP-D is run with ``--resource-monitor``, the resources each node actually used are
+aggregated into a profile in the output dataset's logs (see :func:`update_resource_profile`),
+which later runs can use instead of these estimates with ``--resource-profile``
+(see :func:`apply_resource_profile`).
+This is most useful when processing a cohort with homogeneous data in several jobs.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+from pathlib import Path
+
+from nipype.interfaces.base import isdefined
+
+from xcp_d.utils.probe import probe_file
+
+LOGGER = logging.getLogger('nipype.utils')
+
+#: Inputs with which interfaces size their own pools of worker processes or threads,
+#: besides the ``num_threads`` input that Nipype sets from the node's ``n_procs``.
+_THREAD_INPUTS = ('n_procs', 'n_threads')
+
+#: Memory (in GB) of a single 32-bit float.
+_FLOAT32_GB = 4 / 1024**3
+
+#: Minimum number of data elements (volumes x voxels) handled by each thread.
+#: Below this, starting another thread or worker process costs more than it saves.
+ELEMENTS_PER_THREAD = 25_000_000
+
+#: Peak memory models of the processing steps.
+#: ``base_gb`` and ``factor`` are the intercept and slope on the size of the data,
+#: ``parallel_factor`` is the additional memory (relative to the size of the data) used when
+#: the step runs on more than one thread, and ``threaded`` is whether it can use more than one.
+#: ``data`` is the data the step works on: ``'bold'`` for the full time series,
+#: ``'volume'`` for a single volume (e.g., ReHo or ALFF maps),
+#: and ``'timeseries'`` for the parcellated time series of one atlas.
+RESOURCE_MODEL = {
+    # DenoiseNifti/DenoiseCifti: data, confounds, interpolated, filtered, and denoised copies.
+    # Measured at 4.6-5.4x. Worker processes receive and return a copy of their chunks.
+    'denoise': {
+        'data': 'bold',
+        'base_gb': 0.25,
+        'factor': 5.5,
+        'parallel_factor': 2.0,
+        'threaded': True,
+    },
+    # Censor: the interpolated data and the censored copy. Measured at 1.8-2.8x.
+    'censor': {'data': 'bold', 'base_gb': 0.1, 'factor': 2.0, 'threaded': False},
+    # RemoveDummyVolumes: the data and the trimmed copy.
+    'dummy_scans': {'data': 'bold', 'base_gb': 0.1, 'factor': 2.0, 'threaded': False},
+    # 3dDespike: the input, the output, and per-voxel fitting buffers.
+    'despike': {'data': 'bold', 'base_gb': 0.2, 'factor': 3.0, 'threaded': True},
+    # wb_command -cifti-convert: the input and the output.
+    'convert': {'data': 'bold', 'base_gb': 0.1, 'factor': 2.0, 'threaded': True},
+    # ComputeALFF: the masked data and its power spectrum, voxel by voxel. Measured at 0.6-1.8x.
+    'alff': {
+        'data': 'bold',
+        'base_gb': 0.15,
+        'factor': 0.6,
+        'parallel_factor': 1.0,
+        'threaded': True,
+    },
+    # 3dReHo and SurfaceReHo: the data and the neighborhoods' ranks.
+    'reho': {'data': 'bold', 'base_gb': 0.2, 'factor': 2.0, 'threaded': False},
+    # Smoothing: the input, the output, and the kernel's workspace.
+    'smooth': {'data': 'bold', 'base_gb': 0.2, 'factor': 2.0, 'threaded': True},
+    # NiftiParcellate and wb_command -cifti-parcellate, for one atlas. Measured at 1.7-3.0x.
+    'parcellate': {'data': 'bold', 'base_gb': 0.15, 'factor': 1.6, 'threaded': True},
+    # Smoothing, merging, or parcellating a single map (e.g., ALFF or ReHo).
+    'map': {'data': 'volume', 'base_gb': 0.15, 'factor': 4.0, 'threaded': False},
+    # QCPlots and the executive summary carpet plots: preprocessed and denoised data.
+    'qc': {'data': 'bold', 'base_gb': 0.3, 'factor': 3.0, 'threaded': False},
+    # TSVConnect: the time series and one correlation matrix per exact scan count.
+    'correlate': {'data': 'timeseries', 'base_gb': 0.1, 'factor': 4.0, 'threaded': False},
+    # ConnectPlot: matplotlib, plus one correlation matrix per atlas.
+    'connectivity_plot': {
+        'data': 'timeseries',
+        'base_gb': 0.3,
+        'factor': 1.0,
+        'threaded': False,
+    },
+    # ConcatenateInputs: every run, plus the concatenated copy.
+    'concatenate': {'data': 'bold', 'base_gb': 0.2, 'factor': 2.0, 'threaded': True},
+}
+
+#: The number of parcels assumed for the parcellated time series of an atlas.
+_MAX_PARCELS = 1000
+
+
+def estimate_resources(bold_files, n_atlases=1, n_exact_scans=0):
+    """Estimate the resources each processing step needs for one or more BOLD files.
+
+    Parameters
+    ----------
+    bold_files : :obj:`str` or :obj:`list` of :obj:`str`
+        The BOLD file(s) to be processed.
+        If there is more than one, the estimates are for the files' concatenation.
+    n_atlases : :obj:`int`
+        The number of atlases used for parcellation. Default is 1.
+    n_exact_scans : :obj:`int`
+        The number of exact scan counts for which correlations are computed. Default is 0.
+
+    Returns
+    -------
+    mem_gb : :obj:`dict`
+        A dictionary with the following keys:
+
+        -   ``bold``: the uncompressed size of the BOLD data on disk, in GB
+        -   ``volume``: the size of one volume, in GB
+        -   ``resources``: a dictionary mapping each step in :data:`RESOURCE_MODEL` to
+            its ``mem_gb`` on one thread, the ``parallel_gb`` it needs in addition on more
+            than one thread, and its useful number of threads (``n_procs``)
+
+        Use :func:`get_mem_gb` and :func:`get_n_procs` to read it.
+    """
+    if isinstance(bold_files, str):
+        bold_files = [bold_files]
+
+    nbytes, n_volumes, n_elements = 0, 0, 0
+    for bold_file in bold_files:
+        bold_info = probe_file(bold_file)
+        nbytes += bold_info['nbytes']
+        n_volumes += bold_info['n_volumes']
+        n_elements += math.prod(bold_info['shape'])
+
+    elements = {
+        'bold': n_elements,
+        'volume': n_elements / n_volumes,
+        'timeseries': n_volumes * _MAX_PARCELS,
+    }
+    # Steps that hold one array per atlas or per exact scan count
+    copies = {'correlate': 1 + n_exact_scans, 'connectivity_plot': n_atlases}
+
+    resources = {}
+    for step, model in RESOURCE_MODEL.items():
+        data_gb = elements[model['data']] * _FLOAT32_GB * copies.get(step, 1)
+        resources[step] = {
+            'mem_gb': model['base_gb'] + model['factor'] * data_gb,
+            'parallel_gb': model.get('parallel_factor', 0) * data_gb,
+            'n_procs': (
+                max(1, math.ceil(elements[model['data']] / ELEMENTS_PER_THREAD))
+                if model['threaded']
+                else 1
+            ),
+        }
+
+    bold_gb = nbytes / (1024**3)
+    return {
+        'bold': bold_gb,
+        'volume': bold_gb / n_volumes,
+        'resources': resources,
+    }
+
+
+def get_n_procs(mem_gb, step):
+    """Get the number of threads a step can use, up to ``--omp-nthreads``.
+
+    Parameters
+    ----------
+    mem_gb : :obj:`dict`
+        Estimates from :func:`estimate_resources`.
+        Dictionaries without the ``resources`` key (e.g., ``{"bold": 1}``) are supported,
+        in which case the step may use all ``--omp-nthreads`` threads.
+    step : :obj:`str`
+        The processing step, from :data:`RESOURCE_MODEL`.
+
+    Returns
+    -------
+    n_procs : :obj:`int`
+    """
+    from xcp_d import config
+
+    omp_nthreads = config.nipype.omp_nthreads or 1
+    if not RESOURCE_MODEL[step]['threaded']:
+        return 1
+
+    estimate = mem_gb.get('resources', {}).get(step)
+    if estimate is None:
+        return omp_nthreads
+
+    return max(1, min(omp_nthreads, estimate['n_procs']))
+
+
+def get_mem_gb(mem_gb, step):
+    """Get the peak memory of a step, in GB, on the threads from :func:`get_n_procs`.
+
+    Parameters
+    ----------
+    mem_gb : :obj:`dict`
+        Estimates from :func:`estimate_resources`.
+        Dictionaries without the ``resources`` key (e.g., ``{"bold": 1}``) are supported,
+        in which case the size of the data the step works on (``bold`` or ``volume``) is used.
+    step : :obj:`str`
+        The processing step, from :data:`RESOURCE_MODEL`.
+
+    Returns
+    -------
+    mem_gb : :obj:`float`
+    """
+    estimate = mem_gb.get('resources', {}).get(step)
+    if estimate is None:
+        key = 'volume' if RESOURCE_MODEL[step]['data'] == 'volume' else 'bold'
+        return mem_gb.get(key, mem_gb.get('bold'))
+
+    if get_n_procs(mem_gb, step) > 1:
+        return estimate['mem_gb'] + estimate['parallel_gb']
+
+    return estimate['mem_gb']
+
+
+#: Nodes' memory is set to their largest measured peak, multiplied by this factor.
+PROFILE_MEMORY_MARGIN = 1.2
+#: Seconds to wait for the lock of a resource profile.
+PROFILE_LOCK_TIMEOUT = 60
+
+
+def _node_key(workflow_name, node_name):
+    """Identify a type of node by its name and its parent workflow's name.
+
+    Subject labels are not part of either name, and run and entity set indices are removed,
+    so that a node has the same key for every run and every subject.
+    """
+    return re.sub(r'_\d+(?=_|\.|$)', '', f'{workflow_name}.{node_name}')
+
+
+def _iter_nodes(workflow):
+    """Iterate over the nodes of a workflow, with the names of their parent workflows."""
+    from nipype.pipeline.engine import Workflow
+
+    for node in workflow._graph.nodes():
+        if isinstance(node, Workflow):
+            yield from _iter_nodes(node)
+        else:
+            yield workflow.name, node
+
+
+def init_resource_log(log_file):
+    """Write the records of :func:`log_node_resources` to a file.
+
+    Parameters
+    ----------
+    log_file : :obj:`str` or :obj:`os.PathLike`
+        The file to append the records to, as JSON lines.
+    """
+    Path(log_file).parent.mkdir(exist_ok=True, parents=True)
+    logger = logging.getLogger('callback')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(logging.FileHandler(log_file))
+
+
+def log_node_resources(node, status):
+    """Record the resources a node used, as a Nipype plugin ``status_callback``.
+
+    The records have the same fields as those of :func:`nipype.utils.profiler.log_nodes_cb`,
+    plus the ``key`` identifying the type of node (see :func:`update_resource_profile`).
+
+    Parameters
+    ----------
+    node : :obj:`~nipype.pipeline.engine.Node`
+        The node whose status changed.
+    status : :obj:`str`
+        The status of the node. Only finished (``"end"``) nodes are recorded.
+    """
+    if status != 'end':
+        return
+
+    runtime = node.result.runtime
+    if isinstance(runtime, list):
+        # MapNodes' own results summarize their subnodes, which are recorded separately
+        return
+
+    if node._hierarchy:
+        key = _node_key(node._hierarchy.split('.')[-1], node.name)
+    else:
+        # MapNode subnodes run in <workflow>/<mapnode>/mapflow/_<mapnode><index>
+        mapnode_dir = Path(node.base_dir).parent
+        key = _node_key(mapnode_dir.parent.name, mapnode_dir.name)
+
+    record = {
+        'name': node.name,
+        'id': node._id,
+        'key': key,
+        'start': runtime.startTime,
+        'finish': runtime.endTime,
+        'duration': runtime.duration,
+        'runtime_threads': getattr(runtime, 'cpu_percent', 'N/A'),
+        'runtime_memory_gb': getattr(runtime, 'mem_peak_gb', 'N/A'),
+        'estimated_memory_gb': node.mem_gb,
+        'num_threads': node.n_procs,
+    }
+    logging.getLogger('callback').debug(json.dumps(record))
+
+
+def update_resource_profile(log_file, profile_file):
+    """Aggregate the resources used by nodes into a resource profile.
+
+    Each type of node is summarized by its number of runs, its mean and maximum runtime,
+    its maximum peak memory, and its maximum CPU usage.
+    Nodes without resource measurements (i.e., when Nipype's resource monitor is disabled)
+    are skipped.
+    If the profile already exists, the new measurements are added to it,
+    so that a profile can be built up across jobs.
+    The profile is locked while it is updated, so concurrent jobs can share it.
+    If the lock cannot be acquired (e.g., it was left behind by a killed job),
+    or the profile cannot be written, a warning is logged and the profile is left as is.
+
+    Parameters
+    ----------
+    log_file : :obj:`str` or :obj:`os.PathLike`
+        Records written by :func:`log_node_resources`.
+    profile_file : :obj:`str` or :obj:`os.PathLike`
+        The JSON profile to write or update.
+
+    Returns
+    -------
+    n_records : :obj:`int` or None
+        The number of measurements added to the profile, or None if it could not be updated.
+    """
+    import filelock
+
+    profile_file = Path(profile_file)
+    try:
+        profile_file.parent.mkdir(exist_ok=True, parents=True)
+        # Jobs that finish at the same time must not lose each other's measurements
+        with filelock.SoftFileLock(f'{profile_file}.lock', timeout=PROFILE_LOCK_TIMEOUT):
+            return _update_resource_profile(log_file, profile_file)
+    except (filelock.Timeout, OSError) as err:
+        LOGGER.warning(f'Could not update the resource profile {profile_file}: {err}')
+        return None
+
+
+def _update_resource_profile(log_file, profile_file):
+    """Add measurements to a resource profile, while its lock is held."""
+    from xcp_d import config
+
+    profile = {'nodes': {}}
+    if profile_file.is_file():
+        profile = json.loads(profile_file.read_text())
+
+    n_records = 0
+    with open(log_file) as fobj:
+        for line in fobj:
+            record = json.loads(line)
+            memory_gb, cpu_percent = record['runtime_memory_gb'], record['runtime_threads']
+            if not all(isinstance(val, int | float) for val in (memory_gb, cpu_percent)):
+                continue
+
+            stats = profile['nodes'].setdefault(
+                record['key'],
+                {
+                    'n_runs': 0,
+                    'duration_mean': 0.0,
+                    'duration_max': 0.0,
+                    'memory_gb_max': 0.0,
+                    'cpu_percent_max': 0.0,
+                },
+            )
+            duration = record['duration'] or 0.0
+            stats['n_runs'] += 1
+            stats['duration_mean'] += (duration - stats['duration_mean']) / stats['n_runs']
+            stats['duration_max'] = max(stats['duration_max'], duration)
+            stats['memory_gb_max'] = max(stats['memory_gb_max'], memory_gb)
+            stats['cpu_percent_max'] = max(stats['cpu_percent_max'], cpu_percent)
+            n_records += 1
+
+    profile['XCP-D version'] = config.environment.version
+    tmp_file = profile_file.with_name(f'.{profile_file.name}.{os.getpid()}')
+    tmp_file.write_text(json.dumps(profile, indent=2, sort_keys=True))
+    os.replace(tmp_file, profile_file)
+    return n_records
+
+
+def apply_resource_profile(workflow, profile_file):
+    """Set the memory and threads of a workflow's nodes from a resource profile.
+
+    Each node found in the profile (see :func:`update_resource_profile`) is given
+    its largest measured peak memory, times :data:`PROFILE_MEMORY_MARGIN`.
+    Its number of threads is reduced to the largest number of CPUs it used,
+    but never increased, since its interface may not be able to use more.
+    Interfaces that start their own workers (e.g., with an ``n_procs`` input)
+    are limited to the same number, so they do not use more CPUs than the node reserves.
+    Other nodes keep their estimates.
+
+    Parameters
+    ----------
+    workflow : :obj:`~nipype.pipeline.engine.Workflow`
+        The workflow to update, in place.
+    profile_file : :obj:`str` or :obj:`os.PathLike`
+        The JSON profile.
+
+    Returns
+    -------
+    n_nodes : :obj:`int`
+        The number of nodes that were updated.
+    """
+    from xcp_d import config
+
+    profile = json.loads(Path(profile_file).read_text())['nodes']
+    n_nodes = 0
+    for workflow_name, node in _iter_nodes(workflow):
+        stats = profile.get(_node_key(workflow_name, node.name))
+        if stats is None:
+            continue
+
+        node._mem_gb = max(
+            stats['memory_gb_max'] * PROFILE_MEMORY_MARGIN,
+            config.DEFAULT_MEMORY_MIN_GB,
+        )
+        n_procs = max(1, math.ceil(stats['cpu_percent_max'] / 100))
+        if n_procs < node.n_procs:
+            # This also sets the interface's num_threads input, if it has one
+            node.n_procs = n_procs
+
+        for name in _THREAD_INPUTS:
+            value = getattr(node.inputs, name, None)
+            if isdefined(value) and isinstance(value, int) and value > node.n_procs:
+                setattr(node.inputs, name, node.n_procs)
+
+        n_nodes += 1
+
+    return n_nodes
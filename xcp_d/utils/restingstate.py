@@ -7,9 +7,11 @@ import numpy as np
 from nipype import logging
 from scipy import signal
 from scipy.stats import rankdata
-from templateflow.api import get as get_template
+
+from xcp_d.utils.lazy import lazy_import
 
 LOGGER = logging.getLogger('nipype.utils')
+tflow = lazy_import('templateflow.api')
 
 
 def compute_2d_reho(datat, adjacency_matrix):
@@ -81,7 +83,7 @@ def mesh_adjacency(hemi):
     Modified by Taylor Salo to loop over all vertices in faces.
     """
     surf = str(
-        get_template(
+        tflow.get(
             'fsLR',
             space=None,
             hemi=hemi,
@@ -5,10 +5,11 @@
 import os
 import re
 
-import sentry_sdk
-from niworkflows.utils.misc import read_crashfile
-
 from xcp_d import config
+from xcp_d.utils.lazy import lazy_import
+
+sentry_sdk = lazy_import('sentry_sdk')
+nwmisc = lazy_import('niworkflows.utils.misc')
 
 CHUNK_SIZE = 16384
 # Group common events with pre specified fingerprints
@@ -60,7 +61,7 @@ def sentry_setup():
 
 def process_crashfile(crashfile):
     """Parse the contents of a crashfile and submit sentry messages."""
-    crash_info = read_crashfile(str(crashfile))
+    crash_info = nwmisc.read_crashfile(str(crashfile))
     with sentry_sdk.push_scope() as scope:
         scope.level = 'fatal'
 
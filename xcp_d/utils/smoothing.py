@@ -0,0 +1,512 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Gaussian smoothing of NIfTI and CIFTI data without external tools."""
+
+import hashlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+
+import nibabel as nb
+import numpy as np
+from nibabel.openers import ImageOpener
+from nipype import logging
+from scipy import ndimage, signal, sparse
+from scipy.spatial import cKDTree
+
+LOGGER = logging.getLogger('nipype.utils')
+
+# Kernels with at least this many taps are applied with FFT-based convolution.
+FFT_KERNEL_LENGTH = 33
+# Gaussian kernels are truncated at this many standard deviations, as in scipy and nilearn.
+TRUNCATE = 4.0
+# Bump this whenever the construction of cached CIFTI smoothing operators changes.
+OPERATOR_VERSION = 1
+# Number of time points to smooth at once with a CIFTI smoothing operator.
+CIFTI_BLOCK_SIZE = 256
+
+
+def fwhm_to_voxel_sigmas(fwhm, affine):
+    """Convert a FWHM in millimeters to per-axis standard deviations in voxels.
+
+    Parameters
+    ----------
+    fwhm : :obj:`float` or :obj:`list` of 3 :obj:`float`
+        Full width at half maximum of the Gaussian kernel, in millimeters.
+    affine : (4, 4) :obj:`numpy.ndarray`
+        Affine of the image to smooth.
+
+    Returns
+    -------
+    sigmas : (3,) :obj:`numpy.ndarray`
+        Standard deviation of the kernel along each spatial axis, in voxels.
+    """
+    fwhm = np.broadcast_to(np.asarray(fwhm, dtype=float), (3,))
+    vox_size = np.sqrt(np.sum(affine[:3, :3] ** 2, axis=0))
+    return fwhm / (np.sqrt(8 * np.log(2)) * vox_size)
+
+
+def gaussian_kernel_1d(sigma, truncate=TRUNCATE):
+    """Build a normalized 1D Gaussian kernel.
+
+    The kernel matches the one used by :func:`scipy.ndimage.gaussian_filter1d`.
+
+    Parameters
+    ----------
+    sigma : :obj:`float`
+        Standard deviation of the kernel, in voxels.
+    truncate : :obj:`float`
+        Truncate the kernel at this many standard deviations.
+
+    Returns
+    -------
+    kernel : :obj:`numpy.ndarray` of shape (2 * radius + 1,)
+        The kernel weights.
+    """
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 / sigma**2 * x**2)
+    return kernel / kernel.sum()
+
+
+def smooth_array_separable(arr, kernels, method='auto'):
+    """Smooth the first three axes of an array with separable 1D kernels.
+
+    Parameters
+    ----------
+    arr : :obj:`numpy.ndarray` of shape (X, Y, Z, ...)
+        The array to smooth. Trailing axes (e.g., time) are not smoothed.
+    kernels : :obj:`list` of 3 :obj:`numpy.ndarray` or None
+        One symmetric kernel per spatial axis. None skips the axis.
+    method : {"auto", "direct", "fft"}
+        How to apply each kernel.
+        "direct" uses :func:`scipy.ndimage.correlate1d`,
+        "fft" uses :func:`scipy.signal.fftconvolve`,
+        and "auto" selects "fft" for kernels with at least ``FFT_KERNEL_LENGTH`` taps.
+
+    Returns
+    -------
+    arr : :obj:`numpy.ndarray`
+        The smoothed array.
+
+    Notes
+    -----
+    Edges are handled by reflection, as in :func:`scipy.ndimage.gaussian_filter1d`.
+    """
+    for axis, kernel in enumerate(kernels):
+        if kernel is None or kernel.size == 1:
+            continue
+
+        use_fft = method == 'fft' or (method == 'auto' and kernel.size >= FFT_KERNEL_LENGTH)
+        if not use_fft:
+            arr = ndimage.correlate1d(arr, kernel, axis=axis, mode='reflect')
+            continue
+
+        radius = kernel.size // 2
+        pad_width = [(0, 0)] * arr.ndim
+        pad_width[axis] = (radius, radius)
+        padded = np.pad(arr, pad_width, mode='symmetric')
+        shape = [1] * arr.ndim
+        shape[axis] = kernel.size
+        arr = signal.fftconvolve(
+            padded,
+            kernel.reshape(shape).astype(arr.dtype),
+            mode='valid',
+            axes=axis,
+        )
+
+    return arr
+
+
+def _mask_bounding_box(mask, radii):
+    """Find the bounding box of a mask, padded by the kernel radii and clipped to the volume."""
+    coords = np.nonzero(mask)
+    box = []
+    for axis, radius in enumerate(radii):
+        start = max(int(coords[axis].min()) - radius, 0)
+        stop = min(int(coords[axis].max()) + radius + 1, mask.shape[axis])
+        box.append(slice(start, stop))
+
+    return tuple(box)
+
+
+def _smooth_block(args):
+    """Smooth one block of volumes within the brain mask.
+
+    This function is run in worker processes, so the image is reopened from disk
+    and only the requested volumes are read.
+    """
+    in_file, mask, box, kernels, start, stop, method, dtype = args
+    img = nb.load(in_file)
+    if img.ndim == 3:
+        block = np.asanyarray(img.dataobj[box])[..., None]
+    else:
+        block = np.asanyarray(img.dataobj[box + (slice(start, stop),)])
+
+    block = np.nan_to_num(block.astype(np.float32), copy=False, nan=0, posinf=0, neginf=0)
+    block_mask = mask[box]
+    block[~block_mask] = 0
+    block = smooth_array_separable(block, kernels, method=method)
+    block[~block_mask] = 0
+
+    out_block = np.zeros(mask.shape + (stop - start,), dtype=dtype)
+    out_block[box] = block
+    return out_block
+
+
+def smooth_masked_img(
+    in_file,
+    mask_file,
+    fwhm,
+    out_file,
+    n_procs=1,
+    block_size=None,
+    method='auto',
+):
+    """Smooth a NIfTI image within a brain mask, one block of volumes at a time.
+
+    Parameters
+    ----------
+    in_file : :obj:`str`
+        Path to a 3D or 4D NIfTI image.
+    mask_file : :obj:`str`
+        Path to a binary brain mask in the same space as ``in_file``.
+    fwhm : :obj:`float` or :obj:`list` of 3 :obj:`float`
+        Full width at half maximum of the Gaussian kernel, in millimeters.
+    out_file : :obj:`str`
+        Path to the smoothed image to write out.
+    n_procs : :obj:`int`
+        Number of processes used to smooth blocks of volumes in parallel.
+    block_size : :obj:`int` or None
+        Number of volumes per block.
+        If None, the volumes are split evenly across ``n_procs``, with at most 64 per block.
+    method : {"auto", "direct", "fft"}
+        How to apply the 1D kernels. See :func:`smooth_array_separable`.
+
+    Returns
+    -------
+    out_file : :obj:`str`
+        Path to the smoothed image.
+
+    Notes
+    -----
+    Voxels outside the mask are set to zero before smoothing and in the output image.
+    Only the bounding box of the mask, padded by the kernel radius, is smoothed,
+    so values within the mask are the same as smoothing the zero-filled image
+    with :func:`nilearn.image.smooth_img`.
+
+    The output is streamed to disk volume by volume,
+    so peak memory scales with ``block_size * n_procs`` rather than the full time series.
+    """
+    img = nb.load(in_file)
+    mask = np.asanyarray(nb.load(mask_file).dataobj).astype(bool)
+    if mask.shape != img.shape[:3]:
+        raise ValueError(f'Mask shape {mask.shape} does not match image shape {img.shape[:3]}.')
+
+    sigmas = fwhm_to_voxel_sigmas(fwhm, img.affine)
+    kernels = [gaussian_kernel_1d(sigma) if sigma > 0 else None for sigma in sigmas]
+    radii = [0 if kernel is None else kernel.size // 2 for kernel in kernels]
+
+    out_header = img.header.copy()
+    out_header.set_data_dtype(np.float32)
+    out_header.set_slope_inter(None, None)
+    out_header.set_data_offset(0)
+    dtype = out_header.get_data_dtype()
+
+    n_volumes = img.shape[3] if img.ndim == 4 else 1
+    if block_size is None:
+        block_size = min(64, int(np.ceil(n_volumes / max(n_procs, 1))))
+
+    box = _mask_bounding_box(mask, radii) if mask.any() else None
+    starts = range(0, n_volumes, block_size)
+    args = [
+        (in_file, mask, box, kernels, start, min(start + block_size, n_volumes), method, dtype)
+        for start in starts
+    ]
+    LOGGER.debug(f'Smoothing {n_volumes} volumes in {len(args)} blocks.')
+
+    with ImageOpener(out_file, 'wb') as fobj:
+        out_header.write_to(fobj)
+        fobj.write(b'\x00' * (out_header.get_data_offset() - fobj.tell()))
+
+        if box is None:
+            # Nothing in the mask, so the output is all zeros.
+            for start, stop in ((arg[4], arg[5]) for arg in args):
+                fobj.write(np.zeros(mask.shape + (stop - start,), dtype=dtype).tobytes('F'))
+
+        elif n_procs > 1 and len(args) > 1:
+            with multiprocessing.Pool(processes=min(n_procs, len(args))) as pool:
+                # imap preserves the order of the blocks, so each one can be written as it arrives.
+                for out_block in pool.imap(_smooth_block, args):
+                    fobj.write(out_block.tobytes('F'))
+
+        else:
+            for arg in args:
+                fobj.write(_smooth_block(arg).tobytes('F'))
+
+    return out_file
+
+
+def _vertex_areas(coords, faces):
+    """Assign one third of the area of each triangle to each of its vertices."""
+    edge1 = coords[faces[:, 1]] - coords[faces[:, 0]]
+    edge2 = coords[faces[:, 2]] - coords[faces[:, 0]]
+    face_areas = 0.5 * np.linalg.norm(np.cross(edge1, edge2), axis=1)
+    areas = np.zeros(coords.shape[0])
+    for i_corner in range(3):
+        np.add.at(areas, faces[:, i_corner], face_areas / 3)
+
+    return areas
+
+
+def _gaussian_operator(coords, sigma, distance_func, weights=None, cutoff=None):
+    """Build a row-normalized sparse Gaussian smoothing operator over a set of points.
+
+    Parameters
+    ----------
+    coords : (N, 3) :obj:`numpy.ndarray`
+        Coordinates of the points, in millimeters.
+    sigma : :obj:`float`
+        Standard deviation of the Gaussian kernel, in millimeters.
+    distance_func : callable
+        Function converting Euclidean distances between points to the distances
+        used by the kernel (e.g., geodesic distances on a sphere).
+    weights : (N,) :obj:`numpy.ndarray` or None
+        Weight of each source point (e.g., vertex areas).
+    cutoff : :obj:`float` or None
+        Euclidean search radius. Defaults to ``TRUNCATE * sigma``.
+
+    Returns
+    -------
+    operator : :obj:`scipy.sparse.csr_matrix` of shape (N, N)
+        Smoothing operator. Each row sums to one.
+    """
+    n_points = coords.shape[0]
+    if sigma <= 0:
+        return sparse.identity(n_points, format='csr')
+
+    cutoff = TRUNCATE * sigma if cutoff is None else cutoff
+    pairs = cKDTree(coords).query_pairs(cutoff, output_type='ndarray')
+    diagonal = np.arange(n_points)
+    rows = np.concatenate((pairs[:, 0], pairs[:, 1], diagonal))
+    cols = np.concatenate((pairs[:, 1], pairs[:, 0], diagonal))
+
+    distances = distance_func(np.linalg.norm(coords[rows] - coords[cols], axis=1))
+    values = np.exp(-(distances**2) / (2 * sigma**2))
+    if weights is not None:
+        values *= weights[cols]
+
+    operator = sparse.csr_matrix((values, (rows, cols)), shape=(n_points, n_points))
+    row_sums = np.asarray(operator.sum(axis=1)).ravel()
+    return sparse.diags(1 / row_sums) @ operator
+
+
+def surface_smoothing_operator(surf_file, vertices, sigma):
+    """Build a geodesic Gaussian smoothing operator for vertices on a spherical surface.
+
+    Parameters
+    ----------
+    surf_file : :obj:`str`
+        Path to a spherical GIFTI surface.
+    vertices : :obj:`numpy.ndarray` of shape (V,)
+        Indices of the vertices to include in the operator (e.g., excluding the medial wall).
+    sigma : :obj:`float`
+        Standard deviation of the Gaussian kernel, in millimeters.
+
+    Returns
+    -------
+    operator : :obj:`scipy.sparse.csr_matrix` of shape (V, V)
+        Smoothing operator.
+
+    Notes
+    -----
+    Geodesic distances are great-circle distances on the sphere.
+    As with Workbench's ``GEO_GAUSS_AREA`` method, the kernel is weighted by vertex area
+    to account for irregular meshes, and values outside ``vertices`` are not used.
+    """
+    coords, faces = nb.load(surf_file).agg_data(('pointset', 'triangle'))
+    coords = coords.astype(np.float64)
+    norms = np.linalg.norm(coords - coords.mean(axis=0), axis=1)
+    radius = norms.mean()
+    if np.ptp(norms) > 0.01 * radius:
+        raise ValueError(f'Cached CIFTI smoothing requires spherical surfaces: {surf_file}')
+
+    areas = _vertex_areas(coords, faces)[vertices]
+    cutoff = TRUNCATE * sigma
+    chord_cutoff = 2 * radius * np.sin(min(cutoff / (2 * radius), np.pi / 2))
+
+    def _great_circle(chord):
+        return 2 * radius * np.arcsin(np.clip(chord / (2 * radius), 0, 1))
+
+    return _gaussian_operator(
+        coords[vertices],
+        sigma,
+        distance_func=_great_circle,
+        weights=areas,
+        cutoff=chord_cutoff,
+    )
+
+
+def volume_smoothing_operator(voxels, affine, sigma):
+    """Build a Gaussian smoothing operator restricted to a set of voxels.
+
+    Parameters
+    ----------
+    voxels : :obj:`numpy.ndarray` of shape (N, 3)
+        Voxel indices of the structure.
+    affine : (4, 4) :obj:`numpy.ndarray`
+        Voxel-to-world affine.
+    sigma : :obj:`float`
+        Standard deviation of the Gaussian kernel, in millimeters.
+
+    Returns
+    -------
+    operator : :obj:`scipy.sparse.csr_matrix` of shape (N, N)
+        Smoothing operator.
+    """
+    coords = nb.affines.apply_affine(affine, voxels)
+    return _gaussian_operator(coords, sigma, distance_func=lambda dist: dist)
+
+
+def _cifti_operator_key(brain_models, left_surf, right_surf, sigma_surf, sigma_vol):
+    """Hash everything that determines a CIFTI smoothing operator."""
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps([OPERATOR_VERSION, TRUNCATE, float(sigma_surf), float(sigma_vol)]).encode()
+    )
+    for surf_file in (left_surf, right_surf):
+        digest.update(Path(surf_file).read_bytes())
+
+    for name, _, sub_models in brain_models.iter_structures():
+        digest.update(name.encode())
+        if sub_models.volume_mask.any():
+            digest.update(np.ascontiguousarray(sub_models.voxel, dtype=np.int64).tobytes())
+        else:
+            digest.update(np.ascontiguousarray(sub_models.vertex, dtype=np.int64).tobytes())
+
+    if brain_models.volume_mask.any():
+        digest.update(np.asarray(brain_models.affine, dtype=np.float64).tobytes())
+        digest.update(np.asarray(brain_models.volume_shape, dtype=np.int64).tobytes())
+
+    return digest.hexdigest()[:16]
+
+
+def get_cifti_smoothing_operator(
+    brain_models,
+    left_surf,
+    right_surf,
+    sigma_surf,
+    sigma_vol,
+    cache_dir=None,
+):
+    """Build, or load from a cache, the grayordinate smoothing operator for a CIFTI file.
+
+    Parameters
+    ----------
+    brain_models : :obj:`nibabel.cifti2.cifti2_axes.BrainModelAxis`
+        The brain models of the CIFTI file to smooth.
+    left_surf, right_surf : :obj:`str`
+        Spherical surfaces used to compute geodesic distances for each hemisphere.
+    sigma_surf, sigma_vol : :obj:`float`
+        Standard deviations of the surface and volume kernels, in millimeters.
+    cache_dir : :obj:`str` or None
+        Directory in which to cache operators.
+        The cache key depends on the surface contents, the kernels, and the brain models,
+        so one directory may be shared across subjects and runs.
+
+    Returns
+    -------
+    operator : :obj:`scipy.sparse.csr_matrix` of shape (G, G)
+        Block-diagonal smoothing operator over the G grayordinates.
+        Volumetric structures are smoothed independently, as in ``wb_command -cifti-smoothing``.
+    """
+    cache_file = None
+    if cache_dir is not None:
+        key = _cifti_operator_key(brain_models, left_surf, right_surf, sigma_surf, sigma_vol)
+        cache_file = Path(cache_dir) / f'cifti_smoothing_{key}.npz'
+        if cache_file.is_file():
+            LOGGER.debug(f'Loading cached CIFTI smoothing operator from {cache_file}.')
+            return sparse.load_npz(cache_file).tocsr()
+
+    surfaces = {
+        'CIFTI_STRUCTURE_CORTEX_LEFT': left_surf,
+        'CIFTI_STRUCTURE_CORTEX_RIGHT': right_surf,
+    }
+    blocks = []
+    for name, _, sub_models in brain_models.iter_structures():
+        if sub_models.volume_mask.any():
+            blocks.append(
+                volume_smoothing_operator(sub_models.voxel, brain_models.affine, sigma_vol)
+            )
+        elif name in surfaces:
+            blocks.append(
+                surface_smoothing_operator(surfaces[name], sub_models.vertex, sigma_surf)
+            )
+        else:
+            raise ValueError(f'No surface available to smooth structure {name}.')
+
+    operator = sparse.block_diag(blocks, format='csr')
+
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so concurrent jobs never read a partial operator.
+        tmp_file = cache_file.with_name(f'.{cache_file.stem}.{os.getpid()}.npz')
+        sparse.save_npz(tmp_file, operator)
+        os.replace(tmp_file, cache_file)
+        LOGGER.debug(f'Cached CIFTI smoothing operator in {cache_file}.')
+
+    return operator
+
+
+def smooth_cifti_with_operator(
+    in_file,
+    out_file,
+    left_surf,
+    right_surf,
+    sigma_surf,
+    sigma_vol,
+    cache_dir=None,
+):
+    """Smooth a CIFTI file along its brain models with a (cached) sparse operator.
+
+    Parameters
+    ----------
+    in_file : :obj:`str`
+        CIFTI file with brain models along the columns (e.g., a dtseries or dscalar).
+    out_file : :obj:`str`
+        Path to the smoothed CIFTI file.
+    left_surf, right_surf : :obj:`str`
+        Spherical surfaces for each hemisphere.
+    sigma_surf, sigma_vol : :obj:`float`
+        Standard deviations of the surface and volume kernels, in millimeters.
+    cache_dir : :obj:`str` or None
+        Directory in which to cache the operator.
+
+    Returns
+    -------
+    out_file : :obj:`str`
+        Path to the smoothed CIFTI file.
+    """
+    img = nb.load(in_file)
+    brain_models = img.header.get_axis(1)
+    operator = get_cifti_smoothing_operator(
+        brain_models,
+        left_surf,
+        right_surf,
+        sigma_surf,
+        sigma_vol,
+        cache_dir=cache_dir,
+    )
+
+    n_rows = img.shape[0]
+    out_data = np.empty(img.shape, dtype=np.float32)
+    for start in range(0, n_rows, CIFTI_BLOCK_SIZE):
+        stop = min(start + CIFTI_BLOCK_SIZE, n_rows)
+        block = np.asanyarray(img.dataobj[start:stop], dtype=np.float64)
+        out_data[start:stop] = (operator @ block.T).T
+
+    out_img = nb.Cifti2Image(out_data, header=img.header, nifti_header=img.nifti_header)
+    out_img.nifti_header.set_data_dtype(np.float32)
+    out_img.to_filename(out_file)
+    return out_file
@@ -680,25 +680,14 @@ def _transpose_lol(lol):
     return list(map(list, zip(*lol, strict=False)))
 
 
-def _create_mem_gb(bold_fname):
-    # Load only the header to get shape and data type information
-    bold_img = nb.load(bold_fname)
+def _create_mem_gb(bold_fname, n_atlases=1, n_exact_scans=0):
+    """Estimate the resources needed to postprocess a BOLD file.
 
-    # Calculate uncompressed memory size from header information
-    # This accounts for compression (e.g., .nii.gz files)
-    n_voxels = np.prod(bold_img.shape)
-    dtype_size = bold_img.get_data_dtype().itemsize
-    uncompressed_size_gb = (n_voxels * dtype_size) / (1024**3)
-
-    n_volumes = bold_img.shape[-1]
-
-    # Estimate memory usage based on uncompressed size
-    mem_gbz = {
-        'bold': uncompressed_size_gb,
-        'volume': uncompressed_size_gb / n_volumes,
-    }
+    See :func:`~xcp_d.utils.resources.estimate_resources` for details.
+    """
+    from xcp_d.utils.resources import estimate_resources
 
-    return mem_gbz
+    return estimate_resources(bold_fname, n_atlases=n_atlases, n_exact_scans=n_exact_scans)
 
 
 def is_number(s):
@@ -6,14 +6,15 @@ import os
 
 import nibabel as nb
 import numpy as np
-from nilearn import masking
 from nipype import logging
-from templateflow.api import get as get_template
 
 from xcp_d.utils.doc import fill_doc
 from xcp_d.utils.filemanip import split_filename
+from xcp_d.utils.lazy import lazy_import
 
 LOGGER = logging.getLogger('nipype.utils')
+masking = lazy_import('nilearn.masking')
+tflow = lazy_import('templateflow.api')
 
 
 def read_ndata(datafile, maskfile=None):
@@ -202,7 +203,7 @@ def write_gii(datat, template, filename, hemi):
     """
     datax = np.array(datat, dtype='float32')
     template = str(
-        get_template(
+        tflow.get(
             'fsLR',
             hemi=hemi,
             suffix='midthickness',
@@ -13,13 +13,11 @@ from xcp_d import config
 from xcp_d.config import dismiss_hash
 from xcp_d.data import load as load_data
 from xcp_d.interfaces.bids import DerivativesDataSink
-from xcp_d.interfaces.execsummary import PlotSlicesForBrainSprite
+from xcp_d.interfaces.execsummary import PlotSlicesForBrainSprite, RenderScenes
 from xcp_d.interfaces.nilearn import ApplyMask, ResampleToImage
-from xcp_d.interfaces.workbench import ShowScene
 from xcp_d.utils.doc import fill_doc
 from xcp_d.utils.execsummary import (
     get_png_image_names,
-    make_mosaic,
     modify_pngs_scene_template,
 )
 from xcp_d.workflows.plotting import init_plot_overlay_wf
@@ -138,10 +136,12 @@ def init_brainsprite_figures_wf(
 
         # Modify template scene file with file paths
         plot_slices = pe.Node(
-            PlotSlicesForBrainSprite(n_procs=config.nipype.omp_nthreads),
+            # Sessions that share anatomical data reuse the same images
+            PlotSlicesForBrainSprite(
+                reportlet_store=str(config.execution.work_dir / 'reportlet_store'),
+            ),
             name=f'plot_slices_{image_type}',
-            mem_gb=config.DEFAULT_MEMORY_MIN_GB,
-            n_procs=config.nipype.omp_nthreads,
+            mem_gb=1,
         )
         workflow.connect([
             (inputnode, plot_slices, [(inputnode_anat_name, 'nifti')]),
@@ -153,18 +153,6 @@ def init_brainsprite_figures_wf(
             ]),
         ])  # fmt:skip
 
-        # Make mosaic
-        make_mosaic_node = pe.Node(
-            Function(
-                function=make_mosaic,
-                input_names=['png_files'],
-                output_names=['mosaic_file'],
-            ),
-            name=f'make_mosaic_{image_type}',
-            mem_gb=1,
-        )
-        workflow.connect([(plot_slices, make_mosaic_node, [('out_files', 'png_files')])])
-
         ds_report_mosaic_file = pe.Node(
             DerivativesDataSink(
                 dismiss_entities=dismiss_hash(['desc']),
@@ -176,7 +164,7 @@ def init_brainsprite_figures_wf(
         )
         workflow.connect([
             (inputnode, ds_report_mosaic_file, [(inputnode_anat_name, 'source_file')]),
-            (make_mosaic_node, ds_report_mosaic_file, [('mosaic_file', 'in_file')]),
+            (plot_slices, ds_report_mosaic_file, [('mosaic_file', 'in_file')]),
         ])  # fmt:skip
 
         # Start working on the selected PNG images for the button
@@ -216,18 +204,29 @@ def init_brainsprite_figures_wf(
             name=f'get_png_scene_names_{image_type}',
         )
 
-        create_scenewise_pngs = pe.MapNode(
-            ShowScene(image_width=900, image_height=800, num_threads=config.nipype.omp_nthreads),
+        # Render all of the scenes in one node
+        create_scenewise_pngs = pe.Node(
+            RenderScenes(
+                image_width=900,
+                image_height=800,
+                renderer=config.workflow.scene_renderer,
+                num_threads=config.nipype.omp_nthreads,
+                reportlet_store=str(config.execution.work_dir / 'reportlet_store'),
+            ),
             name=f'create_scenewise_pngs_{image_type}',
-            iterfield=['scene_name_or_number'],
             mem_gb=1,
             n_procs=config.nipype.omp_nthreads,
         )
         workflow.connect([
-            (modify_pngs_template_scene, create_scenewise_pngs, [('out_file', 'scene_file')]),
-            (get_png_scene_names, create_scenewise_pngs, [
-                ('scene_index', 'scene_name_or_number'),
+            (inputnode, create_scenewise_pngs, [(inputnode_anat_name, 'anat_file')]),
+            (surface_buffer, create_scenewise_pngs, [
+                ('lh_wm_surf', 'lh_wm_surf'),
+                ('rh_wm_surf', 'rh_wm_surf'),
+                ('lh_pial_surf', 'lh_pial_surf'),
+                ('rh_pial_surf', 'rh_pial_surf'),
             ]),
+            (modify_pngs_template_scene, create_scenewise_pngs, [('out_file', 'scene_file')]),
+            (get_png_scene_names, create_scenewise_pngs, [('scene_index', 'scene_names')]),
         ])  # fmt:skip
 
         ds_report_scenewise_pngs = pe.MapNode(
@@ -243,7 +242,7 @@ def init_brainsprite_figures_wf(
         workflow.connect([
             (inputnode, ds_report_scenewise_pngs, [(inputnode_anat_name, 'source_file')]),
             (get_png_scene_names, ds_report_scenewise_pngs, [('scene_descriptions', 'desc')]),
-            (create_scenewise_pngs, ds_report_scenewise_pngs, [('out_file', 'in_file')]),
+            (create_scenewise_pngs, ds_report_scenewise_pngs, [('out_files', 'in_file')]),
         ])  # fmt:skip
 
     return workflow
@@ -4,7 +4,6 @@
 
 import os
 import sys
-from copy import deepcopy
 from pathlib import Path
 
 import bids
@@ -29,17 +28,18 @@ from xcp_d.interfaces.bids import DerivativesDataSink
 from xcp_d.interfaces.report import AboutSummary, SubjectSummary
 from xcp_d.utils.bids import (
     _get_tr,
-    collect_confounds,
+    collect_confounds_for_runs,
     collect_data,
     collect_mesh_data,
     collect_morphometry_data,
-    collect_run_data,
+    collect_run_data_for_runs,
     get_entity,
     get_preproc_pipeline_info,
     group_across_runs,
 )
 from xcp_d.utils.doc import fill_doc
-from xcp_d.utils.modified_data import calculate_exact_scans, flag_bad_run
+from xcp_d.utils.modified_data import calculate_exact_scans, flag_bad_runs
+from xcp_d.utils.resources import estimate_resources
 from xcp_d.utils.utils import estimate_brain_radius, is_number
 from xcp_d.workflows.anatomical.parcellation import init_parcellate_surfaces_wf
 from xcp_d.workflows.anatomical.surface import init_postprocess_surfaces_wf
@@ -81,22 +81,47 @@ def init_xcpd_wf():
     for subject_id, anat_session, func_sessions in config.execution.processing_list:
         single_subject_wf = init_single_subject_wf(subject_id, anat_session, func_sessions)
 
-        single_subject_wf.config['execution']['crashdump_dir'] = str(
-            config.execution.output_dir / f'sub-{subject_id}' / 'log' / config.execution.run_uuid
-        )
+        # Nodes share the subject's config, as nipype merges it into a new dict at run time.
         for node in single_subject_wf._get_all_nodes():
-            node.config = deepcopy(single_subject_wf.config)
+            node.config = single_subject_wf.config
 
         xcpd_wf.add_nodes([single_subject_wf])
 
-        # Dump a copy of the config file into the log directory
+    set_run_logs(xcpd_wf)
+
+    return xcpd_wf
+
+
+def set_run_logs(xcpd_wf):
+    """Point each subject's crash files to the log directory of the current run.
+
+    A copy of the config file is also written to each log directory.
+    This is separate from :func:`init_xcpd_wf` so that it can be applied
+    to a workflow built by an earlier run.
+
+    Parameters
+    ----------
+    xcpd_wf : :obj:`~nipype.pipeline.engine.Workflow`
+        The workflow from :func:`init_xcpd_wf`.
+    """
+    for subject_id, anat_session, func_sessions in config.execution.processing_list:
         log_dir = (
             config.execution.output_dir / f'sub-{subject_id}' / 'log' / config.execution.run_uuid
         )
+        single_subject_wf = xcpd_wf.get_node(
+            _get_subject_wf_name(subject_id, anat_session, func_sessions)
+        )
+        # The config is shared by all of the subject's nodes, so update it in place.
+        single_subject_wf.config['execution']['crashdump_dir'] = str(log_dir)
+
+        # Dump a copy of the config file into the log directory
         log_dir.mkdir(exist_ok=True, parents=True)
         config.to_filename(log_dir / 'xcp_d.toml')
 
-    return xcpd_wf
+
+def _get_subject_wf_name(subject_id, anat_session, func_sessions):
+    """Get the name of a single-subject workflow."""
+    return f'sub_{subject_id}_ses_{anat_session}_ses_{"".join(func_sessions)}_wf'
 
 
 @fill_doc
@@ -229,9 +254,7 @@ def init_single_subject_wf(subject_id: str, anat_session: str, func_sessions: li
     inputnode.inputs.myelin = morphometry_files['myelin']
     inputnode.inputs.myelin_smoothed = morphometry_files['myelin_smoothed']
 
-    workflow = Workflow(
-        name=f'sub_{subject_id}_ses_{anat_session}_ses_{"".join(func_sessions)}_wf'
-    )
+    workflow = Workflow(name=_get_subject_wf_name(subject_id, anat_session, func_sessions))
 
     info_dict = get_preproc_pipeline_info(
         input_type=config.workflow.input_type,
@@ -480,12 +503,57 @@ It is released under the [CC0](https://creativecommons.org/publicdomain/zero/1.0
         )
 
     n_runs = len(preproc_files)
+    if isinstance(config.execution.confounds_config, Path):
+        # Resolve the confounds of all of the subject's runs at once
+        confounds_dicts = collect_confounds_for_runs(
+            bold_files=preproc_files,
+            preproc_dataset=config.execution.layout,
+            derivatives_datasets=config.execution.datasets,
+            confound_spec=yaml.safe_load(config.execution.confounds_config.read_text()),
+            database_dir=config.execution.bids_database_dir,
+        )
+    else:
+        confounds_dicts = dict.fromkeys(preproc_files)
+
+    # Resolve the associated files of all of the subject's runs at once
+    run_datas = collect_run_data_for_runs(
+        layout=config.execution.layout,
+        bold_files=preproc_files,
+        file_format=config.workflow.file_format,
+        target_space=target_space,
+    )
+    for bold_file, run_data in run_datas.items():
+        run_data['confounds'] = confounds_dicts[bold_file]
+
+    # Pre-scan motion for all runs in parallel.
+    # The processed motion parameters are cached in the working directory,
+    # to be reused by each run's ProcessMotion node.
+    post_scrubbing_durations = flag_bad_runs(
+        [
+            {
+                'motion_file': run_data['motion_file'],
+                'dummy_scans': config.workflow.dummy_scans,
+                'TR': run_data['bold_metadata']['RepetitionTime'],
+                'motion_filter_type': config.workflow.motion_filter_type,
+                'motion_filter_order': config.workflow.motion_filter_order,
+                'band_stop_min': config.workflow.band_stop_min,
+                'band_stop_max': config.workflow.band_stop_max,
+                'head_radius': head_radius,
+                'fd_thresh': config.workflow.fd_thresh,
+                'cache_dir': str(config.execution.work_dir / 'motion_prescan'),
+            }
+            for run_data in run_datas.values()
+        ],
+        n_procs=config.nipype.nprocs,
+    )
+    post_scrubbing_durations = dict(zip(run_datas, post_scrubbing_durations, strict=True))
+
     # group files across runs and directions, to facilitate concatenation
     preproc_files = group_across_runs(preproc_files)
     run_counter = 0
     for ent_set, task_files in enumerate(preproc_files):
         # Assuming TR is constant across runs for a given combination of entities.
-        TR = _get_tr(nb.load(task_files[0]))
+        TR = _get_tr(task_files[0])
 
         # We only "concatenate" if scans are named with a run or direction entity.
         multirun_entity = get_entity(task_files[0], 'run') is not None
@@ -507,6 +575,7 @@ It is released under the [CC0](https://creativecommons.org/publicdomain/zero/1.0
                 'boldref',
                 'timeseries',
                 'timeseries_ciftis',
+                'correlation_accumulators',
             ]
             merge_dict = {
                 io_name: pe.Node(
@@ -516,36 +585,10 @@ It is released under the [CC0](https://creativecommons.org/publicdomain/zero/1.0
                 for io_name in merge_elements
             }
 
-        n_processed_task_runs = 0
+        processed_task_files = []
         for j_run, bold_file in enumerate(task_files):
-            run_data = collect_run_data(
-                layout=config.execution.layout,
-                bold_file=bold_file,
-                file_format=config.workflow.file_format,
-                target_space=target_space,
-            )
-            if isinstance(config.execution.confounds_config, Path):
-                confounds_dict = collect_confounds(
-                    bold_file=bold_file,
-                    preproc_dataset=config.execution.layout,
-                    derivatives_datasets=config.execution.datasets,
-                    confound_spec=yaml.safe_load(config.execution.confounds_config.read_text()),
-                )
-                run_data['confounds'] = confounds_dict
-            else:
-                run_data['confounds'] = None
-
-            post_scrubbing_duration = flag_bad_run(
-                motion_file=run_data['motion_file'],
-                dummy_scans=config.workflow.dummy_scans,
-                TR=run_data['bold_metadata']['RepetitionTime'],
-                motion_filter_type=config.workflow.motion_filter_type,
-                motion_filter_order=config.workflow.motion_filter_order,
-                band_stop_min=config.workflow.band_stop_min,
-                band_stop_max=config.workflow.band_stop_max,
-                head_radius=head_radius,
-                fd_thresh=config.workflow.fd_thresh,
-            )
+            run_data = run_datas[bold_file]
+            post_scrubbing_duration = post_scrubbing_durations[bold_file]
 
             if (config.workflow.min_time >= 0) and (
                 post_scrubbing_duration < config.workflow.min_time
@@ -580,7 +623,7 @@ It is released under the [CC0](https://creativecommons.org/publicdomain/zero/1.0
                 name=f'postprocess_{run_counter}_wf',
             )
             run_counter += 1
-            n_processed_task_runs += 1
+            processed_task_files.append(bold_file)
 
             workflow.connect([
                 (inputnode, postprocess_bold_wf, [
@@ -620,10 +663,14 @@ It is released under the [CC0](https://creativecommons.org/publicdomain/zero/1.0
                         (postprocess_bold_wf, node, [(f'outputnode.{io_name}', f'in{j_run + 1}')]),
                     ])  # fmt:skip
 
-        if config.workflow.combine_runs and (n_processed_task_runs > 0) and multiscans:
+        if config.workflow.combine_runs and processed_task_files and multiscans:
             concatenate_data_wf = init_concatenate_data_wf(
                 TR=TR,
                 head_radius=head_radius,
+                mem_gb=estimate_resources(
+                    processed_task_files,
+                    n_atlases=len(config.execution.atlases),
+                ),
                 name=f'concatenate_entity_set_{ent_set}_wf',
             )
 
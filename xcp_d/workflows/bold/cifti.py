@@ -126,6 +126,9 @@ def init_postprocess_cifti_wf(
     bold_mask
     %(timeseries)s
     %(timeseries_ciftis)s
+    correlation_accumulators
+        Running sums for correlations across runs.
+        Only defined when runs are combined incrementally.
 
     References
     ----------
@@ -201,12 +204,17 @@ the following post-processing was performed.
                 # if parcellation is performed
                 'timeseries',
                 'timeseries_ciftis',
+                'correlation_accumulators',  # only for incremental concatenation
             ],
         ),
         name='outputnode',
     )
 
-    mem_gbx = _create_mem_gb(bold_file)
+    mem_gbx = _create_mem_gb(
+        bold_file,
+        n_atlases=len(config.execution.atlases),
+        n_exact_scans=len(exact_scans),
+    )
 
     downcast_data = pe.Node(
         ConvertTo32(),
@@ -226,6 +234,7 @@ the following post-processing was performed.
         TR=TR,
         exact_scans=exact_scans,
         head_radius=head_radius,
+        mem_gb=mem_gbx,
     )
 
     workflow.connect([
@@ -256,7 +265,7 @@ the following post-processing was performed.
     ])  # fmt:skip
 
     if despike:
-        despike_wf = init_despike_wf(TR=TR)
+        despike_wf = init_despike_wf(TR=TR, mem_gb=mem_gbx)
 
         workflow.connect([
             (prepare_confounds_wf, despike_wf, [
@@ -402,6 +411,9 @@ the following post-processing was performed.
                 ('outputnode.correlations_exact', 'inputnode.correlations_exact'),
                 ('outputnode.parcellated_reho', 'inputnode.parcellated_reho'),
             ]),
+            (connectivity_wf, outputnode, [
+                ('outputnode.correlation_accumulators', 'correlation_accumulators'),
+            ]),
         ])  # fmt:skip
 
         if bandpass_filter:
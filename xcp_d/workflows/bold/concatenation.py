@@ -11,16 +11,18 @@ from xcp_d.interfaces.concatenation import (
     CleanNameSource,
     ConcatenateInputs,
     FilterOutFailedRuns,
+    FinalizeCorrelations,
 )
 from xcp_d.interfaces.connectivity import CiftiToTSV, TSVConnect
 from xcp_d.interfaces.workbench import CiftiCorrelation
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.resources import get_mem_gb, get_n_procs
 from xcp_d.utils.utils import _select_first
 from xcp_d.workflows.bold.plotting import init_qc_report_wf
 
 
 @fill_doc
-def init_concatenate_data_wf(TR, head_radius, name='concatenate_data_wf'):
+def init_concatenate_data_wf(TR, head_radius, mem_gb=None, name='concatenate_data_wf'):
     """Concatenate postprocessed data across runs and directions.
 
     Workflow Graph
@@ -43,6 +45,10 @@ def init_concatenate_data_wf(TR, head_radius, name='concatenate_data_wf'):
     ----------
     %(TR)s
     %(head_radius)s
+    mem_gb : :obj:`dict` or None
+        Resource estimates for the concatenated data,
+        from :func:`~xcp_d.utils.resources.estimate_resources`.
+        If None, the concatenated BOLD data are assumed to be 6 GB.
     %(name)s
         Default is "concatenate_data_wf".
 
@@ -74,6 +80,10 @@ def init_concatenate_data_wf(TR, head_radius, name='concatenate_data_wf'):
         This will be a list of lists, with one sublist for each run.
     %(timeseries_ciftis)s
         This will be a list of lists, with one sublist for each run.
+    correlation_accumulators
+        Running sums for correlations, from each run's connectivity workflow.
+        This will be a list of lists, with one sublist for each run.
+        Only used when runs are combined incrementally.
     """
     workflow = Workflow(name=name)
 
@@ -82,12 +92,21 @@ def init_concatenate_data_wf(TR, head_radius, name='concatenate_data_wf'):
     file_format = config.workflow.file_format
     fd_thresh = config.workflow.fd_thresh
     atlases = config.execution.atlases
+    incremental = config.workflow.incremental_concatenation
+    # In incremental mode, the concatenated BOLD files are only written when requested.
+    concatenate_bold = not incremental or config.workflow.concatenate_bold
 
-    # Guess memory needs since they can't be estimated from the inputs
-    mem_gb = {'bold': 6.0, 'volume': 1.0}
+    if mem_gb is None:
+        # Guess memory needs since they can't be estimated from the inputs
+        mem_gb = {'bold': 6.0, 'volume': 1.0}
 
     workflow.__desc__ = """
 Postprocessing derivatives from multi-run tasks were then concatenated across runs and directions.
+"""
+    if incremental:
+        workflow.__desc__ += """\
+Correlation matrices for the concatenated data were computed from sums of the low-motion volumes'
+parcellated time series and their cross-products, accumulated across runs.
 """
 
     inputnode = pe.Node(
@@ -109,6 +128,7 @@ Postprocessing derivatives from multi-run tasks were then concatenated across ru
                 'template_to_anat_xfm',  # only for niftis, from data collection
                 'timeseries',
                 'timeseries_ciftis',  # only for ciftis, from postproc workflows
+                'correlation_accumulators',  # only for incremental concatenation
             ],
         ),
         name='inputnode',
@@ -138,59 +158,68 @@ Postprocessing derivatives from multi-run tasks were then concatenated across ru
             ('boldref', 'boldref'),
             ('timeseries', 'timeseries'),
             ('timeseries_ciftis', 'timeseries_ciftis'),
+            ('correlation_accumulators', 'correlation_accumulators'),
         ])
     ])  # fmt:skip
 
     concatenate_inputs = pe.Node(
-        ConcatenateInputs(),
+        ConcatenateInputs(n_procs=get_n_procs(mem_gb, 'concatenate')),
         name='concatenate_inputs',
-        mem_gb=mem_gb['bold'],
+        # Without BOLD files, only run-wise tables and parcellated time series are concatenated.
+        mem_gb=get_mem_gb(mem_gb, 'concatenate') if concatenate_bold else mem_gb['volume'],
+        n_procs=get_n_procs(mem_gb, 'concatenate'),
     )
 
     workflow.connect([
         (filter_runs, concatenate_inputs, [
-            ('preprocessed_bold', 'preprocessed_bold'),
             ('motion_file', 'motion_file'),
             ('temporal_mask', 'temporal_mask'),
-            ('denoised_bold', 'denoised_bold'),
-            ('denoised_interpolated_bold', 'denoised_interpolated_bold'),
-            ('censored_denoised_bold', 'censored_denoised_bold'),
-            ('smoothed_denoised_bold', 'smoothed_denoised_bold'),
             ('timeseries', 'timeseries'),
             ('timeseries_ciftis', 'timeseries_ciftis'),
         ]),
     ])  # fmt:skip
 
-    # Now, run the QC report workflow on the concatenated BOLD file.
-    qc_report_wf = init_qc_report_wf(
-        TR=TR,
-        head_radius=head_radius,
-        mem_gb=mem_gb,
-        name='concat_qc_report_wf',
-    )
-    qc_report_wf.inputs.inputnode.dummy_scans = 0
+    if concatenate_bold:
+        workflow.connect([
+            (filter_runs, concatenate_inputs, [
+                ('preprocessed_bold', 'preprocessed_bold'),
+                ('denoised_bold', 'denoised_bold'),
+                ('denoised_interpolated_bold', 'denoised_interpolated_bold'),
+                ('censored_denoised_bold', 'censored_denoised_bold'),
+                ('smoothed_denoised_bold', 'smoothed_denoised_bold'),
+            ]),
+        ])  # fmt:skip
 
-    workflow.connect([
-        (inputnode, qc_report_wf, [
-            ('template_to_anat_xfm', 'inputnode.template_to_anat_xfm'),
-            ('anat_native', 'inputnode.anat'),
-            ('anat_brainmask', 'inputnode.anat_brainmask'),
-        ]),
-        (clean_name_source, qc_report_wf, [('name_source', 'inputnode.name_source')]),
-        (filter_runs, qc_report_wf, [
-            # nifti-only inputs
-            (('bold_mask', _select_first), 'inputnode.bold_mask'),
-            (('boldref', _select_first), 'inputnode.boldref'),
-        ]),
-        (concatenate_inputs, qc_report_wf, [
-            ('preprocessed_bold', 'inputnode.preprocessed_bold'),
-            ('denoised_interpolated_bold', 'inputnode.denoised_interpolated_bold'),
-            ('censored_denoised_bold', 'inputnode.censored_denoised_bold'),
-            ('motion_file', 'inputnode.motion_file'),
-            ('temporal_mask', 'inputnode.temporal_mask'),
-            ('run_index', 'inputnode.run_index'),
-        ]),
-    ])  # fmt:skip
+        # Now, run the QC report workflow on the concatenated BOLD file.
+        qc_report_wf = init_qc_report_wf(
+            TR=TR,
+            head_radius=head_radius,
+            mem_gb=mem_gb,
+            name='concat_qc_report_wf',
+        )
+        qc_report_wf.inputs.inputnode.dummy_scans = 0
+
+        workflow.connect([
+            (inputnode, qc_report_wf, [
+                ('template_to_anat_xfm', 'inputnode.template_to_anat_xfm'),
+                ('anat_native', 'inputnode.anat'),
+                ('anat_brainmask', 'inputnode.anat_brainmask'),
+            ]),
+            (clean_name_source, qc_report_wf, [('name_source', 'inputnode.name_source')]),
+            (filter_runs, qc_report_wf, [
+                # nifti-only inputs
+                (('bold_mask', _select_first), 'inputnode.bold_mask'),
+                (('boldref', _select_first), 'inputnode.boldref'),
+            ]),
+            (concatenate_inputs, qc_report_wf, [
+                ('preprocessed_bold', 'inputnode.preprocessed_bold'),
+                ('denoised_interpolated_bold', 'inputnode.denoised_interpolated_bold'),
+                ('censored_denoised_bold', 'inputnode.censored_denoised_bold'),
+                ('motion_file', 'inputnode.motion_file'),
+                ('temporal_mask', 'inputnode.temporal_mask'),
+                ('run_index', 'inputnode.run_index'),
+            ]),
+        ])  # fmt:skip
 
     motion_src = pe.Node(
         BIDSURI(
@@ -245,90 +274,91 @@ Postprocessing derivatives from multi-run tasks were then concatenated across ru
             (temporal_mask_src, ds_temporal_mask, [('out', 'Sources')]),
         ])  # fmt:skip
 
-    if file_format == 'cifti':
-        ds_denoised_bold = pe.Node(
-            DerivativesDataSink(
-                dismiss_entities=dismiss_hash(),
-                extension='.dtseries.nii',
-            ),
-            name='ds_denoised_bold',
-            run_without_submitting=True,
-            mem_gb=2,
-        )
-
-        if smoothing:
-            ds_smoothed_denoised_bold = pe.Node(
+    if concatenate_bold:
+        if file_format == 'cifti':
+            ds_denoised_bold = pe.Node(
                 DerivativesDataSink(
                     dismiss_entities=dismiss_hash(),
                     extension='.dtseries.nii',
                 ),
-                name='ds_smoothed_denoised_bold',
+                name='ds_denoised_bold',
                 run_without_submitting=True,
                 mem_gb=2,
             )
 
-    else:
-        ds_denoised_bold = pe.Node(
-            DerivativesDataSink(
-                dismiss_entities=dismiss_hash(),
-                extension='.nii.gz',
-                compression=True,
-            ),
-            name='ds_denoised_bold',
-            run_without_submitting=True,
-            mem_gb=2,
-        )
+            if smoothing:
+                ds_smoothed_denoised_bold = pe.Node(
+                    DerivativesDataSink(
+                        dismiss_entities=dismiss_hash(),
+                        extension='.dtseries.nii',
+                    ),
+                    name='ds_smoothed_denoised_bold',
+                    run_without_submitting=True,
+                    mem_gb=2,
+                )
 
-        if smoothing:
-            ds_smoothed_denoised_bold = pe.Node(
+        else:
+            ds_denoised_bold = pe.Node(
                 DerivativesDataSink(
                     dismiss_entities=dismiss_hash(),
                     extension='.nii.gz',
                     compression=True,
                 ),
-                name='ds_smoothed_denoised_bold',
+                name='ds_denoised_bold',
                 run_without_submitting=True,
                 mem_gb=2,
             )
 
-    denoised_bold_src = pe.Node(
-        BIDSURI(
-            numinputs=1,
-            dataset_links=config.execution.dataset_links,
-            out_dir=str(output_dir),
-        ),
-        name='denoised_bold_src',
-        run_without_submitting=True,
-    )
-    workflow.connect([(filter_runs, denoised_bold_src, [('denoised_bold', 'in1')])])
-
-    workflow.connect([
-        (filter_runs, ds_denoised_bold, [(('denoised_bold', _combine_name), 'source_file')]),
-        (concatenate_inputs, ds_denoised_bold, [('denoised_bold', 'in_file')]),
-        (denoised_bold_src, ds_denoised_bold, [('out', 'Sources')]),
-    ])  # fmt:skip
+            if smoothing:
+                ds_smoothed_denoised_bold = pe.Node(
+                    DerivativesDataSink(
+                        dismiss_entities=dismiss_hash(),
+                        extension='.nii.gz',
+                        compression=True,
+                    ),
+                    name='ds_smoothed_denoised_bold',
+                    run_without_submitting=True,
+                    mem_gb=2,
+                )
 
-    if smoothing:
-        smoothed_src = pe.Node(
+        denoised_bold_src = pe.Node(
             BIDSURI(
                 numinputs=1,
                 dataset_links=config.execution.dataset_links,
                 out_dir=str(output_dir),
             ),
-            name='smoothed_src',
+            name='denoised_bold_src',
             run_without_submitting=True,
         )
+        workflow.connect([(filter_runs, denoised_bold_src, [('denoised_bold', 'in1')])])
+
         workflow.connect([
-            (filter_runs, smoothed_src, [('smoothed_denoised_bold', 'in1')]),
-            (filter_runs, ds_smoothed_denoised_bold, [
-                (('smoothed_denoised_bold', _combine_name), 'source_file'),
-            ]),
-            (concatenate_inputs, ds_smoothed_denoised_bold, [
-                ('smoothed_denoised_bold', 'in_file'),
-            ]),
-            (smoothed_src, ds_smoothed_denoised_bold, [('out', 'Sources')]),
+            (filter_runs, ds_denoised_bold, [(('denoised_bold', _combine_name), 'source_file')]),
+            (concatenate_inputs, ds_denoised_bold, [('denoised_bold', 'in_file')]),
+            (denoised_bold_src, ds_denoised_bold, [('out', 'Sources')]),
         ])  # fmt:skip
 
+        if smoothing:
+            smoothed_src = pe.Node(
+                BIDSURI(
+                    numinputs=1,
+                    dataset_links=config.execution.dataset_links,
+                    out_dir=str(output_dir),
+                ),
+                name='smoothed_src',
+                run_without_submitting=True,
+            )
+            workflow.connect([
+                (filter_runs, smoothed_src, [('smoothed_denoised_bold', 'in1')]),
+                (filter_runs, ds_smoothed_denoised_bold, [
+                    (('smoothed_denoised_bold', _combine_name), 'source_file'),
+                ]),
+                (concatenate_inputs, ds_smoothed_denoised_bold, [
+                    ('smoothed_denoised_bold', 'in_file'),
+                ]),
+                (smoothed_src, ds_smoothed_denoised_bold, [('out', 'Sources')]),
+            ])  # fmt:skip
+
     # Functional connectivity outputs
     if atlases:
         make_timeseries_dict = pe.MapNode(
@@ -364,19 +394,33 @@ Postprocessing derivatives from multi-run tasks were then concatenated across ru
         ])  # fmt:skip
 
         if 'all' in config.workflow.correlation_lengths and file_format == 'nifti':
-            correlate_timeseries = pe.MapNode(
-                TSVConnect(),
-                run_without_submitting=True,
-                mem_gb=1,
-                name='correlate_timeseries',
-                iterfield=['timeseries'],
-            )
-            workflow.connect([
-                (concatenate_inputs, correlate_timeseries, [
-                    ('timeseries', 'timeseries'),
-                    ('temporal_mask', 'temporal_mask'),
-                ]),
-            ])  # fmt:skip
+            if incremental:
+                correlate_timeseries = pe.MapNode(
+                    FinalizeCorrelations(),
+                    run_without_submitting=True,
+                    mem_gb=1,
+                    name='correlate_timeseries',
+                    iterfield=['accumulators'],
+                )
+                workflow.connect([
+                    (filter_runs, correlate_timeseries, [
+                        ('correlation_accumulators', 'accumulators'),
+                    ]),
+                ])  # fmt:skip
+            else:
+                correlate_timeseries = pe.MapNode(
+                    TSVConnect(),
+                    run_without_submitting=True,
+                    mem_gb=1,
+                    name='correlate_timeseries',
+                    iterfield=['timeseries'],
+                )
+                workflow.connect([
+                    (concatenate_inputs, correlate_timeseries, [
+                        ('timeseries', 'timeseries'),
+                        ('temporal_mask', 'temporal_mask'),
+                    ]),
+                ])  # fmt:skip
 
             make_correlations_dict = pe.MapNode(
                 BIDSURI(
@@ -459,18 +503,37 @@ Postprocessing derivatives from multi-run tasks were then concatenated across ru
                 )
                 workflow.connect([(ds_cifti_ts, correlate_cifti_ts_src, [('out_file', 'in1')])])
 
-                # Correlate the parcellated data
-                correlate_cifti_ts = pe.MapNode(
-                    CiftiCorrelation(
-                        num_threads=config.nipype.omp_nthreads,
-                    ),
-                    name='correlate_cifti_ts',
-                    iterfield=['in_file'],
-                    n_procs=config.nipype.omp_nthreads,
-                )
-                workflow.connect([
-                    (ds_cifti_ts, correlate_cifti_ts, [('out_file', 'in_file')]),
-                ])  # fmt:skip
+                if incremental:
+                    # Finalize the correlations from the runs' accumulated sums.
+                    # The concatenated parcellated data only provide the parcel axis.
+                    correlate_cifti_ts = pe.MapNode(
+                        FinalizeCorrelations(),
+                        name='correlate_cifti_ts',
+                        iterfield=['accumulators', 'parcellated_cifti'],
+                    )
+                    workflow.connect([
+                        (filter_runs, correlate_cifti_ts, [
+                            ('correlation_accumulators', 'accumulators'),
+                        ]),
+                        (concatenate_inputs, correlate_cifti_ts, [
+                            ('timeseries_ciftis', 'parcellated_cifti'),
+                        ]),
+                    ])  # fmt:skip
+                    correlations_field = 'correlations'
+                else:
+                    # Correlate the parcellated data
+                    correlate_cifti_ts = pe.MapNode(
+                        CiftiCorrelation(
+                            num_threads=config.nipype.omp_nthreads,
+                        ),
+                        name='correlate_cifti_ts',
+                        iterfield=['in_file'],
+                        n_procs=config.nipype.omp_nthreads,
+                    )
+                    workflow.connect([
+                        (ds_cifti_ts, correlate_cifti_ts, [('out_file', 'in_file')]),
+                    ])  # fmt:skip
+                    correlations_field = 'out_file'
 
                 ds_cifti_correlations = pe.MapNode(
                     DerivativesDataSink(
@@ -488,7 +551,7 @@ Postprocessing derivatives from multi-run tasks were then concatenated across ru
                     (filter_runs, ds_cifti_correlations, [
                         (('timeseries_ciftis', _combine_name), 'source_file'),
                     ]),
-                    (correlate_cifti_ts, ds_cifti_correlations, [('out_file', 'in_file')]),
+                    (correlate_cifti_ts, ds_cifti_correlations, [(correlations_field, 'in_file')]),
                     (correlate_cifti_ts_src, ds_cifti_correlations, [('metadata', 'meta_dict')]),
                 ])  # fmt:skip
 
@@ -502,7 +565,9 @@ Postprocessing derivatives from multi-run tasks were then concatenated across ru
                     (inputnode, cifti_correlations_to_tsv, [
                         ('atlas_labels_files', 'atlas_labels'),
                     ]),
-                    (correlate_cifti_ts, cifti_correlations_to_tsv, [('out_file', 'in_file')]),
+                    (correlate_cifti_ts, cifti_correlations_to_tsv, [
+                        (correlations_field, 'in_file'),
+                    ]),
                 ])  # fmt:skip
 
                 cifti_correlations_tsv_src = pe.MapNode(
@@ -12,6 +12,7 @@ from xcp_d.config import dismiss_hash
 from xcp_d.interfaces.bids import DerivativesDataSink
 from xcp_d.utils.atlas import select_atlases
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.resources import get_mem_gb
 from xcp_d.workflows.parcellation import init_parcellate_cifti_wf
 
 LOGGER = logging.getLogger('nipype.workflow')
@@ -62,9 +63,13 @@ def init_functional_connectivity_nifti_wf(mem_gb, has_multiple_runs, name='conne
     %(timeseries)s
     %(correlations)s
     %(correlations_exact)s
+    correlation_accumulators
+        Running sums for correlations across runs.
+        Only defined when runs are combined incrementally.
     parcellated_alff
     parcellated_reho
     """
+    from xcp_d.interfaces.concatenation import AccumulateCorrelations
     from xcp_d.interfaces.connectivity import ConnectPlot, NiftiParcellate, TSVConnect
 
     workflow = Workflow(name=name)
@@ -105,6 +110,7 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
                 'timeseries',
                 'correlations',
                 'correlations_exact',
+                'correlation_accumulators',
                 'parcellated_alff',
                 'parcellated_reho',
             ],
@@ -116,7 +122,7 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
         NiftiParcellate(min_coverage=min_coverage),
         name='parcellate_data',
         iterfield=['atlas', 'atlas_labels'],
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'parcellate'),
     )
     workflow.connect([
         (inputnode, parcellate_data, [
@@ -138,7 +144,7 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
             TSVConnect(),
             name='functional_connectivity',
             iterfield=['timeseries'],
-            mem_gb=mem_gb['bold'],
+            mem_gb=get_mem_gb(mem_gb, 'correlate'),
         )
         workflow.connect([
             (inputnode, functional_connectivity, [('temporal_mask', 'temporal_mask')]),
@@ -152,7 +158,7 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
         connectivity_plot = pe.Node(
             ConnectPlot(),
             name='connectivity_plot',
-            mem_gb=mem_gb['bold'],
+            mem_gb=get_mem_gb(mem_gb, 'connectivity_plot'),
         )
         workflow.connect([
             (inputnode, connectivity_plot, [
@@ -175,11 +181,23 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
             (connectivity_plot, ds_report_connectivity_plot, [('connectplot', 'in_file')]),
         ])  # fmt:skip
 
+    if _accumulate_correlations(has_multiple_runs):
+        accumulate_correlations = pe.MapNode(
+            AccumulateCorrelations(),
+            name='accumulate_correlations',
+            iterfield=['in_file'],
+        )
+        workflow.connect([
+            (inputnode, accumulate_correlations, [('temporal_mask', 'temporal_mask')]),
+            (parcellate_data, accumulate_correlations, [('timeseries', 'in_file')]),
+            (accumulate_correlations, outputnode, [('out_file', 'correlation_accumulators')]),
+        ])  # fmt:skip
+
     parcellate_reho = pe.MapNode(
         NiftiParcellate(min_coverage=min_coverage),
         name='parcellate_reho',
         iterfield=['atlas', 'atlas_labels'],
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'map'),
     )
     workflow.connect([
         (inputnode, parcellate_reho, [
@@ -196,7 +214,7 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
             NiftiParcellate(min_coverage=min_coverage),
             name='parcellate_alff',
             iterfield=['atlas', 'atlas_labels'],
-            mem_gb=mem_gb['bold'],
+            mem_gb=get_mem_gb(mem_gb, 'map'),
         )
         workflow.connect([
             (inputnode, parcellate_alff, [
@@ -274,10 +292,14 @@ def init_functional_connectivity_cifti_wf(
     %(timeseries)s
     %(correlations)s
     correlations_exact
+    correlation_accumulators
+        Running sums for correlations across runs, computed from the parcellated CIFTIs.
+        Only defined when runs are combined incrementally.
     parcellated_reho
     parcellated_alff
     """
     from xcp_d.interfaces.censoring import Censor
+    from xcp_d.interfaces.concatenation import AccumulateCorrelations
     from xcp_d.interfaces.connectivity import CiftiToTSV, ConnectPlot
     from xcp_d.interfaces.plotting import PlotCiftiParcellation
     from xcp_d.interfaces.workbench import CiftiCorrelation
@@ -327,6 +349,7 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
                 'timeseries',
                 'correlations',
                 'correlations_exact',
+                'correlation_accumulators',
                 'parcellated_alff',
                 'parcellated_reho',
             ],
@@ -353,6 +376,20 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
         ]),
     ])  # fmt:skip
 
+    if _accumulate_correlations(has_multiple_runs):
+        accumulate_correlations = pe.MapNode(
+            AccumulateCorrelations(),
+            name='accumulate_correlations',
+            iterfield=['in_file'],
+        )
+        workflow.connect([
+            (inputnode, accumulate_correlations, [('temporal_mask', 'temporal_mask')]),
+            (parcellate_bold_wf, accumulate_correlations, [
+                ('outputnode.parcellated_cifti', 'in_file'),
+            ]),
+            (accumulate_correlations, outputnode, [('out_file', 'correlation_accumulators')]),
+        ])  # fmt:skip
+
     # Filter out subcortical atlases
     cortical_atlases = select_atlases(atlases=config.execution.atlases, subset='cortical')
     if cortical_atlases:
@@ -360,6 +397,11 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
             PlotCiftiParcellation(
                 base_desc='coverage',
                 cortical_atlases=cortical_atlases,
+                surface_cache_dir=(
+                    str(config.execution.surface_cache_dir)
+                    if config.execution.surface_cache_dir
+                    else None
+                ),
                 vmin=0,
                 vmax=1,
             ),
@@ -448,13 +490,14 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
         connectivity_plot = pe.Node(
             ConnectPlot(),
             name='connectivity_plot',
-            mem_gb=mem_gb['bold'],
+            mem_gb=get_mem_gb(mem_gb, 'connectivity_plot'),
         )
         workflow.connect([
             (inputnode, connectivity_plot, [
                 ('atlases', 'atlases'),
                 ('atlas_labels_files', 'atlas_tsvs'),
             ]),
+            (correlate_bold, connectivity_plot, [('out_file', 'correlations_cifti')]),
             (dconn_to_tsv, connectivity_plot, [('out_file', 'correlations_tsv')]),
         ])  # fmt:skip
 
@@ -549,6 +592,11 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
             PlotCiftiParcellation(
                 base_desc='reho',
                 cortical_atlases=cortical_atlases,
+                surface_cache_dir=(
+                    str(config.execution.surface_cache_dir)
+                    if config.execution.surface_cache_dir
+                    else None
+                ),
             ),
             name='plot_parcellated_reho',
         )
@@ -600,6 +648,11 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
                 PlotCiftiParcellation(
                     base_desc='alff',
                     cortical_atlases=cortical_atlases,
+                    surface_cache_dir=(
+                        str(config.execution.surface_cache_dir)
+                        if config.execution.surface_cache_dir
+                        else None
+                    ),
                 ),
                 name='plot_parcellated_alff',
             )
@@ -628,3 +681,13 @@ or were set to zero (when the parcel had <{min_coverage * 100}% coverage).
             ])  # fmt:skip
 
     return workflow
+
+
+def _accumulate_correlations(has_multiple_runs):
+    """Determine if per-run running sums are needed for concatenated correlations."""
+    return (
+        has_multiple_runs
+        and config.workflow.combine_runs
+        and config.workflow.incremental_concatenation
+        and 'all' in config.workflow.correlation_lengths
+    )
@@ -14,6 +14,7 @@ from xcp_d.interfaces.nilearn import Smooth
 from xcp_d.interfaces.plotting import PlotDenseCifti, PlotNifti
 from xcp_d.interfaces.restingstate import ComputeALFF, ReHoNamePatch, SurfaceReHo
 from xcp_d.interfaces.workbench import (
+    CachedCiftiSmooth,
     CiftiCreateDenseFromTemplate,
     CiftiSeparateMetric,
     CiftiSeparateVolumeAll,
@@ -21,6 +22,7 @@ from xcp_d.interfaces.workbench import (
     FixCiftiIntent,
 )
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.resources import get_mem_gb, get_n_procs
 from xcp_d.utils.utils import fwhm2sigma
 
 
@@ -145,11 +147,11 @@ series to retain the original scaling.
             TR=TR,
             low_pass=low_pass,
             high_pass=high_pass,
-            n_threads=config.nipype.omp_nthreads,
+            n_threads=get_n_procs(mem_gb, 'alff'),
         ),
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'alff'),
         name='alff_compt',
-        n_procs=config.nipype.omp_nthreads,
+        n_procs=get_n_procs(mem_gb, 'alff'),
     )
     workflow.connect([
         (inputnode, alff_compt, [
@@ -172,7 +174,14 @@ series to retain the original scaling.
 
     if file_format == 'cifti':
         alff_plot = pe.Node(
-            PlotDenseCifti(base_desc='alff'),
+            PlotDenseCifti(
+                base_desc='alff',
+                surface_cache_dir=(
+                    str(config.execution.surface_cache_dir)
+                    if config.execution.surface_cache_dir
+                    else None
+                ),
+            ),
             name='alff_plot',
         )
         workflow.connect([
@@ -197,22 +206,28 @@ series to retain the original scaling.
     if smoothing:  # If we want to smooth
         if file_format == 'nifti':
             workflow.__desc__ = workflow.__desc__ + (
-                ' The ALFF maps were smoothed with Nilearn using a Gaussian kernel '
+                ' The ALFF maps were smoothed within the brain mask using a Gaussian kernel '
                 f'(FWHM={str(smoothing)} mm).'
             )
-            # Smooth via Nilearn
+            # Smooth within the brain mask
             smooth_data = pe.Node(
                 Smooth(fwhm=smoothing),
                 name='niftismoothing',
             )
             workflow.connect([
+                (inputnode, smooth_data, [('bold_mask', 'mask')]),
                 (alff_compt, smooth_data, [('alff', 'in_file')]),
                 (smooth_data, outputnode, [('out_file', 'smoothed_alff')])
             ])  # fmt:skip
 
         else:  # If cifti
+            smoother = (
+                'a precomputed grayordinate smoothing operator'
+                if config.execution.smoothing_cache_dir
+                else 'the Connectome Workbench'
+            )
             workflow.__desc__ = workflow.__desc__ + (
-                ' The ALFF maps were smoothed with the Connectome Workbench using a Gaussian '
+                f' The ALFF maps were smoothed with {smoother} using a Gaussian '
                 f'kernel (FWHM={str(smoothing)} mm).'
             )
 
@@ -225,31 +240,50 @@ series to retain the original scaling.
             rh_midthickness = str(
                 get_template('fsLR', hemi='R', suffix='sphere', density='32k', raise_empty=True)[0]
             )
-            smooth_data = pe.Node(
-                CiftiSmooth(
-                    sigma_surf=sigma_lx,
-                    sigma_vol=sigma_lx,
-                    direction='COLUMN',
-                    right_surf=rh_midthickness,
-                    left_surf=lh_midthickness,
-                    num_threads=config.nipype.omp_nthreads,
-                ),
-                name='ciftismoothing',
-                mem_gb=mem_gb['bold'],
-                n_procs=config.nipype.omp_nthreads,
-            )
+            if config.execution.smoothing_cache_dir:
+                # Apply a cached grayordinate smoothing operator instead of calling workbench
+                smooth_data = pe.Node(
+                    CachedCiftiSmooth(
+                        sigma_surf=sigma_lx,
+                        sigma_vol=sigma_lx,
+                        right_surf=rh_midthickness,
+                        left_surf=lh_midthickness,
+                        cache_dir=str(config.execution.smoothing_cache_dir),
+                    ),
+                    name='ciftismoothing',
+                    mem_gb=get_mem_gb(mem_gb, 'map'),
+                )
+                workflow.connect([
+                    (alff_compt, smooth_data, [('alff', 'in_file')]),
+                    (smooth_data, outputnode, [('out_file', 'smoothed_alff')]),
+                ])  # fmt:skip
+
+            else:
+                smooth_data = pe.Node(
+                    CiftiSmooth(
+                        sigma_surf=sigma_lx,
+                        sigma_vol=sigma_lx,
+                        direction='COLUMN',
+                        right_surf=rh_midthickness,
+                        left_surf=lh_midthickness,
+                        num_threads=get_n_procs(mem_gb, 'map'),
+                    ),
+                    name='ciftismoothing',
+                    mem_gb=get_mem_gb(mem_gb, 'map'),
+                    n_procs=get_n_procs(mem_gb, 'map'),
+                )
 
-            # Always check the intent code in CiftiSmooth's output file
-            fix_cifti_intent = pe.Node(
-                FixCiftiIntent(),
-                name='fix_cifti_intent',
-                mem_gb=mem_gb['bold'],
-            )
-            workflow.connect([
-                (alff_compt, smooth_data, [('alff', 'in_file')]),
-                (smooth_data, fix_cifti_intent, [('out_file', 'in_file')]),
-                (fix_cifti_intent, outputnode, [('out_file', 'smoothed_alff')]),
-            ])  # fmt:skip
+                # Always check the intent code in CiftiSmooth's output file
+                fix_cifti_intent = pe.Node(
+                    FixCiftiIntent(),
+                    name='fix_cifti_intent',
+                    mem_gb=get_mem_gb(mem_gb, 'map'),
+                )
+                workflow.connect([
+                    (alff_compt, smooth_data, [('alff', 'in_file')]),
+                    (smooth_data, fix_cifti_intent, [('out_file', 'in_file')]),
+                    (fix_cifti_intent, outputnode, [('out_file', 'smoothed_alff')]),
+                ])  # fmt:skip
 
     return workflow
 
@@ -329,47 +363,47 @@ For the subcortical, volumetric data, ReHo was computed with neighborhood voxels
         CiftiSeparateMetric(
             metric='CORTEX_LEFT',
             direction='COLUMN',
-            num_threads=config.nipype.omp_nthreads,
+            num_threads=get_n_procs(mem_gb, 'convert'),
         ),
         name='separate_lh',
-        mem_gb=mem_gb['bold'],
-        n_procs=config.nipype.omp_nthreads,
+        mem_gb=get_mem_gb(mem_gb, 'convert'),
+        n_procs=get_n_procs(mem_gb, 'convert'),
     )
     rh_surf = pe.Node(
         CiftiSeparateMetric(
             metric='CORTEX_RIGHT',
             direction='COLUMN',
-            num_threads=config.nipype.omp_nthreads,
+            num_threads=get_n_procs(mem_gb, 'convert'),
         ),
         name='separate_rh',
-        mem_gb=mem_gb['bold'],
-        n_procs=config.nipype.omp_nthreads,
+        mem_gb=get_mem_gb(mem_gb, 'convert'),
+        n_procs=get_n_procs(mem_gb, 'convert'),
     )
     subcortical_nifti = pe.Node(
         CiftiSeparateVolumeAll(
             direction='COLUMN',
-            num_threads=config.nipype.omp_nthreads,
+            num_threads=get_n_procs(mem_gb, 'convert'),
         ),
         name='separate_subcortical',
-        mem_gb=mem_gb['bold'],
-        n_procs=config.nipype.omp_nthreads,
+        mem_gb=get_mem_gb(mem_gb, 'convert'),
+        n_procs=get_n_procs(mem_gb, 'convert'),
     )
 
     # Calculate the reho by hemisphere
     lh_reho = pe.Node(
         SurfaceReHo(surf_hemi='L'),
         name='reho_lh',
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'reho'),
     )
     rh_reho = pe.Node(
         SurfaceReHo(surf_hemi='R'),
         name='reho_rh',
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'reho'),
     )
     subcortical_reho = pe.Node(
         ReHoNamePatch(neighborhood='vertices'),
         name='reho_subcortical',
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'reho'),
     )
 
     # Merge the surfaces and subcortical structures back into a CIFTI
@@ -377,14 +411,21 @@ For the subcortical, volumetric data, ReHo was computed with neighborhood voxels
         CiftiCreateDenseFromTemplate(
             from_cropped=True,
             out_file='reho.dscalar.nii',
-            num_threads=config.nipype.omp_nthreads,
+            num_threads=get_n_procs(mem_gb, 'map'),
         ),
         name='merge_cifti',
-        mem_gb=mem_gb['bold'],
-        n_procs=config.nipype.omp_nthreads,
+        mem_gb=get_mem_gb(mem_gb, 'map'),
+        n_procs=get_n_procs(mem_gb, 'map'),
     )
     reho_plot = pe.Node(
-        PlotDenseCifti(base_desc='reho'),
+        PlotDenseCifti(
+            base_desc='reho',
+            surface_cache_dir=(
+                str(config.execution.surface_cache_dir)
+                if config.execution.surface_cache_dir
+                else None
+            ),
+        ),
         name='reho_cifti_plot',
     )
     workflow.connect([
@@ -484,7 +525,7 @@ Regional homogeneity (ReHo) [@jiang2016regional] was computed with neighborhood
     compute_reho = pe.Node(
         ReHoNamePatch(neighborhood='vertices'),
         name='reho_3d',
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'reho'),
         n_procs=1,
     )
     # Get the svg
@@ -18,6 +18,7 @@ from xcp_d.interfaces.plotting import AnatomicalPlot, QCPlots, QCPlotsES
 from xcp_d.interfaces.report import FunctionalSummary
 from xcp_d.interfaces.utils import ABCCQC, LINCQC
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.resources import get_mem_gb
 from xcp_d.utils.utils import get_bold2std_and_t1w_xfms, get_std2bold_xfms
 from xcp_d.workflows.plotting import init_plot_overlay_wf
 
@@ -268,7 +269,7 @@ def init_qc_report_wf(
                 template_mask=nlin2009casym_brain_mask,
             ),
             name='make_linc_qc',
-            mem_gb=mem_gb['volume'],
+            mem_gb=get_mem_gb(mem_gb, 'qc'),
         )
         workflow.connect([
             (inputnode, make_linc_qc, [
@@ -311,7 +312,7 @@ def init_qc_report_wf(
         make_qc_plots_nipreps = pe.Node(
             QCPlots(TR=TR, head_radius=head_radius),
             name='make_qc_plots_nipreps',
-            mem_gb=mem_gb['bold'] * 2,
+            mem_gb=get_mem_gb(mem_gb, 'qc'),
         )
         workflow.connect([
             (inputnode, make_qc_plots_nipreps, [
@@ -410,7 +411,7 @@ def init_qc_report_wf(
         make_qc_plots_es = pe.Node(
             QCPlotsES(TR=TR, standardize=config.execution.confounds_config is None),
             name='make_qc_plots_es',
-            mem_gb=mem_gb['bold'] * 2,
+            mem_gb=get_mem_gb(mem_gb, 'qc'),
         )
         workflow.connect([
             (inputnode, make_qc_plots_es, [
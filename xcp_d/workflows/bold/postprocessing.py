@@ -20,9 +20,14 @@ from xcp_d.interfaces.censoring import (
     RemoveDummyVolumes,
 )
 from xcp_d.interfaces.nilearn import DenoiseCifti, DenoiseNifti, Smooth
-from xcp_d.interfaces.plotting import CensoringPlot
+from xcp_d.interfaces.plotting import CensoringPlot, DeferReportlet
 from xcp_d.interfaces.restingstate import DespikePatch
-from xcp_d.interfaces.workbench import CiftiConvert, CiftiSmooth, FixCiftiIntent
+from xcp_d.interfaces.workbench import (
+    CachedCiftiSmooth,
+    CiftiConvert,
+    CiftiSmooth,
+    FixCiftiIntent,
+)
 from xcp_d.utils.boilerplate import (
     describe_censoring,
     describe_motion_parameters,
@@ -30,6 +35,7 @@ from xcp_d.utils.boilerplate import (
 )
 from xcp_d.utils.doc import fill_doc
 from xcp_d.utils.plotting import plot_design_matrix as _plot_design_matrix
+from xcp_d.utils.resources import get_mem_gb, get_n_procs
 from xcp_d.utils.utils import fwhm2sigma, is_number
 
 
@@ -38,6 +44,7 @@ def init_prepare_confounds_wf(
     TR,
     exact_scans,
     head_radius,
+    mem_gb=None,
     name='prepare_confounds_wf',
 ):
     """Prepare confounds.
@@ -68,6 +75,9 @@ def init_prepare_confounds_wf(
     %(exact_scans)s
     %(head_radius)s
         This will already be estimated before this workflow.
+    mem_gb : :obj:`dict` or None
+        Resource estimates from :func:`~xcp_d.utils.resources.estimate_resources`.
+        If None, dummy volume removal is given a fixed 4 GB.
     %(name)s
         Default is "prepare_confounds_wf".
 
@@ -203,6 +213,8 @@ def init_prepare_confounds_wf(
             motion_filter_order=motion_filter_order,
             fd_thresh=fd_thresh,
             head_radius=head_radius,
+            # Reuse the motion parameters processed during workflow construction
+            cache_dir=str(config.execution.work_dir / 'motion_prescan'),
         ),
         name='process_motion',
         mem_gb=1,
@@ -263,7 +275,7 @@ def init_prepare_confounds_wf(
         remove_dummy_scans = pe.Node(
             RemoveDummyVolumes(),
             name='remove_dummy_scans',
-            mem_gb=4,
+            mem_gb=4 if mem_gb is None else get_mem_gb(mem_gb, 'dummy_scans'),
         )
 
         workflow.connect([
@@ -352,6 +364,64 @@ def init_prepare_confounds_wf(
             (dummy_scan_buffer, outputnode, [('temporal_mask', 'temporal_mask')]),
         ])  # fmt:skip
 
+    reportlet_rendering = config.workflow.reportlet_rendering
+    if reportlet_rendering == 'deferred':
+        # Only write the data of the figures, which are rendered along with the reports
+        if config.execution.confounds_config is not None:
+            ds_reportlet_data_design_matrix = pe.Node(
+                DeferReportlet(
+                    reportlet='design',
+                    datasink={
+                        'dismiss_entities': dismiss_hash(['space', 'res', 'den', 'desc']),
+                        'suffix': 'design',
+                        'extension': '.svg',
+                    },
+                ),
+                name='ds_reportlet_data_design_matrix',
+                run_without_submitting=True,
+            )
+
+            workflow.connect([
+                (inputnode, ds_reportlet_data_design_matrix, [('name_source', 'source_file')]),
+                (dummy_scan_buffer, ds_reportlet_data_design_matrix, [
+                    ('confounds_tsv', 'design_matrix'),
+                ]),
+                (outputnode, ds_reportlet_data_design_matrix, [
+                    ('temporal_mask', 'temporal_mask'),
+                ]),
+            ])  # fmt:skip
+
+        ds_reportlet_data_censoring = pe.Node(
+            DeferReportlet(
+                reportlet='censoring',
+                parameters={
+                    'TR': TR,
+                    'motion_filter_type': motion_filter_type,
+                    'fd_thresh': fd_thresh,
+                    'head_radius': head_radius,
+                },
+                datasink={
+                    'dismiss_entities': dismiss_hash(),
+                    'desc': 'censoring',
+                    'suffix': 'motion',
+                    'extension': '.svg',
+                },
+            ),
+            name='ds_reportlet_data_censoring',
+            run_without_submitting=True,
+        )
+
+        workflow.connect([
+            (inputnode, ds_reportlet_data_censoring, [('name_source', 'source_file')]),
+            (process_motion, ds_reportlet_data_censoring, [('motion_file', 'motion_file')]),
+            (dummy_scan_buffer, ds_reportlet_data_censoring, [('dummy_scans', 'dummy_scans')]),
+            (outputnode, ds_reportlet_data_censoring, [('temporal_mask', 'temporal_mask')]),
+        ])  # fmt:skip
+
+        return workflow
+    elif reportlet_rendering == 'none':
+        return workflow
+
     if config.execution.confounds_config is not None:
         plot_design_matrix = pe.Node(
             niu.Function(
@@ -420,7 +490,7 @@ def init_prepare_confounds_wf(
 
 
 @fill_doc
-def init_despike_wf(TR, name='despike_wf'):
+def init_despike_wf(TR, mem_gb=None, name='despike_wf'):
     """Despike BOLD data with AFNI's 3dDespike.
 
     Despiking truncates large spikes in the BOLD times series.
@@ -448,6 +518,9 @@ def init_despike_wf(TR, name='despike_wf'):
     Parameters
     ----------
     %(TR)s
+    mem_gb : :obj:`dict` or None
+        Resource estimates from :func:`~xcp_d.utils.resources.estimate_resources`.
+        If None, each node is given a fixed 4 GB and ``--omp-nthreads`` threads.
     %(name)s
         Default is "despike_wf".
 
@@ -463,7 +536,8 @@ def init_despike_wf(TR, name='despike_wf'):
     """
     workflow = Workflow(name=name)
     file_format = config.workflow.file_format
-    omp_nthreads = config.nipype.omp_nthreads
+    if mem_gb is None:
+        mem_gb = {'bold': 4}
 
     inputnode = pe.Node(niu.IdentityInterface(fields=['bold_file']), name='inputnode')
     outputnode = pe.Node(niu.IdentityInterface(fields=['bold_file']), name='outputnode')
@@ -471,8 +545,8 @@ def init_despike_wf(TR, name='despike_wf'):
     despike3d = pe.Node(
         DespikePatch(outputtype='NIFTI_GZ', args='-nomask -NEW'),
         name='despike3d',
-        mem_gb=4,
-        n_procs=omp_nthreads,
+        mem_gb=get_mem_gb(mem_gb, 'despike'),
+        n_procs=get_n_procs(mem_gb, 'despike'),
     )
 
     if file_format == 'cifti':
@@ -482,11 +556,12 @@ and converted back to CIFTI format.
 """
 
         # first, convert the cifti to a nifti
+        convert_threads = get_n_procs(mem_gb, 'convert')
         convert_to_nifti = pe.Node(
-            CiftiConvert(target='to', num_threads=config.nipype.omp_nthreads),
+            CiftiConvert(target='to', num_threads=convert_threads),
             name='convert_to_nifti',
-            mem_gb=4,
-            n_procs=config.nipype.omp_nthreads,
+            mem_gb=get_mem_gb(mem_gb, 'convert'),
+            n_procs=convert_threads,
         )
         workflow.connect([
             (inputnode, convert_to_nifti, [('bold_file', 'in_file')]),
@@ -495,10 +570,10 @@ and converted back to CIFTI format.
 
         # finally, convert the despiked nifti back to cifti
         convert_to_cifti = pe.Node(
-            CiftiConvert(target='from', TR=TR, num_threads=config.nipype.omp_nthreads),
+            CiftiConvert(target='from', TR=TR, num_threads=convert_threads),
             name='convert_to_cifti',
-            mem_gb=4,
-            n_procs=config.nipype.omp_nthreads,
+            mem_gb=get_mem_gb(mem_gb, 'convert'),
+            n_procs=convert_threads,
         )
         workflow.connect([
             (inputnode, convert_to_cifti, [('bold_file', 'cifti_template')]),
@@ -541,7 +616,8 @@ def init_denoise_bold_wf(TR, mem_gb, name='denoise_bold_wf'):
     ----------
     %(TR)s
     mem_gb : :obj:`dict`
-        Memory size in GB to use for each of the nodes.
+        Memory size in GB to use for each of the nodes,
+        from :func:`~xcp_d.utils.resources.estimate_resources`.
     %(name)s
         Default is "denoise_bold_wf".
 
@@ -683,11 +759,11 @@ approach.
             high_pass=high_pass,
             filter_order=bpf_order,
             bandpass_filter=bandpass_filter,
-            num_threads=config.nipype.omp_nthreads,
+            num_threads=get_n_procs(mem_gb, 'denoise'),
         ),
         name='regress_and_filter_bold',
-        mem_gb=mem_gb['bold'],
-        n_procs=config.nipype.omp_nthreads,
+        mem_gb=get_mem_gb(mem_gb, 'denoise'),
+        n_procs=get_n_procs(mem_gb, 'denoise'),
     )
     config.loggers.workflow.debug('Created node for regression and filtering of BOLD data.')
 
@@ -715,7 +791,7 @@ approach.
     censor_interpolated_data = pe.Node(
         Censor(column='framewise_displacement'),
         name='censor_interpolated_data',
-        mem_gb=mem_gb['bold'],
+        mem_gb=get_mem_gb(mem_gb, 'censor'),
     )
     config.loggers.workflow.debug('Created censor node for high-motion volumes.')
 
@@ -758,6 +834,7 @@ approach.
         resd_smoothing_wf = init_resd_smoothing_wf(mem_gb=mem_gb)
 
         workflow.connect([
+            (inputnode, resd_smoothing_wf, [('mask', 'inputnode.bold_mask')]),
             (denoised_bold_buffer, resd_smoothing_wf, [('denoised_bold', 'inputnode.bold_file')]),
             (resd_smoothing_wf, outputnode, [
                 ('outputnode.smoothed_bold', 'smoothed_denoised_bold'),
@@ -796,6 +873,8 @@ def init_resd_smoothing_wf(mem_gb, name='resd_smoothing_wf'):
     Inputs
     ------
     bold_file
+    bold_mask
+        Brain mask for NIfTI data. Unused for CIFTI data.
 
     Outputs
     -------
@@ -805,7 +884,10 @@ def init_resd_smoothing_wf(mem_gb, name='resd_smoothing_wf'):
     smoothing = config.workflow.smoothing
     file_format = config.workflow.file_format
 
-    inputnode = pe.Node(niu.IdentityInterface(fields=['bold_file']), name='inputnode')
+    inputnode = pe.Node(
+        niu.IdentityInterface(fields=['bold_file', 'bold_mask']),
+        name='inputnode',
+    )
     outputnode = pe.Node(niu.IdentityInterface(fields=['smoothed_bold']), name='outputnode')
 
     # Turn specified FWHM (Full-Width at Half Maximum) to standard deviation.
@@ -814,66 +896,95 @@ def init_resd_smoothing_wf(mem_gb, name='resd_smoothing_wf'):
         workflow.__desc__ = f""" \
 The denoised BOLD was then smoothed using *Connectome Workbench* with a Gaussian kernel
 (FWHM={str(smoothing)} mm).
+"""
+        if config.execution.smoothing_cache_dir:
+            workflow.__desc__ = f""" \
+The denoised BOLD was then smoothed with a precomputed grayordinate Gaussian kernel
+(FWHM={str(smoothing)} mm), using geodesic distances on the fsLR sphere.
 """
 
-        # Call connectome workbench to smooth for each hemisphere
-        smooth_data = pe.Node(
-            CiftiSmooth(
-                sigma_surf=sigma_lx,  # the size of the surface kernel
-                sigma_vol=sigma_lx,  # the volume of the surface kernel
-                direction='COLUMN',  # which direction to smooth along@
-                # pull out atlases for each hemisphere
-                right_surf=str(
-                    get_template(
-                        template='fsLR',
-                        space=None,
-                        hemi='R',
-                        density='32k',
-                        desc=None,
-                        suffix='sphere',
-                        raise_empty=True,
-                    )
-                ),
-                left_surf=str(
-                    get_template(
-                        template='fsLR',
-                        space=None,
-                        hemi='L',
-                        density='32k',
-                        desc=None,
-                        suffix='sphere',
-                        raise_empty=True,
-                    )
-                ),
-                num_threads=config.nipype.omp_nthreads,
-            ),
-            name='cifti_smoothing',
-            mem_gb=mem_gb['bold'],
-            n_procs=config.nipype.omp_nthreads,
+        # pull out atlases for each hemisphere
+        right_surf = str(
+            get_template(
+                template='fsLR',
+                space=None,
+                hemi='R',
+                density='32k',
+                desc=None,
+                suffix='sphere',
+                raise_empty=True,
+            )
         )
-
-        # Always check the intent code in CiftiSmooth's output file
-        fix_cifti_intent = pe.Node(
-            FixCiftiIntent(),
-            name='fix_cifti_intent',
-            mem_gb=1,
+        left_surf = str(
+            get_template(
+                template='fsLR',
+                space=None,
+                hemi='L',
+                density='32k',
+                desc=None,
+                suffix='sphere',
+                raise_empty=True,
+            )
         )
-        workflow.connect([
-            (smooth_data, fix_cifti_intent, [('out_file', 'in_file')]),
-            (fix_cifti_intent, outputnode, [('out_file', 'smoothed_bold')]),
-        ])  # fmt:skip
+
+        if config.execution.smoothing_cache_dir:
+            # Apply a cached grayordinate smoothing operator instead of calling workbench
+            smooth_data = pe.Node(
+                CachedCiftiSmooth(
+                    sigma_surf=sigma_lx,  # the size of the surface kernel
+                    sigma_vol=sigma_lx,  # the volume of the surface kernel
+                    right_surf=right_surf,
+                    left_surf=left_surf,
+                    cache_dir=str(config.execution.smoothing_cache_dir),
+                ),
+                name='cifti_smoothing',
+                mem_gb=get_mem_gb(mem_gb, 'smooth'),
+            )
+            workflow.connect([(smooth_data, outputnode, [('out_file', 'smoothed_bold')])])
+
+        else:
+            # Call connectome workbench to smooth for each hemisphere
+            smooth_data = pe.Node(
+                CiftiSmooth(
+                    sigma_surf=sigma_lx,  # the size of the surface kernel
+                    sigma_vol=sigma_lx,  # the volume of the surface kernel
+                    direction='COLUMN',  # which direction to smooth along@
+                    right_surf=right_surf,
+                    left_surf=left_surf,
+                    num_threads=get_n_procs(mem_gb, 'smooth'),
+                ),
+                name='cifti_smoothing',
+                mem_gb=get_mem_gb(mem_gb, 'smooth'),
+                n_procs=get_n_procs(mem_gb, 'smooth'),
+            )
+
+            # Always check the intent code in CiftiSmooth's output file
+            fix_cifti_intent = pe.Node(
+                FixCiftiIntent(),
+                name='fix_cifti_intent',
+                mem_gb=1,
+            )
+            workflow.connect([
+                (smooth_data, fix_cifti_intent, [('out_file', 'in_file')]),
+                (fix_cifti_intent, outputnode, [('out_file', 'smoothed_bold')]),
+            ])  # fmt:skip
 
     else:
         workflow.__desc__ = f""" \
-The denoised BOLD was smoothed using *Nilearn* with a Gaussian kernel (FWHM={str(smoothing)} mm).
+The denoised BOLD was smoothed within the brain mask using a separable Gaussian kernel
+(FWHM={str(smoothing)} mm).
 """
-        # Use nilearn to smooth the image
+        # Smooth the image within the brain mask, in parallel over blocks of volumes
         smooth_data = pe.Node(
-            Smooth(fwhm=smoothing),  # FWHM = kernel size
+            Smooth(fwhm=smoothing, n_procs=get_n_procs(mem_gb, 'smooth')),  # FWHM = kernel size
             name='nifti_smoothing',
-            mem_gb=mem_gb['bold'],
+            mem_gb=get_mem_gb(mem_gb, 'smooth'),
+            n_procs=get_n_procs(mem_gb, 'smooth'),
         )
-        workflow.connect([(smooth_data, outputnode, [('out_file', 'smoothed_bold')])])
+        workflow.connect([
+            (inputnode, smooth_data, [('bold_mask', 'mask')]),
+            (smooth_data, outputnode, [('out_file', 'smoothed_bold')]),
+        ])  # fmt:skip
 
     workflow.connect([(inputnode, smooth_data, [('bold_file', 'in_file')])])
 
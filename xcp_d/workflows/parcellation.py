@@ -12,6 +12,7 @@ from xcp_d.interfaces.ants import ApplyTransforms
 from xcp_d.interfaces.bids import BIDSURI
 from xcp_d.interfaces.nilearn import IndexImage
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.resources import get_mem_gb, get_n_procs
 from xcp_d.utils.utils import get_std2bold_xfms
 
 LOGGER = logging.getLogger('nipype.workflow')
@@ -251,7 +252,8 @@ def init_parcellate_cifti_wf(
     Parameters
     ----------
     mem_gb : :obj:`dict`
-        Dictionary of memory allocations.
+        Dictionary of memory allocations,
+        from :func:`~xcp_d.utils.resources.estimate_resources`.
     compute_mask : :obj:`bool`
         Whether to compute a vertex-wise mask for the CIFTI file.
         When processing full BOLD runs, this should be True.
@@ -295,6 +297,8 @@ def init_parcellate_cifti_wf(
     from xcp_d.interfaces.workbench import CiftiMath, CiftiParcellateWorkbench
 
     workflow = Workflow(name=name)
+    # Scalar maps are parcellated without computing a mask
+    step = 'parcellate' if compute_mask else 'map'
 
     inputnode = pe.Node(
         niu.IdentityInterface(
@@ -381,12 +385,12 @@ def init_parcellate_cifti_wf(
             direction='COLUMN',
             only_numeric=True,
             out_file=f'parcellated_data.{"ptseries" if compute_mask else "pscalar"}.nii',
-            num_threads=config.nipype.omp_nthreads,
+            num_threads=get_n_procs(mem_gb, step),
         ),
         name='parcellate_data',
         iterfield=['atlas_label'],
-        mem_gb=mem_gb['bold'],
-        n_procs=config.nipype.omp_nthreads,
+        mem_gb=get_mem_gb(mem_gb, step),
+        n_procs=get_n_procs(mem_gb, step),
     )
     workflow.connect([
         (inputnode, parcellate_data, [